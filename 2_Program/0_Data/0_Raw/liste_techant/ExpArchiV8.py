@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+"""
+ExpArchiV8 : export des tables techantXXXXX (base ``archivage``) en Python, remplaçant la boucle
+« un psql par ligne + sleep » d'ExpArchiV7.1.sh.
+
+- même fichier de configuration (``Nom;Table;nbr``, mêmes validations, 5000 lignes max) et mêmes modes
+  (0 = ``nbr`` dernières lignes, 1 = table complète) ;
+- pool borné de connexions (``--workers``), tables exportées en parallèle, débit global limité
+  (``--rate`` requêtes / s, jeton partagé entre threads ; remplace ``PSQL_DELAY_SEC``) ;
+- PostgreSQL : ``COPY (...) TO STDOUT`` en flux (psycopg 3, sinon psycopg2 ; dépendances optionnelles,
+  2_Program/requirements-optional.txt) ;
+- sorties écrites directement :
+  - ``zip`` (défaut) : ``export_SSTCAD_<YYYYMMDD>.zip`` contenant ``<table>_<YYYYMMDD>.csv`` (``date;<Nom>;inv``,
+    date ``DD/MM/YYYY HH24:MI``), disposition lue par ``load_raw_csvs`` (dataset_preparation_V2, section 2) ;
+  - ``parquet`` : dossier ``export_SSTCAD_<YYYYMMDD>/`` de fragments ``part-XXXXX.parquet`` (zstd) au format long
+    ``date, EGID, DATA_TYPE, valeur, inv, table`` (lecture directe par la section 2, sans analyse CSV) ;
+- ``--incremental`` : extraction incrémentale par filigrane. Le dernier ``tod`` exporté par (Nom, Table) est
+  conservé dans ``<output_dir>/expArchi_state.json`` ; l'exécution suivante ne lit que ``tod > filigrane - recouvrement``
+  (``--overlap-hours``, corrections tardives) et écrit un nouveau fragment horodaté
+  ``export_SSTCAD_<YYYYMMDD_HHMMSS>`` que la section 2 fusionne (dernier fragment prioritaire) ; lignes transférées
+  par table dans ``<fragment>_report.csv`` ;
+- base de substitution locale SQLite (``--sqlite``, ``--seed-fake N`` pour la peupler de tables techant
+  factices) pour valider l'export hors du serveur ; équivalence zip / Parquet / base vérifiée par
+  ``tests/test_exparchi_v8.py`` (2_Program).
+
+Usage (sur le serveur d'archivage, PGHOST / PGPORT / PGUSER / PGPASSWORD ou ~/.pgpass) :
+  python3 ExpArchiV8.py config_export_TempRet_controlCAD.csv ./ExportData
+  python3 ExpArchiV8.py config_export_TempRet_controlCAD.csv ./ExportData 1 --workers 8 --rate 40
+  python3 ExpArchiV8.py config_export_TempRet_controlCAD.csv ./ExportData 1 --format parquet
+  python3 ExpArchiV8.py config_export_TempRet_controlCAD.csv ./ExportData 1 --incremental --overlap-hours 72
+
+Validation locale (depuis 2_Program) :
+  .venv\\Scripts\\python.exe 0_Data\\0_Raw\\liste_techant\\ExpArchiV8.py cfg.csv out 1 --sqlite fake.db --seed-fake 2000
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import logging
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger("ExpArchiV8")
+
+CONFIG_MAX_LINES = 5000
+PSQL_DB = "archivage"
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 20.0  # requêtes / s au total (V7.1 : 1 / PSQL_DELAY_SEC)
+VALID_ID_REGEX = re.compile(r"^[a-zA-Z0-9_]+$")
+VALID_TABLE_REGEX = re.compile(r"^techant[1-9][0-9]*$")
+SPOOL_MAX_BYTES = 64 << 20  # au-delà, le flux COPY d'une table est tamponné sur disque
+SHARD_ROWS = 5_000_000
+STATE_FILE = "expArchi_state.json"
+TOD_PER_HOUR = 3600  # tod en secondes (to_time(tod)) : conversion de --overlap-hours
+DEFAULT_OVERLAP_HOURS = 48.0
+PG_DATE_EXPR = "to_char(to_time(tod), 'DD/MM/YYYY HH24:MI')"
+
+
+@dataclass(frozen=True)
+class ExportJob:
+    nom: str
+    table: str
+    nbr: int
+
+
+@dataclass
+class ExportReport:
+    ok: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    skipped: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+    rows_by_table: dict[tuple[str, str], int] = field(default_factory=dict)
+
+
+def read_config(path: Path, max_lines: int = CONFIG_MAX_LINES) -> tuple[list[ExportJob], int]:
+    """Lignes valides du fichier ``Nom;Table;nbr`` (mêmes contrôles que V7.1) et nombre de lignes ignorées."""
+    jobs: list[ExportJob] = []
+    skipped = 0
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        lines = f.read().splitlines()[1:]
+    if len(lines) > max_lines:
+        logger.warning("Config : %s lignes, limitée à %s.", len(lines), max_lines)
+    for line in lines[:max_lines]:
+        parts = [p.strip() for p in line.split(";")]
+        nom, table, nbr = (parts + ["", "", ""])[:3]
+        if not nom or not table or not nbr:
+            logger.warning("Champ vide dans '%s'.", path)
+        elif not nbr.isdigit() or int(nbr) <= 0:
+            logger.warning("nbr invalide ('%s') : entier strictement positif attendu.", nbr)
+        elif not VALID_ID_REGEX.match(nom):
+            logger.warning("Nom invalide ('%s') : alphanumérique et underscore uniquement.", nom)
+        elif not VALID_TABLE_REGEX.match(table):
+            logger.warning("Table invalide ('%s') : format techantXXXXX attendu.", table)
+        else:
+            jobs.append(ExportJob(nom, table, int(nbr)))
+            continue
+        skipped += 1
+    return jobs, skipped
+
+
+def export_query(
+    job: ExportJob,
+    mode: int,
+    since: int | None = None,
+    with_tod: bool = False,
+    date_expr: str = PG_DATE_EXPR,
+    limit_fmt: str = "FETCH FIRST {n} ROWS ONLY",
+) -> str:
+    """SELECT de V7.1 (identifiant de valeur entre guillemets : noms débutant par un chiffre).
+
+    ``since`` : lignes ``tod > since`` uniquement (incrémental, sans limite ``nbr``) ; ``with_tod`` ajoute la
+    colonne ``tod`` en dernière position (ignorée par la section 2) pour relever le filigrane.
+    """
+    cols = f"{date_expr} AS date, value AS \"{job.nom}\", invalid AS inv" + (", tod" if with_tod else "")
+    sql = f"SELECT {cols} FROM {job.table}"
+    if since is not None:
+        return f"{sql} WHERE tod > {int(since)} ORDER BY tod DESC"
+    sql += " ORDER BY tod DESC"
+    return sql if mode == 1 else f"{sql} {limit_fmt.format(n=job.nbr)}"
+
+
+class WatermarkState:
+    """Dernier ``tod`` exporté par (Nom, Table), fichier JSON réécrit atomiquement en fin d'exécution."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.marks: dict[str, int] = {}
+        if self.path.is_file():
+            self.marks = {k: int(v) for k, v in json.loads(self.path.read_text(encoding="utf-8")).items()}
+
+    @staticmethod
+    def key(job: ExportJob) -> str:
+        return f"{job.nom};{job.table}"
+
+    def get(self, job: ExportJob) -> int | None:
+        return self.marks.get(self.key(job))
+
+    def since(self, job: ExportJob, overlap_hours: float) -> int | None:
+        wm = self.get(job)
+        return None if wm is None else wm - int(overlap_hours * TOD_PER_HOUR)
+
+    def update(self, job: ExportJob, tod: int | None) -> None:
+        if tod is not None:
+            k = self.key(job)
+            self.marks[k] = max(tod, self.marks.get(k, tod))
+
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.marks, indent=0, sort_keys=True), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+def _first_tod(buf) -> int | None:
+    """``tod`` de la première ligne de données (la plus récente : ORDER BY tod DESC), None si vide."""
+    buf.seek(0)
+    buf.readline()
+    row = buf.readline().strip()
+    return int(float(row.rsplit(b";", 1)[-1])) if row else None
+
+
+class RateLimiter:
+    """Au plus ``rate`` départs de requête par seconde, tous threads confondus."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ConnectionPool:
+    """Pool borné : ``size`` connexions ouvertes à la demande, prêtées à un thread à la fois."""
+
+    def __init__(self, connect, size: int):
+        self._connect = connect
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._all: list = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except BaseException:
+                self._slots.release()
+                raise
+            with self._lock:
+                self._all.append(conn)
+            return conn
+
+    def release(self, conn, broken: bool = False) -> None:
+        if broken:
+            with self._lock:
+                self._all.remove(conn)
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._all.clear()
+
+
+class PostgresSource:
+    """Flux ``COPY (...) TO STDOUT WITH CSV`` (psycopg 3 ou psycopg2)."""
+
+    def __init__(self, dbname: str = PSQL_DB):
+        if psycopg is None and psycopg2 is None:
+            raise ImportError("psycopg (ou psycopg2) requis pour l'export PostgreSQL.")
+        self.dbname = dbname
+
+    def connect(self):
+        if psycopg is not None:
+            return psycopg.connect(dbname=self.dbname, autocommit=True)
+        conn = psycopg2.connect(dbname=self.dbname)
+        conn.autocommit = True
+        return conn
+
+    def copy_csv(self, conn, job: ExportJob, mode: int, out, since: int | None = None, with_tod: bool = False) -> None:
+        sql = f"COPY ({export_query(job, mode, since, with_tod)}) TO STDOUT WITH CSV DELIMITER ';' HEADER"
+        with conn.cursor() as cur:
+            if psycopg is not None:
+                with cur.copy(sql) as cp:
+                    for chunk in cp:
+                        out.write(chunk)
+            else:
+                cur.copy_expert(sql, out)
+
+
+class SqliteSource:
+    """Base de substitution locale : tables ``techantN(tod, value, invalid)``, ``tod`` en secondes UTC."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def copy_csv(self, conn, job: ExportJob, mode: int, out, since: int | None = None, with_tod: bool = False) -> None:
+        date_expr = "strftime('%d/%m/%Y %H:%M', tod, 'unixepoch')"
+        sql = export_query(job, mode, since, with_tod, date_expr=date_expr, limit_fmt="LIMIT {n}")
+        text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+        w = csv.writer(text, delimiter=";", lineterminator="\n")
+        w.writerow(["date", job.nom, "inv"] + (["tod"] if with_tod else []))
+        cur = conn.execute(sql)
+        while rows := cur.fetchmany(10_000):
+            w.writerows(rows)
+        text.detach()
+
+
+def seed_fake_archive(path: Path, jobs: list[ExportJob], n_rows: int, seed: int = 0, step_s: int = 900) -> None:
+    """Crée (si absentes) des tables techant factices de ``n_rows`` lignes pour les tables de ``jobs``."""
+    import random
+
+    rng = random.Random(seed)
+    t_end = int(datetime(2026, 2, 1).timestamp())
+    with sqlite3.connect(path) as conn:
+        for table in sorted({j.table for j in jobs}):
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (tod INTEGER PRIMARY KEY, value REAL, invalid INTEGER)")
+            if conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]:
+                continue
+            rows = [
+                (t_end - i * step_s, round(rng.uniform(20.0, 80.0), 2), int(rng.random() < 0.02))
+                for i in range(n_rows)
+            ]
+            conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?)", rows)
+
+
+class ZipSink:
+    """Archive zip unique ; chaque table devient ``<table>_<horodatage>.csv`` (écriture sérialisée)."""
+
+    def __init__(self, out_dir: Path, stamp: str):
+        self.path = out_dir / f"export_SSTCAD_{stamp}.zip"
+        self.stamp = stamp
+        self._zf = zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+        self._lock = threading.Lock()
+
+    def add(self, job: ExportJob, data) -> int:
+        data.seek(0)
+        n = -1  # en-tête
+        with self._lock, self._zf.open(f"{job.table}_{self.stamp}.csv", "w", force_zip64=True) as dst:
+            for chunk in iter(lambda: data.read(1 << 20), b""):
+                n += chunk.count(b"\n")
+                dst.write(chunk)
+        return max(n, 0)
+
+    def close(self) -> None:
+        self._zf.close()
+
+
+class ParquetShardSink:
+    """Fragments Parquet (zstd) au format long de la section 2 : date, EGID, DATA_TYPE, valeur, inv (+ table)."""
+
+    def __init__(self, out_dir: Path, stamp: str, shard_rows: int = SHARD_ROWS):
+        if pa is None:
+            raise ImportError("pyarrow requis pour --format parquet.")
+        self.path = out_dir / f"export_SSTCAD_{stamp}"
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.shard_rows = shard_rows
+        self._pending: list = []
+        self._n_pending = 0
+        self._n_shards = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def to_long(job: ExportJob, data) -> "pa.Table":
+        data.seek(0)
+        egid, _, data_type = job.nom.partition("_")
+        t = pacsv.read_csv(
+            data,
+            parse_options=pacsv.ParseOptions(delimiter=";"),
+            convert_options=pacsv.ConvertOptions(
+                column_types={"date": pa.timestamp("s"), job.nom: pa.float64(), "inv": pa.float64()},
+                timestamp_parsers=["%d/%m/%Y %H:%M"],
+                include_columns=["date", job.nom, "inv"],
+            ),
+        )
+        n = t.num_rows
+        return pa.table(
+            {
+                "date": t["date"],
+                "EGID": pa.array([egid] * n, pa.string()),
+                "DATA_TYPE": pa.array([data_type] * n, pa.string()),
+                "valeur": t[job.nom],
+                "inv": t["inv"].fill_null(0),
+                "table": pa.array([job.table] * n, pa.string()),
+            }
+        )
+
+    def add(self, job: ExportJob, data) -> int:
+        t = self.to_long(job, data)
+        with self._lock:
+            self._pending.append(t)
+            self._n_pending += t.num_rows
+            if self._n_pending >= self.shard_rows:
+                self._flush()
+        return t.num_rows
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        table = pa.concat_tables(self._pending)
+        pq.write_table(table, self.path / f"part-{self._n_shards:05d}.parquet", compression="zstd")
+        self._n_shards += 1
+        self._pending, self._n_pending = [], 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+
+
+def run_export(
+    jobs: list[ExportJob],
+    source,
+    sink,
+    mode: int = 0,
+    workers: int = DEFAULT_WORKERS,
+    rate: float = DEFAULT_RATE,
+    state: WatermarkState | None = None,
+    overlap_hours: float = DEFAULT_OVERLAP_HOURS,
+) -> ExportReport:
+    """Exporte ``jobs`` en parallèle (pool de ``workers`` connexions, ``rate`` requêtes / s au plus).
+
+    Avec ``state`` : lignes postérieures au filigrane moins ``overlap_hours`` ; filigranes mis à jour pour les
+    tables réussies et enregistrés une fois le fragment fermé.
+    """
+    pool = ConnectionPool(source.connect, workers)
+    limiter = RateLimiter(rate)
+    report = ExportReport()
+    t0 = time.perf_counter()
+
+    def one(job: ExportJob) -> tuple[int, int | None]:
+        since = None if state is None else state.since(job, overlap_hours)
+        limiter.wait()
+        conn = pool.acquire()
+        broken = False
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as buf:
+                source.copy_csv(conn, job, mode, buf, since=since, with_tod=state is not None)
+                n = sink.add(job, buf)
+                return n, (_first_tod(buf) if state is not None else None)
+        except Exception:
+            broken = True
+            raise
+        finally:
+            pool.release(conn, broken=broken)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = {ex.submit(one, job): job for job in jobs}
+            for fut in as_completed(futures):
+                job = futures[fut]
+                try:
+                    n, tod = fut.result()
+                    report.rows += n
+                    report.rows_by_table[(job.nom, job.table)] = n
+                    report.ok.append(job.table)
+                    if state is not None:
+                        state.update(job, tod)
+                    logger.info("Export réussi : %s (nom : %s)", job.table, job.nom)
+                except Exception as e:
+                    report.failed[job.table] = str(e)
+                    logger.error("Échec de l'export de %s : %s", job.table, e)
+    finally:
+        sink.close()
+        pool.close()
+    if state is not None:
+        state.save()
+    report.seconds = time.perf_counter() - t0
+    return report
+
+
+def write_report(report: ExportReport, path: Path, state: WatermarkState | None = None) -> None:
+    """Lignes transférées par table (``Nom;Table;rows;watermark``), tables en échec comprises (rows vide)."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, delimiter=";", lineterminator="\n")
+        w.writerow(["Nom", "Table", "rows", "watermark"])
+        for (nom, table), n in sorted(report.rows_by_table.items()):
+            wm = state.get(ExportJob(nom, table, 1)) if state is not None else None
+            w.writerow([nom, table, n, "" if wm is None else wm])
+        for table in sorted(report.failed):
+            w.writerow(["", table, "", ""])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("config", type=Path)
+    ap.add_argument("output_dir", type=Path)
+    ap.add_argument("mode", type=int, nargs="?", default=0, choices=(0, 1), help="0 = nbr lignes, 1 = complet")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Connexions simultanées")
+    ap.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requêtes / s au plus (0 = illimité)")
+    ap.add_argument("--format", choices=("zip", "parquet"), default="zip")
+    ap.add_argument("--db", default=PSQL_DB, help="Base PostgreSQL")
+    ap.add_argument("--sqlite", type=Path, default=None, help="Base SQLite de substitution (validation locale)")
+    ap.add_argument("--seed-fake", type=int, default=0, help="Avec --sqlite : N lignes factices par table absente")
+    ap.add_argument("--max-lines", type=int, default=CONFIG_MAX_LINES)
+    ap.add_argument("--incremental", action="store_true", help=f"Lignes postérieures au filigrane ({STATE_FILE})")
+    ap.add_argument("--overlap-hours", type=float, default=DEFAULT_OVERLAP_HOURS, help="Recouvrement relu")
+    ap.add_argument("--state", type=Path, default=None, help=f"Fichier d'état (défaut : <output_dir>/{STATE_FILE})")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if not args.config.is_file():
+        raise SystemExit(f"Error: unable to find '{args.config}'.")
+    if not args.output_dir.is_dir():
+        raise SystemExit(f"Error: The output directory '{args.output_dir}' does not exist.")
+    jobs, skipped = read_config(args.config, args.max_lines)
+
+    if args.sqlite is not None:
+        if args.seed_fake:
+            seed_fake_archive(args.sqlite, jobs, args.seed_fake)
+        source = SqliteSource(args.sqlite)
+    else:
+        source = PostgresSource(args.db)
+    try:
+        source.connect().close()
+    except Exception as e:
+        raise SystemExit(f"Error: Cannot connect to database: {e}")
+
+    state = WatermarkState(args.state or args.output_dir / STATE_FILE) if args.incremental else None
+    # Fragments incrémentaux horodatés à la seconde : plusieurs exécutions par jour sans écrasement
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S" if args.incremental else "%Y%m%d")
+    sink = ZipSink(args.output_dir, stamp) if args.format == "zip" else ParquetShardSink(args.output_dir, stamp)
+    print(
+        f"Start extracting configuration from {args.config} (mode={args.mode}, {len(jobs)} tables, "
+        f"{args.workers} connexions, {args.rate:g} req/s max)."
+    )
+    report = run_export(jobs, source, sink, args.mode, args.workers, args.rate, state, args.overlap_hours)
+    report.skipped = skipped
+    report_path = args.output_dir / f"export_SSTCAD_{stamp}_report.csv"
+    write_report(report, report_path, state)
+    print(
+        f"{len(report.ok)} table(s) exportée(s), {len(report.failed)} échec(s), {report.skipped} ligne(s) de config "
+        f"ignorée(s), {report.rows:,} lignes en {report.seconds:.1f} s → {sink.path} (détail : {report_path.name})"
+    )
+    if report.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
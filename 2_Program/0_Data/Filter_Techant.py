@@ -1,23 +1,26 @@
 """
 Génère des fichiers config_export_{suffix}_controlCAD.csv (un par type de donnée)
 à partir des points de transmission CAD et de la liste des techant.
+
+Correspondance vectorisée : chaque ligne techant reçoit le premier filtre de FILTERS qu'elle satisfait
+(opérations de chaînes pandas), l'index (ouvrage, filtre) garde la première ligne rencontrée, puis
+jointure (merge) avec les EGID CAD. Les EGID CAD sont lus depuis un cache Parquet de l'Excel
+(``0_Raw/RefFiles/_cache/``), invalidé si l'Excel change (taille / mtime, puis empreinte SHA-1).
 """
 
-from collections import defaultdict
+import hashlib
+import json
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
-try:
-    from tqdm import tqdm
-except ImportError:
-    tqdm = None
-
 # Chemins des fichiers
 BASE_DIR = Path(__file__).resolve().parent
 EXCEL_PATH = BASE_DIR / "0_Raw" / "RefFiles" / "Point_transmission_CAD_20260202.xlsx"
 TECHANT_PATH = BASE_DIR / "0_Raw" / "liste_techant" / "20260219_techant.csv"
 OUTPUT_DIR = BASE_DIR / "0_Raw" / "liste_techant"
+CACHE_DIR = BASE_DIR / "0_Raw" / "RefFiles" / "_cache"
 
 # Définition des filtres : (champ, libelle_2, frequence, type, suffix)
 # libelle_2=None signifie pas de filtre sur libelle_2
@@ -34,16 +37,93 @@ FILTERS = [
 ]
 
 
-def _champ_matches(champ: str, filter_champ: str) -> bool:
+def _champ_matches(champ: pd.Series, filter_champ: str) -> pd.Series:
     """Vérifie si le champ correspond (exact ou préfixe pour VANNE 2 VOIES)."""
-    return champ == filter_champ or champ.startswith(f"{filter_champ} ")
+    return (champ == filter_champ) | champ.str.startswith(f"{filter_champ} ")
+
+
+def _file_sig(path: Path) -> dict:
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_cad_egids(excel_path: Path = EXCEL_PATH, cache_dir: Path = CACHE_DIR) -> pd.Series:
+    """EGID CAD (``U_NO_EGID`` en texte, ordre de l'Excel, vides exclus) ; cache Parquet à côté de l'Excel."""
+    cache = cache_dir / f"{excel_path.stem}.parquet"
+    meta_path = cache.with_suffix(".json")
+    sig = _file_sig(excel_path)
+    if cache.is_file() and meta_path.is_file():
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta["file"] == sig or meta["sha1"] == _sha1(excel_path):
+                if meta["file"] != sig:
+                    meta["file"] = sig
+                    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+                return pd.read_parquet(cache)["U_NO_EGID"]
+        except (ValueError, KeyError):
+            pass
+
+    df_cad = pd.read_excel(excel_path)
+    if "U_NO_EGID" not in df_cad.columns:
+        raise ValueError(f"Colonne U_NO_EGID absente dans {excel_path}")
+    vals = df_cad["U_NO_EGID"].dropna()
+    egids = pd.Series([str(v).strip() for v in vals], dtype=str, name="U_NO_EGID")
+    egids = egids[egids != ""].reset_index(drop=True)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    egids.to_frame().to_parquet(cache, index=False)
+    meta_path.write_text(json.dumps({"file": sig, "sha1": _sha1(excel_path)}), encoding="utf-8")
+    return egids
+
+
+def build_techant_index(df_techant: pd.DataFrame) -> pd.DataFrame:
+    """Index (ouvrage, filtre) → ref_techant : premier filtre satisfait par ligne, première ligne par clé."""
+    cols = {c: df_techant[c].astype(str).str.strip() for c in ("ouvrage", "champ", "libelle_2", "frequence", "type")}
+    masks = []
+    for champ_f, libelle_2_f, freq_f, type_f, _ in FILTERS:
+        m = _champ_matches(cols["champ"], champ_f) & (cols["frequence"] == freq_f) & (cols["type"] == type_f)
+        if libelle_2_f is not None:
+            m &= cols["libelle_2"] == libelle_2_f
+        masks.append(m.to_numpy())
+    masks = np.column_stack(masks)
+    matched = masks.any(axis=1)
+    index = pd.DataFrame(
+        {
+            "ouvrage": cols["ouvrage"].to_numpy()[matched],
+            "filtre": masks.argmax(axis=1)[matched],
+            "ref_techant": df_techant["ref_techant"].to_numpy()[matched],
+        }
+    )
+    return index.drop_duplicates(["ouvrage", "filtre"], keep="first")
+
+
+def match_cad(egids: pd.Series, techant_index: pd.DataFrame) -> pd.DataFrame:
+    """Lignes de configuration (Nom, Table, nbr, suffix) dans l'ordre CAD puis FILTERS, sans doublon."""
+    cad = pd.DataFrame({"egid": egids.to_numpy(), "pos": np.arange(len(egids))})
+    cad["ouvrage"] = cad["egid"] + " SST"
+    m = cad.merge(techant_index, on="ouvrage", how="inner")
+    m = m.sort_values(["pos", "filtre"], kind="mergesort").drop_duplicates(["egid", "filtre"], keep="first")
+    suffixes = np.array([f[4] for f in FILTERS], dtype=object)[m["filtre"].to_numpy()]
+    return pd.DataFrame(
+        {
+            "Nom": m["egid"].to_numpy() + "_" + suffixes,
+            "Table": "techant" + m["ref_techant"].astype(str).to_numpy(),
+            "nbr": 120,
+            "suffix": suffixes,
+        }
+    )
 
 
 def main() -> None:
     # Chargement des données
-    df_cad = pd.read_excel(EXCEL_PATH)
-    if "U_NO_EGID" not in df_cad.columns:
-        raise ValueError(f"Colonne U_NO_EGID absente dans {EXCEL_PATH}")
+    egids = load_cad_egids(EXCEL_PATH)
 
     df_techant = pd.read_csv(TECHANT_PATH, sep=";", dtype=str)
     required_cols = ["ref_techant", "ouvrage", "champ", "libelle_2", "frequence", "type"]
@@ -51,72 +131,16 @@ def main() -> None:
         if col not in df_techant.columns:
             raise ValueError(f"Colonne {col} absente dans {TECHANT_PATH}")
 
-    # Index des correspondances techant (une seule passe)
-    techant_index = {}
-    for _, row in df_techant.iterrows():
-        ouvrage = str(row["ouvrage"]).strip()
-        champ = str(row["champ"]).strip()
-        libelle_2 = str(row["libelle_2"]).strip()
-        frequence = str(row["frequence"]).strip()
-        type_val = str(row["type"]).strip()
-
-        for champ_f, libelle_2_f, freq_f, type_f, suffix in FILTERS:
-            if not _champ_matches(champ, champ_f):
-                continue
-            if libelle_2_f is not None and libelle_2 != libelle_2_f:
-                continue
-            if frequence != freq_f or type_val != type_f:
-                continue
-            key = (ouvrage, champ_f, libelle_2_f)
-            if key not in techant_index:
-                techant_index[key] = (row["ref_techant"], suffix)
-            break
-
-    # Parcours des lignes Excel avec barre de progression
-    results = []
-    seen = set()
-    rows_iter = df_cad.iterrows()
-    if tqdm:
-        rows_iter = tqdm(rows_iter, total=len(df_cad), desc="Traitement des points CAD")
-
-    for _, row_cad in rows_iter:
-        val = row_cad.get("U_NO_EGID")
-        if pd.isna(val):
-            continue
-        name_nummer = str(val).strip()
-        if not name_nummer:
-            continue
-
-        ouvrage = f"{name_nummer} SST"
-        for champ_f, libelle_2_f, _, _, suffix in FILTERS:
-            key = (name_nummer, champ_f, libelle_2_f)
-            if key in seen:
-                continue
-            techant_key = (ouvrage, champ_f, libelle_2_f)
-            if techant_key in techant_index:
-                seen.add(key)
-                ref_techant, suffix = techant_index[techant_key]
-                results.append({
-                    "Nom": f"{name_nummer}_{suffix}",
-                    "Table": f"techant{ref_techant}",
-                    "nbr": 120,
-                    "_suffix": suffix,
-                })
-
-    if not results:
+    results = match_cad(egids, build_techant_index(df_techant))
+    if results.empty:
         print("Aucune correspondance trouvée.")
         return
 
-    # Regroupement par suffix et export d'un fichier par type
-    results_by_suffix = defaultdict(list)
-    for r in results:
-        suffix = r.pop("_suffix")
-        results_by_suffix[suffix].append(r)
-
+    # Export d'un fichier par type (ordre de première apparition du suffixe)
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    for suffix, suffix_results in results_by_suffix.items():
+    for suffix, suffix_results in results.groupby("suffix", sort=False):
         out_path = OUTPUT_DIR / f"config_export_{suffix}_controlCAD.csv"
-        pd.DataFrame(suffix_results).to_csv(
+        suffix_results.drop(columns="suffix").to_csv(
             out_path, sep=";", index=False, lineterminator="\n"
         )
         print(f"Fichier généré : {out_path} ({len(suffix_results)} lignes)")
@@ -1,10 +1,58 @@
 
 
 
-def cluster_deep_analysis(cluster_id: int, path_training=None):
+def corr_features_targets(d, features, targets, min_rows: int = 80, eps: float = 1e-9):
+    """
+    Matrice de Pearson features × cibles en quelques produits matriciels masqués (float64).
+
+    Mêmes règles que la boucle par cible d'origine (``d[features + [t]].dropna()`` puis ``Series.corr``) :
+    pour chaque cible, lignes où la cible **et** toutes les features sont renseignées ; colonne NaN si
+    moins de ``min_rows`` lignes ou cible de variance nulle ; cellule NaN si la feature est constante.
+    Variance nulle : écart-type < ``eps × max(|moyenne|, 1)`` sur ces lignes (résidu d'arrondi des sommes).
+    Features absentes de ``d`` : lignes NaN.
+    """
+    mat = pd.DataFrame(np.nan, index=list(features), columns=list(targets), dtype=float)
+    present = [c for c in features if c in d.columns]
+    if not present or not len(targets):
+        return mat
+    X = d[present].to_numpy(dtype=np.float64)
+    Y = d[list(targets)].to_numpy(dtype=np.float64)
+    row_ok = ~np.isnan(X).any(axis=1)
+    M = (~np.isnan(Y) & row_ok[:, None]).astype(np.float64)
+    n = M.sum(axis=0)
+    # Centrage global avant accumulation (limite l'annulation catastrophique de Sxx - Sx²/n)
+    cx = X[row_ok].mean(axis=0) if row_ok.any() else np.zeros(len(present))
+    cy = np.nanmean(Y, axis=0)
+    X = np.where(row_ok[:, None], X - cx, 0.0)
+    Y = np.nan_to_num(Y - cy, nan=0.0) * M
+    sx = X.T @ M
+    sxx = (X * X).T @ M
+    sxy = X.T @ Y
+    sy = Y.sum(axis=0)
+    syy = (Y * Y).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dof = np.where(n > 1, n - 1, np.nan)
+        var_x = (sxx - sx * sx / n) / dof
+        var_y = (syy - sy * sy / n) / dof
+        cov = (sxy - sx * sy / n) / dof
+        r = cov / np.sqrt(var_x * var_y)
+        # moyennes sur les lignes de chaque cible (échelle du seuil de variance nulle)
+        tol_x = eps * np.maximum(np.abs(sx / n + cx[:, None]), 1.0)
+        tol_y = eps * np.maximum(np.abs(sy / n + cy), 1.0)
+    ok_col = (n >= min_rows) & (np.sqrt(np.clip(var_y, 0, None)) >= tol_y)
+    r[:, ~ok_col] = np.nan
+    r[np.sqrt(np.clip(var_x, 0, None)) < tol_x] = np.nan
+    mat.loc[present, :] = np.clip(r, -1.0, 1.0)
+    return mat
+
+
+def cluster_deep_analysis(cluster_id: int, path_training=None, max_targets: int | None = 45, path_rollups=None):
     """Analyse section 9 : corrélations features × cibles normalisées, hétérogénéité sur MIN_YEARS_DATA (jeu train)."""
     if path_training is None:
         path_training = PATH_TRAINING
+    if path_rollups is None:
+        # pyramide à côté des splits (0_Data/8_Rollups, section 7)
+        path_rollups = Path(path_training).parent / PATH_ROLLUPS.name
     path_cl = path_training / f"cluster{cluster_id}.parquet"
     if not path_cl.exists():
         raise FileNotFoundError(
@@ -22,10 +70,11 @@ def cluster_deep_analysis(cluster_id: int, path_training=None):
     tret_cols = [c for c in df_cl.columns if c.endswith(".TempRet_norm")]
     puis_cols = [c for c in df_cl.columns if c.endswith(".PuisCpt_fc")]
 
-    MAX_TARGETS_HEAT = 45
+    # None → tous les EGID sur la carte (corrélations vectorisées : coût négligeable)
+    MAX_TARGETS_HEAT = max_targets
 
     def pick_targets(cols, d, k=MAX_TARGETS_HEAT):
-        if len(cols) <= k:
+        if k is None or len(cols) <= k:
             return cols
         v = d[cols].var().replace(0, np.nan).dropna().sort_values(ascending=False)
         return v.head(k).index.tolist()
@@ -37,22 +86,6 @@ def cluster_deep_analysis(cluster_id: int, path_training=None):
             return c.replace(".PuisCpt_fc", "")
         return c[:18]
 
-    def corr_features_targets(d, features, targets):
-        mat = pd.DataFrame(np.nan, index=features, columns=targets, dtype=float)
-        for t in targets:
-            use = [c for c in features if c in d.columns] + [t]
-            sub = d[use].dropna()
-            if len(sub) < 80 or float(sub[t].std(skipna=True) or 0) < 1e-12:
-                continue
-            for f in features:
-                if f not in sub.columns:
-                    continue
-                sf = float(sub[f].std(skipna=True) or 0)
-                if sf < 1e-12:
-                    continue
-                mat.loc[f, t] = sub[f].corr(sub[t])
-        return mat
-
     tret_sel = pick_targets(tret_cols, df_cl)
     puis_sel = pick_targets(puis_cols, df_cl)
     corr_tret = corr_features_targets(df_cl, feat_cols, tret_sel)
@@ -122,6 +155,17 @@ def cluster_deep_analysis(cluster_id: int, path_training=None):
             t0p = df_cl.loc[m_first, "Dates"].min()
             df15_puis = df_cl[(df_cl["Dates"] >= t0p) & (df_cl["Dates"] < span_train_window(t0p))].copy()
 
+    def weekly_means(d, columns):
+        """
+        Moyennes hebdo (``resample("W")``) de la fenêtre ``d`` depuis la pyramide de rollups (jour → semaine) :
+        jours entiers lus dans ``path_rollups``, jours partiels en bordure agrégés depuis ``d`` ; None sans pyramide.
+        """
+        try:
+            day = day_rollup_window(cluster_id, d, columns, root=path_rollups)
+        except FileNotFoundError:
+            return None
+        return wide_mean(coarsen(day, "week")).reindex(columns=columns)
+
     if df15_tret.empty and (df15_puis is None or df15_puis.empty):
         print(f"Pas de lignes dans les fenêtres {MIN_YEARS_DATA} an.")
     else:
@@ -161,7 +205,10 @@ def cluster_deep_analysis(cluster_id: int, path_training=None):
             ax_bar.set_title(f"Cluster {cluster_id} — dispersion relative — {title_short}")
             ax_bar.tick_params(axis="y", labelsize=6)
 
-            w = X.resample("W").mean()
+            # Rollups (rollup_pyramid.py, fin de section 7) : quelques Ko lus au lieu du 15 min complet
+            w = weekly_means(d, columns)
+            if w is None:
+                w = X.resample("W").mean()
             if w.empty:
                 ax_line.text(0.5, 0.5, "Agrégation hebdo vide", ha="center", va="center")
                 ax_line.set_axis_off()
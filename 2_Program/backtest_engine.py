@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+Backtesting à origines glissantes (rolling origin) pour RF / XGB / LSTM.
+
+Au lieu de l'unique fenêtre test de ``compute_chrono_split_bounds``, chaque famille de modèles est évaluée
+sur K fenêtres test consécutives (fenêtre d'entraînement croissante, validation juste avant le test) :
+
+    fold k : train = [début, val_k) ; val = [val_k, test_k) ; test = [test_k, test_k + test_days)
+
+Les matrices de features par EGID (``build_xy_matrices`` sur train + val + test concaténés) sont calculées
+une fois et mises en cache (``.npz`` sous ``9_Results/Cluster{N}/_backtest_cache``, invalidées si les parquets
+changent) ; les tâches (EGID, modèle, fold) tournent en parallèle dans un pool de processus, chacun relisant
+le cache. Même filtrage que ML_training : train / val hors ``.inv``, test complet ; mêmes métriques que la
+section 5 (RMSE TempRet en °C, PuisCpt en fc, score = moyenne).
+
+Sorties (``9_Results/Cluster{N}/``) : ``backtest_metrics_cluster{N}.csv`` (une ligne par EGID × modèle × fold,
+avec durées train / predict), ``backtest_best_model_per_egid_cluster{N}.csv`` (score moyen sur les folds) et
+``backtest_summary_cluster{N}.json``.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe backtest_engine.py --cluster 3 --folds 4 --test-days 14 --workers 4
+  .venv\\Scripts\\python.exe backtest_engine.py --cluster 3 --models RF XGB --max-egids 30 --time-budget-s 1800
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+from ml_features import (
+    DEFAULT_SPEC,
+    PATH_RESULTS,
+    SEQ_LEN,
+    build_xy_matrices,
+    load_concat_frames,
+    lstm_end_indices,
+    parse_egids,
+    predictions_frame,
+    split_paths,
+)
+from ml_global_cluster import RF_PARAMS, XGB_EARLY_STOPPING_ROUNDS, XGB_PARAMS
+
+logger = logging.getLogger("backtest_engine")
+
+SEED = 42
+MODEL_KINDS = ("RF", "XGB", "LSTM")
+RESULT_PREFIX = {"RF": "RF", "XGB": "XB", "LSTM": "LSTM"}
+
+# LSTM — mêmes valeurs que la configuration de ML_training
+LSTM_EPOCHS = 80
+LSTM_BATCH_SIZE = 64
+LSTM_PATIENCE = 12
+LSTM_ADAM_LEARNING_RATE = 1e-3
+
+
+@dataclass(frozen=True)
+class Fold:
+    k: int
+    val_start: pd.Timestamp
+    test_start: pd.Timestamp
+    test_end: pd.Timestamp
+
+
+@dataclass(frozen=True)
+class BacktestTask:
+    cluster_id: int
+    egid: str
+    kind: str
+    fold: Fold
+    cache_path: str
+    threads: int
+
+
+def rolling_folds(
+    dmin: pd.Timestamp,
+    dmax: pd.Timestamp,
+    n_folds: int,
+    test_days: float,
+    val_days: float,
+    step_days: float | None = None,
+    min_train_days: float = 60.0,
+) -> list[Fold]:
+    """K fenêtres test (bornes à minuit UTC), la dernière contenant ``dmax`` ; pas ``step_days`` (défaut ``test_days``)."""
+    test_len = pd.Timedelta(days=test_days)
+    val_len = pd.Timedelta(days=val_days)
+    step = pd.Timedelta(days=step_days or test_days)
+    folds = []
+    end = dmax.floor("D") + pd.Timedelta(days=1)
+    for j in range(n_folds):
+        test_end = end - (n_folds - 1 - j) * step
+        test_start = test_end - test_len
+        val_start = test_start - val_len
+        if val_start - dmin < pd.Timedelta(days=min_train_days):
+            logger.warning("Fold %s ignoré : moins de %s j d'entraînement", j, min_train_days)
+            continue
+        folds.append(Fold(len(folds), val_start, test_start, test_end))
+    return folds
+
+
+def cluster_date_range(cluster_id: int) -> tuple[pd.Timestamp, pd.Timestamp]:
+    lo, hi = [], []
+    for p in split_paths(cluster_id):
+        d = pd.to_datetime(pd.read_parquet(p, columns=["Dates"])["Dates"], utc=True)
+        lo.append(d.min())
+        hi.append(d.max())
+    return min(lo), max(hi)
+
+
+def _source_signature(cluster_id: int) -> str:
+    return json.dumps(
+        {
+            "sources": [[p.name, p.stat().st_mtime_ns, p.stat().st_size] for p in split_paths(cluster_id)],
+            "features": DEFAULT_SPEC.feature_columns(),
+        }
+    )
+
+
+def cache_feature_matrix(cluster_id: int, egid: str, cache_dir: Path) -> Path:
+    """``{egid}.npz`` (X_raw, y, inv_ok, dates en ns UTC) ; recalculé si parquets ou features ont changé."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{egid}.npz"
+    sig = _source_signature(cluster_id)
+    if path.exists():
+        with np.load(path, allow_pickle=False) as z:
+            if str(z["signature"]) == sig:
+                return path
+    full, _sizes = load_concat_frames(cluster_id, egid)
+    X_raw, y, _sp, inv_ok, dates, _inv = build_xy_matrices(full, egid)
+    del full
+    d = pd.to_datetime(pd.Series(dates), utc=True)
+    dates_ns = ((d - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(nanoseconds=1)).to_numpy(dtype=np.int64)
+    np.savez(path, X_raw=X_raw, y=y, inv_ok=inv_ok, dates_ns=dates_ns, signature=np.array(sig))
+    return path
+
+
+def fold_split_codes(dates_ns: np.ndarray, fold: Fold) -> np.ndarray:
+    """0 train, 1 val, 2 test, -1 hors fold (après la fenêtre test)."""
+    sp = np.full(len(dates_ns), -1, dtype=np.int8)
+    sp[dates_ns < fold.val_start.value] = 0
+    sp[(dates_ns >= fold.val_start.value) & (dates_ns < fold.test_start.value)] = 1
+    sp[(dates_ns >= fold.test_start.value) & (dates_ns < fold.test_end.value)] = 2
+    return sp
+
+
+def _fit_predict_tabular(kind: str, X_tr, y_tr, X_va, y_va, X_te, threads: int):
+    """Retourne (modèle, fonction de prédiction (n, 2))."""
+    if kind == "RF":
+        rf = RandomForestRegressor(**RF_PARAMS, random_state=SEED, n_jobs=threads)
+        rf.fit(X_tr, y_tr)
+        return rf, rf.predict
+    from xgb_multi_target import predict_boosters, train_xgb_multi_target
+
+    res = train_xgb_multi_target(
+        X_tr,
+        y_tr,
+        X_va,
+        y_va,
+        X_te,
+        {**XGB_PARAMS, "n_jobs": threads},
+        early_stopping_rounds=XGB_EARLY_STOPPING_ROUNDS,
+    )
+    return res.boosters, lambda X: predict_boosters(res.boosters, X)
+
+
+def _build_lstm(seq_len: int, n_features: int):
+    """Même architecture que ``build_lstm_model`` (ML_training, section 4)."""
+    import tensorflow as tf
+    from tensorflow.keras import Sequential
+    from tensorflow.keras.layers import LSTM, Dense, Dropout
+
+    model = Sequential(
+        [
+            LSTM(32, return_sequences=True, input_shape=(seq_len, n_features)),
+            Dropout(0.2),
+            LSTM(16, return_sequences=False),
+            Dropout(0.2),
+            Dense(2, activation="sigmoid"),
+        ]
+    )
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=LSTM_ADAM_LEARNING_RATE),
+        loss="mse",
+        metrics=["mae"],
+    )
+    return model
+
+
+def run_task(task: BacktestTask) -> dict:
+    """Entraîne un modèle sur un fold et l'évalue sur sa fenêtre test (exécuté dans un processus du pool)."""
+    with np.load(task.cache_path, allow_pickle=False) as z:
+        X_raw, y, inv_ok, dates_ns = z["X_raw"], z["y"], z["inv_ok"], z["dates_ns"]
+    sp = fold_split_codes(dates_ns, task.fold)
+    row = dict(
+        cluster_id=task.cluster_id,
+        egid=task.egid,
+        model=RESULT_PREFIX[task.kind],
+        fold=task.fold.k,
+        test_start=str(task.fold.test_start),
+        test_end=str(task.fold.test_end),
+    )
+    tr_m, va_m, te_m = (sp == 0) & inv_ok, (sp == 1) & inv_ok, sp == 2
+    if not tr_m.any() or not va_m.any() or not te_m.any():
+        return {**row, "status": "vide"}
+
+    t0 = time.perf_counter()
+    scaler = StandardScaler().fit(X_raw[tr_m])
+    if task.kind == "LSTM":
+        from tensorflow.keras.callbacks import EarlyStopping
+
+        X_s = scaler.transform(X_raw).astype(np.float32)
+        train_e, val_e, test_e = lstm_end_indices(sp, SEQ_LEN)
+        train_e, val_e = train_e[inv_ok[train_e]], val_e[inv_ok[val_e]]
+        if len(train_e) == 0 or len(val_e) == 0 or len(test_e) == 0:
+            return {**row, "status": "vide"}
+        win = np.arange(-SEQ_LEN + 1, 1)
+        model = _build_lstm(SEQ_LEN, X_s.shape[1])
+        model.fit(
+            X_s[train_e[:, None] + win],
+            y[train_e].astype(np.float32),
+            validation_data=(X_s[val_e[:, None] + win], y[val_e].astype(np.float32)),
+            epochs=LSTM_EPOCHS,
+            batch_size=LSTM_BATCH_SIZE,
+            callbacks=[EarlyStopping(monitor="val_loss", patience=LSTM_PATIENCE, restore_best_weights=True)],
+            verbose=0,
+        )
+        train_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        pred = model.predict(X_s[test_e[:, None] + win], batch_size=LSTM_BATCH_SIZE, verbose=0)
+        te_idx = test_e
+        n_train = len(train_e)
+    else:
+        X_tr = scaler.transform(X_raw[tr_m])
+        X_va = scaler.transform(X_raw[va_m])
+        X_te = scaler.transform(X_raw[te_m])
+        _model, predict = _fit_predict_tabular(task.kind, X_tr, y[tr_m], X_va, y[va_m], X_te, task.threads)
+        train_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        pred = predict(X_te)
+        te_idx = np.where(te_m)[0]
+        n_train = int(tr_m.sum())
+    predict_s = time.perf_counter() - t0
+
+    frame = predictions_frame(pd.to_datetime(dates_ns[te_idx], utc=True), y[te_idx], pred)
+    yt = frame[["TempRet", "PuisCpt"]].to_numpy()
+    yp = frame[["TempRetPred", "PuisCptPred"]].to_numpy()
+    err = yt - yp
+    rmse = np.sqrt(np.mean(err * err, axis=0))
+    mae = np.mean(np.abs(err), axis=0)
+    return {
+        **row,
+        "status": "ok",
+        "n_train": n_train,
+        "n_test": len(te_idx),
+        "rmse_TempRet": float(rmse[0]),
+        "rmse_PuisCpt": float(rmse[1]),
+        "mae_TempRet": float(mae[0]),
+        "mae_PuisCpt": float(mae[1]),
+        "score": float(np.mean(rmse)),
+        "train_s": round(train_s, 3),
+        "predict_s": round(predict_s, 3),
+    }
+
+
+def _lstm_available() -> bool:
+    try:
+        import tensorflow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run_backtest(
+    cluster_id: int,
+    egids: list[str],
+    kinds: tuple[str, ...] = MODEL_KINDS,
+    *,
+    n_folds: int = 4,
+    test_days: float = 14.0,
+    val_days: float = 14.0,
+    step_days: float | None = None,
+    workers: int | None = None,
+    threads_per_worker: int = 1,
+    time_budget_s: float | None = None,
+    out_dir: Path | None = None,
+) -> tuple[pd.DataFrame, dict]:
+    """Lance toutes les tâches (EGID × modèle × fold) ; s'arrête proprement si ``time_budget_s`` est dépassé."""
+    t_start = time.perf_counter()
+    out_dir = Path(out_dir or PATH_RESULTS / f"Cluster{cluster_id}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if "LSTM" in kinds and not _lstm_available():
+        logger.warning("TensorFlow absent : LSTM ignoré")
+        kinds = tuple(k for k in kinds if k != "LSTM")
+
+    dmin, dmax = cluster_date_range(cluster_id)
+    folds = rolling_folds(dmin, dmax, n_folds, test_days, val_days, step_days)
+    if not folds:
+        raise ValueError("Aucun fold valide (historique trop court pour les fenêtres demandées)")
+
+    t0 = time.perf_counter()
+    cache_dir = out_dir / "_backtest_cache"
+    cache = {e: str(cache_feature_matrix(cluster_id, e, cache_dir)) for e in egids}
+    t_cache = time.perf_counter() - t0
+    logger.info("Cache features : %s EGID en %.1f s", len(cache), t_cache)
+
+    tasks = [
+        BacktestTask(cluster_id, e, kind, f, cache[e], threads_per_worker)
+        for f in folds
+        for e in egids
+        for kind in kinds
+    ]
+    workers = workers or max(1, (os.cpu_count() or 2) // max(1, threads_per_worker) - 1)
+    rows, skipped = [], 0
+    deadline = None if time_budget_s is None else t_start + float(time_budget_s)
+
+    def collect(fut, t: BacktestTask) -> None:
+        try:
+            rows.append(fut.result())
+        except Exception as exc:  # noqa: BLE001 — une tâche en échec ne stoppe pas le backtest
+            logger.warning("Tâche %s/%s/fold %s en échec : %s", t.egid, t.kind, t.fold.k, exc)
+            rows.append(
+                dict(
+                    cluster_id=cluster_id,
+                    egid=t.egid,
+                    model=RESULT_PREFIX[t.kind],
+                    fold=t.fold.k,
+                    status=f"erreur: {exc}",
+                )
+            )
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending = {ex.submit(run_task, t): t for t in tasks}
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                collect(fut, pending.pop(fut))
+            if deadline is not None and time.perf_counter() >= deadline and pending:
+                # Budget atteint : tâches non démarrées annulées, tâches en cours terminées et conservées
+                running = {f: t for f, t in pending.items() if not f.cancel()}
+                skipped = len(pending) - len(running)
+                logger.warning("Budget temps atteint : %s tâches annulées", skipped)
+                wait(running)
+                for fut, t in running.items():
+                    collect(fut, t)
+                break
+
+    if not rows:
+        raise RuntimeError("Aucune tâche terminée (budget temps trop court ?)")
+    metrics = pd.DataFrame(rows).sort_values(["egid", "model", "fold"], ignore_index=True)
+    metrics.to_csv(out_dir / f"backtest_metrics_cluster{cluster_id}.csv", index=False)
+    ok = metrics[metrics["status"] == "ok"] if "status" in metrics else metrics.iloc[:0]
+    if len(ok):
+        agg = (
+            ok.groupby(["cluster_id", "egid", "model"], as_index=False)
+            .agg(score_mean=("score", "mean"), score_std=("score", "std"), n_folds=("fold", "nunique"))
+            .sort_values("score_mean")
+        )
+        best = agg.groupby(["cluster_id", "egid"], as_index=False).first()
+        best.to_csv(out_dir / f"backtest_best_model_per_egid_cluster{cluster_id}.csv", index=False)
+        timing = ok.groupby("model")[["train_s", "predict_s"]].agg(["mean", "sum"]).round(3)
+        timing_d = {f"{m}_{c}_{s}": float(v) for (c, s), col in timing.items() for m, v in col.items()}
+        best_counts = best["model"].value_counts().to_dict()
+    else:
+        timing_d, best_counts = {}, {}
+
+    summary = {
+        "cluster_id": cluster_id,
+        "n_egids": len(egids),
+        "models": [RESULT_PREFIX[k] for k in kinds],
+        "folds": [{k: str(v) for k, v in asdict(f).items()} for f in folds],
+        "workers": workers,
+        "threads_per_worker": threads_per_worker,
+        "n_tasks": len(tasks),
+        "n_done": int((metrics.get("status") == "ok").sum()) if len(metrics) else 0,
+        "n_skipped_budget": skipped,
+        "time_budget_s": time_budget_s,
+        "cache_s": round(t_cache, 3),
+        "wall_s": round(time.perf_counter() - t_start, 3),
+        "timings_s": timing_d,
+        "best_model_counts": best_counts,
+    }
+    (out_dir / f"backtest_summary_cluster{cluster_id}.json").write_text(
+        json.dumps(summary, indent=2, default=str), encoding="utf-8"
+    )
+    return metrics, summary
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cluster", type=int, required=True)
+    ap.add_argument("--models", nargs="+", default=list(MODEL_KINDS), choices=list(MODEL_KINDS))
+    ap.add_argument("--folds", type=int, default=4)
+    ap.add_argument("--test-days", type=float, default=14.0)
+    ap.add_argument("--val-days", type=float, default=14.0)
+    ap.add_argument("--step-days", type=float, default=None, help="Décalage entre origines (défaut = test-days)")
+    ap.add_argument("--max-egids", type=int, default=-1, help="-1 = tous les EGID")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--threads-per-worker", type=int, default=1)
+    ap.add_argument("--time-budget-s", type=float, default=None)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    egids = parse_egids(pq.ParquetFile(split_paths(args.cluster)[0]).schema_arrow.names)
+    if args.max_egids > 0:
+        egids = egids[: args.max_egids]
+    metrics, summary = run_backtest(
+        args.cluster,
+        egids,
+        tuple(args.models),
+        n_folds=args.folds,
+        test_days=args.test_days,
+        val_days=args.val_days,
+        step_days=args.step_days,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        time_budget_s=args.time_budget_s,
+    )
+    print(json.dumps(summary, indent=2, default=str))
+    if "score" in metrics:
+        print(metrics.groupby("model")["score"].describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Mesures de performance des chemins coûteux du pipeline SST sur données synthétiques (synthetic_sst.py),
+à plusieurs échelles, avec historique pour comparer les commits.
+
+| Mesure              | Fonction                                              | Entrée                                  |
+|---------------------|-------------------------------------------------------|-----------------------------------------|
+| ``localize``        | ``localize_zurich_infer_order``                       | dates PuisCpt brutes (1 min)            |
+| ``puiscpt_15min``   | ``aggregate_puiscpt_to_15min_raw``                    | lignes PuisCpt brutes (section 2)       |
+| ``aggregate_long``  | ``aggregate_long`` (PuisCpt pré-agrégé)               | table enrichie (section 4)              |
+| ``chrono_split``    | ``compute_chrono_split_bounds``                       | étape ``sst_enriched`` écrite en tmp    |
+| ``wide_split``      | ``split_wide.build_split_df``                         | table transfo (section 7)               |
+| ``xy_matrices``     | ``ml_features.build_xy_matrices``                     | split large + lags d'un EGID            |
+
+Préparation (génération, étapes intermédiaires) hors chronométrage ; chaque mesure est répétée ``--repeat``
+fois (min et médiane retenus). Une ligne JSON par (mesure, échelle) est ajoutée à
+``9_Results/_bench/bench_history.jsonl`` avec le commit git, la machine et les versions ; ``--compare``
+rapporte le ratio à la dernière exécution d'un autre commit (ou d'un commit donné) et ``--max-slowdown``
+fait échouer le script (code 1) au-delà d'un ratio.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe bench_pipeline.py
+  .venv\\Scripts\\python.exe bench_pipeline.py --scales s m --repeat 5
+  .venv\\Scripts\\python.exe bench_pipeline.py --only aggregate_long wide_split --compare
+  .venv\\Scripts\\python.exe bench_pipeline.py --compare 140c211 --max-slowdown 1.2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from chrono_split_optimize import compute_chrono_split_bounds
+from ml_features import add_lag_features, build_xy_matrices
+from split_wide import build_split_df
+from sst_bucket_aggregate import aggregate_long, aggregate_puiscpt_to_15min_raw, localize_zurich_infer_order
+from sst_dataset import write_stage
+from synthetic_sst import generate_long, tempext
+
+ROOT = Path(__file__).resolve().parent
+PATH_BENCH = ROOT / "0_Data" / "9_Results" / "_bench"
+HISTORY = PATH_BENCH / "bench_history.jsonl"
+
+# échelle → (nombre d'EGID, années)
+SCALES = {"s": (2, 0.25), "m": (5, 1.0), "l": (20, 2.0)}
+BENCHES = ("localize", "puiscpt_15min", "aggregate_long", "chrono_split", "wide_split", "xy_matrices")
+SEED = 42
+
+
+@dataclass
+class BenchResult:
+    bench: str
+    scale: str
+    n_egids: int
+    years: float
+    n_rows: int
+    repeat: int
+    min_s: float
+    median_s: float
+    commit: str
+    dirty: bool
+    timestamp: str
+    host: str
+    python: str
+    numpy: str
+    pandas: str
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _timed(fn, repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+class Fixtures:
+    """Entrées d'une échelle, construites à la demande et partagées entre mesures."""
+
+    def __init__(self, n_egids: int, years: float, tmp: Path):
+        self.n_egids, self.years, self.tmp = n_egids, years, tmp
+        self._cache: dict = {}
+
+    def _get(self, name: str, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def raw(self) -> pd.DataFrame:
+        return self._get("raw", lambda: generate_long(self.n_egids, self.years, SEED).drop(columns="table"))
+
+    def raw_pc(self) -> pd.DataFrame:
+        return self._get("raw_pc", lambda: self.raw()[self.raw()["DATA_TYPE"] == "PuisCpt"].reset_index(drop=True))
+
+    def enriched(self) -> pd.DataFrame:
+        """Sections 2–3 : PuisCpt pré-agrégé, ``date_15min`` UTC, TempExt."""
+
+        def build():
+            raw = self.raw()
+            m_pc = raw["DATA_TYPE"] == "PuisCpt"
+            df = pd.concat([raw.loc[~m_pc], aggregate_puiscpt_to_15min_raw(raw.loc[m_pc].copy())], ignore_index=True)
+            df["date_15min"] = (
+                df["date"]
+                .dt.tz_localize("Europe/Zurich", ambiguous=True, nonexistent="shift_forward")
+                .dt.tz_convert("UTC")
+                .dt.floor("15min")
+            )
+            df["TempExt"] = tempext(pd.DatetimeIndex(df["date_15min"])).round(1)
+            return df
+
+        return self._get("enriched", build)
+
+    def enriched_stage(self) -> Path:
+        return self._get("enriched_stage", lambda: write_stage(self.enriched().copy(), self.tmp / "sst_enriched"))
+
+    def transfo(self) -> pd.DataFrame:
+        """Sections 4–6 simplifiées : agrégation 15 min, exogènes, ``valeur_fc`` / ``valeur_norm``."""
+
+        def build():
+            enr = self.enriched()
+            df = aggregate_long(
+                enr[["date", "EGID", "DATA_TYPE", "valeur", "inv"]].copy(),
+                aggregation_15min=True,
+                freq="15min",
+                puiscpt_preaggregated=True,
+            )
+            df["date_15min"] = pd.to_datetime(df["date_15min"], utc=True).dt.tz_localize(None)
+            dates = df["date_15min"].dt.tz_localize("UTC").dt.tz_convert("Europe/Zurich")
+            for name, val, period in (
+                ("dayofyear", dates.dt.dayofyear - 1, 366),
+                ("dayofweek", dates.dt.dayofweek, 7),
+                ("hour", dates.dt.hour, 24),
+            ):
+                df[f"{name}_cos"] = np.cos(2 * np.pi * val / period)
+                df[f"{name}_sin"] = np.sin(2 * np.pi * val / period)
+            df["TempExt_norm"] = np.clip((tempext(pd.DatetimeIndex(df["date_15min"])) + 20) / 60, 0, 1)
+            pc = df["DATA_TYPE"] == "PuisCpt"
+            df["valeur_fc"] = np.where(pc, np.clip(df["valeur"] / 200.0, 0, 1), np.nan)
+            df["valeur_norm"] = np.where(~pc, np.clip((df["valeur"] - 20) / 60, 0, 1), np.nan)
+            return df
+
+        return self._get("transfo", build)
+
+    def dates_full(self) -> pd.DataFrame:
+        return self._get(
+            "dates_full",
+            lambda: self.enriched()[["date_15min", "TempExt"]].drop_duplicates(subset=["date_15min"]),
+        )
+
+    def wide(self) -> pd.DataFrame:
+        return self._get("wide", lambda: build_split_df(self.transfo(), self.dates_full()))
+
+    def xy_input(self) -> tuple[pd.DataFrame, str]:
+        def build():
+            wide = self.wide().copy()
+            wide["_sp"] = np.minimum(np.arange(len(wide)) * 3 // max(len(wide), 1), 2).astype(np.int8)
+            egid = str(self.raw()["EGID"].iloc[0])
+            return add_lag_features(wide, egid), egid
+
+        return self._get("xy", build)
+
+
+def bench_case(name: str, fx: Fixtures):
+    """(callable chronométré, lignes d'entrée) d'une mesure ; la préparation est faite ici."""
+    if name == "localize":
+        dates = fx.raw_pc()["date"]
+        return (lambda: localize_zurich_infer_order(dates)), len(dates)
+    if name == "puiscpt_15min":
+        df = fx.raw_pc()
+        return (lambda: aggregate_puiscpt_to_15min_raw(df)), len(df)
+    if name == "aggregate_long":
+        df = fx.enriched()[["date", "EGID", "DATA_TYPE", "valeur", "inv"]]
+        return (
+            lambda: aggregate_long(df, aggregation_15min=True, freq="15min", puiscpt_preaggregated=True)
+        ), len(df)
+    if name == "chrono_split":
+        path = fx.enriched_stage()
+        n = fx.enriched()["date_15min"].nunique()
+        return (lambda: compute_chrono_split_bounds(path)), n
+    if name == "wide_split":
+        df, dates_full = fx.transfo(), fx.dates_full()
+        return (lambda: build_split_df(df, dates_full)), len(df)
+    if name == "xy_matrices":
+        full, egid = fx.xy_input()
+        return (lambda: build_xy_matrices(full, egid)), len(full)
+    raise ValueError(f"Mesure inconnue : {name}")
+
+
+def run(scales: list[str], benches: list[str], repeat: int) -> list[BenchResult]:
+    commit = _git("rev-parse", "--short", "HEAD") or "inconnu"
+    dirty = bool(_git("status", "--porcelain", "--untracked-files=no"))
+    meta = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": pd.Timestamp.now(tz="UTC").isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+    results = []
+    for scale in scales:
+        n_egids, years = SCALES[scale]
+        tmp = Path(tempfile.mkdtemp(prefix=f"bench_{scale}_"))
+        try:
+            fx = Fixtures(n_egids, years, tmp)
+            for name in benches:
+                fn, n_rows = bench_case(name, fx)
+                times = _timed(fn, repeat)
+                r = BenchResult(
+                    name, scale, n_egids, years, int(n_rows), repeat, min(times), float(np.median(times)), **meta
+                )
+                results.append(r)
+                print(
+                    f"{scale:>2} {name:<16} {r.n_rows:>12,} lignes  min {r.min_s:8.3f} s  médiane {r.median_s:8.3f} s"
+                    f"  ({r.n_rows / max(r.min_s, 1e-9):,.0f} lignes/s)"
+                )
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def append_history(results: list[BenchResult], path: Path = HISTORY) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for r in results:
+            f.write(json.dumps(asdict(r), ensure_ascii=False) + "\n")
+
+
+def load_history(path: Path = HISTORY) -> pd.DataFrame:
+    if not path.is_file():
+        return pd.DataFrame(columns=list(BenchResult.__dataclass_fields__))
+    return pd.read_json(path, lines=True, dtype={"commit": str})
+
+
+def compare(results: list[BenchResult], history: pd.DataFrame, ref: str | None = None) -> pd.DataFrame:
+    """Ratio médiane courante / médiane de référence par (mesure, échelle).
+
+    Référence : dernière exécution du commit ``ref`` (préfixe accepté), sinon dernière exécution d'un autre commit.
+    """
+    cur = pd.DataFrame([asdict(r) for r in results])
+    if cur.empty or history.empty:
+        return pd.DataFrame()
+    commit = cur["commit"].iloc[0]
+    if ref:
+        base = history[history["commit"].astype(str).str.startswith(ref)]
+    else:
+        base = history[history["commit"].astype(str) != commit]
+    if base.empty:
+        return pd.DataFrame()
+    base = base.sort_values("timestamp").groupby(["bench", "scale"], as_index=False).last()
+    m = cur.merge(base, on=["bench", "scale"], suffixes=("", "_ref"))
+    m["ratio"] = m["median_s"] / m["median_s_ref"]
+    return m[["bench", "scale", "n_rows", "median_s", "commit_ref", "median_s_ref", "ratio"]]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scales", nargs="+", default=["s"], choices=list(SCALES))
+    ap.add_argument("--only", nargs="+", default=list(BENCHES), choices=list(BENCHES), help="Mesures à lancer")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--history", type=Path, default=HISTORY)
+    ap.add_argument("--no-save", action="store_true", help="N'ajoute pas les résultats à l'historique")
+    ap.add_argument(
+        "--compare",
+        nargs="?",
+        const="",
+        default=None,
+        help="Compare à la dernière exécution d'un autre commit (ou du commit donné)",
+    )
+    ap.add_argument("--max-slowdown", type=float, default=None, help="Ratio médian au-delà duquel le script échoue")
+    args = ap.parse_args()
+    warnings.filterwarnings("ignore", message="Mean of empty slice", category=RuntimeWarning)
+
+    history = load_history(args.history)
+    results = run(args.scales, args.only, args.repeat)
+    if not args.no_save:
+        append_history(results, args.history)
+        print(f"\n{len(results)} résultats ajoutés à {args.history}")
+    if args.compare is None:
+        return
+    cmp = compare(results, history, args.compare or None)
+    if cmp.empty:
+        print("Aucune exécution de référence dans l'historique.")
+        return
+    print("\n" + cmp.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    if args.max_slowdown is not None:
+        slow = cmp[cmp["ratio"] > args.max_slowdown]
+        if not slow.empty:
+            print(f"\nRalentissement > {args.max_slowdown:g}× : " + ", ".join(f"{b}/{s}" for b, s in zip(slow["bench"], slow["scale"])))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Vérifie que le moteur DuckDB (sst_sql.py) produit les mêmes étapes que le chemin pandas du notebook
+dataset_preparation_V2.ipynb, sur un export synthétique (synthetic_sst.py) écrit dans un répertoire temporaire.
+
+Déroulé : sections 1 et 2 du notebook une fois (import brut), puis sections 3 à 5 avec
+``STAGE_BACKENDS`` tout pandas, copie des étapes, et de nouveau avec tout duckdb. Les étapes
+
+| Étape                 | Section | Fonction SQL               |
+|-----------------------|---------|----------------------------|
+| ``sst_enriched``      | 3       | ``sst_sql.enrich_stage``   |
+| ``sst_filtered``      | 4       | ``sst_sql.filter_stage``   |
+| ``sst_filtered_clean``| 5       | ``sst_sql.clean_stage``    |
+
+sont comparées valeur à valeur (``read_stage``, ordre des lignes et types compris). La météo Open-Meteo est
+remplacée par ``synthetic_sst.tempext`` (aucun accès réseau). Code de sortie 1 au premier écart.
+
+Les cellules sont exécutées telles quelles (repérées par leur contenu) ; seuls ``PATH_RAW``,
+``MIN_YEARS_DATA`` (et ``FREQ`` / agrégation avec ``--no-aggregation``) et ``urlopen`` sont surchargés
+après la section 1 : le script suit donc le notebook sans copie à maintenir.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe check_sql_backend.py
+  .venv\\Scripts\\python.exe check_sql_backend.py --egids 4 --years 1.5 --min-years 1.1
+  .venv\\Scripts\\python.exe check_sql_backend.py --no-aggregation --verbose
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import sst_sql
+from sst_dataset import read_stage, stage_exists
+from synthetic_sst import gis_frame, generate_long, tempext, write_export
+
+ROOT = Path(__file__).resolve().parent
+NOTEBOOK = ROOT / "dataset_preparation_V2.ipynb"
+
+# cellules de code exécutées, repérées par un fragment de leur source
+CELLS = {
+    "config": 'PATH_RAW = Path("',
+    "ingest": "def load_raw_csvs(",
+    "write_raw": 'PROFILER.section("write_sst_raw"',
+    "enrich": 'PROFILER.section("enrich"',
+    "filter": "def filter_batch(",
+    "clean": 'PROFILER.section("clean"',
+}
+SQL_SECTIONS = ("enrich", "filter", "clean")
+STAGES = {"enrich": "PATH_SST_ENRICHED", "filter": "PATH_SST_FILTERED", "clean": "PATH_SST_FILTERED_CLEAN"}
+
+
+def notebook_cells(path: Path = NOTEBOOK) -> dict[str, str]:
+    """Source des cellules de ``CELLS`` (erreur si un repère est absent ou ambigu)."""
+    nb = json.loads(path.read_text(encoding="utf-8"))
+    code = ["".join(c["source"]) for c in nb["cells"] if c["cell_type"] == "code"]
+    out = {}
+    for name, marker in CELLS.items():
+        hits = [s for s in code if marker in s]
+        if len(hits) != 1:
+            raise ValueError(f"{path.name} : {len(hits)} cellules contiennent {marker!r} (attendu 1)")
+        out[name] = hits[0]
+    return out
+
+
+class _FakeResponse(io.BytesIO):
+    """Réponse ``urlopen`` minimale (gestionnaire de contexte)."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fake_urlopen(url: str, timeout: float | None = None) -> _FakeResponse:
+    """Archive Open-Meteo horaire simulée par ``synthetic_sst.tempext`` (même format JSON)."""
+    q = parse_qs(urlparse(url).query)
+    start = pd.Timestamp(q["start_date"][0], tz="UTC")
+    end = pd.Timestamp(q["end_date"][0], tz="UTC") + pd.Timedelta(hours=23)
+    hours = pd.date_range(start, end, freq="h")
+    body = {
+        "hourly": {
+            "time": hours.strftime("%Y-%m-%dT%H:%M").tolist(),
+            "temperature_2m": [round(float(t), 1) for t in tempext(hours)],
+        }
+    }
+    return _FakeResponse(json.dumps(body).encode())
+
+
+class NotebookRun:
+    """Espace de noms partagé par les cellules, comme un noyau Jupyter."""
+
+    def __init__(self, cells: dict[str, str], verbose: bool = False):
+        self.cells = cells
+        self.verbose = verbose
+        self.ns: dict = {"__name__": "__main__"}
+
+    def run(self, name: str) -> float:
+        t0 = time.perf_counter()
+        out = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        with out:
+            exec(compile(self.cells[name], f"<{name}>", "exec"), self.ns)
+        return time.perf_counter() - t0
+
+
+def compare_stage(ref: Path, new: Path) -> str | None:
+    """Message d'écart entre deux étapes, None si identiques."""
+    a, b = read_stage(ref), read_stage(new)
+    try:
+        pd.testing.assert_frame_equal(a.reset_index(drop=True), b.reset_index(drop=True), check_exact=True)
+    except AssertionError as e:
+        return str(e).splitlines()[0] if str(e) else "écart"
+    return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--egids", type=int, default=3)
+    ap.add_argument("--years", type=float, default=1.0, help="Durée de l'export synthétique")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--min-years", type=float, default=0.5, help="MIN_YEARS_DATA (section 1)")
+    ap.add_argument(
+        "--no-aggregation",
+        action="store_true",
+        help="AGGREGATION_15MIN=False, FREQ=1min (chemin sans agrégation de la section 4)",
+    )
+    ap.add_argument("--keep", action="store_true", help="Conserve le répertoire de travail")
+    ap.add_argument("--verbose", action="store_true", help="Affiche la sortie des cellules")
+    args = ap.parse_args()
+
+    if not sst_sql.available():
+        sys.exit("duckdb n'est pas installé : pip install -r requirements-optional.txt")
+    warnings.filterwarnings("ignore")
+    cells = notebook_cells()
+    work = Path(tempfile.mkdtemp(prefix="check_sql_"))
+    cwd = Path.cwd()
+    nb = NotebookRun(cells, args.verbose)
+    failed = False
+    try:
+        os.chdir(work)
+        raw_root = work / "0_Data" / "0_Raw" / "ExportSST"
+        raw_root.mkdir(parents=True)
+        export = write_export(generate_long(args.egids, args.years, args.seed, late_start_share=0.0), raw_root)
+        (work / "0_Data" / "1_Structured").mkdir(parents=True)
+        gis_frame(args.egids, args.seed).to_parquet(work / "0_Data" / "1_Structured" / "DATA_GIS_Filtered.parquet")
+        print(f"Export synthétique : {args.egids} EGID × {args.years} an → {work}")
+
+        nb.run("config")
+        ns = nb.ns
+        ns.update(
+            PATH_RAW=export.relative_to(work),
+            MIN_YEARS_DATA=args.min_years,
+            urlopen=fake_urlopen,
+        )
+        if args.no_aggregation:
+            ns.update(AGGREGATION_15MIN=False, PUISCPT_PREAGGREGATED_IN_RAW=False, FREQ="1min")
+        ns["PROFILER"].out_dir = work / "_profiles"
+        t = nb.run("ingest") + nb.run("write_raw")
+        print(f"Sections 1-2 : {t:.1f} s")
+
+        timings: dict[str, dict[str, float]] = {}
+        for backend in sst_sql.BACKENDS:
+            ns["STAGE_BACKENDS"] = {s: backend for s in SQL_SECTIONS}
+            if backend == "duckdb" and ns.get("SQL_CON") is None:
+                ns["SQL_CON"] = sst_sql.connect(work_dir=work / "_duckdb")
+            timings[backend] = {s: nb.run(s) for s in SQL_SECTIONS}
+            if backend == "pandas":
+                for s in SQL_SECTIONS:
+                    path = Path(ns[STAGES[s]])
+                    shutil.copytree(path, work / "_ref" / path.name)
+
+        print(f"{'section':<10}{'pandas (s)':>12}{'duckdb (s)':>12}  résultat")
+        for s in SQL_SECTIONS:
+            path = Path(ns[STAGES[s]])
+            ref = work / "_ref" / path.name
+            diff = compare_stage(ref, path) if stage_exists(path) else "étape absente"
+            failed |= diff is not None
+            print(
+                f"{s:<10}{timings['pandas'][s]:>12.2f}{timings['duckdb'][s]:>12.2f}  "
+                f"{'identique' if diff is None else 'ÉCART : ' + diff}"
+            )
+    finally:
+        if nb.ns.get("SQL_CON") is not None:
+            nb.ns["SQL_CON"].close()
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Répertoire conservé : {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,9 @@ import numpy as np
 import pandas as pd
 from scipy.stats import wasserstein_distance
 
+from sst_dataset import read_stage, stage_exists, stage_path
+from stage_profiler import profiled
+
 
 @dataclass(frozen=True)
 class ChronoSplitResult:
@@ -68,6 +71,7 @@ def _as_utc(ts: pd.Timestamp | str) -> pd.Timestamp:
     return t.tz_convert("UTC")
 
 
+@profiled("chrono_split")
 def compute_chrono_split_bounds(
     path_sst_enriched: Path | str,
     *,
@@ -83,13 +87,13 @@ def compute_chrono_split_bounds(
     clip_timeline_end_utc: pd.Timestamp | str | None = None,
 ) -> ChronoSplitResult:
     path = Path(path_sst_enriched)
-    if not path.is_file():
-        raise FileNotFoundError(f"Parquet enrichi introuvable : {path}")
+    if not stage_exists(path):
+        raise FileNotFoundError(f"Parquet enrichi introuvable : {stage_path(path)}")
 
     quant_levels = np.linspace(0.05, 0.95, 19)
     cold_thr = float(tempext_cold_threshold_c)
 
-    dfm = pd.read_parquet(path, columns=["date_15min", "TempExt"])
+    dfm = read_stage(path, columns=["date_15min", "TempExt"])
     dfm = dfm.dropna(subset=["date_15min", "TempExt"])
     dfm["date_15min"] = pd.to_datetime(dfm["date_15min"], utc=True)
     dfm = dfm.sort_values("date_15min").drop_duplicates(subset=["date_15min"], keep="last")
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+Export CSV en flux (Arrow natif) d'un cluster, d'un lot d'EGID, d'étapes et de colonnes quelconques.
+
+Remplace la logique « lire chaque row group complet → pandas → concaténer → trier → to_csv » des scripts
+``export_cluster3_*`` :
+
+- filtres ``cluster == N`` et ``EGID in (...)`` poussés dans le scan Parquet (partitions ``cluster=N`` des jeux
+  partitionnés de sst_dataset.py, statistiques des row groups ; pour un ancien fichier monolithique, index annexe
+  EGID → row groups d'egid_lookup.py s'il existe), projection sur les colonnes demandées ;
+- lecture des row groups en parallèle (scanner ``pyarrow.dataset``, ``--threads``) ;
+- écriture incrémentale par ``pyarrow.csv`` (mémoire bornée) au format de l'ancien ``to_csv`` : BOM UTF-8 comme
+  ``utf-8-sig``, guillemets seulement si nécessaires, horodatages ``AAAA-MM-JJ hh:mm:ss`` (ceux avec fuseau en UTC
+  sans fuseau : pas de base tz requise sous Windows) ;
+- tri optionnel (EGID, date, DATA_TYPE) par tri externe : répartition des lignes en paquets d'EGID contigus
+  (≤ ``--sort-mem-rows`` lignes chacun, fichiers IPC temporaires), puis tri stable de chaque paquet en mémoire
+  et écriture dans l'ordre des EGID ;
+- ``--sample uniform|stratified`` : échantillon représentatif de ``--max-rows`` lignes (row_sampler.py, graine
+  ``--seed``) au lieu des premières lignes du fichier ; seuls les row groups contenant une ligne tirée sont relus.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe cluster_export.py --cluster 3 --max-rows 500000
+  .venv\\Scripts\\python.exe cluster_export.py --cluster 5 --egids 1511188,190198380 --sort
+  .venv\\Scripts\\python.exe cluster_export.py --cluster 4 --stages transfo --columns date EGID DATA_TYPE valeur_fc
+  .venv\\Scripts\\python.exe cluster_export.py --cluster 3 --max-rows 200000 --sample stratified --seed 1
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from egid_lookup import INDEX_SUFFIX, EgidRowGroupIndex, typed_egids
+from row_sampler import PER_STRATUM, plan_sample
+from sst_dataset import open_stage, stage_exists, stage_path
+
+logger = logging.getLogger("cluster_export")
+
+ROOT = Path(__file__).resolve().parent
+STRUCT = ROOT / "0_Data/1_Structured"
+
+# Jeux partitionnés (sst_dataset.py) ; anciens fichiers <étape>.parquet lus s'ils sont seuls présents
+STAGES = {
+    "filtered": STRUCT / "sst_filtered",
+    "clean": STRUCT / "sst_filtered_clean",
+    "transfo": STRUCT / "sst_filtered_transfo",
+}
+
+# Colonnes utiles pour visualiser le décalage TempRet / PuisCpt (évite CSV trop larges)
+COLS_FILTERED_CLEAN = [
+    "date",
+    "date_15min",
+    "EGID",
+    "DATA_TYPE",
+    "valeur",
+    "inv",
+    "cluster",
+    "TempExt",
+]
+COLS_TRANSFO = COLS_FILTERED_CLEAN + [
+    "TempExt_norm",
+    "dayofyear_cos",
+    "dayofyear_sin",
+    "hour_cos",
+    "hour_sin",
+    "valeur_fc",
+    "valeur_norm",
+]
+DEFAULT_COLUMNS = {"filtered": COLS_FILTERED_CLEAN, "clean": COLS_FILTERED_CLEAN, "transfo": COLS_TRANSFO}
+
+SORT_KEYS = ("EGID", "date", "DATA_TYPE")
+SAMPLE_MODES = ("head", "uniform", "stratified")
+BATCH_ROWS = 131_072
+SORT_MEM_ROWS = 2_000_000
+UTF8_BOM = b"\xef\xbb\xbf"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # pas de fraction : données au pas minute / 15 min
+_NEEDS_QUOTES = '[,"\r\n]'
+
+
+def stage_dataset(path: Path, egids=None) -> ds.Dataset:
+    """Dataset de l'étape ; ancien fichier : restreint aux row groups des EGID demandés si l'index annexe existe."""
+    path = stage_path(path)
+    dataset = open_stage(path)
+    if path.is_dir():
+        return dataset
+    idx_path = path.with_name(path.name + INDEX_SUFFIX)
+    if egids is None or not idx_path.is_file():
+        return dataset
+    rgs = EgidRowGroupIndex.for_file(path).row_groups(egids)
+    frag = next(iter(dataset.get_fragments()))
+    return ds.FileSystemDataset([frag.subset(row_group_ids=rgs)], dataset.schema, dataset.format, dataset.filesystem)
+
+
+def scan_filter(schema: pa.Schema, cluster_id: int | None, egids=None) -> ds.Expression | None:
+    flt = None
+    if cluster_id is not None:
+        if "cluster" not in schema.names:
+            raise ValueError("Colonne cluster manquante")
+        flt = ds.field("cluster") == pa.scalar(cluster_id).cast(_value_type(schema.field("cluster").type))
+    if egids is not None:
+        f = ds.field("EGID").isin(typed_egids(egids, schema.field("EGID").type))
+        flt = f if flt is None else flt & f
+    return flt
+
+
+def _value_type(t: pa.DataType) -> pa.DataType:
+    return t.value_type if pa.types.is_dictionary(t) else t
+
+
+def csv_ready(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Dictionnaires décodés, horodatages avec fuseau → UTC sans fuseau (comme l'ancien export pandas)."""
+    cols, fields = [], []
+    for f, col in zip(batch.schema, batch.columns):
+        t = f.type
+        if pa.types.is_dictionary(t):
+            col = col.cast(t.value_type)
+        elif pa.types.is_timestamp(t) and t.tz is not None:
+            col = col.cast(pa.timestamp(t.unit))
+        cols.append(col)
+        fields.append(pa.field(f.name, col.type))
+    return pa.RecordBatch.from_arrays(cols, schema=pa.schema(fields))
+
+
+class CsvSink:
+    """CSV au format de l'ancien ``DataFrame.to_csv(index=False, encoding="utf-8-sig")`` : guillemets seulement si
+    nécessaires (``QUOTE_MINIMAL``), horodatages ``TIMESTAMP_FORMAT``, fins de ligne LF.
+
+    Arrow écrit les lots sans guillemets ; un lot dont un texte contient un séparateur, un guillemet ou un saut de
+    ligne passe par pandas (seul à savoir ne citer que ces valeurs). Seule différence avec ``to_csv`` : les flottants
+    suivent la représentation la plus courte d'Arrow (``0`` au lieu de ``0.0``, ``1e-7`` au lieu de ``1e-07``),
+    mêmes valeurs à la relecture.
+    """
+
+    def __init__(self, out_csv: Path, schema: pa.Schema):
+        out_csv.parent.mkdir(parents=True, exist_ok=True)
+        self.fh = open(out_csv, "wb")
+        self.fh.write(UTF8_BOM)
+        self.fh.write(pd.DataFrame(columns=schema.names).to_csv(index=False, lineterminator="\n").encode("utf-8"))
+        self.options = pacsv.WriteOptions(include_header=False, quoting_style="none")
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        cols = []
+        for col in batch.columns:
+            if pa.types.is_timestamp(col.type):
+                col = pc.strftime(col.cast(pa.timestamp("s"), safe=False), format=TIMESTAMP_FORMAT)
+            cols.append(col)
+        batch = pa.RecordBatch.from_arrays(cols, names=batch.schema.names)
+        quoted = any(
+            pc.any(pc.match_substring_regex(c, _NEEDS_QUOTES)).as_py() for c in cols if pa.types.is_string(c.type) or pa.types.is_large_string(c.type)
+        )
+        if quoted:
+            frame = batch.to_pandas(integer_object_nulls=True)
+            self.fh.write(frame.to_csv(index=False, header=False, lineterminator="\n").encode("utf-8"))
+        else:
+            pacsv.write_csv(batch, self.fh, self.options)
+
+    def write_table(self, table: pa.Table) -> None:
+        for batch in table.to_batches():
+            self.write_batch(batch)
+
+    def close(self) -> None:
+        self.fh.close()
+
+
+def _batches(dataset: ds.Dataset, columns, flt, max_rows: int | None, threads: bool):
+    """Lots filtrés dans l'ordre du fichier, tronqués à ``max_rows`` lignes au total."""
+    scanner = dataset.scanner(columns=columns, filter=flt, batch_size=BATCH_ROWS, use_threads=threads)
+    n = 0
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        if max_rows is not None and n + batch.num_rows > max_rows:
+            batch = batch.slice(0, max_rows - n)
+        n += batch.num_rows
+        yield csv_ready(batch)
+        if max_rows is not None and n >= max_rows:
+            return
+
+
+def _egid_buckets(dataset: ds.Dataset, flt, max_rows: int | None, mem_rows: int) -> tuple[pa.Array, pa.Array]:
+    """(EGID triés, n° de paquet) : paquets d'EGID contigus d'au plus ``mem_rows`` lignes (1 EGID minimum)."""
+    keys = dataset.scanner(columns=["EGID"], filter=flt).to_table()
+    if max_rows is not None:
+        keys = keys.slice(0, max_rows)
+    col = keys.column(0)
+    if pa.types.is_dictionary(col.type):
+        col = col.cast(col.type.value_type)
+    counts = pa.table({"EGID": col}).group_by("EGID").aggregate([("EGID", "count")]).sort_by("EGID")
+    egids = counts.column("EGID").combine_chunks()
+    bucket, filled, out = 0, 0, []
+    for c in counts.column("EGID_count").to_pylist():
+        if filled and filled + c > mem_rows:
+            bucket, filled = bucket + 1, 0
+        out.append(bucket)
+        filled += c
+    return egids, pa.array(out, type=pa.int32())
+
+
+def export_stage(
+    path: Path,
+    out_csv: Path,
+    cluster_id: int | None,
+    egids=None,
+    columns: list[str] | None = None,
+    max_rows: int | None = None,
+    sort: bool = False,
+    threads: bool = True,
+    sort_mem_rows: int = SORT_MEM_ROWS,
+) -> int:
+    """Exporte une étape en CSV (flux) ; retourne le nombre de lignes écrites."""
+    if not stage_exists(path):
+        raise FileNotFoundError(path)
+    dataset = stage_dataset(path, egids)
+    names = set(dataset.schema.names) - {"year"}
+    cols = [c for c in (columns or dataset.schema.names) if c in names]
+    if sort:
+        cols += [k for k in SORT_KEYS if k in names and k not in cols]
+    flt = scan_filter(dataset.schema, cluster_id, egids)
+
+    written = 0
+    writer = None
+    try:
+        if not sort:
+            for batch in _batches(dataset, cols, flt, max_rows, threads):
+                if writer is None:
+                    writer = CsvSink(out_csv, batch.schema)
+                writer.write_batch(batch)
+                written += batch.num_rows
+        else:
+            written = _export_sorted(dataset, cols, flt, max_rows, threads, sort_mem_rows, out_csv)
+    finally:
+        if writer is not None:
+            writer.close()
+    if written == 0:
+        out_csv.parent.mkdir(parents=True, exist_ok=True)
+        out_csv.write_text("no_data\n", encoding="utf-8")
+    return written
+
+
+def export_sample(
+    path: Path,
+    out_csv: Path,
+    cluster_id: int | None,
+    n_rows: int,
+    mode: str = "uniform",
+    egids=None,
+    columns: list[str] | None = None,
+    sort: bool = False,
+    per_stratum: int = PER_STRATUM,
+    seed: int = 0,
+) -> int:
+    """Exporte un échantillon (row_sampler.py) de ``n_rows`` lignes ; ordre du fichier, ou trié si ``sort``."""
+    if not stage_exists(path):
+        raise FileNotFoundError(path)
+    path = stage_path(path)
+    plan = plan_sample(path, n_rows, cluster_id, mode=mode, per_stratum=per_stratum, seed=seed, egids=egids)
+    logger.info(
+        "%s : %s lignes tirées sur %s (%s row groups relus / %s parcourus%s)",
+        path.name,
+        plan.n_rows,
+        plan.n_candidates,
+        len(plan.row_groups),
+        plan.row_groups_scanned,
+        f", {plan.n_strata} strates" if mode == "stratified" else "",
+    )
+    schema = open_stage(path).schema
+    names = set(schema.names) - {"year"}
+    cols = [c for c in (columns or schema.names) if c in names]
+    if sort:
+        cols += [k for k in SORT_KEYS if k in names and k not in cols]
+    parts = (
+        pq.ParquetFile(plan.units[i].path).read_row_group(plan.units[i].row_group, columns=cols).take(pa.array(idx))
+        for i, idx in sorted(plan.row_groups.items())
+    )
+    if sort:
+        tables = list(parts)
+        if tables:
+            table = pa.concat_tables(tables)
+            table = pa.Table.from_batches([csv_ready(b) for b in table.to_batches()])
+            parts = iter([table.sort_by([(k, "ascending") for k in SORT_KEYS if k in cols])])
+    written = 0
+    writer = None
+    try:
+        for table in parts:
+            for batch in table.to_batches():
+                batch = csv_ready(batch)
+                if writer is None:
+                    writer = CsvSink(out_csv, batch.schema)
+                writer.write_batch(batch)
+                written += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    if written == 0:
+        out_csv.parent.mkdir(parents=True, exist_ok=True)
+        out_csv.write_text("no_data\n", encoding="utf-8")
+    return written
+
+
+def _export_sorted(dataset, cols, flt, max_rows, threads, mem_rows, out_csv: Path) -> int:
+    """Tri externe (EGID, date, DATA_TYPE) : répartition en paquets d'EGID sur disque, tri par paquet."""
+    egids, bucket_ids = _egid_buckets(dataset, flt, max_rows, mem_rows)
+    if len(egids) == 0:
+        return 0
+    sort_keys = [(k, "ascending") for k in SORT_KEYS if k in cols]
+    tmp_dir = Path(tempfile.mkdtemp(prefix="cluster_export_", dir=out_csv.parent if out_csv.parent.exists() else None))
+    sinks: dict[int, tuple] = {}
+    try:
+        for batch in _batches(dataset, cols, flt, max_rows, threads):
+            b_of_row = pc.take(bucket_ids, pc.index_in(batch.column("EGID"), value_set=egids))
+            for b in pc.unique(b_of_row).to_pylist():
+                part = batch.filter(pc.equal(b_of_row, b))
+                if b not in sinks:
+                    f = open(tmp_dir / f"bucket_{b:05d}.arrow", "wb")
+                    sinks[b] = (f, ipc.new_stream(f, part.schema))
+                sinks[b][1].write_batch(part)
+        for f, w in sinks.values():
+            w.close()
+            f.close()
+
+        written = 0
+        writer = None
+        try:
+            for b in sorted(sinks):
+                with ipc.open_stream(tmp_dir / f"bucket_{b:05d}.arrow") as reader:
+                    table = reader.read_all().sort_by(sort_keys)
+                if writer is None:
+                    writer = CsvSink(out_csv, table.schema)
+                writer.write_table(table)
+                written += table.num_rows
+                del table
+        finally:
+            if writer is not None:
+                writer.close()
+        return written
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def output_name(cluster_id: int, stage: str, egids, max_rows: int | None, sample: str = "head") -> str:
+    if sample != "head" and max_rows is not None:
+        return f"cluster{cluster_id}_{stage}_{sample}_{max_rows}rows.csv"
+    if egids:
+        name = f"cluster{cluster_id}_{stage}_EGID_{'_'.join(egids)}.csv"
+        return name if len(name) <= 200 else f"cluster{cluster_id}_{stage}_n{len(egids)}_egids.csv"
+    if max_rows is not None:
+        return f"cluster{cluster_id}_{stage}_sample_{max_rows}rows.csv"
+    return f"cluster{cluster_id}_{stage}.csv"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cluster", type=int, required=True)
+    ap.add_argument("--egids", type=str, default="", help="Liste d'EGID séparés par des virgules (défaut : tous)")
+    ap.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    ap.add_argument("--columns", nargs="+", default=None, help="Colonnes (défaut : sélection par étape)")
+    ap.add_argument("--all-columns", action="store_true", help="Toutes les colonnes du parquet")
+    ap.add_argument("--max-rows", type=int, default=None, help="Lignes max par CSV (ordre du fichier)")
+    ap.add_argument("--sort", action="store_true", help="Ordre (EGID, date, DATA_TYPE) par tri externe")
+    ap.add_argument("--sort-mem-rows", type=int, default=SORT_MEM_ROWS, help="Lignes max triées en mémoire")
+    ap.add_argument("--sample", choices=SAMPLE_MODES, default="head", help="Tirage des --max-rows lignes")
+    ap.add_argument("--per-stratum", type=int, default=PER_STRATUM, help="Lignes max par strate (stratified)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--threads", type=int, default=None, help="Threads de lecture Arrow (défaut : tous)")
+    ap.add_argument("--out-dir", type=Path, default=None)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if args.threads:
+        pa.set_cpu_count(args.threads)
+        pa.set_io_thread_count(args.threads)
+    egids = [e.strip() for e in args.egids.split(",") if e.strip()] or None
+    if args.sample != "head" and args.max_rows is None:
+        ap.error("--sample uniform|stratified requiert --max-rows")
+    out_dir = args.out_dir or STRUCT / f"cluster{args.cluster}_csv_export"
+    for stage in args.stages:
+        path = STAGES[stage]
+        if not stage_exists(path):
+            print(f"Ignoré (absent) : {path}")
+            continue
+        cols = None if args.all_columns else (args.columns or DEFAULT_COLUMNS[stage])
+        out = out_dir / output_name(args.cluster, stage, egids, args.max_rows, args.sample)
+        if args.sample != "head":
+            n = export_sample(
+                path,
+                out,
+                args.cluster,
+                args.max_rows,
+                mode=args.sample,
+                egids=egids,
+                columns=cols,
+                sort=args.sort,
+                per_stratum=args.per_stratum,
+                seed=args.seed,
+            )
+            print(f"{stage}: {n:,} lignes ({args.sample}) → {out}")
+            continue
+        n = export_stage(
+            path,
+            out,
+            args.cluster,
+            egids=egids,
+            columns=cols,
+            max_rows=args.max_rows,
+            sort=args.sort,
+            threads=args.threads != 1,
+            sort_mem_rows=args.sort_mem_rows,
+        )
+        print(f"{stage}: {n:,} lignes → {out}")
+
+
+if __name__ == "__main__":
+    main()
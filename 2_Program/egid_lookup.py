@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Lecture ciblée d'un ou plusieurs EGID dans les parquets longs (``sst_enriched``, ``sst_filtered_transfo``, …)
+et larges (``cluster{N}.parquet``) sans charger le fichier complet.
+
+Fichiers longs : index annexe ``<fichier>.egid_rg.json`` (EGID → row groups), construit une fois par lecture de
+la seule colonne EGID et invalidé si le parquet change (taille / mtime). Une requête ne lit que les row groups
+contenant au moins un EGID demandé, avec projection de colonnes, puis filtre les lignes côté Arrow
+(``pyarrow.compute.is_in``). Sans index (``use_index=False``), repli sur les statistiques min / max des row
+groups (efficace si le fichier est trié par EGID).
+
+Fichiers larges : projection sur ``Dates`` + colonnes ``{egid}.*`` demandées (métadonnées seulement pour le reste).
+"""
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+logger = logging.getLogger("egid_lookup")
+
+INDEX_SUFFIX = ".egid_rg.json"
+
+
+def _file_sig(path: Path) -> dict:
+    st = Path(path).stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def typed_egids(egids, arrow_type: pa.DataType) -> pa.Array:
+    """EGID demandés convertis au type de la colonne (entier ou chaîne)."""
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_integer(arrow_type):
+        vals = []
+        for e in egids:
+            try:
+                vals.append(int(str(e)))
+            except ValueError:
+                continue
+        return pa.array(vals, type=arrow_type)
+    return pa.array([str(e) for e in egids], type=pa.string())
+
+
+class EgidRowGroupIndex:
+    """Index EGID → row groups d'un parquet long (fichier annexe JSON)."""
+
+    def __init__(self, path: Path, column: str = "EGID", groups: dict[str, list[int]] | None = None):
+        self.path = Path(path)
+        self.column = column
+        self.groups = groups or {}
+
+    @property
+    def index_path(self) -> Path:
+        return self.path.with_name(self.path.name + INDEX_SUFFIX)
+
+    @classmethod
+    def for_file(cls, path: Path, column: str = "EGID", rebuild: bool = False) -> "EgidRowGroupIndex":
+        """Charge l'index annexe s'il est à jour, sinon le (re)construit."""
+        idx = cls(path, column)
+        if not rebuild and idx.index_path.is_file():
+            try:
+                raw = json.loads(idx.index_path.read_text(encoding="utf-8"))
+                if raw.get("column") == column and raw.get("file") == _file_sig(path):
+                    idx.groups = {k: list(v) for k, v in raw["groups"].items()}
+                    return idx
+            except (ValueError, KeyError) as e:
+                logger.warning("Index EGID illisible %s : %s", idx.index_path, e)
+        idx.build()
+        return idx
+
+    def build(self) -> None:
+        pf = pq.ParquetFile(self.path)
+        groups: dict[str, list[int]] = {}
+        for rg in range(pf.num_row_groups):
+            col = pf.read_row_group(rg, columns=[self.column]).column(0)
+            for v in pc.unique(col.combine_chunks()).to_pylist():
+                if v is not None:
+                    groups.setdefault(str(v), []).append(rg)
+        self.groups = groups
+        payload = {"column": self.column, "file": _file_sig(self.path), "groups": groups}
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp.write_text(json.dumps(payload), encoding="utf-8")
+        tmp.replace(self.index_path)
+        logger.info("Index EGID %s : %s EGID, %s row groups", self.index_path.name, len(groups), pf.num_row_groups)
+
+    def row_groups(self, egids) -> list[int]:
+        out: set[int] = set()
+        for e in egids:
+            out.update(self.groups.get(str(e), ()))
+        return sorted(out)
+
+
+def _row_groups_from_stats(pf: pq.ParquetFile, column: str, values: pa.Array) -> list[int]:
+    """Row groups dont [min, max] de ``column`` peut contenir une valeur demandée (tous si pas de statistiques)."""
+    ci = pf.schema_arrow.get_field_index(column)
+    wanted = values.to_pylist()
+    out = []
+    for rg in range(pf.num_row_groups):
+        st = pf.metadata.row_group(rg).column(ci).statistics
+        if st is None or not st.has_min_max:
+            out.append(rg)
+            continue
+        lo, hi = st.min, st.max
+        if isinstance(lo, bytes):
+            lo, hi = lo.decode("utf-8", "replace"), hi.decode("utf-8", "replace")
+        if any(lo <= v <= hi for v in wanted):
+            out.append(rg)
+    return out
+
+
+def read_egids(
+    path: Path,
+    egids,
+    columns: list[str] | None = None,
+    column: str = "EGID",
+    use_index: bool = True,
+) -> pd.DataFrame:
+    """Lignes des EGID demandés (une seule passe pour tout le lot) ; colonne EGID renvoyée en ``str``."""
+    path = Path(path)
+    pf = pq.ParquetFile(path)
+    field_type = pf.schema_arrow.field(column).type
+    values = typed_egids(egids, field_type)
+    cols = None if columns is None else list(dict.fromkeys([column] + list(columns)))
+    if use_index:
+        rgs = EgidRowGroupIndex.for_file(path, column).row_groups(egids)
+    else:
+        rgs = _row_groups_from_stats(pf, column, values)
+    if not rgs or len(values) == 0:
+        schema = pf.schema_arrow if cols is None else pa.schema([pf.schema_arrow.field(c) for c in cols])
+        table = schema.empty_table()
+    else:
+        table = pf.read_row_groups(rgs, columns=cols)
+        key = table.column(column)
+        if pa.types.is_dictionary(key.type):
+            key = key.cast(key.type.value_type)
+        table = table.filter(pc.is_in(key, value_set=values.cast(key.type)))
+    df = table.to_pandas()
+    df[column] = df[column].astype(str)
+    return df
+
+
+def wide_columns_for(path: Path, egids, suffixes=("TempRet_norm", "PuisCpt_fc")) -> list[str]:
+    """Colonnes ``{egid}.{suffixe}`` présentes dans le schéma du parquet large (lecture des métadonnées)."""
+    names = set(pq.read_schema(path).names)
+    return [f"{e}.{s}" for e in egids for s in suffixes if f"{e}.{s}" in names]
+
+
+def read_wide_egids(path: Path, egids, suffixes=("TempRet_norm", "PuisCpt_fc")) -> pd.DataFrame:
+    """``Dates`` + colonnes des EGID demandés uniquement (projection Parquet)."""
+    cols = ["Dates"] + wide_columns_for(path, [str(e) for e in egids], suffixes)
+    df = pd.read_parquet(path, columns=cols)
+    df["Dates"] = pd.to_datetime(df["Dates"], utc=True)
+    return df
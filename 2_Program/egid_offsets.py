@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Index CSR par EGID d'une table longue : un seul tri (EGID, DATA_TYPE, date), puis tableaux d'offsets.
+
+- ``group_ptr`` : lignes ``[group_ptr[g], group_ptr[g + 1])`` = groupe g = (EGID, DATA_TYPE), dates croissantes
+  (NaT en fin de groupe) ; ``group_egid`` / ``group_type`` : EGID (indice dans ``egids``) et type de chaque groupe ;
+- ``egid_ptr`` : lignes de chaque EGID (tous types), ``egids`` triés ;
+- ``order`` : permutation ordre d'origine → ordre trié (``apply`` / ``sorted``).
+
+Accès à un EGID ou à un couple (EGID, DATA_TYPE) = tranche O(1) au lieu d'un masque ``df["EGID"] == egid`` sur
+toute la table ; réductions par groupe = ``ufunc.reduceat`` sur les offsets (``reduce``, ``per_egid``).
+
+Sérialisable à côté du Parquet (``.npz``, ``load_sorted``) : une étape relue réutilise la permutation sans
+retrier, tant que les fichiers n'ont pas changé (taille / mtime, comme l'index annexe d'egid_lookup.py).
+Jeu partitionné (sst_dataset.py) : ``<étape>/_egid_offsets.npz`` (lecture complète) ou
+``<étape>/cluster=N/_egid_offsets.npz`` (un cluster) ; ancien fichier : ``<fichier>.egid_offsets.npz``.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sst_dataset import stage_files, stage_path
+from sst_schema import coerce_long
+
+logger = logging.getLogger("egid_offsets")
+
+OFFSETS_NAME = "_egid_offsets.npz"
+OFFSETS_SUFFIX = ".egid_offsets.npz"
+KEY_COLUMNS = ("EGID", "DATA_TYPE")
+_NAT = np.iinfo(np.int64).min
+
+
+def _date_keys(s: pd.Series) -> np.ndarray:
+    """Horodatages en int64 (ns), NaT reporté en fin de tri."""
+    if getattr(s.dt, "tz", None) is not None:
+        s = s.dt.tz_convert("UTC").dt.tz_localize(None)
+    k = s.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    return np.where(k == _NAT, np.iinfo(np.int64).max, k)
+
+
+@dataclass
+class EgidOffsets:
+    """Offsets CSR par (EGID, DATA_TYPE) et par EGID sur une table triée (EGID, DATA_TYPE, date)."""
+
+    egids: np.ndarray
+    egid_ptr: np.ndarray
+    group_egid: np.ndarray
+    group_type: np.ndarray
+    group_ptr: np.ndarray
+    order: np.ndarray
+    date: str = "date"
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, date: str = "date") -> "EgidOffsets":
+        """Tri (EGID, DATA_TYPE, date) stable ; ``df`` n'est pas modifié (voir ``apply``)."""
+        e_codes, e_uniq = pd.factorize(df["EGID"], sort=True)
+        t_codes, t_uniq = pd.factorize(df["DATA_TYPE"].astype(str), sort=True)
+        keys = [t_codes, e_codes]
+        if date in df.columns:
+            keys.insert(0, _date_keys(df[date]))
+        order = np.lexsort(keys).astype(np.int64)
+        e_sorted, t_sorted = e_codes[order], t_codes[order]
+        n = len(order)
+        e_break = np.r_[True, np.diff(e_sorted) != 0] if n else np.zeros(0, bool)
+        g_break = e_break | np.r_[True, np.diff(t_sorted) != 0] if n else e_break
+        g_start, e_start = np.flatnonzero(g_break), np.flatnonzero(e_break)
+        return cls(
+            egids=_egid_array(e_uniq),
+            egid_ptr=np.r_[e_start, n].astype(np.int64),
+            group_egid=e_sorted[g_start].astype(np.int32),
+            group_type=np.asarray(t_uniq, dtype=str)[t_sorted[g_start]] if n else np.zeros(0, dtype=str),
+            group_ptr=np.r_[g_start, n].astype(np.int64),
+            order=order,
+            date=date,
+        )
+
+    # --- tailles et positions -------------------------------------------------------------------------------
+
+    @property
+    def n_rows(self) -> int:
+        return int(self.group_ptr[-1]) if len(self.group_ptr) else 0
+
+    @property
+    def n_egids(self) -> int:
+        return len(self.egids)
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.group_egid)
+
+    def group_sizes(self) -> np.ndarray:
+        return np.diff(self.group_ptr)
+
+    def egid_sizes(self) -> np.ndarray:
+        return np.diff(self.egid_ptr)
+
+    def _egid_pos(self) -> dict[str, int]:
+        if not hasattr(self, "_pos"):
+            self._pos = {str(e): i for i, e in enumerate(self.egids)}
+        return self._pos
+
+    def _group_pos(self) -> dict[tuple[int, str], int]:
+        if not hasattr(self, "_gpos"):
+            self._gpos = {(int(e), str(t)): g for g, (e, t) in enumerate(zip(self.group_egid, self.group_type))}
+        return self._gpos
+
+    # --- accès O(1) -----------------------------------------------------------------------------------------
+
+    def egid_slice(self, egid) -> slice:
+        """Lignes (ordre trié) d'un EGID ; tranche vide si absent."""
+        i = self._egid_pos().get(str(egid))
+        return slice(0, 0) if i is None else slice(int(self.egid_ptr[i]), int(self.egid_ptr[i + 1]))
+
+    def group_slice(self, egid, data_type: str) -> slice:
+        """Lignes (ordre trié) d'un couple (EGID, DATA_TYPE) ; tranche vide si absent."""
+        i = self._egid_pos().get(str(egid))
+        g = None if i is None else self._group_pos().get((i, str(data_type)))
+        return slice(0, 0) if g is None else slice(int(self.group_ptr[g]), int(self.group_ptr[g + 1]))
+
+    def egid_slices(self):
+        """(EGID, tranche) pour chaque EGID, dans l'ordre trié."""
+        for i, e in enumerate(self.egids):
+            yield e, slice(int(self.egid_ptr[i]), int(self.egid_ptr[i + 1]))
+
+    def type_slices(self, data_type: str):
+        """(EGID, tranche) des groupes d'un type."""
+        for g in np.flatnonzero(self.group_type == data_type):
+            yield self.egids[self.group_egid[g]], slice(int(self.group_ptr[g]), int(self.group_ptr[g + 1]))
+
+    # --- données triées et réductions -----------------------------------------------------------------------
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """``df`` (ordre d'origine) réordonné selon l'index, index pandas remis à zéro."""
+        return df.iloc[self.order].reset_index(drop=True)
+
+    def sorted(self, values) -> np.ndarray:
+        """Tableau (ordre d'origine) réordonné selon l'index."""
+        return np.asarray(values)[self.order]
+
+    def reduce(self, values: np.ndarray, ufunc=np.add, level: str = "group") -> np.ndarray:
+        """``ufunc.reduceat`` de ``values`` (ordre trié) par groupe (EGID, DATA_TYPE) ou par EGID."""
+        ptr = self.group_ptr if level == "group" else self.egid_ptr
+        values = np.asarray(values)
+        if values.dtype == bool and ufunc is np.add:
+            values = values.astype(np.int64)
+        if len(ptr) <= 1:
+            return np.zeros(0, dtype=values.dtype)
+        return ufunc.reduceat(values, ptr[:-1])
+
+    def per_egid(self, group_values: np.ndarray, data_type: str, fill=np.nan) -> np.ndarray:
+        """Valeurs par groupe du type ``data_type`` dispersées par EGID (``fill`` si le type manque)."""
+        dtype = np.result_type(np.asarray(group_values).dtype, np.min_scalar_type(fill))
+        out = np.full(self.n_egids, fill, dtype=dtype)
+        m = self.group_type == data_type
+        out[self.group_egid[m]] = group_values[m]
+        return out
+
+    # --- sérialisation --------------------------------------------------------------------------------------
+
+    def save(self, path: Path, signature: dict | None = None) -> None:
+        arrays = {k: getattr(self, k) for k in ("egids", "egid_ptr", "group_egid", "group_type", "group_ptr", "order")}
+        arrays["egids"] = _egid_array(arrays["egids"])  # pas de tableau objet : relu sans pickle
+        meta = {"date": self.date, "signature": signature or {}}
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, meta=np.array(json.dumps(meta)), **arrays)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> tuple["EgidOffsets", dict]:
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(str(z["meta"]))
+            idx = cls(
+                egids=z["egids"],
+                egid_ptr=z["egid_ptr"],
+                group_egid=z["group_egid"],
+                group_type=z["group_type"],
+                group_ptr=z["group_ptr"],
+                order=z["order"],
+                date=meta["date"],
+            )
+        return idx, meta["signature"]
+
+
+def _egid_array(values) -> np.ndarray:
+    """EGID distincts : entiers tels quels, sinon texte à largeur fixe (``<U``, sérialisable sans pickle)."""
+    arr = np.asarray(values)
+    return arr if arr.dtype.kind in "iuU" else arr.astype(str)
+
+
+def offsets_path(path: Path, cluster: int | None = None) -> Path:
+    """Emplacement du fichier d'offsets d'une étape (lecture complète ou d'un cluster)."""
+    p = stage_path(path)
+    if not p.is_dir():
+        return p.with_name(p.name + OFFSETS_SUFFIX)
+    return (p if cluster is None else p / f"cluster={cluster}") / OFFSETS_NAME
+
+
+def _signature(files: list[Path], date: str) -> dict:
+    sig = [[f.as_posix(), f.stat().st_size, f.stat().st_mtime_ns] for f in files]
+    return {"date": date, "files": sig}
+
+
+def load_sorted(
+    path: Path,
+    columns: list[str] | None = None,
+    cluster: int | None = None,
+    date: str = "date",
+) -> tuple[pd.DataFrame, EgidOffsets]:
+    """Étape (ou un cluster) triée (EGID, DATA_TYPE, date) et son index ; permutation relue si à jour."""
+    p = stage_path(path)
+    if cluster is not None and not p.is_dir():
+        raise ValueError(f"Lecture par cluster : jeu partitionné requis ({p})")
+    files = stage_files(p, None if cluster is None else [cluster])
+    schema_names = pq.read_schema(files[0]).names if files else []
+    cols = None if columns is None else list(dict.fromkeys(list(columns) + [c for c in (*KEY_COLUMNS, date) if c in schema_names]))
+    tables = [pq.read_table(f, columns=cols) for f in files]
+    df = coerce_long(pa.concat_tables(tables).to_pandas() if tables else pd.DataFrame(columns=cols or []))
+
+    side = offsets_path(p, cluster)
+    sig = _signature(files, date)
+    idx = None
+    if side.is_file():
+        try:
+            cached, cached_sig = EgidOffsets.load(side)
+            if cached_sig == sig and cached.n_rows == len(df):
+                idx = cached
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Offsets EGID illisibles %s : %s", side, e)
+    if idx is None:
+        idx = EgidOffsets.build(df, date=date)
+        idx.save(side, sig)
+        logger.info("Offsets EGID %s : %s EGID, %s groupes", side, idx.n_egids, idx.n_groups)
+    return idx.apply(df), idx
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Résumé par (cluster, EGID, DATA_TYPE) d'un parquet long (``sst_filtered_transfo.parquet`` par défaut) :
+nombre de lignes, date min / max, part de ``valeur_fc`` non nulle (PuisCpt) et de ``valeur_norm`` non nulle
+(TempRet).
+
+Agrégation par hachage Arrow (``Table.group_by``) sur chaque row group, row groups traités en parallèle
+(threads : lecture Parquet et noyaux Arrow libèrent le GIL), puis fusion des agrégats partiels
+(sommes des compteurs, min / max des dates). Un seul parcours de l'étape couvre tous les clusters ;
+``cluster_id`` restreint le calcul à un cluster (partitions ``cluster=N`` du jeu partitionné, sst_dataset.py,
+ou row groups hors plage écartés par les statistiques d'un ancien fichier).
+
+Sorties : parquet de synthèse (tous clusters) + par cluster, CSV au format historique
+``cluster{N}_transfo_summary_by_egid_datatype.csv`` et parquet du même nom à côté.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe egid_summary.py
+  .venv\\Scripts\\python.exe egid_summary.py --clusters 3 5 --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from sst_dataset import RowGroupUnit, open_stage, row_group_units, stage_exists, stage_path
+
+logger = logging.getLogger("egid_summary")
+
+ROOT = Path(__file__).resolve().parent
+STRUCT = ROOT / "0_Data/1_Structured"
+DEFAULT_SOURCE = STRUCT / "sst_filtered_transfo.parquet"
+DEFAULT_SUMMARY = STRUCT / "sst_filtered_transfo_summary_by_egid_datatype.parquet"
+
+KEYS = ["cluster", "EGID", "DATA_TYPE"]
+COUNTERS = ["n_rows", "fc_ok", "fc_tot", "vn_ok", "vn_tot"]
+# Noms produits par group_by (agrégats partiels puis fusion) → noms du résumé
+_AGG_NAMES = {f"{c}_sum": c for c in COUNTERS} | {"date_min_min": "date_min", "date_max_max": "date_max"}
+CSV_COLUMNS = ["EGID", "DATA_TYPE", "n_rows", "date_min", "date_max", "pct_valeur_fc_ok", "pct_valeur_norm_ok"]
+
+
+def summary_csv_name(cluster_id: int) -> str:
+    return f"cluster{cluster_id}_transfo_summary_by_egid_datatype.csv"
+
+
+def _decoded(col: pa.ChunkedArray) -> pa.ChunkedArray:
+    return col.cast(col.type.value_type) if pa.types.is_dictionary(col.type) else col
+
+
+def partial_summary(t: pa.Table, cluster_id: int | None = None) -> pa.Table:
+    """Agrégats partiels d'une table (un row group) : compteurs et dates extrêmes par clé."""
+    if cluster_id is not None:
+        t = t.filter(pc.equal(t["cluster"], pa.scalar(cluster_id, type=_decoded(t["cluster"]).type)))
+    n = t.num_rows
+    dtype = _decoded(t["DATA_TYPE"])
+    is_pc = pc.fill_null(pc.equal(dtype, "PuisCpt"), False)
+    is_tr = pc.fill_null(pc.equal(dtype, "TempRet"), False)
+
+    def flags(name: str, mask) -> tuple[pa.Array, pa.Array]:
+        if name not in t.column_names:
+            mask = pc.and_(mask, pa.scalar(False))
+            return mask, mask
+        return pc.and_(mask, pc.is_valid(t[name])), mask
+
+    fc_ok, fc_tot = flags("valeur_fc", is_pc)
+    vn_ok, vn_tot = flags("valeur_norm", is_tr)
+    work = pa.table(
+        {
+            "cluster": _decoded(t["cluster"]),
+            "EGID": _decoded(t["EGID"]).cast(pa.string()),
+            "DATA_TYPE": dtype,
+            "date": t["date"],
+            "n_rows": pa.array(np.ones(n, dtype=np.int64)),
+            "fc_ok": pc.cast(fc_ok, pa.int64()),
+            "fc_tot": pc.cast(fc_tot, pa.int64()),
+            "vn_ok": pc.cast(vn_ok, pa.int64()),
+            "vn_tot": pc.cast(vn_tot, pa.int64()),
+        }
+    )
+    g = work.group_by(KEYS, use_threads=False).aggregate(
+        [(c, "sum") for c in COUNTERS] + [("date", "min"), ("date", "max")]
+    )
+    return g.rename_columns([_AGG_NAMES.get(c, c) for c in g.column_names])
+
+
+def merge_partials(parts: list[pa.Table]) -> pa.Table:
+    """Fusionne des agrégats partiels (mêmes clés) : sommes des compteurs, min / max des dates."""
+    t = pa.concat_tables(parts)
+    g = t.group_by(KEYS).aggregate(
+        [(c, "sum") for c in COUNTERS] + [("date_min", "min"), ("date_max", "max")]
+    )
+    g = g.rename_columns([_AGG_NAMES.get(c, c) for c in g.column_names])
+    return g.select(KEYS + ["n_rows", "date_min", "date_max"] + COUNTERS[1:])
+
+
+def _with_pct(t: pa.Table) -> pa.Table:
+    def pct(ok: str, tot: str) -> pa.Array:
+        tot_f = pc.cast(t[tot], pa.float64())
+        ratio = pc.divide(pc.multiply(pc.cast(t[ok], pa.float64()), 100.0), tot_f)
+        ratio = pc.round(ratio, 4)
+        return pc.if_else(pc.greater(t[tot], 0), ratio, pa.scalar(None, type=pa.float64()))
+
+    t = t.append_column("pct_valeur_fc_ok", pct("fc_ok", "fc_tot"))
+    return t.append_column("pct_valeur_norm_ok", pct("vn_ok", "vn_tot"))
+
+
+def summarize(
+    path: Path = DEFAULT_SOURCE,
+    cluster_id: int | None = None,
+    workers: int | None = None,
+) -> pa.Table:
+    """Résumé (cluster, EGID, DATA_TYPE) du parquet, un seul parcours ; trié par (cluster, DATA_TYPE, EGID)."""
+    path = stage_path(path)
+    names = open_stage(path).schema.names
+    missing = [c for c in KEYS + ["date"] if c not in names]
+    if missing:
+        raise ValueError(f"Colonnes manquantes dans {path} : {missing}")
+    cols = KEYS + ["date"] + [c for c in ("valeur_fc", "valeur_norm") if c in names]
+    units = row_group_units(path, cluster_id)
+
+    def one(u: RowGroupUnit) -> pa.Table:
+        return partial_summary(pq.ParquetFile(u.path).read_row_group(u.row_group, columns=cols), cluster_id)
+
+    workers = workers or min(8, os.cpu_count() or 1)
+    if workers > 1 and len(units) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(one, units))
+    else:
+        parts = [one(u) for u in units]
+    parts = [p for p in parts if p.num_rows]
+    logger.info("%s : %s row groups lus, %s agrégats partiels", path.name, len(units), sum(p.num_rows for p in parts))
+    if not parts:
+        return pa.table({})
+    out = _with_pct(merge_partials(parts))
+    return out.sort_by([("cluster", "ascending"), ("DATA_TYPE", "ascending"), ("EGID", "ascending")])
+
+
+def cluster_frame(summary: pa.Table, cluster_id: int):
+    """Lignes d'un cluster au format du CSV historique (colonnes pct vides si non applicables)."""
+    sub = summary.filter(pc.equal(summary["cluster"], pa.scalar(cluster_id, type=summary["cluster"].type)))
+    df = sub.select(CSV_COLUMNS).to_pandas()
+    return df.dropna(axis=1, how="all")
+
+
+def write_cluster_summary(summary: pa.Table, cluster_id: int, out_csv: Path) -> int:
+    """CSV (``utf-8-sig``) + parquet du même nom à côté ; ``no_data`` si le cluster est absent."""
+    out_csv = Path(out_csv)
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    if summary.num_columns == 0:
+        out_csv.write_text("no_data\n", encoding="utf-8")
+        return 0
+    df = cluster_frame(summary, cluster_id)
+    if df.empty:
+        out_csv.write_text("no_data\n", encoding="utf-8")
+        return 0
+    df.to_csv(out_csv, index=False, encoding="utf-8-sig")
+    sub = summary.filter(pc.equal(summary["cluster"], pa.scalar(cluster_id, type=summary["cluster"].type)))
+    pq.write_table(sub, out_csv.with_suffix(".parquet"))
+    return len(df)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--source", type=Path, default=DEFAULT_SOURCE)
+    ap.add_argument("--clusters", type=int, nargs="+", default=None, help="Clusters à écrire (défaut : tous)")
+    ap.add_argument("--workers", type=int, default=None, help="Threads (défaut : min(8, CPU))")
+    ap.add_argument("--out", type=Path, default=DEFAULT_SUMMARY, help="Parquet de synthèse tous clusters")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if not stage_exists(args.source):
+        raise SystemExit(f"Manquant : {args.source}")
+    summary = summarize(args.source, workers=args.workers)
+    if summary.num_columns == 0:
+        raise SystemExit(f"Aucune ligne dans {args.source}")
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(summary, args.out)
+    print(f"Écrit : {args.out} ({summary.num_rows:,} lignes)")
+
+    clusters = args.clusters or sorted(pc.unique(summary["cluster"]).to_pylist())
+    for cid in clusters:
+        out = STRUCT / f"cluster{cid}_csv_export" / summary_csv_name(cid)
+        n = write_cluster_summary(summary, cid, out)
+        print(f"cluster {cid} : {n} lignes → {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 """
-Sélectionne les EGID du cluster 3 avec le plus grand écart (début PuisCpt − début TempRet)
-et exporte toutes leurs lignes (filtré, nettoyé, transfo) en CSV.
+Sélectionne les EGID du cluster 3 (ou ``--cluster N``) avec le plus grand écart (début PuisCpt − début TempRet)
+et exporte toutes leurs lignes (filtré, nettoyé, transfo) en CSV, triées (EGID, date, DATA_TYPE)
+(écriture en flux et tri externe : cluster_export.py).
+
+Début de chaque type = premier pas 15 min valide (inv=0 & valeur non NaN) dans l'index de validité de
+``sst_enriched`` (validity_index.py), avant troncature au chevauchement ; EGID du cluster = partition
+``cluster=N`` de l'étape transfo. Sans index : ``date_min`` du résumé CSV d'export_cluster3_csv_samples.py.
 
 Usage (depuis 2_Program) :
   .venv\\Scripts\\python.exe export_cluster3_problematic_egids.py
   .venv\\Scripts\\python.exe export_cluster3_problematic_egids.py --top 3
   .venv\\Scripts\\python.exe export_cluster3_problematic_egids.py --egids 1511188,190198380,235554367
+  .venv\\Scripts\\python.exe export_cluster3_problematic_egids.py --cluster 5 --top 5
 """
 from __future__ import annotations
 
@@ -14,76 +20,54 @@ import argparse
 from pathlib import Path
 
 import pandas as pd
-import pyarrow as pa
-import pyarrow.compute as pc
-import pyarrow.parquet as pq
+
+import cluster_export
+from cluster_export import STAGES as PATHS
+from sst_dataset import read_stage, stage_exists
+from validity_index import PATH_ENRICHED, open_index
 
 ROOT = Path(__file__).resolve().parent
 STRUCT = ROOT / "0_Data/1_Structured"
-OUT_DIR = STRUCT / "cluster3_csv_export" / "problematic_egids"
 CLUSTER = 3
 
-PATHS = {
-    "filtered": STRUCT / "sst_filtered.parquet",
-    "clean": STRUCT / "sst_filtered_clean.parquet",
-    "transfo": STRUCT / "sst_filtered_transfo.parquet",
-}
 
-SUMMARY_CSV = STRUCT / "cluster3_csv_export" / "cluster3_transfo_summary_by_egid_datatype.csv"
+def out_dir_for(cluster_id: int) -> Path:
+    return STRUCT / f"cluster{cluster_id}_csv_export" / "problematic_egids"
+
+
+def summary_csv_for(cluster_id: int) -> Path:
+    return STRUCT / f"cluster{cluster_id}_csv_export" / f"cluster{cluster_id}_transfo_summary_by_egid_datatype.csv"
+
+
+def _start_gaps(tr: pd.DataFrame, pu: pd.DataFrame, top_n: int) -> pd.DataFrame:
+    m = tr.merge(pu, on="EGID", how="inner")
+    m["gap_days"] = (m["puis_min"] - m["tret_min"]).dt.days
+    return m.sort_values("gap_days", ascending=False).head(top_n)
 
 
-def pick_top_problematic_from_summary(summary_path: Path, top_n: int) -> list[str]:
+def pick_top_problematic_from_summary(summary_path: Path, top_n: int) -> pd.DataFrame:
     s = pd.read_csv(summary_path)
     s["date_min"] = pd.to_datetime(s["date_min"])
     tr = s[s["DATA_TYPE"] == "TempRet"][["EGID", "date_min"]].rename(columns={"date_min": "tret_min"})
     pu = s[s["DATA_TYPE"] == "PuisCpt"][["EGID", "date_min"]].rename(columns={"date_min": "puis_min"})
-    m = tr.merge(pu, on="EGID", how="inner")
-    m["gap_days"] = (m["puis_min"] - m["tret_min"]).dt.days
-    m = m.sort_values("gap_days", ascending=False)
-    return m.head(top_n)["EGID"].astype(str).tolist()
-
-
-def egid_scalar_type(sample_table: pa.Table, egids: list[str]) -> list:
-    col = sample_table["EGID"]
-    # convert egids to same type as parquet
-    if pa.types.is_integer(col.type):
-        return [int(e) for e in egids]
-    return egids
-
-
-def export_stage(path: Path, egids: list[str], out_csv: Path) -> int:
-    if not path.exists():
-        raise FileNotFoundError(path)
-    pf = pq.ParquetFile(path)
-    t0 = pf.read_row_group(0, columns=["EGID", "cluster"])
-    egids_typed = egid_scalar_type(t0, egids)
-    del t0
-
-    chunks: list[pd.DataFrame] = []
-    n_total = 0
-    for rg in range(pf.num_row_groups):
-        t = pf.read_row_group(rg)
-        f1 = pc.equal(t["cluster"], pa.scalar(CLUSTER, type=t["cluster"].type))
-        f2 = pc.is_in(t["EGID"], pa.array(egids_typed))
-        sub = pc.filter(t, pc.and_(f1, f2))
-        if sub.num_rows == 0:
-            continue
-        df = sub.to_pandas()
-        for c in df.select_dtypes(include=["datetimetz"]).columns:
-            df[c] = df[c].dt.tz_convert("UTC").dt.tz_localize(None)
-        chunks.append(df)
-        n_total += len(df)
+    return _start_gaps(tr, pu, top_n)
 
-    if not chunks:
-        out_csv.parent.mkdir(parents=True, exist_ok=True)
-        out_csv.write_text("no_data\n", encoding="utf-8")
-        return 0
 
-    out = pd.concat(chunks, ignore_index=True)
-    out = out.sort_values(["EGID", "date", "DATA_TYPE"], kind="mergesort")
-    out_csv.parent.mkdir(parents=True, exist_ok=True)
-    out.to_csv(out_csv, index=False, encoding="utf-8-sig")
-    return n_total
+def pick_top_problematic_from_index(cluster_id: int, top_n: int) -> pd.DataFrame | None:
+    """Écarts de début depuis l'index de validité de l'étape enrichie ; None si index ou étape transfo absents."""
+    vidx = open_index(PATH_ENRICHED)
+    if vidx is None or not stage_exists(PATHS["transfo"]):
+        return None
+    egids = read_stage(PATHS["transfo"], columns=["EGID"], clusters=[cluster_id])["EGID"].unique()
+    rows = [(str(e), vidx.first_valid(e, "TempRet"), vidx.first_valid(e, "PuisCpt")) for e in egids]
+    m = pd.DataFrame(rows, columns=["EGID", "tret_min", "puis_min"]).dropna()
+    m[["tret_min", "puis_min"]] = m[["tret_min", "puis_min"]].astype("datetime64[ns]")
+    return _start_gaps(m[["EGID", "tret_min"]], m[["EGID", "puis_min"]], top_n)
+
+
+def export_stage(path: Path, egids: list[str], out_csv: Path, cluster_id: int = CLUSTER) -> int:
+    """Toutes les lignes des EGID, triées (EGID, date, DATA_TYPE) par tri externe, écrites en flux."""
+    return cluster_export.export_stage(path, out_csv, cluster_id, egids=egids, sort=True)
 
 
 def main() -> None:
@@ -95,26 +79,28 @@ def main() -> None:
         default="",
         help="Liste forcée d'EGID (ex: 1511188,190198380,235554367)",
     )
+    ap.add_argument("--cluster", type=int, default=CLUSTER)
     args = ap.parse_args()
+    cid = args.cluster
+    out_dir = out_dir_for(cid)
+    summary_csv = summary_csv_for(cid)
 
     meta_lines = []
     if args.egids.strip():
         egids = [e.strip() for e in args.egids.split(",") if e.strip()]
         meta_lines.append("Sélection : liste --egids fournie par l'utilisateur.")
     else:
-        if not SUMMARY_CSV.exists():
+        top = pick_top_problematic_from_index(cid, args.top)
+        if top is not None:
+            meta_lines.append("Sélection : index de validité sst_enriched (1er pas 15 min valide par type).")
+        elif summary_csv.exists():
+            top = pick_top_problematic_from_summary(summary_csv, args.top)
+            meta_lines.append(f"Sélection : résumé {summary_csv.name} (date_min par type).")
+        else:
             raise SystemExit(
-                f"Résumé absent : {SUMMARY_CSV}. Lancez d'abord export_cluster3_csv_samples.py "
-                "ou fournissez --egids."
+                f"Index de validité et résumé absents ({summary_csv}). Lancez validity_index.py "
+                "ou export_cluster3_csv_samples.py, ou fournissez --egids."
             )
-        s = pd.read_csv(SUMMARY_CSV)
-        s["date_min"] = pd.to_datetime(s["date_min"])
-        tr = s[s["DATA_TYPE"] == "TempRet"][["EGID", "date_min"]].rename(columns={"date_min": "tret_min"})
-        pu = s[s["DATA_TYPE"] == "PuisCpt"][["EGID", "date_min"]].rename(columns={"date_min": "puis_min"})
-        m = tr.merge(pu, on="EGID", how="inner")
-        m["gap_days"] = (m["puis_min"] - m["tret_min"]).dt.days
-        m = m.sort_values("gap_days", ascending=False)
-        top = m.head(args.top)
         egids = top["EGID"].astype(str).tolist()
         for _, r in top.iterrows():
             meta_lines.append(
@@ -123,20 +109,23 @@ def main() -> None:
             )
 
     print("EGID exportés :", egids)
-    meta = OUT_DIR / "selection_meta.txt"
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    meta = out_dir / "selection_meta.txt"
+    out_dir.mkdir(parents=True, exist_ok=True)
     meta.write_text(
-        "Cluster 3 — EGID retenus pour export CSV (fort décalage début TempRet vs PuisCpt si auto).\n\n"
+        f"Cluster {cid} — EGID retenus pour export CSV (fort décalage début TempRet vs PuisCpt si auto).\n\n"
         + "\n".join(meta_lines),
         encoding="utf-8",
     )
 
     for stage, path in PATHS.items():
+        if not stage_exists(path):
+            print(f"Ignoré (absent) : {path}")
+            continue
         suffix = "_".join(egids)
-        out = OUT_DIR / f"cluster3_{stage}_EGID_{suffix}.csv"
+        out = out_dir / f"cluster{cid}_{stage}_EGID_{suffix}.csv"
         if len(out.name) > 200:
-            out = OUT_DIR / f"cluster3_{stage}_n{len(egids)}_egids.csv"
-        n = export_stage(path, egids, out)
+            out = out_dir / f"cluster{cid}_{stage}_n{len(egids)}_egids.csv"
+        n = export_stage(path, egids, out, cid)
         print(f"{stage}: {n:,} lignes → {out}")
 
 
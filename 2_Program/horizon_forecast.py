@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+Prévision multi-pas (J+1 = 96 quarts d'heure) pour tous les EGID d'un cluster.
+
+Deux moteurs :
+
+- **récursif** (modèles un pas ``RF`` / ``XB`` / ``LSTM`` / ``RFG`` / ``XBG``) : toutes les lignes
+  (origine × EGID) avancent ensemble ; à chaque pas, la matrice lags / rolling est mise à jour en place à
+  partir des prédictions précédentes (tampons circulaires de ``online_forecaster``) puis **un seul**
+  ``predict`` est appelé par modèle (toutes les origines d'un EGID, ou tous les EGID pour un modèle global) ;
+- **direct** (``DH_{egid}.joblib``) : un RandomForest multi-sorties prédit d'un coup les 96 pas
+  (2 × 96 cibles) à partir des features à l'origine + TempExt_norm moyen sur l'horizon.
+
+Les exogènes futurs sont lus dans le split (météo observée = prévision parfaite) ; les métriques par
+horizon suivent la section 5 de ML_training (RMSE TempRet en °C, PuisCpt en fc, score = moyenne, toutes les
+lignes du split y compris inv≠0) ; ``--exclude-inv`` les restreint aux pas valides.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe horizon_forecast.py --cluster 3 --model XB --n-origins 8
+  .venv\\Scripts\\python.exe horizon_forecast.py --cluster 3 --model DH --train-direct --max-egids 20
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from numpy.lib.stride_tricks import sliding_window_view
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+from inference_service import LoadedModel, load_model, model_key
+from ml_features import (
+    DEFAULT_SPEC,
+    PATH_MODELS,
+    PATH_RESULTS,
+    FeatureSpec,
+    add_lag_features,
+    denorm_tempret_celsius,
+    inv_cols,
+    load_concat_frames,
+    parse_egids,
+    split_paths,
+    target_cols,
+)
+from online_forecaster import SPLITS, RingBufferFeatures, scale_rows
+
+logger = logging.getLogger("horizon_forecast")
+
+SEED = 42
+N_JOBS_PARALLEL = -5
+HORIZON = 96
+DIRECT_PREFIX = "DH"
+DIRECT_STRIDE = 4  # une origine d'entraînement par heure
+DIRECT_RF_PARAMS = {"n_estimators": 120, "max_depth": 10, "min_samples_leaf": 5}
+DIRECT_MAX_INV_FRAC = 0.1  # part max de pas invalidés (.inv) sur l'horizon d'une origine d'entraînement
+
+
+@dataclass
+class HorizonForecast:
+    """Prédictions ``pred`` (n_origines, n_egid, horizon, 2) en [TempRet_norm, PuisCpt_fc] ; NaN si indisponible."""
+
+    egids: list[str]
+    origin_dates: np.ndarray
+    origin_idx: np.ndarray
+    pred: np.ndarray
+    timings: dict = field(default_factory=dict)
+
+
+def load_split_frame(cluster_id: int, egids: list[str], split: str, spec: FeatureSpec = DEFAULT_SPEC) -> pd.DataFrame:
+    cols = ["Dates", *spec.exog_cols] + [c for e in egids for c in (*target_cols(e), *inv_cols(e))]
+    return pd.read_parquet(split_paths(cluster_id)[SPLITS[split]], columns=cols)
+
+
+def pick_origins(n_rows: int, n_origins: int, warmup: int, horizon: int = HORIZON) -> np.ndarray:
+    """Origines réparties régulièrement, avec historique ``warmup`` et horizon complet dans le split."""
+    lo, hi = warmup - 1, n_rows - 1 - horizon
+    if hi < lo:
+        raise ValueError(f"Split trop court ({n_rows} lignes) pour warmup={warmup} et horizon={horizon}")
+    return np.unique(np.linspace(lo, hi, max(1, n_origins)).astype(np.int64))
+
+
+def _load_models(cluster_id: int, egids: list[str], prefix: str, model_root: Path):
+    models: dict[str, LoadedModel] = {}
+    global_model = None
+    for key in sorted({model_key(cluster_id, prefix, e) for e in egids}, key=str):
+        m = load_model(key, model_root)
+        if m.is_global:
+            global_model = m
+        else:
+            models[m.egid] = m
+    return models, global_model
+
+
+def recursive_forecast(
+    cluster_id: int,
+    egids: list[str],
+    prefix: str,
+    frame: pd.DataFrame,
+    origins: np.ndarray,
+    horizon: int = HORIZON,
+    model_root: Path = PATH_MODELS,
+) -> HorizonForecast:
+    """Prévision récursive : ``origins`` = indices de ``frame`` (dernière observation connue)."""
+    t0 = time.perf_counter()
+    models, global_model = _load_models(cluster_id, egids, prefix, model_root)
+    all_models = list(models.values()) + ([global_model] if global_model is not None else [])
+    specs = {m.spec for m in all_models}
+    if len(specs) != 1:
+        raise ValueError(f"Features différentes entre modèles {prefix} : {specs}")
+    spec = specs.pop()
+    seq_len = max(m.seq_len for m in all_models)
+    t_load = time.perf_counter() - t0
+
+    n_o, n_e = len(origins), len(egids)
+    tr = frame[[target_cols(e)[0] for e in egids]].to_numpy(dtype=np.float64)
+    pc = frame[[target_cols(e)[1] for e in egids]].to_numpy(dtype=np.float64)
+    exog = frame[list(spec.exog_cols)].to_numpy(dtype=np.float64)
+
+    # Lignes (origine k, EGID i) → k * n_e + i
+    buf = RingBufferFeatures(n_o * n_e, spec, seq_len)
+    warmup = buf.capacity + seq_len - 1
+    start = np.asarray(origins) - warmup + 1
+    if (start < 0).any():
+        raise ValueError(f"Origines trop proches du début du split (historique requis : {warmup} pas)")
+
+    t0 = time.perf_counter()
+    for j in range(warmup):
+        buf.push(tr[start + j].ravel(), pc[start + j].ravel())
+        if buf.capacity - 1 <= j < warmup - 1:
+            buf.features(np.repeat(exog[start + j + 1], n_e, axis=0))
+    t_warm = time.perf_counter() - t0
+
+    rows_of = {e: np.arange(n_o) * n_e + i for i, e in enumerate(egids)}
+    if global_model is not None:
+        n_static = len(global_model.feature_columns) - len(spec.feature_columns())
+        sv = global_model.static_values
+        static = np.tile(np.array([sv.get(e, [np.nan] * n_static) for e in egids], dtype=np.float64), (n_o, 1))
+
+    pred = np.full((horizon, n_o * n_e, 2), np.nan)
+    n_calls = 0
+    t0 = time.perf_counter()
+    for h in range(horizon):
+        X = buf.features(np.repeat(exog[np.asarray(origins) + 1 + h], n_e, axis=0))
+        if global_model is not None:
+            Xg = np.hstack([X, static])
+            ok = np.isfinite(Xg).all(axis=1)
+            if ok.any():
+                pred[h, ok] = global_model.predict_scaled(scale_rows(global_model, Xg[ok]))
+                n_calls += 1
+        else:
+            seqs = buf.sequences() if seq_len > 1 else None
+            for e, m in models.items():
+                rows = rows_of[e]
+                Xm = seqs[rows][:, -m.seq_len :, :] if m.seq_len > 1 else X[rows]
+                ok = np.isfinite(Xm.reshape(len(rows), -1)).all(axis=1)
+                if ok.any():
+                    Xs = scale_rows(m, Xm[ok])
+                    pred[h, rows[ok]] = m.predict_scaled(Xs.astype(np.float32) if m.seq_len > 1 else Xs)
+                    n_calls += 1
+        p = np.clip(pred[h], 0.0, 1.0)
+        buf.push(p[:, 0], p[:, 1])
+    t_loop = time.perf_counter() - t0
+
+    out = pred.reshape(horizon, n_o, n_e, 2).transpose(1, 2, 0, 3)
+    timings = {
+        "load_models_s": round(t_load, 3),
+        "warmup_s": round(t_warm, 3),
+        "forecast_s": round(t_loop, 3),
+        "ms_per_step": round(1000 * t_loop / horizon, 3),
+        "predict_calls": n_calls,
+        "forecasts_per_s": round(n_o * n_e * horizon / t_loop, 1) if t_loop > 0 else None,
+    }
+    return HorizonForecast(egids, frame["Dates"].to_numpy()[origins], np.asarray(origins), out, timings)
+
+
+def direct_design(
+    df: pd.DataFrame, egid: str, horizon: int = HORIZON, spec: FeatureSpec = DEFAULT_SPEC
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Matrices du modèle direct pour toutes les origines t : X = features du pas t + 1 (lags jusqu'à t,
+    exogènes de t + 1) + TempExt_norm moyen sur [t + 1, t + horizon] ; Y = cibles t + 1 … t + horizon
+    (TempRet puis PuisCpt) ; ok = cibles finies, au plus ``DIRECT_MAX_INV_FRAC`` de pas invalidés.
+    Lignes = origines 0 … n - 1 - horizon.
+    """
+    tr_c, pc_c = target_cols(egid)
+    vi_tr, vi_pc = inv_cols(egid)
+    feats = add_lag_features(df, egid, spec)[spec.feature_columns()].to_numpy(dtype=np.float64)
+    n = len(df) - horizon
+    if n <= 0:
+        return np.empty((0, feats.shape[1] + 1)), np.empty((0, 2 * horizon)), np.zeros(0, dtype=bool)
+    text = df["TempExt_norm"].to_numpy(dtype=np.float64)
+    text_mean = sliding_window_view(text[1:], horizon).mean(axis=1)[:n]
+    X = np.column_stack([feats[1 : n + 1], text_mean])
+    y_tr = np.clip(df[tr_c].to_numpy(dtype=np.float64), 0.0, 1.0)
+    y_pc = np.clip(df[pc_c].to_numpy(dtype=np.float64), 0.0, 1.0)
+    Y = np.hstack([sliding_window_view(y_tr[1:], horizon)[:n], sliding_window_view(y_pc[1:], horizon)[:n]])
+    inv = (df[vi_tr].to_numpy() != 0) | (df[vi_pc].to_numpy() != 0)
+    inv_frac = sliding_window_view(inv[1:], horizon)[:n].mean(axis=1)
+    ok = np.isfinite(X).all(axis=1) & np.isfinite(Y).all(axis=1) & (inv_frac <= DIRECT_MAX_INV_FRAC)
+    return X, Y, ok
+
+
+def train_direct_models(
+    cluster_id: int,
+    egids: list[str],
+    horizon: int = HORIZON,
+    stride: int = DIRECT_STRIDE,
+    rf_params: dict | None = None,
+    spec: FeatureSpec = DEFAULT_SPEC,
+) -> list[str]:
+    """Entraîne ``DH_{egid}.joblib`` sur les origines du split train (une toutes les ``stride``)."""
+    rf_params = dict(rf_params or DIRECT_RF_PARAMS)
+    mdir = PATH_MODELS / f"Cluster{cluster_id}"
+    mdir.mkdir(parents=True, exist_ok=True)
+    done = []
+    for egid in egids:
+        full, _sizes = load_concat_frames(cluster_id, egid, spec)
+        train = full.loc[full["_sp"] == 0].reset_index(drop=True)
+        X, Y, ok = direct_design(train, egid, horizon, spec)
+        sel = np.zeros(len(ok), dtype=bool)
+        sel[::stride] = True
+        sel &= ok
+        if sel.sum() < 10:
+            logger.warning("DH EGID %s : trop peu d'origines valides (%s)", egid, int(sel.sum()))
+            continue
+        scaler = StandardScaler()
+        Xs = scaler.fit_transform(X[sel])
+        rf = RandomForestRegressor(**rf_params, random_state=SEED, n_jobs=N_JOBS_PARALLEL)
+        rf.fit(Xs, Y[sel])
+        bundle = {
+            "kind": "RF_DIRECT",
+            "model": rf,
+            "scaler": scaler,
+            "feature_columns": spec.feature_columns() + ["text_mean_horizon"],
+            "horizon": horizon,
+            "stride": stride,
+            "egid": egid,
+            "cluster_id": cluster_id,
+        }
+        joblib.dump(bundle, mdir / f"{DIRECT_PREFIX}_{egid}.joblib")
+        done.append(egid)
+        logger.info("DH EGID %s : %s origines", egid, int(sel.sum()))
+    return done
+
+
+def direct_forecast(
+    cluster_id: int,
+    egids: list[str],
+    frame: pd.DataFrame,
+    origins: np.ndarray,
+    horizon: int = HORIZON,
+    model_root: Path = PATH_MODELS,
+) -> HorizonForecast:
+    """Prévision directe : un ``predict`` par EGID pour toutes les origines (96 pas d'un coup)."""
+    origins = np.asarray(origins)
+    pred = np.full((len(origins), len(egids), horizon, 2), np.nan)
+    mdir = Path(model_root) / f"Cluster{cluster_id}"
+    t_load = t_pred = 0.0
+    n_calls = 0
+    for i, egid in enumerate(egids):
+        path = mdir / f"{DIRECT_PREFIX}_{egid}.joblib"
+        if not path.exists():
+            continue
+        t0 = time.perf_counter()
+        b = joblib.load(path)
+        t_load += time.perf_counter() - t0
+        if int(b["horizon"]) < horizon:
+            raise ValueError(f"{path.name} : horizon {b['horizon']} < {horizon}")
+        spec = FeatureSpec.from_feature_columns(b["feature_columns"][:-1])
+        t0 = time.perf_counter()
+        X, _Y, _ok = direct_design(frame, egid, int(b["horizon"]), spec)
+        valid = origins < len(X)
+        Xo = X[origins[valid]]
+        fin = np.isfinite(Xo).all(axis=1)
+        if fin.any():
+            yp = b["model"].predict(b["scaler"].transform(Xo[fin]))
+            H = int(b["horizon"])
+            k = np.where(valid)[0][fin]
+            pred[k, i, :, 0] = yp[:, :horizon]
+            pred[k, i, :, 1] = yp[:, H : H + horizon]
+            n_calls += 1
+        t_pred += time.perf_counter() - t0
+    timings = {
+        "load_models_s": round(t_load, 3),
+        "forecast_s": round(t_pred, 3),
+        "predict_calls": n_calls,
+        "forecasts_per_s": round(len(origins) * len(egids) * horizon / t_pred, 1) if t_pred > 0 else None,
+    }
+    return HorizonForecast(egids, frame["Dates"].to_numpy()[origins], origins, pred, timings)
+
+
+def horizon_metrics(fc: HorizonForecast, frame: pd.DataFrame, exclude_inv: bool = False) -> pd.DataFrame:
+    """RMSE / MAE par pas d'horizon (toutes origines et EGID), TempRet en °C, PuisCpt en fc.
+
+    Définitions de la section 5 de ML_training : vérité et prédiction bornées à [0, 1], lignes inv≠0 comprises
+    (comme les parquet test) ; ``exclude_inv`` écarte les pas où TempRet.inv ou PuisCpt.inv ≠ 0.
+    """
+    horizon = fc.pred.shape[2]
+    idx = fc.origin_idx[:, None] + 1 + np.arange(horizon)[None, :]
+    truth = np.stack(
+        [
+            np.stack([frame[target_cols(e)[j]].to_numpy(dtype=np.float64)[idx] for e in fc.egids], axis=1)
+            for j in range(2)
+        ],
+        axis=-1,
+    )
+    truth = np.clip(truth, 0.0, 1.0)
+    pred = np.clip(fc.pred, 0.0, 1.0)
+    ok = np.isfinite(truth).all(axis=-1) & np.isfinite(pred).all(axis=-1)
+    if exclude_inv:
+        inv = [(frame[inv_cols(e)[0]].to_numpy() != 0) | (frame[inv_cols(e)[1]].to_numpy() != 0) for e in fc.egids]
+        ok &= ~np.stack([v[idx] for v in inv], axis=1)
+    t_c = denorm_tempret_celsius(np.nan_to_num(truth[..., 0]))
+    p_c = denorm_tempret_celsius(np.nan_to_num(pred[..., 0]))
+    err_t = np.where(ok, t_c - p_c, np.nan)
+    err_p = np.where(ok, truth[..., 1] - pred[..., 1], np.nan)
+    rows = []
+    for h in range(horizon):
+        et, ep = err_t[:, :, h], err_p[:, :, h]
+        n = int(np.isfinite(et).sum())
+        rmse_t = float(np.sqrt(np.nanmean(et * et))) if n else np.nan
+        rmse_p = float(np.sqrt(np.nanmean(ep * ep))) if n else np.nan
+        rows.append(
+            dict(
+                step=h + 1,
+                n=n,
+                rmse_TempRet=rmse_t,
+                rmse_PuisCpt=rmse_p,
+                mae_TempRet=float(np.nanmean(np.abs(et))) if n else np.nan,
+                mae_PuisCpt=float(np.nanmean(np.abs(ep))) if n else np.nan,
+                score=float(np.mean([rmse_t, rmse_p])) if n else np.nan,
+            )
+        )
+    return pd.DataFrame(rows)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cluster", type=int, default=3)
+    ap.add_argument("--model", default="XB", choices=["RF", "XB", "LSTM", "RFG", "XBG", DIRECT_PREFIX])
+    ap.add_argument("--split", default="test", choices=list(SPLITS))
+    ap.add_argument("--horizon", type=int, default=HORIZON)
+    ap.add_argument("--n-origins", type=int, default=8)
+    ap.add_argument("--max-egids", type=int, default=-1, help="-1 = tous les EGID")
+    ap.add_argument("--train-direct", action="store_true", help="Entraîne d'abord les modèles DH_{egid}")
+    ap.add_argument("--exclude-inv", action="store_true", help="Métriques sur les seuls pas inv=0 (section 5 : tous)")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    egids = parse_egids(pq.ParquetFile(split_paths(args.cluster)[0]).schema_arrow.names)
+    if args.max_egids > 0:
+        egids = egids[: args.max_egids]
+    mdir = PATH_MODELS / f"Cluster{args.cluster}"
+    if args.model == DIRECT_PREFIX:
+        if args.train_direct:
+            train_direct_models(args.cluster, egids, args.horizon)
+        egids = [e for e in egids if (mdir / f"{DIRECT_PREFIX}_{e}.joblib").exists()]
+    elif args.model not in ("RFG", "XBG"):
+        suffix = "_meta.joblib" if args.model == "LSTM" else ".joblib"
+        egids = [e for e in egids if (mdir / f"{args.model}_{e}{suffix}").exists()]
+    if not egids:
+        raise SystemExit("Aucun EGID avec modèle entraîné")
+
+    frame = load_split_frame(args.cluster, egids, args.split)
+    warmup = DEFAULT_SPEC.history_len + 24  # marge LSTM (SEQ_LEN)
+    origins = pick_origins(len(frame), args.n_origins, warmup, args.horizon)
+    t0 = time.perf_counter()
+    if args.model == DIRECT_PREFIX:
+        fc = direct_forecast(args.cluster, egids, frame, origins, args.horizon)
+    else:
+        fc = recursive_forecast(args.cluster, egids, args.model, frame, origins, args.horizon)
+    total = time.perf_counter() - t0
+
+    met = horizon_metrics(fc, frame, exclude_inv=args.exclude_inv)
+    rdir = PATH_RESULTS / f"Cluster{args.cluster}"
+    rdir.mkdir(parents=True, exist_ok=True)
+    met.to_csv(rdir / f"horizon_{args.model}_{args.split}.csv", index=False)
+    summary = {
+        "cluster_id": args.cluster,
+        "model": args.model,
+        "mode": "direct" if args.model == DIRECT_PREFIX else "recursive",
+        "horizon": args.horizon,
+        "n_egids": len(egids),
+        "n_origins": len(origins),
+        "exclude_inv": args.exclude_inv,
+        "total_s": round(total, 3),
+        **fc.timings,
+        "score_mean": round(float(met["score"].mean()), 5),
+        "score_step_1": round(float(met["score"].iloc[0]), 5),
+        "score_step_last": round(float(met["score"].iloc[-1]), 5),
+    }
+    (rdir / f"horizon_{args.model}_{args.split}.json").write_text(
+        json.dumps(summary, indent=2, default=str), encoding="utf-8"
+    )
+    print(json.dumps(summary, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
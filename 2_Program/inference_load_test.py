@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Test de charge du service d'inférence : débit (requêtes/s, prédictions/s) et latences p50 / p95 / p99.
+
+Requêtes générées à partir des modèles présents dans ``6_Models/Cluster{N}`` et des dates du split test.
+Sans ``--url`` : service en mémoire (même processus) ; avec ``--url`` : serveur lancé par
+``inference_service.py serve``.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe inference_load_test.py --cluster 3 --model XB --n-batches 200
+  .venv\\Scripts\\python.exe inference_load_test.py --cluster 3 --url http://127.0.0.1:8765 --concurrency 8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from inference_service import InferenceService, PredictRequest
+from ml_features import PATH_MODELS, PATH_RESULTS, split_paths
+
+SEED = 42
+
+
+def available_egids(cluster_id: int, prefix: str) -> list[str]:
+    mdir = PATH_MODELS / f"Cluster{cluster_id}"
+    if prefix == "LSTM":
+        return sorted(p.name[len("LSTM_") : -len("_meta.joblib")] for p in mdir.glob("LSTM_*_meta.joblib"))
+    return sorted(
+        p.stem[len(prefix) + 1 :]
+        for p in mdir.glob(f"{prefix}_*.joblib")
+        if not p.stem.startswith(f"{prefix}_cluster")
+    )
+
+
+def make_batches(
+    cluster_id: int,
+    prefix: str,
+    egids: list[str],
+    n_batches: int,
+    batch_size: int,
+    n_timestamps: int,
+) -> list[list[dict]]:
+    """Lots aléatoires de requêtes (EGID tirés parmi ``egids``, horodatages consécutifs du split test)."""
+    rng = np.random.default_rng(SEED)
+    dates = pd.to_datetime(pd.read_parquet(split_paths(cluster_id)[2], columns=["Dates"])["Dates"], utc=True)
+    stamps = dates.dt.strftime("%Y-%m-%dT%H:%M:%SZ").to_numpy()
+    n_start = max(1, len(stamps) - n_timestamps)
+    batches = []
+    for _ in range(n_batches):
+        batch = []
+        for egid in rng.choice(np.array(egids, dtype=object), batch_size):
+            a = int(rng.integers(0, n_start))
+            batch.append(
+                {"cluster": cluster_id, "egid": str(egid), "model": prefix, "timestamps": list(stamps[a : a + n_timestamps])}
+            )
+        batches.append(batch)
+    return batches
+
+
+def _run_local(service: InferenceService, batch: list[dict]) -> int:
+    res = service.predict_batch([PredictRequest.from_dict(d) for d in batch])
+    return sum(len(r.predictions) for r in res)
+
+
+def _run_http(url: str, batch: list[dict]) -> int:
+    data = json.dumps({"requests": batch}).encode("utf-8")
+    req = urllib.request.Request(url.rstrip("/") + "/predict", data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        payload = json.loads(resp.read())
+    return sum(len(r["predictions"]) for r in payload["results"])
+
+
+def run_load_test(batches: list[list[dict]], call, concurrency: int = 1, warmup: int = 1) -> dict:
+    """Exécute ``call(batch)`` pour chaque lot (``concurrency`` fils) ; retourne débit et latences (ms)."""
+    for b in batches[:warmup]:
+        call(b)
+
+    def timed(batch):
+        t0 = time.perf_counter()
+        n = call(batch)
+        return time.perf_counter() - t0, n
+
+    t0 = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            out = list(ex.map(timed, batches))
+    else:
+        out = [timed(b) for b in batches]
+    wall = time.perf_counter() - t0
+
+    lat_ms = np.array([o[0] for o in out]) * 1000.0
+    n_pred = int(sum(o[1] for o in out))
+    n_req = sum(len(b) for b in batches)
+    return {
+        "n_batches": len(batches),
+        "n_requests": n_req,
+        "n_predictions": n_pred,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "batches_per_s": round(len(batches) / wall, 2),
+        "requests_per_s": round(n_req / wall, 2),
+        "predictions_per_s": round(n_pred / wall, 1),
+        "latency_ms": {
+            "p50": round(float(np.percentile(lat_ms, 50)), 2),
+            "p95": round(float(np.percentile(lat_ms, 95)), 2),
+            "p99": round(float(np.percentile(lat_ms, 99)), 2),
+            "max": round(float(lat_ms.max()), 2),
+        },
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cluster", type=int, default=3)
+    ap.add_argument("--model", default="XB", choices=["RF", "XB", "LSTM", "RFG", "XBG"])
+    ap.add_argument("--url", default=None, help="URL du service HTTP (sinon service en mémoire)")
+    ap.add_argument("--n-batches", type=int, default=100)
+    ap.add_argument("--batch-size", type=int, default=16, help="Requêtes (EGID) par lot")
+    ap.add_argument("--n-timestamps", type=int, default=96, help="Horodatages par requête")
+    ap.add_argument("--max-egids", type=int, default=50)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--cache-size", type=int, default=64)
+    ap.add_argument("--out", type=Path, default=None, help="JSON de résultats (défaut : 9_Results/Cluster{N}/)")
+    args = ap.parse_args()
+
+    ref = "RF" if args.model == "RFG" else "XB" if args.model == "XBG" else args.model
+    egids = available_egids(args.cluster, ref)[: args.max_egids]
+    if not egids:
+        raise SystemExit(f"Aucun modèle {ref} dans {PATH_MODELS / f'Cluster{args.cluster}'}")
+    batches = make_batches(args.cluster, args.model, egids, args.n_batches, args.batch_size, args.n_timestamps)
+
+    if args.url:
+        summary = run_load_test(batches, lambda b: _run_http(args.url, b), args.concurrency)
+    else:
+        service = InferenceService(cache_size=args.cache_size)
+        summary = run_load_test(batches, lambda b: _run_local(service, b), args.concurrency)
+        summary["service"] = service.stats()
+    summary.update(cluster_id=args.cluster, model=args.model, n_egids=len(egids), mode="http" if args.url else "local")
+
+    out = args.out or PATH_RESULTS / f"Cluster{args.cluster}" / f"inference_load_test_{args.model}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(summary, indent=2, default=str), encoding="utf-8")
+    print(json.dumps(summary, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
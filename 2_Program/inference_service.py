@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+Service d'inférence multi-EGID : chargement paresseux des modèles entraînés (cache LRU borné) et
+prédiction par lots.
+
+Une requête = (cluster, EGID, modèle, horodatages). Les requêtes d'un lot sont regroupées par modèle
+(``RF_{egid}.joblib``, ``XB_{egid}.joblib`` + ``.ubj``, ``LSTM_{egid}.keras`` + ``_meta.joblib``,
+``RFG`` / ``XBG_cluster{N}.joblib`` du mode global) : un seul ``scaler.transform`` + ``predict`` par modèle.
+Les features (exogènes + lags / rolling) sont reconstruites depuis les splits larges ``cluster{N}.parquet``
+(train / val / test concaténés, mêmes lignes et mêmes fenêtres LSTM que ML_training : ``build_xy_matrices`` et
+``lstm_end_indices`` d'ml_features), elles aussi gardées en cache LRU. Seuls les horodatages présents dans
+ces splits peuvent être prédits : une requête hors de leur période est rejetée (``error``), un horodatage de la
+période sans ligne exploitable (features ou cibles manquantes, historique LSTM insuffisant) est rendu dans
+``missing`` ; pour des dates futures : online_forecaster.py.
+
+Sorties au format des ``{RF,XB,LSTM}_{egid}.parquet`` : ``TempRetPred`` en °C, ``PuisCptPred`` en fc.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe inference_service.py serve --port 8765 --cache-size 64
+  .venv\\Scripts\\python.exe inference_service.py predict requete.json
+
+Requête HTTP : POST /predict {"requests": [{"cluster": 3, "egid": "1511188", "model": "XB",
+"timestamps": ["2025-01-01T00:00:00Z", ...]}]} ; GET /health, GET /stats.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from ml_features import (
+    PATH_MODELS,
+    FeatureSpec,
+    build_xy_matrices,
+    load_concat_frames,
+    lstm_end_indices,
+    predictions_frame,
+)
+
+logger = logging.getLogger("inference_service")
+
+MODEL_PREFIXES = ("RF", "XB", "LSTM", "RFG", "XBG")
+GLOBAL_MODEL_PREFIXES = ("RFG", "XBG")
+DEFAULT_CACHE_SIZE = 64
+DEFAULT_FEATURE_CACHE_SIZE = 32
+
+
+class LRUCache:
+    """
+    Cache LRU thread-safe borné en nombre d'entrées ; ``loader(key)`` appelé en cas d'absence.
+
+    Le chargement se fait hors du verrou : seuls les appels concurrents sur la **même** clé attendent le
+    chargement en cours (``Future`` par clé), les autres clés (présentes ou non) ne sont pas bloquées.
+    """
+
+    def __init__(self, max_items: int, loader: Callable):
+        if max_items < 1:
+            raise ValueError("max_items doit être >= 1")
+        self.max_items = int(max_items)
+        self._loader = loader
+        self._data: OrderedDict = OrderedDict()
+        self._pending: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.load_s = 0.0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            pending = self._pending.get(key)
+            if pending is None:
+                self.misses += 1
+                pending = self._pending[key] = Future()
+                owner = True
+            else:
+                self.waits += 1
+                owner = False
+        if not owner:
+            return pending.result()  # chargement lancé par un autre appel (exception propagée)
+        t0 = time.perf_counter()
+        try:
+            value = self._loader(key)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            self.load_s += time.perf_counter() - t0
+            self._data[key] = value
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            del self._pending[key]
+        pending.set_result(value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "max_items": self.max_items,
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "evictions": self.evictions,
+            "load_s": round(self.load_s, 3),
+        }
+
+
+@dataclass
+class LoadedModel:
+    """Modèle prêt à prédire : ``predict_scaled(X)`` → (n, 2) [TempRet_norm, PuisCpt_fc]."""
+
+    cluster_id: int
+    prefix: str
+    egid: str | None
+    scaler: object
+    feature_columns: list[str]
+    spec: FeatureSpec
+    predict_scaled: Callable[[np.ndarray], np.ndarray]
+    seq_len: int = 1
+    static_values: dict[str, list[float]] = field(default_factory=dict)
+
+    @property
+    def is_global(self) -> bool:
+        return self.egid is None
+
+    @property
+    def history_len(self) -> int:
+        """Pas passés nécessaires pour une prédiction (features + fenêtre LSTM)."""
+        return self.spec.history_len + self.seq_len - 1
+
+
+def model_key(cluster_id: int, prefix: str, egid: str) -> tuple[int, str, str | None]:
+    """Clé de cache : les modèles globaux sont partagés par tous les EGID du cluster."""
+    prefix = str(prefix).upper()
+    if prefix not in MODEL_PREFIXES:
+        raise ValueError(f"Modèle inconnu : {prefix} (attendu : {', '.join(MODEL_PREFIXES)})")
+    return int(cluster_id), prefix, None if prefix in GLOBAL_MODEL_PREFIXES else str(egid)
+
+
+def _xgb_predictor(bundle: dict, model_dir: Path) -> Callable[[np.ndarray], np.ndarray]:
+    if "booster_files" in bundle:
+        from xgb_multi_target import load_boosters_ubj, predict_boosters
+
+        boosters = load_boosters_ubj(model_dir, bundle["booster_files"])
+        return lambda X: predict_boosters(boosters, X)
+    models = bundle["models"]
+    return lambda X: np.column_stack([models[name].predict(X) for name in ("TempRet", "PuisCpt")])
+
+
+def _lstm_predictor(path_keras: Path) -> Callable[[np.ndarray], np.ndarray]:
+    try:
+        import tensorflow as tf
+    except ImportError as exc:
+        raise ImportError("TensorFlow requis pour les modèles LSTM") from exc
+    keras_m = tf.keras.models.load_model(path_keras)
+    return lambda X: np.asarray(keras_m.predict(X, batch_size=256, verbose=0), dtype=np.float64)
+
+
+def load_model(key: tuple[int, str, str | None], model_root: Path = PATH_MODELS) -> LoadedModel:
+    """Charge un modèle depuis ``6_Models/Cluster{N}`` (bundle joblib + fichiers natifs éventuels)."""
+    cluster_id, prefix, egid = key
+    mdir = Path(model_root) / f"Cluster{cluster_id}"
+    if prefix == "LSTM":
+        bundle = joblib.load(mdir / f"LSTM_{egid}_meta.joblib")
+        predict = _lstm_predictor(mdir / f"LSTM_{egid}.keras")
+    else:
+        stem = f"{prefix}_cluster{cluster_id}" if egid is None else f"{prefix}_{egid}"
+        bundle = joblib.load(mdir / f"{stem}.joblib")
+        if prefix in ("XB", "XBG"):
+            predict = _xgb_predictor(bundle, mdir)
+        else:
+            rf = bundle["model"]
+            predict = lambda X: np.asarray(rf.predict(X), dtype=np.float64)  # noqa: E731
+
+    feats = list(bundle["feature_columns"])
+    static_cols = list(bundle.get("static_columns", []))
+    base = feats[: len(feats) - len(static_cols)] if static_cols else feats
+    logger.info("Modèle chargé : %s", mdir / f"{prefix}_{egid or f'cluster{cluster_id}'}")
+    return LoadedModel(
+        cluster_id=cluster_id,
+        prefix=prefix,
+        egid=egid,
+        scaler=bundle["scaler"],
+        feature_columns=feats,
+        spec=FeatureSpec.from_feature_columns(base),
+        predict_scaled=predict,
+        seq_len=int(bundle.get("seq_len", 1)),
+        static_values={str(k): list(v) for k, v in bundle.get("static_values", {}).items()},
+    )
+
+
+@dataclass
+class EgidFeatures:
+    """Features d'un EGID sur train + val + test : lignes retenues par ``build_xy_matrices`` (features et cibles
+    finies, comme à l'entraînement), indexées par date (UTC) ; ``sp`` = split de chaque ligne."""
+
+    dates: pd.DatetimeIndex
+    X_raw: np.ndarray
+    sp: np.ndarray
+    _ends: dict = field(default_factory=dict, repr=False)
+
+    def window_ends(self, seq_len: int) -> np.ndarray:
+        """Indices de fin des fenêtres LSTM de l'entraînement (``lstm_end_indices``, train + val + test)."""
+        if seq_len not in self._ends:
+            self._ends[seq_len] = np.sort(np.concatenate(lstm_end_indices(self.sp, seq_len)))
+        return self._ends[seq_len]
+
+
+def load_egid_features(key: tuple[int, str, FeatureSpec]) -> EgidFeatures:
+    cluster_id, egid, spec = key
+    full, _sizes = load_concat_frames(cluster_id, egid, spec)
+    X_raw, _y, sp, _inv_ok, dates, _inv = build_xy_matrices(full, egid, spec)
+    return EgidFeatures(
+        dates=pd.DatetimeIndex(pd.to_datetime(dates, utc=True)), X_raw=np.ascontiguousarray(X_raw), sp=sp
+    )
+
+
+def parse_timestamps(values) -> pd.DatetimeIndex:
+    """Horodatages (ISO 8601, epoch, Timestamp) → UTC ; les dates naïves sont supposées UTC."""
+    out = []
+    for v in values:
+        t = pd.Timestamp(v)
+        out.append(t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC"))
+    return pd.DatetimeIndex(out, tz="UTC")
+
+
+@dataclass
+class PredictRequest:
+    cluster_id: int
+    egid: str
+    model: str
+    timestamps: list
+
+    @classmethod
+    def from_dict(cls, d: dict) -> PredictRequest:
+        return cls(int(d["cluster"]), str(d["egid"]), str(d["model"]).upper(), list(d["timestamps"]))
+
+
+@dataclass
+class PredictResult:
+    request: PredictRequest
+    predictions: pd.DataFrame
+    missing: list[str]
+    error: str | None = None
+
+    def to_dict(self) -> dict:
+        preds = self.predictions.copy()
+        if "Dates" in preds.columns:
+            preds["Dates"] = pd.to_datetime(preds["Dates"], utc=True).dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        return {
+            "cluster": self.request.cluster_id,
+            "egid": self.request.egid,
+            "model": self.request.model,
+            "predictions": preds.to_dict(orient="records"),
+            "missing": self.missing,
+            "error": self.error,
+        }
+
+
+class InferenceService:
+    """Prédiction par lots : regroupement par modèle, un ``predict`` vectorisé par modèle."""
+
+    def __init__(
+        self,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        feature_cache_size: int = DEFAULT_FEATURE_CACHE_SIZE,
+        model_root: Path = PATH_MODELS,
+    ):
+        self.model_root = Path(model_root)
+        self.models = LRUCache(cache_size, lambda k: load_model(k, self.model_root))
+        self.features = LRUCache(feature_cache_size, load_egid_features)
+        self.n_batches = 0
+        self.n_requests = 0
+        self.n_predictions = 0
+        self.predict_s = 0.0
+
+    def _rows_for(self, m: LoadedModel, req: PredictRequest) -> tuple[np.ndarray, pd.DatetimeIndex, list[str]]:
+        """Matrice brute (n, f) ou (n, seq_len, f) pour les horodatages disponibles + horodatages manquants."""
+        ef = self.features.get((req.cluster_id, req.egid, m.spec))
+        ts = parse_timestamps(req.timestamps)
+        if len(ef.dates) == 0:
+            raise ValueError(f"EGID {req.egid} : aucune ligne exploitable dans les splits du cluster {req.cluster_id}")
+        out = (ts < ef.dates[0]) | (ts > ef.dates[-1])
+        if out.any():
+            raise ValueError(
+                f"{int(out.sum())} horodatage(s) hors des splits ({ef.dates[0]} → {ef.dates[-1]}), "
+                f"ex. {ts[out][0]} : seules les dates des splits cluster{req.cluster_id}.parquet sont prédites"
+            )
+        pos = ef.dates.get_indexer(ts)
+        ok = pos >= 0
+        if m.seq_len > 1:
+            ok &= np.isin(pos, ef.window_ends(m.seq_len))
+        missing = [str(t) for t in ts[~ok]]
+        pos = pos[ok]
+        X = ef.X_raw
+        if m.is_global:
+            static = m.static_values.get(req.egid)
+            if static is None:
+                return np.empty((0, len(m.feature_columns))), ts[:0], [str(t) for t in ts]
+            X = np.hstack([X[pos], np.broadcast_to(np.asarray(static, dtype=np.float64), (len(pos), len(static)))])
+            return X, ts[ok], missing
+        if m.seq_len > 1:
+            win = pos[:, None] + np.arange(-m.seq_len + 1, 1)[None, :]
+            return X[win], ts[ok], missing
+        return X[pos], ts[ok], missing
+
+    def _predict_group(self, m: LoadedModel, X: np.ndarray) -> np.ndarray:
+        if len(X) == 0:
+            return np.zeros((0, 2))
+        if X.ndim == 3:
+            n, s, f = X.shape
+            Xs = m.scaler.transform(X.reshape(n * s, f)).astype(np.float32).reshape(n, s, f)
+        else:
+            Xs = m.scaler.transform(X)
+        return m.predict_scaled(Xs)
+
+    def predict_batch(self, requests: list[PredictRequest]) -> list[PredictResult]:
+        t0 = time.perf_counter()
+        results: list[PredictResult | None] = [None] * len(requests)
+        groups: dict[tuple, list[int]] = {}
+        for i, req in enumerate(requests):
+            try:
+                groups.setdefault(model_key(req.cluster_id, req.model, req.egid), []).append(i)
+            except ValueError as exc:
+                results[i] = PredictResult(req, pd.DataFrame(), [], str(exc))
+
+        for key, idxs in groups.items():
+            try:
+                m = self.models.get(key)
+            except (OSError, KeyError, ValueError, ImportError) as exc:
+                logger.warning("Modèle %s indisponible : %s", key, exc)
+                for i in idxs:
+                    results[i] = PredictResult(requests[i], pd.DataFrame(), [], f"{type(exc).__name__}: {exc}")
+                continue
+            parts = {}
+            for i in idxs:
+                try:
+                    parts[i] = self._rows_for(m, requests[i])
+                except (OSError, KeyError, ValueError) as exc:
+                    results[i] = PredictResult(requests[i], pd.DataFrame(), [], f"{type(exc).__name__}: {exc}")
+            if not parts:
+                continue
+            sizes = [len(p[0]) for p in parts.values()]
+            X = np.concatenate([p[0] for p in parts.values()]) if sum(sizes) else np.empty((0,))
+            pred = self._predict_group(m, X)
+            offsets = np.concatenate([[0], np.cumsum(sizes)])
+            for (i, (_X, dates, missing)), a, b in zip(parts.items(), offsets[:-1], offsets[1:]):
+                results[i] = PredictResult(requests[i], predictions_frame(dates, None, pred[a:b]), missing)
+                self.n_predictions += int(b - a)
+
+        self.n_batches += 1
+        self.n_requests += len(requests)
+        self.predict_s += time.perf_counter() - t0
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.n_batches,
+            "requests": self.n_requests,
+            "predictions": self.n_predictions,
+            "predict_s": round(self.predict_s, 3),
+            "model_cache": self.models.stats(),
+            "feature_cache": self.features.stats(),
+        }
+
+
+def make_server(service: InferenceService, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """Serveur HTTP local (stdlib) : POST /predict, GET /health, GET /stats."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload: dict) -> None:
+            body = json.dumps(payload, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:  # noqa: N802
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            elif self.path == "/stats":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"error": "route inconnue"})
+
+        def do_POST(self) -> None:  # noqa: N802
+            if self.path != "/predict":
+                self._send(404, {"error": "route inconnue"})
+                return
+            try:
+                n = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(n) or b"{}")
+                reqs = [PredictRequest.from_dict(d) for d in payload.get("requests", [])]
+            except (ValueError, KeyError, TypeError) as exc:
+                self._send(400, {"error": f"requête invalide : {exc}"})
+                return
+            results = service.predict_batch(reqs)
+            self._send(200, {"results": [r.to_dict() for r in results]})
+
+        def log_message(self, fmt: str, *args) -> None:
+            logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_serve = sub.add_parser("serve", help="Serveur HTTP local")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_pred = sub.add_parser("predict", help="Lot de requêtes depuis un fichier JSON")
+    p_pred.add_argument("json_path", type=Path)
+    for p in (p_serve, p_pred):
+        p.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="Modèles gardés en mémoire")
+        p.add_argument("--feature-cache-size", type=int, default=DEFAULT_FEATURE_CACHE_SIZE)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    service = InferenceService(args.cache_size, args.feature_cache_size)
+    if args.cmd == "predict":
+        payload = json.loads(args.json_path.read_text(encoding="utf-8"))
+        reqs = [PredictRequest.from_dict(d) for d in payload.get("requests", [])]
+        out = {"results": [r.to_dict() for r in service.predict_batch(reqs)], "stats": service.stats()}
+        json.dump(out, sys.stdout, indent=2, default=str, ensure_ascii=False)
+        print()
+        return
+
+    server = make_server(service, args.host, args.port)
+    logger.info("Service d'inférence sur http://%s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
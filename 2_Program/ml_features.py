@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Features ML par EGID (exogènes + lags / rolling) et chargement des splits larges ``cluster{N}.parquet``.
+
+Source unique de la configuration des features (``EXOG_COLS``, ``LAGS``, ``ROLL_WINDOWS``, ``SEQ_LEN``), des
+chemins des splits et des helpers de données (``add_lag_features``, ``load_concat_frames``, ``build_xy_matrices``,
+``lstm_end_indices``, ``predictions_frame``) : ML_training les importe, comme les scripts hors notebook
+(mode global par cluster, inférence, prévision, backtest).
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from stage_profiler import profiled
+
+ROOT = Path(__file__).resolve().parent
+PATH_TRAIN = ROOT / "0_Data" / "3_Training"
+PATH_VAL = ROOT / "0_Data" / "4_Validation"
+PATH_TEST = ROOT / "0_Data" / "5_Test"
+PATH_MODELS = ROOT / "0_Data" / "6_Models"
+PATH_RESULTS = ROOT / "0_Data" / "9_Results"
+PATH_GIS = ROOT / "0_Data" / "1_Structured" / "DATA_GIS_Filtered.parquet"
+
+CLUSTER_IDS = [3, 4, 5, 6]
+
+EXOG_COLS = [
+    "TempExt_norm",
+    "dayofyear_cos",
+    "dayofyear_sin",
+    "dayofweek_cos",
+    "dayofweek_sin",
+    "hour_cos",
+    "hour_sin",
+]
+LAGS = [1, 2, 3, 7]
+ROLL_WINDOWS = [3, 7]
+SEQ_LEN = 24
+
+# Dénormalisation TempRet (°C) — aligné pipeline : clip((T-20)/60, 0, 1)
+TEMPRET_NORM_T0_C = 20.0
+TEMPRET_NORM_SCALE_C = 60.0
+# TempExt_norm — aligné pipeline : clip((T+20)/60, 0, 1)
+TEMPEXT_NORM_T0_C = -20.0
+TEMPEXT_NORM_SCALE_C = 60.0
+
+_RE_LAG = re.compile(r"^lag_(?:tr|pc)_(\d+)$")
+_RE_ROLL = re.compile(r"^roll_(?:tr|pc)_(?:mean|std)_(\d+)$")
+
+
+@dataclass(frozen=True)
+class FeatureSpec:
+    """Définition du vecteur de features (ordre identique à ``feature_column_names`` du notebook)."""
+
+    exog_cols: tuple[str, ...] = tuple(EXOG_COLS)
+    lags: tuple[int, ...] = tuple(LAGS)
+    roll_windows: tuple[int, ...] = tuple(ROLL_WINDOWS)
+    extra_cols: tuple[str, ...] = field(default_factory=tuple)
+
+    def feature_columns(self) -> list[str]:
+        feats = list(self.exog_cols)
+        for lag in self.lags:
+            feats += [f"lag_tr_{lag}", f"lag_pc_{lag}"]
+        for w in self.roll_windows:
+            feats += [
+                f"roll_tr_mean_{w}",
+                f"roll_tr_std_{w}",
+                f"roll_pc_mean_{w}",
+                f"roll_pc_std_{w}",
+            ]
+        return feats + list(self.extra_cols)
+
+    @property
+    def history_len(self) -> int:
+        """Nombre de pas passés nécessaires aux lags et aux fenêtres glissantes (décalées d'un pas)."""
+        return max([1, *self.lags, *self.roll_windows])
+
+    @classmethod
+    def from_feature_columns(cls, columns: list[str]) -> FeatureSpec:
+        """Reconstruit la spec depuis ``bundle["feature_columns"]`` (modèles déjà entraînés)."""
+        exog: list[str] = []
+        lags: list[int] = []
+        wins: list[int] = []
+        extra: list[str] = []
+        for c in columns:
+            m_lag = _RE_LAG.match(c)
+            m_roll = _RE_ROLL.match(c)
+            if m_lag:
+                v = int(m_lag.group(1))
+                if v not in lags:
+                    lags.append(v)
+            elif m_roll:
+                v = int(m_roll.group(1))
+                if v not in wins:
+                    wins.append(v)
+            elif not lags and not wins:
+                exog.append(c)
+            else:
+                extra.append(c)
+        spec = cls(tuple(exog), tuple(lags), tuple(wins), tuple(extra))
+        if spec.feature_columns() != list(columns):
+            raise ValueError("feature_columns non reconnues (ordre exogènes → lags → rolling attendu)")
+        return spec
+
+
+DEFAULT_SPEC = FeatureSpec()
+
+
+def target_cols(egid: str) -> tuple[str, str]:
+    eg = str(egid)
+    return f"{eg}.TempRet_norm", f"{eg}.PuisCpt_fc"
+
+
+def inv_cols(egid: str) -> tuple[str, str]:
+    eg = str(egid)
+    return f"{eg}.TempRet.inv", f"{eg}.PuisCpt.inv"
+
+
+def columns_for_egid(egid: str, spec: FeatureSpec = DEFAULT_SPEC) -> list[str]:
+    return ["Dates"] + list(spec.exog_cols) + list(target_cols(egid)) + list(inv_cols(egid))
+
+
+def parse_egids(columns: list[str]) -> list[str]:
+    """EGID à partir des colonnes *.TempRet_norm."""
+    return sorted({c[: -len(".TempRet_norm")] for c in columns if c.endswith(".TempRet_norm")})
+
+
+def split_paths(cluster_id: int) -> tuple[Path, Path, Path]:
+    name = f"cluster{int(cluster_id)}.parquet"
+    return PATH_TRAIN / name, PATH_VAL / name, PATH_TEST / name
+
+
+def add_lag_features(df: pd.DataFrame, egid: str, spec: FeatureSpec = DEFAULT_SPEC) -> pd.DataFrame:
+    tr, pc = target_cols(egid)
+    out = df.copy()
+    for lag in spec.lags:
+        out[f"lag_tr_{lag}"] = out[tr].shift(lag)
+        out[f"lag_pc_{lag}"] = out[pc].shift(lag)
+    shifted_tr = out[tr].shift(1)
+    shifted_pc = out[pc].shift(1)
+    for w in spec.roll_windows:
+        out[f"roll_tr_mean_{w}"] = shifted_tr.rolling(w).mean()
+        out[f"roll_tr_std_{w}"] = shifted_tr.rolling(w).std()
+        out[f"roll_pc_mean_{w}"] = shifted_pc.rolling(w).mean()
+        out[f"roll_pc_std_{w}"] = shifted_pc.rolling(w).std()
+    return out
+
+
+def load_concat_frames(
+    cluster_id: int, egid: str, spec: FeatureSpec = DEFAULT_SPEC
+) -> tuple[pd.DataFrame, tuple[int, int, int]]:
+    """Charge train/val/test (colonnes minimales), concatène avec marqueur _sp et ajoute les lags."""
+    cols = columns_for_egid(egid, spec)
+    parts = []
+    for k, p in enumerate(split_paths(cluster_id)):
+        d = pd.read_parquet(p, columns=cols)
+        d["_sp"] = k
+        parts.append(d)
+    sizes = tuple(len(d) for d in parts)
+    full = pd.concat(parts, ignore_index=True)
+    return add_lag_features(full, egid, spec), sizes
+
+
+@profiled("feature_build")
+def build_xy_matrices(full: pd.DataFrame, egid: str, spec: FeatureSpec = DEFAULT_SPEC):
+    """Retourne X_raw, y ([TempRet_norm, PuisCpt_fc] dans [0,1]), sp, inv_ok, dates, inv_df."""
+    tr_c, pc_c = target_cols(egid)
+    vi_tr, vi_pc = inv_cols(egid)
+    feat = spec.feature_columns()
+
+    feat_ok = full[feat].replace([np.inf, -np.inf], np.nan).notna().all(axis=1)
+    y_ok = full[[tr_c, pc_c]].replace([np.inf, -np.inf], np.nan).notna().all(axis=1)
+    sub = full.loc[feat_ok & y_ok].reset_index(drop=True)
+
+    X_raw = sub[feat].to_numpy(dtype=np.float64)
+    y = np.clip(sub[[tr_c, pc_c]].to_numpy(dtype=np.float64), 0.0, 1.0)
+    sp = sub["_sp"].to_numpy(dtype=np.int8)
+    dates = sub["Dates"].to_numpy()
+    inv_ok = (sub[vi_tr].to_numpy() == 0) & (sub[vi_pc].to_numpy() == 0)
+    return X_raw, y, sp, inv_ok, dates, sub[[vi_tr, vi_pc]]
+
+
+def lstm_end_indices(sp: np.ndarray, seq_len: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Version vectorisée de ``collect_lstm_end_indices`` (fenêtres train / val / test sans chevauchement)."""
+    sp = np.asarray(sp)
+    if len(sp) < seq_len:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    win = np.lib.stride_tricks.sliding_window_view(sp, seq_len)
+    ends = np.arange(seq_len - 1, len(sp))
+    last, hi = win[:, -1], win.max(axis=1)
+    train = (last == 0) & (hi == 0) & (win.min(axis=1) == 0)
+    val = (last == 1) & (hi <= 1)
+    test = last == 2
+    return ends[train], ends[val], ends[test]
+
+
+def cycl_encode(val, max_val):
+    angle = 2 * np.pi * val / max_val
+    return np.cos(angle), np.sin(angle)
+
+
+def exog_frame(dates, tempext_norm) -> pd.DataFrame:
+    """
+    Exogènes ``EXOG_COLS`` d'horodatages quelconques (encodages cycliques de la section 6 de
+    dataset_preparation_V2) : calculés sur l'heure locale Europe/Zurich comme ``date`` dans le pipeline ;
+    ``dates`` avec fuseau (``Dates`` des splits, UTC) converties, sans fuseau prises comme heure locale.
+    """
+    d = pd.DatetimeIndex(pd.to_datetime(dates))
+    if d.tz is not None:
+        d = d.tz_convert("Europe/Zurich").tz_localize(None)
+    out = pd.DataFrame(index=range(len(d)))
+    out["TempExt_norm"] = np.broadcast_to(np.asarray(tempext_norm, dtype=np.float64), (len(d),))
+    out["dayofyear_cos"], out["dayofyear_sin"] = cycl_encode(np.asarray(d.dayofyear) - 1, 366)
+    out["dayofweek_cos"], out["dayofweek_sin"] = cycl_encode(np.asarray(d.dayofweek), 7)
+    out["hour_cos"], out["hour_sin"] = cycl_encode(np.asarray(d.hour), 24)
+    return out[EXOG_COLS]
+
+
+def norm_tempext(t_celsius) -> np.ndarray:
+    """TempExt (°C) → ``TempExt_norm`` du pipeline."""
+    x = (np.asarray(t_celsius, dtype=np.float64) - TEMPEXT_NORM_T0_C) / TEMPEXT_NORM_SCALE_C
+    return np.clip(x, 0.0, 1.0)
+
+
+def denorm_tempret_celsius(norm: np.ndarray) -> np.ndarray:
+    """Inverse norme pipeline : T(°C) = TEMPRET_NORM_T0_C + scale * clip(norm, 0, 1)."""
+    x = np.clip(np.asarray(norm, dtype=np.float64), 0.0, 1.0)
+    return TEMPRET_NORM_T0_C + TEMPRET_NORM_SCALE_C * x
+
+
+def predictions_frame(
+    dates: np.ndarray,
+    y_true: np.ndarray | None,
+    y_pred: np.ndarray,
+    inv_df: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """Même format que les ``{RF,XB,LSTM}_{egid}.parquet`` (TempRet en °C, PuisCpt en fc)."""
+    yp = np.clip(np.asarray(y_pred, dtype=np.float64), 0.0, 1.0)
+    out = pd.DataFrame({"Dates": dates})
+    if y_true is not None:
+        yt = np.clip(np.asarray(y_true, dtype=np.float64), 0.0, 1.0)
+        out["TempRet"] = denorm_tempret_celsius(yt[:, 0])
+        out["PuisCpt"] = yt[:, 1]
+    out["TempRetPred"] = denorm_tempret_celsius(yp[:, 0])
+    out["PuisCptPred"] = yp[:, 1]
+    if inv_df is not None and len(inv_df) == len(out):
+        out["TempRet.inv"] = inv_df.iloc[:, 0].to_numpy()
+        out["PuisCpt.inv"] = inv_df.iloc[:, 1].to_numpy()
+    return out
+
+
+def export_test_predictions(
+    path_parquet: Path,
+    dates: np.ndarray,
+    y_true: np.ndarray,
+    y_pred: np.ndarray,
+    inv_df: pd.DataFrame | None,
+) -> None:
+    predictions_frame(dates, y_true, y_pred, inv_df).to_parquet(path_parquet, index=False)
+
+
+def mae_rmse_per_target(y_true: np.ndarray, y_pred: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    yt = np.asarray(y_true, dtype=np.float64)
+    yp = np.asarray(y_pred, dtype=np.float64)
+    err = yt - yp
+    return np.mean(np.abs(err), axis=0), np.sqrt(np.mean(err * err, axis=0))
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+Mode global par cluster : un seul modèle (RF ou XGB) entraîné sur les lignes empilées de tous les EGID.
+
+Chaque ligne = features habituelles (exogènes + lags / rolling de l'EGID) + attributs statiques de l'EGID :
+``U_PUISSANCE_kW`` (GIS), indicateur ECS (``U_PROD_ECS`` → 0/1, règle GESA) et identifiant encodé par la
+moyenne des cibles **train** de l'EGID (target encoding, sans fuite val/test).
+
+Évaluation par EGID au même format que ML_training : ``RFG_{egid}.parquet`` / ``XBG_{egid}.parquet`` dans
+``9_Results/Cluster{N}/`` (mêmes colonnes que ``RF_*`` / ``XB_*``). L'option ``--benchmark`` compare temps,
+mémoire et précision au mode par EGID (mêmes hyperparamètres) ; écart de RSS mesuré si psutil (optionnel,
+requirements-optional.txt) est installé, pic tracemalloc seul sinon.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe ml_global_cluster.py --cluster 3
+  .venv\\Scripts\\python.exe ml_global_cluster.py --cluster 3 --kinds XGB --max-egids 30 --benchmark
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import logging
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+from ml_features import (
+    DEFAULT_SPEC,
+    PATH_GIS,
+    PATH_MODELS,
+    PATH_RESULTS,
+    FeatureSpec,
+    build_xy_matrices,
+    load_concat_frames,
+    parse_egids,
+    predictions_frame,
+    split_paths,
+)
+from xgb_multi_target import save_boosters_ubj, train_xgb_multi_target
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger("ml_global_cluster")
+
+SEED = 42
+N_JOBS_PARALLEL = -5
+GLOBAL_PREFIXES = {"RF": "RFG", "XGB": "XBG"}
+STATIC_COLS = ["static_u_puissance_kw", "static_prod_ecs", "static_te_tr", "static_te_pc"]
+
+# Mêmes hyperparamètres pour le mode global et la référence par EGID du benchmark
+RF_PARAMS = {"n_estimators": 120, "max_depth": 10}
+XGB_PARAMS = dict(
+    n_estimators=500,
+    max_depth=6,
+    learning_rate=0.05,
+    subsample=0.8,
+    colsample_bytree=0.8,
+    random_state=SEED,
+    n_jobs=N_JOBS_PARALLEL,
+    verbosity=0,
+)
+XGB_EARLY_STOPPING_ROUNDS = 40
+
+
+@dataclass
+class StackedCluster:
+    """Lignes empilées d'un cluster (float32) ; ``egid_idx`` renvoie à ``egids``."""
+
+    cluster_id: int
+    egids: list[str]
+    feature_columns: list[str]
+    X_raw: np.ndarray
+    y: np.ndarray
+    sp: np.ndarray
+    inv_ok: np.ndarray
+    egid_idx: np.ndarray
+    dates: np.ndarray
+    inv: np.ndarray
+
+
+def _ecs_01(x) -> int:
+    """U_PROD_ECS → 0/1 (NaN / -1 → 0), comme ``map_ecs_01`` de l'analyse GESA."""
+    return 1 if str(x).strip() in ("1", "1.0") else 0
+
+
+def load_static_attributes(egids: list[str], path_gis: Path = PATH_GIS) -> pd.DataFrame:
+    """Attributs statiques par EGID (index str) : ``u_puissance_kw`` (médiane si absent) et ``prod_ecs``."""
+    out = pd.DataFrame(index=pd.Index([str(e) for e in egids], name="EGID"))
+    out["u_puissance_kw"] = np.nan
+    out["prod_ecs"] = 0
+    if not Path(path_gis).exists():
+        logger.warning("GIS absent (%s) : attributs statiques neutres", path_gis)
+        out["u_puissance_kw"] = 0.0
+        return out
+    gis = pd.read_parquet(path_gis)
+    gis["U_NO_EGID"] = gis["U_NO_EGID"].astype(str)
+    gis = gis.drop_duplicates(subset=["U_NO_EGID"]).set_index("U_NO_EGID")
+    if "U_PUISSANCE_kW" in gis.columns:
+        pw = pd.to_numeric(gis["U_PUISSANCE_kW"], errors="coerce")
+    else:
+        pw = pd.to_numeric(
+            gis["U_PUISSANCE"].astype(str).str.extract(r"([0-9.]+)", expand=False), errors="coerce"
+        )
+    out["u_puissance_kw"] = pw.reindex(out.index).to_numpy(dtype=np.float64)
+    if "U_PROD_ECS" in gis.columns:
+        out["prod_ecs"] = gis["U_PROD_ECS"].reindex(out.index).map(_ecs_01).fillna(0).astype(np.int8)
+    med = float(np.nanmedian(out["u_puissance_kw"])) if out["u_puissance_kw"].notna().any() else 0.0
+    out["u_puissance_kw"] = out["u_puissance_kw"].fillna(med)
+    return out
+
+
+def stack_cluster_rows(
+    cluster_id: int,
+    egids: list[str],
+    spec: FeatureSpec = DEFAULT_SPEC,
+    static: pd.DataFrame | None = None,
+) -> StackedCluster:
+    """Empile les matrices par EGID (``build_xy_matrices``) et ajoute les colonnes ``STATIC_COLS``."""
+    if static is None:
+        static = load_static_attributes(egids)
+    n_base = len(spec.feature_columns())
+    blocks: dict[str, list] = {k: [] for k in ("X", "y", "sp", "inv_ok", "idx", "dates", "inv")}
+    kept: list[str] = []
+    for egid in egids:
+        full, _sizes = load_concat_frames(cluster_id, egid, spec)
+        X_raw, y, sp, inv_ok, dates, inv_sub = build_xy_matrices(full, egid, spec)
+        del full
+        if len(y) == 0:
+            continue
+        k = len(kept)
+        kept.append(str(egid))
+        X = np.empty((len(y), n_base + len(STATIC_COLS)), dtype=np.float32)
+        X[:, :n_base] = X_raw
+        X[:, n_base] = static.at[str(egid), "u_puissance_kw"]
+        X[:, n_base + 1] = static.at[str(egid), "prod_ecs"]
+        blocks["X"].append(X)
+        blocks["y"].append(y.astype(np.float32))
+        blocks["sp"].append(sp)
+        blocks["inv_ok"].append(inv_ok)
+        blocks["idx"].append(np.full(len(y), k, dtype=np.int32))
+        blocks["dates"].append(dates)
+        blocks["inv"].append(inv_sub.to_numpy(dtype=np.int8))
+        del X_raw, y
+    if not kept:
+        raise ValueError(f"Cluster {cluster_id} : aucune ligne exploitable pour le mode global")
+
+    st = StackedCluster(
+        cluster_id=int(cluster_id),
+        egids=kept,
+        feature_columns=spec.feature_columns() + list(STATIC_COLS),
+        X_raw=np.concatenate(blocks["X"]),
+        y=np.concatenate(blocks["y"]),
+        sp=np.concatenate(blocks["sp"]),
+        inv_ok=np.concatenate(blocks["inv_ok"]),
+        egid_idx=np.concatenate(blocks["idx"]),
+        dates=np.concatenate(blocks["dates"]),
+        inv=np.concatenate(blocks["inv"]),
+    )
+    del blocks
+    gc.collect()
+    _fill_target_encoding(st, n_base)
+    return st
+
+
+def _fill_target_encoding(st: StackedCluster, n_base: int) -> None:
+    """Moyenne des cibles sur les lignes train valides de chaque EGID (repli : moyenne globale train)."""
+    m = (st.sp == 0) & st.inv_ok
+    n_e = len(st.egids)
+    cnt = np.bincount(st.egid_idx[m], minlength=n_e).astype(np.float64)
+    for j in range(2):
+        s = np.bincount(st.egid_idx[m], weights=st.y[m, j], minlength=n_e)
+        glob = float(st.y[m, j].mean()) if m.any() else 0.0
+        enc = np.where(cnt > 0, s / np.maximum(cnt, 1.0), glob)
+        st.X_raw[:, n_base + 2 + j] = enc[st.egid_idx]
+
+
+def _split_masks(st: StackedCluster) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return (st.sp == 0) & st.inv_ok, (st.sp == 1) & st.inv_ok, st.sp == 2
+
+
+def _per_egid_metrics(
+    cluster_id: int, egid: str, model: str, frame: pd.DataFrame
+) -> dict:
+    """Mêmes définitions que ``load_result_metrics`` (TempRet en °C, PuisCpt en fc)."""
+    yt = frame[["TempRet", "PuisCpt"]].to_numpy(dtype=np.float64)
+    yp = frame[["TempRetPred", "PuisCptPred"]].to_numpy(dtype=np.float64)
+    err = yt - yp
+    mae = np.mean(np.abs(err), axis=0)
+    rmse = np.sqrt(np.mean(err * err, axis=0))
+    return dict(
+        cluster_id=cluster_id,
+        egid=egid,
+        model=model,
+        rmse_TempRet=float(rmse[0]),
+        rmse_PuisCpt=float(rmse[1]),
+        mae_TempRet=float(mae[0]),
+        mae_PuisCpt=float(mae[1]),
+        score=float(np.mean(rmse)),
+    )
+
+
+def _fit_predict(kind: str, X_tr, y_tr, X_va, y_va, X_te, rf_params: dict, xgb_params: dict):
+    """Retourne (modèle ou boosters, prédictions test (n, 2))."""
+    if kind == "RF":
+        rf = RandomForestRegressor(**rf_params, random_state=SEED, n_jobs=N_JOBS_PARALLEL)
+        rf.fit(X_tr, y_tr)
+        return rf, rf.predict(X_te) if len(X_te) else np.zeros((0, 2))
+    if kind == "XGB":
+        res = train_xgb_multi_target(
+            X_tr, y_tr, X_va, y_va, X_te, xgb_params, early_stopping_rounds=XGB_EARLY_STOPPING_ROUNDS
+        )
+        return res.boosters, res.pred_te
+    raise ValueError(f"Type de modèle inconnu : {kind} (RF ou XGB)")
+
+
+def train_global_cluster(
+    cluster_id: int,
+    egids: list[str] | None = None,
+    kinds: tuple[str, ...] = ("RF", "XGB"),
+    *,
+    spec: FeatureSpec = DEFAULT_SPEC,
+    rf_params: dict | None = None,
+    xgb_params: dict | None = None,
+    write_outputs: bool = True,
+    stacked: StackedCluster | None = None,
+) -> pd.DataFrame:
+    """Entraîne un modèle global par type ; écrit modèles + ``{RFG,XBG}_{egid}.parquet`` ; retourne les métriques test."""
+    rf_params = dict(rf_params or RF_PARAMS)
+    xgb_params = dict(xgb_params or XGB_PARAMS)
+    if egids is None:
+        egids = parse_egids(pq.ParquetFile(split_paths(cluster_id)[0]).schema_arrow.names)
+    st = stacked if stacked is not None else stack_cluster_rows(cluster_id, egids, spec)
+    tr_m, va_m, te_m = _split_masks(st)
+    logger.info(
+        "Global cluster %s : %s EGID, %s lignes train, %s val, %s test",
+        cluster_id, len(st.egids), int(tr_m.sum()), int(va_m.sum()), int(te_m.sum()),
+    )
+
+    scaler = StandardScaler()
+    X_tr = scaler.fit_transform(st.X_raw[tr_m]).astype(np.float32)
+    X_va = scaler.transform(st.X_raw[va_m]).astype(np.float32)
+    X_te = scaler.transform(st.X_raw[te_m]).astype(np.float32)
+    y_tr, y_va = st.y[tr_m], st.y[va_m]
+    idx_te = st.egid_idx[te_m]
+    dates_te, inv_te, y_te = st.dates[te_m], st.inv[te_m], st.y[te_m]
+
+    mdir = PATH_MODELS / f"Cluster{cluster_id}"
+    rdir = PATH_RESULTS / f"Cluster{cluster_id}"
+    if write_outputs:
+        mdir.mkdir(parents=True, exist_ok=True)
+        rdir.mkdir(parents=True, exist_ok=True)
+
+    first_row = np.unique(st.egid_idx, return_index=True)[1]
+    static_values = {
+        e: st.X_raw[first_row[k], -len(STATIC_COLS):].tolist() for k, e in enumerate(st.egids)
+    }
+
+    rows = []
+    for kind in kinds:
+        prefix = GLOBAL_PREFIXES[kind]
+        model, pred_te = _fit_predict(kind, X_tr, y_tr, X_va, y_va, X_te, rf_params, xgb_params)
+        if write_outputs:
+            bundle = {
+                "kind": f"{kind}_GLOBAL",
+                "scaler": scaler,
+                "feature_columns": list(st.feature_columns),
+                "egids": list(st.egids),
+                "cluster_id": cluster_id,
+                "static_columns": list(STATIC_COLS),
+                "static_values": static_values,
+            }
+            if kind == "XGB":
+                bundle["booster_files"] = save_boosters_ubj(model, mdir, prefix, f"cluster{cluster_id}")
+            else:
+                bundle["model"] = model
+            joblib.dump(bundle, mdir / f"{prefix}_cluster{cluster_id}.joblib")
+        for k, egid in enumerate(st.egids):
+            sel = idx_te == k
+            if not sel.any():
+                continue
+            inv_df = pd.DataFrame(inv_te[sel], columns=["TempRet.inv", "PuisCpt.inv"])
+            frame = predictions_frame(dates_te[sel], y_te[sel], pred_te[sel], inv_df)
+            if write_outputs:
+                frame.to_parquet(rdir / f"{prefix}_{egid}.parquet", index=False)
+            rows.append(_per_egid_metrics(cluster_id, egid, prefix, frame))
+        del model, pred_te
+        gc.collect()
+    return pd.DataFrame(rows)
+
+
+def train_per_egid_reference(
+    cluster_id: int,
+    egids: list[str],
+    kinds: tuple[str, ...] = ("RF", "XGB"),
+    *,
+    spec: FeatureSpec = DEFAULT_SPEC,
+    rf_params: dict | None = None,
+    xgb_params: dict | None = None,
+) -> pd.DataFrame:
+    """Référence du benchmark : un modèle par EGID (sans artefacts), mêmes hyperparamètres que le global."""
+    rf_params = dict(rf_params or RF_PARAMS)
+    xgb_params = dict(xgb_params or XGB_PARAMS)
+    prefixes = {"RF": "RF", "XGB": "XB"}
+    rows = []
+    for egid in egids:
+        full, _sizes = load_concat_frames(cluster_id, egid, spec)
+        X_raw, y, sp, inv_ok, dates, inv_sub = build_xy_matrices(full, egid, spec)
+        del full
+        tr_m, va_m, te_m = (sp == 0) & inv_ok, (sp == 1) & inv_ok, sp == 2
+        if not tr_m.any() or not va_m.any() or not te_m.any():
+            continue
+        scaler = StandardScaler()
+        X_tr = scaler.fit_transform(X_raw[tr_m])
+        X_va = scaler.transform(X_raw[va_m])
+        X_te = scaler.transform(X_raw[te_m])
+        inv_te = inv_sub.iloc[np.where(te_m)[0]].reset_index(drop=True)
+        for kind in kinds:
+            _model, pred_te = _fit_predict(kind, X_tr, y[tr_m], X_va, y[va_m], X_te, rf_params, xgb_params)
+            frame = predictions_frame(dates[te_m], y[te_m], pred_te, inv_te)
+            rows.append(_per_egid_metrics(cluster_id, egid, prefixes[kind], frame))
+            del _model
+        gc.collect()
+    return pd.DataFrame(rows)
+
+
+def _measure(fn, *args, **kwargs):
+    """Exécute fn en mesurant durée, pic tracemalloc (allocations Python / numpy) et RSS (si psutil)."""
+    gc.collect()
+    rss0 = psutil.Process().memory_info().rss if psutil else None
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        out = fn(*args, **kwargs)
+    finally:
+        wall = time.perf_counter() - t0
+        _cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    rss1 = psutil.Process().memory_info().rss if psutil else None
+    stats = {
+        "wall_s": round(wall, 3),
+        "tracemalloc_peak_mb": round(peak / 2**20, 1),
+        "rss_delta_mb": round((rss1 - rss0) / 2**20, 1) if psutil else None,
+    }
+    return out, stats
+
+
+def _dir_size_mb(files: list[Path]) -> float:
+    return round(sum(p.stat().st_size for p in files if p.exists()) / 2**20, 2)
+
+
+def benchmark_global_vs_per_egid(
+    cluster_id: int,
+    egids: list[str],
+    kinds: tuple[str, ...] = ("RF", "XGB"),
+    *,
+    out_dir: Path | None = None,
+) -> pd.DataFrame:
+    """
+    Compare mode global et mode par EGID sur les mêmes EGID : temps, mémoire, taille des artefacts
+    globaux et précision test par EGID. Écrit ``benchmark_global_cluster{N}.csv`` (détail) et ``.json``.
+    """
+    out_dir = Path(out_dir or PATH_RESULTS / f"Cluster{cluster_id}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    met_g, st_g = _measure(train_global_cluster, cluster_id, egids, kinds)
+    met_p, st_p = _measure(train_per_egid_reference, cluster_id, egids, kinds)
+    detail = pd.concat([met_g, met_p], ignore_index=True)
+    detail.to_csv(out_dir / f"benchmark_global_cluster{cluster_id}.csv", index=False)
+
+    mdir = PATH_MODELS / f"Cluster{cluster_id}"
+    artefacts = [p for pref in (GLOBAL_PREFIXES[k] for k in kinds) for p in mdir.glob(f"{pref}_cluster{cluster_id}*")]
+    summary = {
+        "cluster_id": cluster_id,
+        "n_egids": len(egids),
+        "kinds": list(kinds),
+        "global": {**st_g, "artefacts_mb": _dir_size_mb(artefacts), "n_artefacts": len(artefacts)},
+        "per_egid": st_p,
+        "score_mean_by_model": detail.groupby("model")["score"].mean().round(5).to_dict(),
+    }
+    (out_dir / f"benchmark_global_cluster{cluster_id}.json").write_text(
+        json.dumps(summary, indent=2, default=str), encoding="utf-8"
+    )
+    logger.info("Benchmark cluster %s : %s", cluster_id, json.dumps(summary, default=str))
+    return detail
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cluster", type=int, required=True)
+    ap.add_argument("--kinds", nargs="+", default=["RF", "XGB"], choices=["RF", "XGB"])
+    ap.add_argument("--max-egids", type=int, default=-1, help="-1 = tous les EGID du cluster")
+    ap.add_argument("--benchmark", action="store_true", help="Compare au mode par EGID (temps, mémoire, score)")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    egids = parse_egids(pq.ParquetFile(split_paths(args.cluster)[0]).schema_arrow.names)
+    if 0 < args.max_egids < len(egids):
+        rng = np.random.default_rng(SEED)
+        egids = sorted(str(x) for x in rng.choice(np.array(egids, dtype=object), args.max_egids, replace=False))
+    kinds = tuple(args.kinds)
+    if args.benchmark:
+        detail = benchmark_global_vs_per_egid(args.cluster, egids, kinds)
+    else:
+        detail = train_global_cluster(args.cluster, egids, kinds)
+    print(detail.groupby("model")["score"].describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Prévision en ligne au pas quart-horaire : tampons circulaires par EGID, features mises à jour en O(1).
+
+Pour chaque EGID, un tampon circulaire garde les ``max(LAGS, ROLL_WINDOWS)`` dernières valeurs de
+``TempRet_norm`` / ``PuisCpt_fc`` ; les fenêtres glissantes sont tenues par sommes courantes (somme,
+somme des carrés, nombre de NaN) : chaque nouvelle lecture ajoute une valeur et en retire une, sans
+relire l'historique. Les features produites sont identiques à ``add_lag_features`` (lags, moyennes et
+écarts-types ddof=1 décalés d'un pas ; NaN dès qu'une valeur de la fenêtre manque). Pour les LSTM, un
+second tampon garde les ``SEQ_LEN`` derniers vecteurs de features.
+
+Tous les EGID d'un cluster avancent ensemble (une ligne du parquet large = un pas) ; un EGID sans
+lecture reçoit NaN, comme ``shift`` sur le format large.
+
+Le mode replay rejoue un split ``cluster{N}.parquet`` ligne par ligne et mesure le débit soutenu
+(lectures / s), avec ou sans prédiction ; ``--check`` compare les features aux calculs pandas et les
+exogènes du split à ceux de ``forecast_at`` (exploitation : horodatage + TempExt en °C, sans split).
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe online_forecaster.py --cluster 3 --model XB --max-egids 20
+  .venv\\Scripts\\python.exe online_forecaster.py --cluster 3 --split val --no-predict --check
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from inference_service import LoadedModel, load_model, model_key
+from ml_features import (
+    DEFAULT_SPEC,
+    PATH_MODELS,
+    PATH_RESULTS,
+    FeatureSpec,
+    add_lag_features,
+    denorm_tempret_celsius,
+    exog_frame,
+    norm_tempext,
+    parse_egids,
+    split_paths,
+    target_cols,
+)
+
+logger = logging.getLogger("online_forecaster")
+
+SPLITS = {"train": 0, "val": 1, "test": 2}
+RESYNC_EVERY = 4096  # recalcul exact des sommes courantes (dérive flottante)
+
+
+class RingBufferFeatures:
+    """
+    Tampons circulaires (n_egid, capacité, 2) et statistiques glissantes de tous les EGID d'un cluster.
+
+    Après ``push`` de la lecture au pas t, ``features(exog)`` renvoie les features du pas t + 1.
+    """
+
+    def __init__(self, n_egids: int, spec: FeatureSpec = DEFAULT_SPEC, seq_len: int = 1):
+        self.spec = spec
+        self.n = int(n_egids)
+        self.capacity = spec.history_len
+        self.values = np.full((self.n, self.capacity, 2), np.nan)
+        self.head = 0  # prochain emplacement écrit
+        self.n_pushed = 0
+        self.windows = np.asarray(spec.roll_windows, dtype=np.int64)
+        self.sums = np.zeros((len(self.windows), self.n, 2))
+        self.sumsq = np.zeros((len(self.windows), self.n, 2))
+        self.n_nan = np.broadcast_to(self.windows[:, None, None], (len(self.windows), self.n, 2)).astype(np.int64)
+        self.seq_len = int(seq_len)
+        self.n_features = len(spec.feature_columns())
+        self.feat_ring = np.full((self.n, self.seq_len, self.n_features), np.nan) if seq_len > 1 else None
+        self.feat_head = 0
+
+    def _slot(self, steps_back: int) -> int:
+        """Emplacement de la valeur poussée il y a ``steps_back`` pas (0 = dernière)."""
+        return (self.head - 1 - steps_back) % self.capacity
+
+    def push(self, tempret: np.ndarray, puiscpt: np.ndarray) -> None:
+        """Ajoute une lecture par EGID (NaN = absente) : O(1) par EGID et par fenêtre."""
+        v = np.column_stack([tempret, puiscpt]).astype(np.float64)
+        isnan = np.isnan(v)
+        v0 = np.where(isnan, 0.0, v)
+        for k, w in enumerate(self.windows):
+            old = self.values[:, (self.head - w) % self.capacity, :]
+            old_nan = np.isnan(old)
+            old0 = np.where(old_nan, 0.0, old)
+            self.sums[k] += v0 - old0
+            self.sumsq[k] += v0 * v0 - old0 * old0
+            self.n_nan[k] += isnan.astype(np.int64) - old_nan
+        self.values[:, self.head, :] = v
+        self.head = (self.head + 1) % self.capacity
+        self.n_pushed += 1
+        if self.n_pushed % RESYNC_EVERY == 0:
+            self.resync()
+
+    def resync(self) -> None:
+        """Recalcule exactement les sommes depuis le tampon (O(capacité))."""
+        for k, w in enumerate(self.windows):
+            idx = [(self.head - 1 - j) % self.capacity for j in range(w)]
+            win = self.values[:, idx, :]
+            self.n_nan[k] = np.isnan(win).sum(axis=1)
+            win0 = np.nan_to_num(win, nan=0.0)
+            self.sums[k] = win0.sum(axis=1)
+            self.sumsq[k] = (win0 * win0).sum(axis=1)
+
+    def features(self, exog: np.ndarray) -> np.ndarray:
+        """Features (n_egid, n_features) du pas suivant ; ``exog`` = valeurs ``spec.exog_cols`` de ce pas."""
+        cols = [np.broadcast_to(np.asarray(exog, dtype=np.float64), (self.n, len(self.spec.exog_cols)))]
+        for lag in self.spec.lags:
+            cols.append(self.values[:, self._slot(lag - 1), :])
+        for k, w in enumerate(self.windows):
+            ok = self.n_nan[k] == 0
+            mean = np.where(ok, self.sums[k] / w, np.nan)
+            if w > 1:
+                var = (self.sumsq[k] - self.sums[k] * self.sums[k] / w) / (w - 1)
+                std = np.where(ok, np.sqrt(np.maximum(var, 0.0)), np.nan)
+            else:
+                std = np.full_like(mean, np.nan)
+            cols.append(np.column_stack([mean[:, 0], std[:, 0], mean[:, 1], std[:, 1]]))
+        X = np.concatenate(cols, axis=1)
+        if self.feat_ring is not None:
+            self.feat_ring[:, self.feat_head, :] = X
+            self.feat_head = (self.feat_head + 1) % self.seq_len
+        return X
+
+    def sequences(self) -> np.ndarray:
+        """Fenêtres LSTM (n_egid, seq_len, n_features) se terminant au dernier appel de ``features``."""
+        if self.feat_ring is None:
+            raise ValueError("seq_len = 1 : pas de fenêtre LSTM")
+        order = (self.feat_head + np.arange(self.seq_len)) % self.seq_len
+        return self.feat_ring[:, order, :]
+
+
+def scale_rows(m: LoadedModel, X: np.ndarray) -> np.ndarray:
+    """StandardScaler appliqué sans surcoût sklearn (1 ligne par EGID et par pas)."""
+    mean = getattr(m.scaler, "mean_", None)
+    scale = getattr(m.scaler, "scale_", None)
+    if mean is None or scale is None:
+        shape = X.shape
+        return m.scaler.transform(X.reshape(-1, shape[-1])).reshape(shape)
+    return (X - mean) / scale
+
+
+class OnlineForecaster:
+    """Prévision du pas suivant pour les EGID d'un cluster à partir des bundles entraînés."""
+
+    def __init__(
+        self,
+        cluster_id: int,
+        egids: list[str],
+        prefix: str = "XB",
+        model_root: Path = PATH_MODELS,
+        spec: FeatureSpec | None = None,
+    ):
+        self.cluster_id = int(cluster_id)
+        self.egids = [str(e) for e in egids]
+        self.prefix = str(prefix).upper()
+        self.models: dict[str, LoadedModel] = {}
+        self.global_model: LoadedModel | None = None
+        if spec is None:
+            keys = {model_key(cluster_id, self.prefix, e) for e in self.egids}
+            for key in sorted(keys, key=str):
+                m = load_model(key, model_root)
+                if m.is_global:
+                    self.global_model = m
+                else:
+                    self.models[m.egid] = m
+            specs = {m.spec for m in self._all_models()}
+            if len(specs) != 1:
+                raise ValueError(f"Features différentes entre modèles {self.prefix} : {specs}")
+            spec = specs.pop()
+            seq_len = max(m.seq_len for m in self._all_models())
+        else:
+            seq_len = 1
+        self.spec = spec
+        self.buffers = RingBufferFeatures(len(self.egids), spec, seq_len)
+        if self.global_model is not None:
+            sv = self.global_model.static_values
+            n_static = len(self.global_model.feature_columns) - len(spec.feature_columns())
+            self._static = np.array([sv.get(e, [np.nan] * n_static) for e in self.egids], dtype=np.float64)
+
+    def _all_models(self) -> list[LoadedModel]:
+        return list(self.models.values()) + ([self.global_model] if self.global_model is not None else [])
+
+    def ingest(self, tempret: np.ndarray, puiscpt: np.ndarray) -> None:
+        self.buffers.push(tempret, puiscpt)
+
+    def forecast(self, exog_next: np.ndarray, predict: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """Prédictions (n_egid, 2) [TempRet_norm, PuisCpt_fc] du pas suivant (NaN si features incomplètes)."""
+        X = self.buffers.features(exog_next)
+        pred = np.full((len(self.egids), 2), np.nan)
+        if not predict:
+            return pred, X
+        if self.global_model is not None:
+            Xg = np.hstack([X, self._static])
+            ok = np.isfinite(Xg).all(axis=1)
+            if ok.any():
+                pred[ok] = self.global_model.predict_scaled(scale_rows(self.global_model, Xg[ok]))
+            return pred, X
+        seqs = self.buffers.sequences() if self.buffers.feat_ring is not None else None
+        for i, egid in enumerate(self.egids):
+            m = self.models.get(egid)
+            if m is None:
+                continue
+            if m.seq_len > 1:
+                xi = seqs[i : i + 1, -m.seq_len :, :]
+                if np.isfinite(xi).all():
+                    pred[i] = m.predict_scaled(scale_rows(m, xi).astype(np.float32))[0]
+            elif np.isfinite(X[i]).all():
+                pred[i] = m.predict_scaled(scale_rows(m, X[i : i + 1]))[0]
+        return pred, X
+
+    def forecast_at(self, date, tempext_celsius: float, predict: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """
+        ``forecast`` en exploitation, sans ligne de split : exogènes du pas suivant recalculés depuis son
+        horodatage (UTC ou heure locale) et la température extérieure en °C (mesure ou prévision météo).
+        """
+        exog = exog_frame([date], norm_tempext(tempext_celsius))
+        return self.forecast(exog[list(self.spec.exog_cols)].to_numpy(dtype=np.float64)[0], predict=predict)
+
+
+def replay(
+    cluster_id: int,
+    egids: list[str],
+    prefix: str = "XB",
+    split: str = "test",
+    *,
+    max_steps: int | None = None,
+    predict: bool = True,
+    check: bool = False,
+    model_root: Path = PATH_MODELS,
+) -> tuple[dict, pd.DataFrame]:
+    """
+    Rejoue un split ligne par ligne : lecture au pas t → prévision du pas t + 1.
+
+    Retourne (résumé débit / latence, prédictions longues Dates / egid / TempRetPred (°C) / PuisCptPred).
+    """
+    path = split_paths(cluster_id)[SPLITS[split]]
+    spec = None if predict else DEFAULT_SPEC
+    fc = OnlineForecaster(cluster_id, egids, prefix, model_root, spec=spec)
+    cols = ["Dates", *fc.spec.exog_cols] + [c for e in fc.egids for c in target_cols(e)]
+    df = pd.read_parquet(path, columns=cols)
+    if max_steps:
+        df = df.iloc[: max_steps + 1]
+    exog = df[list(fc.spec.exog_cols)].to_numpy(dtype=np.float64)
+    tr = df[[target_cols(e)[0] for e in fc.egids]].to_numpy(dtype=np.float64)
+    pc = df[[target_cols(e)[1] for e in fc.egids]].to_numpy(dtype=np.float64)
+    dates = df["Dates"].to_numpy()
+    n_steps = len(df) - 1
+
+    preds = np.full((n_steps, len(fc.egids), 2), np.nan)
+    feats = np.empty((n_steps, len(fc.egids), len(fc.spec.feature_columns()))) if check else None
+    t_push = t_pred = 0.0
+    lat = np.empty(n_steps)
+    for t in range(n_steps):
+        t0 = time.perf_counter()
+        fc.ingest(tr[t], pc[t])
+        t1 = time.perf_counter()
+        preds[t], X = fc.forecast(exog[t + 1], predict=predict)
+        t2 = time.perf_counter()
+        t_push += t1 - t0
+        t_pred += t2 - t1
+        lat[t] = t2 - t0
+        if check:
+            feats[t] = X
+
+    n_readings = n_steps * len(fc.egids)
+    wall = t_push + t_pred
+    summary = {
+        "cluster_id": cluster_id,
+        "model": prefix if predict else None,
+        "split": split,
+        "n_egids": len(fc.egids),
+        "n_steps": n_steps,
+        "n_readings": n_readings,
+        "readings_per_s": round(n_readings / wall, 1) if wall > 0 else None,
+        "update_readings_per_s": round(n_readings / t_push, 1) if t_push > 0 else None,
+        "update_s": round(t_push, 3),
+        "features_predict_s": round(t_pred, 3),
+        "step_latency_ms": {
+            "p50": round(float(np.percentile(lat, 50)) * 1000, 3),
+            "p99": round(float(np.percentile(lat, 99)) * 1000, 3),
+        },
+        "n_predictions": int(np.isfinite(preds[:, :, 0]).sum()),
+    }
+    if check:
+        summary["max_abs_diff_vs_pandas"] = _check_features(df, fc, feats)
+        summary["max_abs_diff_exog"] = _check_exog(df, fc.spec)
+
+    long = pd.DataFrame(
+        {
+            "Dates": np.repeat(dates[1:], len(fc.egids)),
+            "egid": np.tile(np.array(fc.egids, dtype=object), n_steps),
+            "TempRetPred": denorm_tempret_celsius(np.nan_to_num(preds[:, :, 0].ravel(), nan=0.0)),
+            "PuisCptPred": np.clip(preds[:, :, 1].ravel(), 0.0, 1.0),
+        }
+    )
+    long.loc[~np.isfinite(preds[:, :, 0].ravel()), "TempRetPred"] = np.nan
+    return summary, long.dropna(subset=["TempRetPred", "PuisCptPred"]).reset_index(drop=True)
+
+
+def _check_features(df: pd.DataFrame, fc: OnlineForecaster, feats: np.ndarray) -> float:
+    """Écart max entre features en ligne et ``add_lag_features`` (mêmes lignes, NaN aux mêmes places)."""
+    worst = 0.0
+    names = fc.spec.feature_columns()
+    for i, egid in enumerate(fc.egids):
+        ref = add_lag_features(df, egid, fc.spec)[names].to_numpy(dtype=np.float64)[1:]
+        got = feats[:, i, :]
+        if not np.array_equal(np.isnan(ref), np.isnan(got)):
+            return float("inf")
+        both = np.isfinite(ref)
+        if both.any():
+            worst = max(worst, float(np.max(np.abs(ref[both] - got[both]))))
+    return worst
+
+
+def _check_exog(df: pd.DataFrame, spec: FeatureSpec) -> float:
+    """Écart max entre les exogènes du split et ``exog_frame`` (chemin ``forecast_at``), lignes renseignées."""
+    ref = df[list(spec.exog_cols)].to_numpy(dtype=np.float64)
+    got = exog_frame(df["Dates"], df["TempExt_norm"])[list(spec.exog_cols)].to_numpy(dtype=np.float64)
+    ok = np.isfinite(ref)
+    return float(np.max(np.abs(ref[ok] - got[ok]))) if ok.any() else 0.0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cluster", type=int, default=3)
+    ap.add_argument("--model", default="XB", choices=["RF", "XB", "LSTM", "RFG", "XBG"])
+    ap.add_argument("--split", default="test", choices=list(SPLITS))
+    ap.add_argument("--max-egids", type=int, default=-1, help="-1 = tous les EGID")
+    ap.add_argument("--max-steps", type=int, default=None)
+    ap.add_argument("--no-predict", action="store_true", help="Mesure seule des tampons / features")
+    ap.add_argument("--check", action="store_true", help="Compare les features à add_lag_features")
+    ap.add_argument("--out", type=Path, default=None, help="Parquet des prédictions (optionnel)")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    egids = parse_egids(pq.ParquetFile(split_paths(args.cluster)[0]).schema_arrow.names)
+    if not args.no_predict and args.model not in ("RFG", "XBG"):
+        mdir = PATH_MODELS / f"Cluster{args.cluster}"
+        suffix = "_meta.joblib" if args.model == "LSTM" else ".joblib"
+        egids = [e for e in egids if (mdir / f"{args.model}_{e}{suffix}").exists()]
+    if args.max_egids > 0:
+        egids = egids[: args.max_egids]
+    if not egids:
+        raise SystemExit("Aucun EGID avec modèle entraîné")
+
+    summary, preds = replay(
+        args.cluster,
+        egids,
+        args.model,
+        args.split,
+        max_steps=args.max_steps,
+        predict=not args.no_predict,
+        check=args.check,
+    )
+    out_json = PATH_RESULTS / f"Cluster{args.cluster}" / f"online_replay_{args.model}_{args.split}.json"
+    out_json.parent.mkdir(parents=True, exist_ok=True)
+    out_json.write_text(json.dumps(summary, indent=2, default=str), encoding="utf-8")
+    if args.out is not None:
+        preds.to_parquet(args.out, index=False)
+    print(json.dumps(summary, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
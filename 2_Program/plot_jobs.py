@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Rendu des graphiques PNG (diagnostics d'entraînement RF / XGB / LSTM, comparaisons par EGID) hors de la boucle
+d'entraînement : backend Agg sans affichage, pool de processus, rendu incrémental.
+
+Chaque figure est un job ``(kind, png, payload)`` : ``payload`` ne contient que les données nécessaires au tracé
+(métriques, top features, séries déjà tronquées), jamais de modèle ni de Parquet à relire. La clé du job est
+l'empreinte SHA-1 de ``kind`` + ``RENDER_VERSION`` + payload ; elle est écrite dans les métadonnées du PNG
+(chunk texte ``plot_job_key``) et un PNG dont la clé est identique n'est pas redessiné.
+
+``PlotPool.submit`` rend la main immédiatement (l'entraînement ne fait qu'empiler) ; ``PlotPool.wait`` attend
+les jobs en cours et retourne les compteurs. ``max_workers=0`` → rendu synchrone dans le processus appelant.
+
+Les fonctions ``render_*`` sont au niveau module pour être picklables (workers ``spawn``, défaut Windows).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import multiprocessing as mp
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("plot_jobs")
+
+# Incrémenter quand le code d'une fonction render_* change (invalide les PNG existants)
+RENDER_VERSION = 1
+PNG_KEY = "plot_job_key"
+PNG_DPI = 150
+
+
+# ---------------------------------------------------------------------------
+# Clé de job
+# ---------------------------------------------------------------------------
+def _feed(h, obj) -> None:
+    """Empreinte déterministe d'un payload (dict / list / ndarray / scalaires)."""
+    if isinstance(obj, np.ndarray):
+        a = np.ascontiguousarray(obj)
+        h.update(f"nd{a.dtype.str}{a.shape}".encode())
+        h.update(a.tobytes() if a.dtype != object else json.dumps(a.tolist(), default=str).encode())
+    elif isinstance(obj, dict):
+        h.update(b"{")
+        for k in sorted(obj, key=str):
+            h.update(str(k).encode() + b":")
+            _feed(h, obj[k])
+        h.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"[")
+        for v in obj:
+            _feed(h, v)
+        h.update(b"]")
+    else:
+        h.update(json.dumps(obj, default=str).encode())
+
+
+def job_key(kind: str, payload: dict) -> str:
+    h = hashlib.sha1(f"{kind}|v{RENDER_VERSION}|".encode())
+    _feed(h, payload)
+    return h.hexdigest()
+
+
+def png_job_key(path: Path) -> str | None:
+    """Clé stockée dans le PNG (None si absent / illisible)."""
+    if not Path(path).is_file():
+        return None
+    try:
+        from PIL import Image
+
+        with Image.open(path) as im:
+            return im.text.get(PNG_KEY)
+    except Exception:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Rendu (exécuté dans les workers)
+# ---------------------------------------------------------------------------
+def _pyplot():
+    import matplotlib
+
+    matplotlib.use("Agg", force=True)
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def _bars_train_val(ax, target_names, mae_tr, mae_va, rmse_tr, rmse_va) -> None:
+    x = np.arange(len(target_names))
+    w = 0.18
+    ax.bar(x - 1.5 * w, mae_tr, w, label="MAE train")
+    ax.bar(x - 0.5 * w, mae_va, w, label="MAE val")
+    ax.bar(x + 0.5 * w, rmse_tr, w, label="RMSE train")
+    ax.bar(x + 1.5 * w, rmse_va, w, label="RMSE val")
+    ax.set_xticks(x)
+    ax.set_xticklabels(target_names)
+    ax.legend(fontsize=7)
+    ax.grid(axis="y", alpha=0.3)
+
+
+def render_rf_diagnostics(p: dict):
+    plt = _pyplot()
+    fig = plt.figure(figsize=(11, 8))
+    gs = fig.add_gridspec(2, 2, height_ratios=[1.1, 1.0])
+    ax0 = fig.add_subplot(gs[0, 0])
+    _bars_train_val(ax0, p["target_names"], p["train_mae"], p["val_mae"], p["train_rmse"], p["val_rmse"])
+    ax0.set_ylabel("Erreur (cibles norm. [0,1])")
+    ax0.set_title("Train vs validation")
+
+    ax1 = fig.add_subplot(gs[0, 1])
+    ax1.barh(p["top_names"][::-1], p["top_vals"][::-1], color="steelblue")
+    ax1.set_title("Top 5 features (importance moyenne sur les 2 cibles)")
+    ax1.grid(axis="x", alpha=0.3)
+
+    ax2 = fig.add_subplot(gs[1, :])
+    ax2.axis("off")
+    lines = [
+        f"Cluster {p['cluster_id']} — EGID {p['egid']}",
+        "",
+        "Hyperparamètres retenus (grille RF_PARAM_GRID):",
+        json.dumps(p["best_params"], indent=2, default=str),
+        "",
+        "Scores validation (RMSE moyen des 2 cibles) par jeu de paramètres:",
+    ]
+    for pr, sc in p["grid_results"]:
+        lines.append(f"  {sc:.6f}  <-  {pr}")
+    ax2.text(0, 1, "\n".join(lines), transform=ax2.transAxes, va="top", fontsize=8, family="monospace")
+
+    fig.suptitle(f"{p['prefix']} — diagnostic entraînement / validation")
+    fig.tight_layout()
+    return fig
+
+
+def render_xgb_diagnostics(p: dict):
+    plt = _pyplot()
+    fig = plt.figure(figsize=(11, 7))
+    gs = fig.add_gridspec(2, 2, height_ratios=[1.1, 1.0])
+    ax0 = fig.add_subplot(gs[0, 0])
+    _bars_train_val(ax0, p["target_names"], p["train_mae"], p["val_mae"], p["train_rmse"], p["val_rmse"])
+    ax0.set_ylabel("Erreur (cibles norm. [0,1])")
+    ax0.set_title("Train vs validation (early stopping sur val)")
+
+    ax1 = fig.add_subplot(gs[0, 1])
+    ax1.barh(p["top_names"][::-1], p["top_vals"][::-1], color="darkorange")
+    ax1.set_title("Top 5 features (gain moyen XGB, 2 cibles)")
+    ax1.grid(axis="x", alpha=0.3)
+
+    ax2 = fig.add_subplot(gs[1, :])
+    ax2.axis("off")
+    meta_lines = [f"Cluster {p['cluster_id']} — EGID {p['egid']}", "", "Early stopping / arbres:"]
+    for name, m in p["trees"].items():
+        meta_lines.append(f"  {name}: best_iteration={m['best_iteration']}, n_estimators={m['n_estimators']}")
+    if p.get("timings"):
+        meta_lines += ["", "Durées (s) : " + json.dumps(p["timings"], default=str)]
+    ax2.text(0, 1, "\n".join(meta_lines), transform=ax2.transAxes, va="top", fontsize=9, family="monospace")
+
+    fig.suptitle(f"{p['prefix']} — diagnostic entraînement / validation")
+    fig.tight_layout()
+    return fig
+
+
+def render_lstm_diagnostics(p: dict):
+    plt = _pyplot()
+    h = p["history"]
+    fig = plt.figure(figsize=(11, 8))
+    gs = fig.add_gridspec(2, 2, height_ratios=[1.0, 1.0])
+    ax_l = fig.add_subplot(gs[0, 0])
+    ax_l.plot(h["loss"], label="train")
+    ax_l.plot(h["val_loss"], label="val")
+    ax_l.set_title("Loss (MSE)")
+    ax_l.set_xlabel("Epoch")
+    ax_l.legend(fontsize=8)
+    ax_l.grid(alpha=0.3)
+
+    ax_m = fig.add_subplot(gs[0, 1])
+    if "mae" in h:
+        ax_m.plot(h["mae"], label="train MAE")
+    if "val_mae" in h:
+        ax_m.plot(h["val_mae"], label="val MAE")
+    ax_m.set_title("MAE")
+    ax_m.set_xlabel("Epoch")
+    ax_m.legend(fontsize=8)
+    ax_m.grid(alpha=0.3)
+
+    ax_b = fig.add_subplot(gs[1, :])
+    _bars_train_val(ax_b, p["target_names"], p["train_mae"], p["val_mae"], p["train_rmse"], p["val_rmse"])
+    ax_b.set_ylabel("Erreur fin d’entraînement (cibles norm. [0,1])")
+    ax_b.set_title("Dernière epoch (poids restaurés si early stopping)")
+
+    fig.suptitle(
+        f"{p['prefix']} — cluster {p['cluster_id']} EGID {p['egid']} — courbes + écart train/val (sur-apprentissage ?)"
+    )
+    fig.tight_layout()
+    return fig
+
+
+COMPARISON_STYLES = (("RF", "-"), ("XB", "--"), ("LSTM", ":"))
+
+
+def render_egid_comparison(p: dict):
+    """``p["series"]`` : {prefix: {"Dates": ndarray datetime64, "TempRet", "TempRetPred", "PuisCpt", "PuisCptPred"}}."""
+    plt = _pyplot()
+    fig, axes = plt.subplots(2, 1, figsize=(12, 6), sharex=True)
+    for pref, style in COMPARISON_STYLES:
+        d = p["series"].get(pref)
+        if d is None:
+            continue
+        ax0, ax1 = axes[0], axes[1]
+        ax0.plot(d["Dates"], d["TempRet"], color="k", alpha=0.35, linewidth=1, label="_nolegend_" if pref != "RF" else "cible")
+        ax0.plot(d["Dates"], d["TempRetPred"], linestyle=style, linewidth=1.2, label=f"{pref} pred")
+        ax1.plot(d["Dates"], d["PuisCpt"], color="k", alpha=0.35, linewidth=1, label="_nolegend_" if pref != "RF" else "cible")
+        ax1.plot(d["Dates"], d["PuisCptPred"], linestyle=style, linewidth=1.2, label=f"{pref} pred")
+    axes[0].set_ylabel("TempRet (°C)")
+    axes[1].set_ylabel("PuisCpt (fc)")
+    axes[0].set_title(f"Cluster {p['cluster_id']} — EGID {p['egid']}")
+    axes[0].legend(loc="upper right", fontsize=8)
+    axes[1].legend(loc="upper right", fontsize=8)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    return fig
+
+
+RENDERERS = {
+    "rf_diagnostics": render_rf_diagnostics,
+    "xgb_diagnostics": render_xgb_diagnostics,
+    "lstm_diagnostics": render_lstm_diagnostics,
+    "egid_comparison": render_egid_comparison,
+}
+
+
+def render_job(kind: str, out_path: str, payload: dict, key: str) -> str:
+    """Rend un job et écrit le PNG de manière atomique (clé dans les métadonnées). Retourne le chemin."""
+    plt = _pyplot()
+    fig = RENDERERS[kind](payload)
+    out = Path(out_path)
+    tmp = out.with_name(f".{out.stem}.{os.getpid()}.tmp.png")
+    try:
+        fig.savefig(tmp, dpi=PNG_DPI, bbox_inches="tight", metadata={PNG_KEY: key})
+    finally:
+        plt.close(fig)
+    tmp.replace(out)
+    return str(out)
+
+
+# ---------------------------------------------------------------------------
+# Pool
+# ---------------------------------------------------------------------------
+class PlotPool:
+    """File de jobs de rendu : ``submit`` non bloquant, ``wait`` en fin de section."""
+
+    def __init__(self, max_workers: int | None = 2):
+        self.max_workers = max_workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._futures: dict[Future, str] = {}
+        self._queued: dict[str, str] = {}
+        self.stats = {"submitted": 0, "skipped": 0, "rendered": 0, "failed": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=mp.get_context("spawn")
+            )
+        return self._executor
+
+    def submit(self, kind: str, out_path: Path, payload: dict) -> bool:
+        """Empile le rendu de ``out_path`` ; False si le PNG existant est déjà à jour (même clé)."""
+        if kind not in RENDERERS:
+            raise ValueError(f"Type de graphique inconnu : {kind}")
+        out_path = Path(out_path)
+        key = job_key(kind, payload)
+        if self._queued.get(str(out_path)) == key or png_job_key(out_path) == key:
+            self.stats["skipped"] += 1
+            return False
+        self.stats["submitted"] += 1
+        self._queued[str(out_path)] = key
+        if not self.max_workers:
+            self._run_inline(kind, out_path, payload, key)
+            return True
+        fut = self._pool().submit(render_job, kind, str(out_path), payload, key)
+        self._futures[fut] = str(out_path)
+        self._reap(block=False)
+        return True
+
+    def _run_inline(self, kind: str, out_path: Path, payload: dict, key: str) -> None:
+        try:
+            render_job(kind, str(out_path), payload, key)
+            self.stats["rendered"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning("Graphique %s en échec : %s", out_path, e)
+
+    def _reap(self, block: bool) -> None:
+        for fut in [f for f in self._futures if block or f.done()]:
+            out = self._futures.pop(fut)
+            try:
+                fut.result()
+                self.stats["rendered"] += 1
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._executor = None
+                self.stats["failed"] += 1
+                self._queued.pop(out, None)
+                logger.warning("Graphique %s en échec : %s", out, e)
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for f in self._futures if not f.done())
+
+    def wait(self) -> dict:
+        """Attend tous les jobs soumis ; retourne une copie des compteurs."""
+        self._reap(block=True)
+        logger.info(
+            "Graphiques : %(rendered)s rendus, %(skipped)s à jour, %(failed)s en échec", self.stats
+        )
+        return dict(self.stats)
+
+    def shutdown(self) -> None:
+        self._reap(block=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,592 @@
+# -*- coding: utf-8 -*-
+"""
+Planification des ressources de dataset_preparation_V2 avant exécution : pic mémoire et durée estimés par
+section, choix du mode d'exécution quand le pic dépasse le budget mémoire.
+
+Lecture sans charger les données :
+
+- manifeste de l'export brut (``PATH_RAW``) : en-tête de chaque CSV (EGID, DATA_TYPE), lignes estimées par
+  taille du fichier / longueur moyenne des premières lignes, première et dernière date (début et fin du
+  fichier) ; fragments ``part-*.parquet`` : pieds Parquet (lignes, min / max par row group) ; rapport ExpArchiV8
+  ``<export>_report.csv`` (lignes exactes par série) s'il existe ; fragments incrémentaux (tailles des membres) ;
+- pieds Parquet des étapes déjà écrites (``1_Structured/<étape>/``) : lignes par partition cluster / DATA_TYPE,
+  plage de dates (statistiques) ;
+- ``DATA_GIS_Filtered.parquet`` : EGID → cluster (deux colonnes).
+
+Coûts par ligne d'entrée (octets de pic au-dessus du RSS de début de section, secondes) : ``DEFAULT_COSTS``
+mesurés sur données synthétiques (synthetic_sst.py), remplacés par la médiane des dernières exécutions profilées
+(stage_profiler.py, ``calibrate``).
+
+Mode par section : ``memory`` (tout en mémoire) ou ``chunked`` — lots d'EGID consécutifs (fichiers d'étape
+triés par EGID : row groups contigus) de lignes équilibrées, tels que le pic d'un lot tienne dans
+``budget × CHUNK_FILL``. Sections découpables : ``filter`` (section 4, lots écrits par
+``sst_dataset.StageWriter``) et ``split`` (section 7, par cluster, lots réunis par
+``split_wide.merge_split_parts``) ; une section qui dépasse quand même le budget est signalée (``over``).
+
+Budget mémoire par défaut : mémoire disponible via psutil (optionnel, requirements-optional.txt), sinon
+``/proc/meminfo`` ou ``sysconf``, sinon ``DEFAULT_BUDGET_GB``.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe resource_planner.py
+  .venv\\Scripts\\python.exe resource_planner.py --budget-gb 8
+  .venv\\Scripts\\python.exe resource_planner.py --raw 0_Data/0_Raw/Synthetic/export_SSTCAD_20240101 --costs
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import logging
+import math
+import os
+import zipfile
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from sst_dataset import stage_files, stage_path
+from stage_profiler import PATH_PROFILES, load_reports
+
+try:
+    import psutil
+except ImportError:  # mémoire disponible via /proc/meminfo ou sysconf
+    psutil = None
+
+logger = logging.getLogger("resource_planner")
+
+ROOT = Path(__file__).resolve().parent
+PATH_RAW = ROOT / "0_Data" / "0_Raw" / "ExportSST" / "export_SSTCAD_20260227"
+PATH_RAW_INCREMENTS = ROOT / "0_Data" / "0_Raw" / "ExportSST" / "increments"
+PATH_STRUCTURED = ROOT / "0_Data" / "1_Structured"
+PATH_GIS = PATH_STRUCTURED / "DATA_GIS_Filtered.parquet"
+
+CHUNKABLE = ("filter", "split")
+STEP_MIN = 15
+_MB = 1024 * 1024
+
+# Part de la mémoire disponible retenue comme budget ; remplissage visé par lot en mode chunked
+BUDGET_FRACTION = 0.7
+DEFAULT_BUDGET_GB = 8.0  # mémoire disponible inconnue (ni psutil, ni /proc, ni sysconf)
+CHUNK_FILL = 0.8
+# Table météo de la section 4 (date_15min + TempExt de toutes les lignes enrichies, avant dédoublonnage)
+EXT_BYTES_PER_ROW = 16.0
+# Format large (section 7) : cellules float64 par ligne longue (valeur, inv, _fc / _norm) conservées entre lots
+WIDE_BYTES_PER_ROW = 40.0
+# Étalonnage : exécutions retenues par section, lignes minimales (petites exécutions dominées par les frais fixes)
+CALIBRATION_RUNS = 5
+CALIBRATION_MIN_ROWS = 100_000
+
+HEAD_BYTES = 64 * 1024
+TAIL_BYTES = 4 * 1024
+_DATE_FMT = "%d/%m/%Y %H:%M"
+
+
+@dataclass
+class StageCost:
+    """Coût d'une section par ligne d'entrée."""
+
+    bytes_per_row: float
+    seconds_per_row: float
+    source: str = "defaut"
+
+
+# Mesures sur exports synthétiques (4 EGID × 1,3 an, pandas 3, pyarrow 23), octets arrondis au-dessus : le RSS
+# de début de section inclut de la mémoire libérée réutilisée ; ``calibrate`` les remplace par les mesures réelles
+DEFAULT_COSTS = {
+    "ingest": StageCost(480.0, 4.2e-5),
+    "enrich": StageCost(260.0, 1.6e-6),
+    "filter": StageCost(1000.0, 2.1e-4),
+    "clean": StageCost(180.0, 1.1e-6),
+    "transform": StageCost(240.0, 1.6e-6),
+    "split": StageCost(520.0, 9.3e-6),
+}
+
+# Étapes profilées (stage_profiler.py) servant à l'étalonnage : sections 4 et 7 mesurées par lot (un seul lot
+# en mode memory), le pic d'une section par lots étant celui de son plus gros lot
+PROFILED_STAGES = {
+    "ingest": "ingest",
+    "enrich": "enrich",
+    "filter": "filter.batch",
+    "clean": "clean",
+    "transform": "transform",
+    "split": "split.batch",
+}
+
+
+@dataclass
+class StagePlan:
+    stage: str
+    cluster: int | None
+    rows_in: int
+    rows_out: int
+    peak_mb: float
+    seconds: float
+    source: str
+    mode: str = "memory"
+    batches: list[list[str]] = field(default_factory=list)
+    batch_peak_mb: float | None = None
+    over: bool = False
+
+
+@dataclass
+class PipelinePlan:
+    budget_mb: float
+    stages: list[StagePlan]
+    costs: dict[str, StageCost]
+    n_series: int
+    n_egids: int
+    date_min: pd.Timestamp | None
+    date_max: pd.Timestamp | None
+
+    def get(self, stage: str, cluster: int | None = None) -> StagePlan | None:
+        return next((p for p in self.stages if p.stage == stage and p.cluster == cluster), None)
+
+    def batches(self, stage: str, cluster: int | None = None) -> list[list[str] | None]:
+        """Lots d'EGID d'une section ; ``[None]`` (tout en une fois) en mode ``memory`` ou section inconnue."""
+        p = self.get(stage, cluster)
+        return list(p.batches) if p is not None and p.mode == "chunked" else [None]
+
+    def report(self) -> pd.DataFrame:
+        rows = []
+        for p in self.stages:
+            d = asdict(p)
+            d["n_batches"] = len(d.pop("batches")) or 1
+            rows.append(d)
+        return pd.DataFrame(rows)
+
+    def describe(self) -> str:
+        head = (
+            f"Budget mémoire : {self.budget_mb / 1024:.1f} Go — {self.n_series:,} séries, {self.n_egids:,} EGID"
+            + (f", {self.date_min:%Y-%m-%d} → {self.date_max:%Y-%m-%d}" if self.date_min is not None else "")
+        )
+        lines = [head]
+        for p in self.stages:
+            name = p.stage if p.cluster is None else f"{p.stage} (cluster {p.cluster})"
+            mode = p.mode if p.mode == "memory" else f"{p.mode} × {len(p.batches)} (lot ≈ {p.batch_peak_mb:,.0f} Mo)"
+            flag = "  ⚠ dépasse le budget" if p.over else ""
+            lines.append(
+                f"  {name:<22} {p.rows_in:>14,} → {p.rows_out:>14,} lignes  pic ≈ {p.peak_mb:>9,.0f} Mo  "
+                f"durée ≈ {p.seconds / 60:>6.1f} min  [{mode}] ({p.source}){flag}"
+            )
+        return "\n".join(lines)
+
+
+# --- mémoire disponible ----------------------------------------------------------------------------------------
+
+
+def available_memory_mb() -> float | None:
+    if psutil is not None:
+        return psutil.virtual_memory().available / _MB
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") / _MB
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def memory_budget_mb(budget_gb: float | None = None, fraction: float = BUDGET_FRACTION) -> float:
+    """Budget configuré, sinon ``fraction`` de la mémoire disponible, sinon ``DEFAULT_BUDGET_GB``."""
+    if budget_gb is not None:
+        return float(budget_gb) * 1024
+    avail = available_memory_mb()
+    if avail is None:
+        logger.warning("Mémoire disponible inconnue : budget par défaut %.0f Go", DEFAULT_BUDGET_GB)
+        return DEFAULT_BUDGET_GB * 1024
+    return avail * fraction
+
+
+# --- manifeste de l'export brut --------------------------------------------------------------------------------
+
+MANIFEST_COLUMNS = ["EGID", "DATA_TYPE", "rows", "date_min", "date_max", "bytes", "source"]
+
+
+def _parse_date(text: str) -> pd.Timestamp | None:
+    ts = pd.to_datetime(text.strip(), format=_DATE_FMT, errors="coerce")
+    return None if pd.isna(ts) else ts
+
+
+def _series_key(name: str) -> tuple[str, str] | None:
+    parts = name.strip().split("_", 1)
+    return (parts[0], parts[1]) if len(parts) == 2 and parts[0] else None
+
+
+def _csv_entry(head: bytes, tail: bytes | None, size: int, name: str) -> dict | None:
+    """Une série d'après le début (et la fin) d'un CSV d'export ``date;<EGID>_<TYPE>;inv``."""
+    text = head.decode("utf-8", errors="replace")
+    lines = text.split("\n")
+    complete = len(head) >= size
+    body = [l for l in (lines[1:] if complete else lines[1:-1]) if l.strip()]
+    cols = lines[0].strip().split(";")
+    key = _series_key(cols[1]) if len(cols) >= 3 else None
+    if key is None:
+        return None
+    if complete:
+        rows = len(body)
+    elif body:
+        mean_len = sum(len(l) + 1 for l in body) / len(body)
+        rows = int(round((size - len(lines[0]) - 1) / mean_len))
+    else:
+        rows = 0
+    first = _parse_date(body[0].split(";", 1)[0]) if body else None
+    last = None
+    if complete and body:
+        last = _parse_date(body[-1].split(";", 1)[0])
+    elif tail:
+        tail_lines = [l for l in tail.decode("utf-8", errors="replace").split("\n")[1:] if l.strip()]
+        last = _parse_date(tail_lines[-1].split(";", 1)[0]) if tail_lines else None
+    return {
+        "EGID": key[0],
+        "DATA_TYPE": key[1],
+        "rows": rows,
+        "date_min": first,
+        "date_max": last,
+        "bytes": size,
+        "source": name,
+    }
+
+
+def _scan_csv_dir(path: Path) -> list[dict]:
+    out = []
+    for fp in sorted(path.glob("*.csv")):
+        size = fp.stat().st_size
+        with open(fp, "rb") as f:
+            head = f.read(HEAD_BYTES)
+            tail = None
+            if size > HEAD_BYTES:
+                f.seek(max(HEAD_BYTES, size - TAIL_BYTES))
+                tail = f.read()
+        entry = _csv_entry(head, tail, size, fp.name)
+        if entry is not None:
+            out.append(entry)
+    return out
+
+
+def _scan_zip(path: Path) -> list[dict]:
+    """Membres CSV d'un fragment zip : début de chaque membre (la fin exigerait de tout décompresser)."""
+    out = []
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if not info.filename.endswith(".csv"):
+                continue
+            with zf.open(info) as f:
+                head = f.read(HEAD_BYTES)
+            entry = _csv_entry(head, None, info.file_size, f"{path.name}/{info.filename}")
+            if entry is not None:
+                out.append(entry)
+    return out
+
+
+def _stat(st, default=None):
+    return (st.min, st.max) if st is not None and st.has_min_max else (default, default)
+
+
+def _scan_shards(files: list[Path]) -> list[dict]:
+    """Fragments ``part-*.parquet`` (format long) : lignes des row groups d'une seule série attribuées, sinon
+    série inconnue ; plages de dates gardées pour la plage globale seulement (partielles par série)."""
+    out = []
+    dec = lambda v: v.decode("utf-8", "replace") if isinstance(v, bytes) else v
+    for fp in files:
+        md = pq.ParquetFile(fp).metadata
+        names = md.schema.to_arrow_schema().names
+        ie, it, idt = (names.index(c) if c in names else -1 for c in ("EGID", "DATA_TYPE", "date"))
+        for rg in range(md.num_row_groups):
+            g = md.row_group(rg)
+            e = _stat(g.column(ie).statistics) if ie >= 0 else (None, None)
+            t = _stat(g.column(it).statistics) if it >= 0 else (None, None)
+            d = _stat(g.column(idt).statistics) if idt >= 0 else (None, None)
+            single = e[0] is not None and e[0] == e[1] and t[0] is not None and t[0] == t[1]
+            dates = {
+                "date_min": pd.Timestamp(d[0]) if d[0] is not None else None,
+                "date_max": pd.Timestamp(d[1]) if d[1] is not None else None,
+            }
+            base = {"bytes": g.total_byte_size, "source": fp.name}
+            if single:
+                out.append({"EGID": str(dec(e[0])), "DATA_TYPE": str(dec(t[0])), "rows": g.num_rows,
+                            "date_min": None, "date_max": None, **base})
+                out.append({"EGID": None, "DATA_TYPE": None, "rows": 0, **dates, **base, "bytes": 0})
+            else:
+                out.append({"EGID": None, "DATA_TYPE": None, "rows": g.num_rows, **dates, **base})
+    return out
+
+
+def _report_rows(path_raw: Path) -> dict[tuple[str, str], int]:
+    """Lignes exactes par série du rapport ExpArchiV8 ``<export>_report.csv`` (à côté de l'export)."""
+    rep = path_raw.parent / f"{path_raw.name}_report.csv"
+    if not rep.is_file():
+        return {}
+    out = {}
+    with open(rep, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            key = _series_key(row.get("Nom") or "")
+            if key is not None and (row.get("rows") or "").strip():
+                out[key] = out.get(key, 0) + int(row["rows"])
+    return out
+
+
+def scan_raw(path_raw: Path = PATH_RAW, increments: Path | None = None) -> pd.DataFrame:
+    """Manifeste de l'export brut : une ligne par série (EGID, DATA_TYPE) et par source."""
+    path_raw = Path(path_raw)
+    shards = sorted(path_raw.glob("part-*.parquet"))
+    entries = _scan_shards(shards) if shards else _scan_csv_dir(path_raw)
+    exact = _report_rows(path_raw)
+    if exact:  # lignes du rapport ; l'export ne fournit plus que les plages de dates
+        for e in entries:
+            e["rows"] = 0
+        entries += [
+            {"EGID": k[0], "DATA_TYPE": k[1], "rows": n, "date_min": None, "date_max": None, "bytes": 0, "source": "rapport"}
+            for k, n in exact.items()
+        ]
+    if increments is not None and Path(increments).is_dir():
+        for frag in sorted(Path(increments).glob("export_SSTCAD_*")):
+            if frag.is_dir():
+                parts = sorted(frag.glob("part-*.parquet"))
+                entries += _scan_shards(parts) if parts else _scan_csv_dir(frag)
+            elif frag.suffix == ".zip":
+                entries += _scan_zip(frag)
+    df = pd.DataFrame(entries, columns=MANIFEST_COLUMNS)
+    df["rows"] = df["rows"].astype(np.int64)
+    for c in ("date_min", "date_max"):
+        df[c] = pd.to_datetime(df[c])
+    return df
+
+
+def series_table(manifest: pd.DataFrame, aggregation_15min: bool = True) -> pd.DataFrame:
+    """Par série : lignes brutes, plage, lignes au pas 15 min (après agrégation section 2 / section 4)."""
+    m = manifest.dropna(subset=["EGID"])
+    g = m.groupby(["EGID", "DATA_TYPE"], sort=True).agg(
+        rows=("rows", "sum"), date_min=("date_min", "min"), date_max=("date_max", "max")
+    )
+    # Plage inconnue (rapport, fragments Parquet) : plage globale de l'export
+    g["date_min"] = g["date_min"].fillna(manifest["date_min"].min())
+    g["date_max"] = g["date_max"].fillna(manifest["date_max"].max())
+    span_steps = ((g["date_max"] - g["date_min"]).dt.total_seconds() / (STEP_MIN * 60) + 1).fillna(np.inf)
+    g["rows_15"] = np.minimum(g["rows"], span_steps).astype(np.int64)
+    if aggregation_15min:
+        pre = g.index.get_level_values("DATA_TYPE") == "PuisCpt"
+        g["rows_ingest"] = np.where(pre, g["rows_15"], g["rows"])
+    else:
+        g["rows_ingest"] = g["rows"]
+    return g.reset_index()
+
+
+# --- pieds Parquet des étapes ----------------------------------------------------------------------------------
+
+
+def scan_stage(path: Path) -> pd.DataFrame:
+    """Fichiers d'une étape : partition (cluster, DATA_TYPE), lignes, octets, plage ``date`` (pieds seuls)."""
+    cols = ["file", "cluster", "DATA_TYPE", "rows", "bytes", "date_min", "date_max"]
+    p = stage_path(path)
+    if not p.exists():
+        return pd.DataFrame(columns=cols)
+    rows = []
+    for f in stage_files(p):
+        md = pq.ParquetFile(f).metadata
+        parts = dict(seg.split("=", 1) for seg in f.relative_to(p).parts[:-1] if "=" in seg) if p.is_dir() else {}
+        names = md.schema.to_arrow_schema().names
+        idt = names.index("date") if "date" in names else -1
+        lo = hi = None
+        for rg in range(md.num_row_groups):
+            st = md.row_group(rg).column(idt).statistics if idt >= 0 else None
+            a, b = _stat(st)
+            if a is not None:
+                lo = a if lo is None else min(lo, a)
+                hi = b if hi is None else max(hi, b)
+        rows.append(
+            {
+                "file": f,
+                "cluster": int(parts["cluster"]) if "cluster" in parts else None,
+                "DATA_TYPE": parts.get("DATA_TYPE"),
+                "rows": md.num_rows,
+                "bytes": f.stat().st_size,
+                "date_min": lo,
+                "date_max": hi,
+            }
+        )
+    return pd.DataFrame(rows, columns=cols)
+
+
+def read_gis_clusters(path_gis: Path = PATH_GIS) -> dict[str, int]:
+    if not Path(path_gis).is_file():
+        return {}
+    gis = pd.read_parquet(path_gis, columns=["U_NO_EGID", "cluster"])
+    return dict(zip(gis["U_NO_EGID"].astype(str), gis["cluster"].astype(int)))
+
+
+# --- étalonnage ------------------------------------------------------------------------------------------------
+
+
+def calibrate(
+    reports: pd.DataFrame | None = None,
+    runs: int = CALIBRATION_RUNS,
+    min_rows: int = CALIBRATION_MIN_ROWS,
+) -> dict[str, StageCost]:
+    """Coûts par section : médiane des ``runs`` dernières mesures profilées, ``DEFAULT_COSTS`` sinon."""
+    reports = load_reports(PATH_PROFILES) if reports is None else reports
+    costs = dict(DEFAULT_COSTS)
+    if reports.empty:
+        return costs
+    df = reports[(reports["status"] == "ok") & (reports["rows_in"] >= min_rows)].copy()
+    df = df.dropna(subset=["rss_start_mb", "rss_peak_mb", "wall_s"])
+    # sections exécutées par sst_sql : mémoire et durée de DuckDB, sans rapport avec le chemin pandas planifié
+    df = df[~df["labels"].astype(str).str.contains('"backend": "duckdb"', regex=False)]
+    for stage, name in PROFILED_STAGES.items():
+        sub = df[df["stage"] == name].sort_values("started_at").tail(runs)
+        if sub.empty:
+            continue
+        bpr = ((sub["rss_peak_mb"] - sub["rss_start_mb"]).clip(lower=0) * _MB / sub["rows_in"]).median()
+        spr = (sub["wall_s"] / sub["rows_in"]).median()
+        costs[stage] = StageCost(float(bpr), float(spr), f"{len(sub)} mesure(s)")
+    return costs
+
+
+# --- plan ------------------------------------------------------------------------------------------------------
+
+
+def egid_batches(rows: pd.Series, target_rows: float) -> list[list[str]]:
+    """EGID (ordre trié) regroupés consécutivement, ``target_rows`` lignes au plus par lot (un EGID au moins)."""
+    out, cur, acc = [], [], 0
+    for egid, n in rows.sort_index().items():
+        if cur and acc + n > target_rows:
+            out.append(cur)
+            cur, acc = [], 0
+        cur.append(str(egid))
+        acc += int(n)
+    if cur:
+        out.append(cur)
+    return out
+
+
+def _plan_stage(
+    stage: str,
+    cluster: int | None,
+    rows_in: int,
+    rows_out: int,
+    cost: StageCost,
+    budget_mb: float,
+    source: str,
+    egid_rows: pd.Series | None = None,
+    resident_mb: float = 0.0,
+) -> StagePlan:
+    """Pic = ``rows_in × bytes_per_row`` (+ ``resident_mb`` conservé entre lots) ; lots si au-delà du budget."""
+    peak = rows_in * cost.bytes_per_row / _MB
+    plan = StagePlan(stage, cluster, int(rows_in), int(rows_out), peak, rows_in * cost.seconds_per_row, source)
+    if peak <= budget_mb:
+        return plan
+    if stage not in CHUNKABLE or egid_rows is None or egid_rows.empty:
+        plan.over = True
+        return plan
+    room = budget_mb * CHUNK_FILL - resident_mb
+    n = max(2, math.ceil(peak / room)) if room > 0 else len(egid_rows)
+    batches = egid_batches(egid_rows, math.ceil(egid_rows.sum() / n))
+    biggest = max(sum(int(egid_rows.get(e, 0)) for e in b) for b in batches)
+    plan.mode, plan.batches = "chunked", batches
+    plan.batch_peak_mb = biggest * cost.bytes_per_row / _MB + resident_mb
+    plan.over = plan.batch_peak_mb > budget_mb
+    return plan
+
+
+def plan_pipeline(
+    path_raw: Path = PATH_RAW,
+    path_gis: Path = PATH_GIS,
+    path_structured: Path = PATH_STRUCTURED,
+    budget_gb: float | None = None,
+    aggregation_15min: bool = True,
+    increments: Path | None = None,
+    costs: dict[str, StageCost] | None = None,
+) -> PipelinePlan:
+    """Plan des sections 2 à 7 : lignes, pic mémoire, durée, mode (``memory`` / ``chunked``) et lots d'EGID."""
+    budget = memory_budget_mb(budget_gb)
+    costs = calibrate() if costs is None else costs
+    manifest = scan_raw(path_raw, increments)
+    series = series_table(manifest, aggregation_15min)
+    clusters = read_gis_clusters(path_gis)
+    unknown = int(manifest.loc[manifest["EGID"].isna(), "rows"].sum())
+
+    raw_rows = int(manifest["rows"].sum())
+    ingest_rows = int(series["rows_ingest"].sum()) + unknown
+    stages = [
+        _plan_stage("ingest", None, raw_rows, ingest_rows, costs["ingest"], budget, "manifeste"),
+        _plan_stage("enrich", None, ingest_rows, ingest_rows, costs["enrich"], budget, "manifeste"),
+    ]
+
+    # Section 4 : EGID du GIS ayant TempRet et PuisCpt ; sortie ≈ 2 × min(lignes 15 min) (chevauchement)
+    gis_series = series[series["EGID"].isin(clusters)] if clusters else series
+    in_rows = gis_series.groupby("EGID")["rows_ingest"].sum()
+    by_type = gis_series.pivot_table(index="EGID", columns="DATA_TYPE", values="rows_15", aggfunc="sum")
+    both = [c for c in ("TempRet", "PuisCpt") if c in by_type.columns]
+    out_rows = 2 * by_type[both].min(axis=1).fillna(0) if len(both) == 2 else pd.Series(0, index=by_type.index)
+    out_rows = out_rows.astype(np.int64)
+    ext_mb = ingest_rows * EXT_BYTES_PER_ROW / _MB  # table météo lue une fois, conservée entre lots
+    stages.append(
+        _plan_stage(
+            "filter", None, ingest_rows, int(out_rows.sum()), costs["filter"], budget, "manifeste", in_rows, ext_mb
+        )
+    )
+    filtered = int(out_rows.sum())
+    stages.append(_plan_stage("clean", None, filtered, filtered, costs["clean"], budget, "manifeste"))
+    stages.append(_plan_stage("transform", None, filtered, filtered, costs["transform"], budget, "manifeste"))
+
+    # Section 7 : par cluster ; pieds de sst_filtered_transfo s'il existe (répartition par EGID : manifeste)
+    transfo = scan_stage(Path(path_structured) / "sst_filtered_transfo")
+    if not transfo.empty and transfo["cluster"].notna().any():
+        per_cluster = transfo.groupby("cluster")["rows"].sum().astype(np.int64)
+        source = "pieds Parquet"
+    else:
+        cl = pd.Series({e: clusters.get(str(e)) for e in out_rows.index}, dtype="float64")
+        per_cluster = out_rows[out_rows > 0].groupby(cl).sum().astype(np.int64)
+        source = "manifeste"
+    for cluster, n in per_cluster.items():
+        eg = out_rows[[clusters.get(str(e)) == int(cluster) for e in out_rows.index]] if clusters else out_rows
+        eg = eg[eg > 0]
+        if not eg.empty and eg.sum() > 0:
+            eg = (eg * (n / eg.sum())).round().astype(np.int64)  # répartition du manifeste, total des pieds
+        resident = n * WIDE_BYTES_PER_ROW / _MB
+        stages.append(
+            _plan_stage("split", int(cluster), int(n), int(n), costs["split"], budget, source, eg, resident)
+        )
+
+    known = manifest.dropna(subset=["EGID"])
+    return PipelinePlan(
+        budget_mb=budget,
+        stages=stages,
+        costs=costs,
+        n_series=len(series),
+        n_egids=int(known["EGID"].nunique()),
+        date_min=manifest["date_min"].min() if manifest["date_min"].notna().any() else None,
+        date_max=manifest["date_max"].max() if manifest["date_max"].notna().any() else None,
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--raw", type=Path, default=PATH_RAW, help="Export brut (dossier CSV ou fragments Parquet)")
+    ap.add_argument("--increments", type=Path, default=PATH_RAW_INCREMENTS)
+    ap.add_argument("--gis", type=Path, default=PATH_GIS)
+    ap.add_argument("--structured", type=Path, default=PATH_STRUCTURED)
+    ap.add_argument("--budget-gb", type=float, default=None, help=f"Défaut : {BUDGET_FRACTION:.0%} de la RAM disponible")
+    ap.add_argument("--no-aggregation", action="store_true", help="AGGREGATION_15MIN = False")
+    ap.add_argument("--costs", action="store_true", help="Affiche les coûts par ligne (étalonnés / par défaut)")
+    ap.add_argument("--json", type=Path, default=None, help="Écrit le plan (une ligne par section) en JSON")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    plan = plan_pipeline(
+        args.raw, args.gis, args.structured, args.budget_gb, not args.no_aggregation, args.increments
+    )
+    print(plan.describe())
+    if args.costs:
+        for stage, c in plan.costs.items():
+            print(f"  {stage:<10} {c.bytes_per_row:>8.0f} o/ligne  {c.seconds_per_row * 1e6:>7.2f} µs/ligne  ({c.source})")
+    if args.json is not None:
+        args.json.write_text(plan.report().to_json(orient="records", date_format="iso", force_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
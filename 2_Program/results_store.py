@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Jeu de résultats consolidé : métriques test + résumés d'entraînement + prédictions test de tous les EGID.
+
+Remplace la lecture, à chaque analyse, d'un ``{RF,XB,LSTM}_{egid}.parquet`` et d'un
+``*_training_summary.json`` par EGID et par modèle. L'entraînement **ajoute** ses résultats (un fichier
+par boucle cluster × modèle, pas par EGID) ; l'analyse lit une seule fois chaque partition.
+
+Arborescence (``9_Results/_store/``) ::
+
+    metrics/cluster_id=3/model=RF/part-<horodatage>-<id>.parquet      une ligne par EGID
+    predictions/cluster_id=3/model=RF/part-<horodatage>-<id>.parquet  prédictions test (format RF_{egid}.parquet)
+    index.parquet                                                      (cluster_id, egid, model) → config_hash,
+                                                                       part, updated_at, source_mtime_ns
+
+Une clé réécrite (ré-entraînement) est ajoutée dans un nouveau part ; la lecture ne garde que la version la plus
+récente (index) et ``compact`` réécrit une partition en un seul fichier. ``sync_results_dir`` importe les
+parquets ``9_Results/Cluster{N}/{prefix}_{egid}.parquet`` existants **modifiés depuis le dernier import**
+(comparaison de mtime, sans ouverture des fichiers inchangés).
+
+Métriques identiques à ``load_result_metrics`` (ML_training, section 5) : RMSE / MAE TempRet en °C, PuisCpt en
+fc, score = moyenne des deux RMSE.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe results_store.py sync --clusters 3 4 5 6
+  .venv\\Scripts\\python.exe results_store.py compact
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger("results_store")
+
+ROOT = Path(__file__).resolve().parent
+PATH_RESULTS = ROOT / "0_Data" / "9_Results"
+PATH_MODELS = ROOT / "0_Data" / "6_Models"
+PATH_STORE = PATH_RESULTS / "_store"
+
+KEY_COLS = ["cluster_id", "egid", "model"]
+METRIC_COLS = ["rmse_TempRet", "rmse_PuisCpt", "mae_TempRet", "mae_PuisCpt", "score", "n_test"]
+COMPACT_MAX_PARTS = 16
+# Colonnes texte typées explicitement : un part dont toutes les valeurs sont nulles (résumé JSON absent, RFG/XBG)
+# serait sinon écrit en type ``null``, et le schéma du dataset (pris sur le premier part) ne lirait plus les autres
+STRING_COLS = ("egid", "config_hash", "summary_json")
+_RE_RESULT = re.compile(r"^(?P<model>[A-Za-z]+)_(?P<egid>[^_]+)$")
+
+
+def config_hash(config: dict) -> str:
+    """Empreinte courte (12 hex) d'une configuration d'entraînement (JSON trié)."""
+    raw = json.dumps(config, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def test_metrics(frame: pd.DataFrame) -> dict:
+    """Mêmes définitions que ``load_result_metrics`` sur un ``{prefix}_{egid}.parquet``."""
+    yt = frame[["TempRet", "PuisCpt"]].to_numpy(dtype=np.float64)
+    yp = frame[["TempRetPred", "PuisCptPred"]].to_numpy(dtype=np.float64)
+    if len(yt) == 0:
+        return {c: np.nan for c in METRIC_COLS[:-1]} | {"n_test": 0}
+    err = yt - yp
+    rmse = np.sqrt(np.mean(err * err, axis=0))
+    mae = np.mean(np.abs(err), axis=0)
+    return {
+        "rmse_TempRet": float(rmse[0]),
+        "rmse_PuisCpt": float(rmse[1]),
+        "mae_TempRet": float(mae[0]),
+        "mae_PuisCpt": float(mae[1]),
+        "score": float(np.mean(rmse)),
+        "n_test": int(len(yt)),
+    }
+
+
+def parse_result_path(path: Path) -> tuple[int, str, str]:
+    """``.../Cluster3/RF_1511188.parquet`` → (3, "RF", "1511188")."""
+    path = Path(path)
+    m = _RE_RESULT.match(path.stem)
+    if m is None or not path.parent.name.startswith("Cluster"):
+        raise ValueError(f"Chemin de résultat non reconnu : {path}")
+    return int(path.parent.name[len("Cluster") :]), m.group("model"), m.group("egid")
+
+
+class ResultsStore:
+    """Écriture bufferisée (``add_*`` puis ``flush``) et lecture en un passage des résultats consolidés."""
+
+    def __init__(self, root: Path = PATH_STORE):
+        self.root = Path(root)
+        self._pending: dict[tuple[int, str, str], dict] = {}
+
+    # ------------------------------------------------------------------ écriture
+    def _entry(self, cluster_id: int, model: str, egid: str) -> dict:
+        return self._pending.setdefault((int(cluster_id), str(model), str(egid)), {})
+
+    def add_predictions(
+        self,
+        cluster_id: int,
+        model: str,
+        egid: str,
+        frame: pd.DataFrame,
+        config_hash: str = "",
+        source_path: Path | None = None,
+    ) -> None:
+        e = self._entry(cluster_id, model, egid)
+        e["frame"] = frame
+        e["config_hash"] = config_hash
+        if source_path is not None and Path(source_path).exists():
+            e["source_mtime_ns"] = Path(source_path).stat().st_mtime_ns
+
+    def add_training_summary(self, cluster_id: int, model: str, egid: str, summary: dict | None) -> None:
+        if summary is not None:
+            self._entry(cluster_id, model, egid)["summary"] = summary
+
+    def flush(self) -> int:
+        """Écrit un part métriques + un part prédictions par (cluster, modèle) et met à jour l'index."""
+        if not self._pending:
+            return 0
+        now = time.time_ns()
+        groups: dict[tuple[int, str], list] = {}
+        for key, e in self._pending.items():
+            groups.setdefault(key[:2], []).append((key, e))
+
+        idx_rows = []
+        for (cid, model), items in groups.items():
+            part = f"part-{now}-{uuid.uuid4().hex[:8]}.parquet"
+            m_rows, p_frames = [], []
+            for (_c, _m, egid), e in items:
+                frame = e.get("frame")
+                row = {"cluster_id": cid, "egid": egid, "model": model, "config_hash": e.get("config_hash", "")}
+                row.update(test_metrics(frame) if frame is not None else {c: np.nan for c in METRIC_COLS})
+                row["summary_json"] = json.dumps(e["summary"], default=str) if "summary" in e else None
+                row["updated_at"] = now
+                m_rows.append(row)
+                if frame is not None:
+                    p_frames.append(frame.assign(egid=egid, updated_at=now))
+                idx_rows.append({**row, "part": part, "source_mtime_ns": e.get("source_mtime_ns", 0)})
+            self._write_part("metrics", cid, model, part, pd.DataFrame(m_rows).drop(columns=KEY_COLS[::2]))
+            if p_frames:
+                self._write_part("predictions", cid, model, part, pd.concat(p_frames, ignore_index=True))
+        n = len(self._pending)
+        self._pending.clear()
+        self._update_index(pd.DataFrame(idx_rows))
+        for cid, model in groups:
+            if len(self._parts("metrics", cid, model)) > COMPACT_MAX_PARTS:
+                self.compact(cid, model)
+        return n
+
+    def _partition(self, kind: str, cluster_id: int, model: str) -> Path:
+        return self.root / kind / f"cluster_id={int(cluster_id)}" / f"model={model}"
+
+    def _parts(self, kind: str, cluster_id: int, model: str) -> list[Path]:
+        d = self._partition(kind, cluster_id, model)
+        return sorted(d.glob("part-*.parquet")) if d.is_dir() else []
+
+    def _write_part(self, kind: str, cluster_id: int, model: str, part: str, df: pd.DataFrame) -> None:
+        d = self._partition(kind, cluster_id, model)
+        d.mkdir(parents=True, exist_ok=True)
+        tmp = d / f".{part}.tmp"
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        for c in STRING_COLS:
+            i = table.schema.get_field_index(c)
+            if i >= 0 and not pa.types.is_string(table.schema.field(i).type):
+                table = table.set_column(i, pa.field(c, pa.string()), table.column(i).cast(pa.string()))
+        pq.write_table(table, tmp)
+        tmp.replace(d / part)
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / "index.parquet"
+
+    def index(self) -> pd.DataFrame:
+        """Dernière version par (cluster_id, egid, model)."""
+        if not self.index_path.exists():
+            return pd.DataFrame(
+                columns=KEY_COLS + ["config_hash", "part", "updated_at", "source_mtime_ns", "score"]
+            )
+        return pd.read_parquet(self.index_path)
+
+    def _update_index(self, new_rows: pd.DataFrame) -> None:
+        cols = KEY_COLS + ["config_hash", "part", "updated_at", "source_mtime_ns", "score"]
+        idx = pd.concat([self.index(), new_rows[cols]], ignore_index=True)
+        idx["egid"] = idx["egid"].astype(str)
+        idx = idx.sort_values("updated_at").drop_duplicates(KEY_COLS, keep="last").reset_index(drop=True)
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / ".index.parquet.tmp"
+        idx.to_parquet(tmp, index=False)
+        tmp.replace(self.index_path)
+
+    # ------------------------------------------------------------------ lecture
+    def _scan(self, kind: str, cluster_ids=None, models=None, egids=None) -> pd.DataFrame:
+        base = self.root / kind
+        if not base.is_dir():
+            return pd.DataFrame()
+        kwargs = dict(
+            format="parquet",
+            partitioning=ds.partitioning(pa.schema([("cluster_id", pa.int64()), ("model", pa.string())]), flavor="hive"),
+            exclude_invalid_files=True,
+            ignore_prefixes=[".", "_"],
+        )
+        dataset = ds.dataset(base, **kwargs)
+        schema = dataset.schema
+        if any(pa.types.is_null(f.type) for f in schema):  # parts écrits avant STRING_COLS
+            schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in schema])
+            dataset = ds.dataset(base, schema=schema, **kwargs)
+        flt = None
+        for col, vals in (("cluster_id", cluster_ids), ("model", models), ("egid", egids)):
+            if vals is None:
+                continue
+            vals = [int(v) for v in vals] if col == "cluster_id" else [str(v) for v in vals]
+            f = ds.field(col).isin(vals)
+            flt = f if flt is None else flt & f
+        return dataset.to_table(filter=flt).to_pandas()
+
+    def _latest(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Ne garde que les lignes de la version indexée (les parts antérieurs sont ignorés)."""
+        if df.empty:
+            return df
+        idx = self.index()[KEY_COLS + ["updated_at"]]
+        df["egid"] = df["egid"].astype(str)
+        df["model"] = df["model"].astype(str)
+        return df.merge(idx, on=KEY_COLS + ["updated_at"], how="inner")
+
+    def metrics(self, cluster_ids=None, models=None, egids=None) -> pd.DataFrame:
+        """Table (cluster_id, egid, model, métriques test, config_hash, summary_json) — un seul passage."""
+        df = self._latest(self._scan("metrics", cluster_ids, models, egids))
+        if df.empty:
+            return pd.DataFrame(columns=KEY_COLS + METRIC_COLS + ["config_hash", "summary_json"])
+        return df.sort_values(KEY_COLS, ignore_index=True)
+
+    def training_summaries(self, cluster_ids=None, models=None) -> dict[tuple[int, str, str], dict]:
+        """{(cluster_id, egid, model): résumé d'entraînement} (contenu des ``*_training_summary.json``)."""
+        df = self.metrics(cluster_ids, models)
+        df = df[df["summary_json"].notna()]
+        return {
+            (int(r.cluster_id), str(r.egid), str(r.model)): json.loads(r.summary_json)
+            for r in df.itertuples(index=False)
+        }
+
+    def predictions(self, cluster_id: int, model: str, egids=None) -> pd.DataFrame:
+        df = self._latest(self._scan("predictions", [cluster_id], [model], egids))
+        return df.drop(columns=["updated_at"], errors="ignore")
+
+    # ------------------------------------------------------------------ maintenance
+    def compact(self, cluster_id: int | None = None, model: str | None = None) -> int:
+        """Réécrit chaque partition (métriques + prédictions) en un seul part ne gardant que les dernières versions."""
+        idx = self.index()
+        n = 0
+        keys = idx[KEY_COLS[::2]].drop_duplicates().itertuples(index=False)
+        for cid, mod in keys:
+            if (cluster_id is not None and int(cid) != int(cluster_id)) or (model is not None and mod != model):
+                continue
+            for kind in ("metrics", "predictions"):
+                parts = self._parts(kind, cid, mod)
+                if len(parts) <= 1:
+                    continue
+                df = self._latest(self._scan(kind, [cid], [mod]))
+                part = f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+                self._write_part(kind, cid, mod, part, df.drop(columns=KEY_COLS[::2]))
+                for p in parts:
+                    p.unlink()
+                n += 1
+        return n
+
+    def sync_results_dir(
+        self,
+        cluster_id: int,
+        prefixes,
+        egids=None,
+        results_root: Path = PATH_RESULTS,
+        models_root: Path = PATH_MODELS,
+        config_hashes: dict[str, str] | None = None,
+    ) -> int:
+        """
+        Importe les ``{prefix}_{egid}.parquet`` (+ ``*_training_summary.json``) nouveaux ou modifiés depuis le
+        dernier import ; les fichiers inchangés ne sont pas ouverts. Retourne le nombre d'EGID × modèles importés.
+        """
+        rdir = Path(results_root) / f"Cluster{cluster_id}"
+        mdir = Path(models_root) / f"Cluster{cluster_id}"
+        idx = self.index()
+        known = {
+            (str(r.egid), str(r.model)): int(r.source_mtime_ns)
+            for r in idx[idx["cluster_id"] == int(cluster_id)].itertuples(index=False)
+        }
+        wanted = None if egids is None else {str(e) for e in egids}
+        n = 0
+        for pref in prefixes:
+            for p in rdir.glob(f"{pref}_*.parquet"):
+                try:
+                    _cid, model, egid = parse_result_path(p)
+                except ValueError:
+                    continue
+                if model != pref or (wanted is not None and egid not in wanted):
+                    continue
+                mtime = p.stat().st_mtime_ns
+                if known.get((egid, model), -1) >= mtime:
+                    continue
+                self.add_predictions(cluster_id, model, egid, pd.read_parquet(p), (config_hashes or {}).get(model, ""))
+                self._pending[(int(cluster_id), model, egid)]["source_mtime_ns"] = mtime
+                js = mdir / f"{model}_{egid}_training_summary.json"
+                if js.is_file():
+                    try:
+                        self.add_training_summary(cluster_id, model, egid, json.loads(js.read_text(encoding="utf-8")))
+                    except ValueError as exc:
+                        logger.warning("JSON illisible %s: %s", js, exc)
+                n += 1
+        self.flush()
+        if n:
+            logger.info("Store : %s résultats importés (cluster %s)", n, cluster_id)
+        return n
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_sync = sub.add_parser("sync", help="Importe les résultats par EGID modifiés depuis le dernier import")
+    p_sync.add_argument("--clusters", type=int, nargs="+", default=[3, 4, 5, 6])
+    p_sync.add_argument("--prefixes", nargs="+", default=["RF", "XB", "LSTM"])
+    sub.add_parser("compact", help="Un seul fichier par partition")
+    p_exp = sub.add_parser("export", help="metrics_all_models.csv depuis le store")
+    p_exp.add_argument("--out", type=Path, default=PATH_RESULTS / "metrics_all_models.csv")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    store = ResultsStore()
+    if args.cmd == "sync":
+        for cid in args.clusters:
+            store.sync_results_dir(cid, args.prefixes)
+        print(store.index().groupby(["cluster_id", "model"]).size())
+    elif args.cmd == "compact":
+        print(f"{store.compact()} partitions compactées")
+    else:
+        met = store.metrics()
+        met[KEY_COLS + METRIC_COLS[:-1]].to_csv(args.out, index=False)
+        print(args.out)
+
+
+if __name__ == "__main__":
+    main()
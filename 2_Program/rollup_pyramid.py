@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Pyramide d'agrégats multi-résolution (15 min → heure → jour → semaine) par EGID et canal.
+
+Construite une fois après la section 7 (Split) de dataset_preparation_V2 à partir des parquets larges
+``cluster{N}.parquet`` (train + val + test, disjoints dans le temps), puis mise à jour incrémentalement :
+seules les lignes postérieures au dernier pas déjà agrégé (``_meta.json``) sont lues.
+
+Pour chaque niveau (``hour``, ``day``, ``week``) et chaque couple (EGID, canal) :
+``sum`` (somme des valeurs non NaN), ``count`` (pas 15 min du bucket), ``valid`` (pas non NaN), ``min``, ``max``.
+Moyenne = ``sum / valid`` ; couverture = ``valid / count``. Le niveau ``hour`` est calculé depuis les données
+15 min, ``day`` depuis ``hour``, ``week`` depuis ``day`` (jamais depuis la donnée brute).
+
+Buckets en UTC : heure / jour tronqués ; semaine lundi–dimanche étiquetée par le **dimanche 00:00**
+(même convention que ``DataFrame.resample("W")``).
+
+Sortie : ``0_Data/8_Rollups/cluster{N}/{hour,day,week}.parquet`` (format long, trié par canal / EGID / bucket :
+un filtre ``egids=`` ou ``channels=`` ne lit que quelques row groups).
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe rollup_pyramid.py build --clusters 3 4 5 6
+  .venv\\Scripts\\python.exe rollup_pyramid.py build --clusters 3 --incremental
+  .venv\\Scripts\\python.exe rollup_pyramid.py build --clusters 3 --split-dirs 0_Data/3_training 0_Data/4_Validation 0_Data/5_Test
+  .venv\\Scripts\\python.exe rollup_pyramid.py show --cluster 3 --level week --egids 1511188
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger("rollup_pyramid")
+
+ROOT = Path(__file__).resolve().parent
+PATH_ROLLUPS = ROOT / "0_Data" / "8_Rollups"
+# Répertoires train / val / test de la CLI (ceux de la section 1 de dataset_preparation_V2) ; le notebook
+# passe ses propres chemins à build_rollups
+SPLIT_DIRS = ("0_Data/3_training", "0_Data/4_Validation", "0_Data/5_Test")
+
+CHANNELS = ("TempRet_norm", "PuisCpt_fc", "TempRet", "PuisCpt")
+LEVELS = ("hour", "day", "week")
+STATS = ("sum", "count", "valid", "min", "max")
+KEY_COLS = ["channel", "egid", "bucket"]
+BATCH_ROWS = 65_536
+ROW_GROUP_ROWS = 131_072
+
+
+# ---------------------------------------------------------------------------
+# Buckets
+# ---------------------------------------------------------------------------
+def bucket_of(dates: pd.Series | pd.DatetimeIndex, level: str) -> pd.DatetimeIndex:
+    """Début de bucket (heure, jour) ou dimanche 00:00 de la semaine lundi–dimanche (UTC)."""
+    d = pd.DatetimeIndex(pd.to_datetime(dates, utc=True))
+    if level == "hour":
+        return d.floor("h")
+    day = d.floor("D")
+    if level == "day":
+        return day
+    if level == "week":
+        return day + pd.to_timedelta(6 - day.dayofweek, unit="D")
+    raise ValueError(f"Niveau inconnu : {level}")
+
+
+def value_columns(columns, channels=CHANNELS) -> list[tuple[str, str, str]]:
+    """[(colonne, egid, canal)] des colonnes ``{egid}.{canal}`` du parquet large."""
+    out = []
+    for c in columns:
+        egid, sep, ch = str(c).partition(".")
+        if sep and ch in channels:
+            out.append((c, egid, ch))
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Agrégation (forme large : une colonne par série, index = bucket)
+# ---------------------------------------------------------------------------
+def aggregate_wide(dates, values: pd.DataFrame, level: str = "hour") -> dict[str, pd.DataFrame]:
+    """Agrégats d'un bloc 15 min large : {stat: DataFrame bucket × colonne}."""
+    g = values.set_axis(bucket_of(dates, level)).groupby(level=0, sort=True)
+    size = g.size()
+    return {
+        "sum": g.sum(min_count=0),
+        "count": pd.DataFrame(
+            np.repeat(size.to_numpy()[:, None], values.shape[1], axis=1), index=size.index, columns=values.columns
+        ),
+        "valid": g.count(),
+        "min": g.min(),
+        "max": g.max(),
+    }
+
+
+def _combine_long(df: pd.DataFrame) -> pd.DataFrame:
+    """Fusionne les lignes de même clé (blocs adjacents, ou bucket plus fin → plus grossier)."""
+    g = df.groupby(KEY_COLS, sort=True, observed=True)
+    out = g.agg(sum=("sum", "sum"), count=("count", "sum"), valid=("valid", "sum"), min=("min", "min"), max=("max", "max"))
+    return out.reset_index()
+
+
+def to_long(agg: dict[str, pd.DataFrame], col_map: list[tuple[str, str, str]]) -> pd.DataFrame:
+    """Forme large → longue (channel, egid, bucket, stats)."""
+    cols = [c for c, _e, _ch in col_map]
+    base = agg["sum"][cols]
+    m, k = base.shape
+    out = pd.DataFrame(
+        {
+            "channel": np.repeat(np.array([ch for _c, _e, ch in col_map], dtype=object), m),
+            "egid": np.repeat(np.array([e for _c, e, _ch in col_map], dtype=object), m),
+            "bucket": np.tile(base.index.to_numpy(), k),
+        }
+    )
+    for st in STATS:
+        out[st] = agg[st][cols].to_numpy().T.reshape(-1)
+    return out
+
+
+def coarsen(df: pd.DataFrame, level: str) -> pd.DataFrame:
+    """Ré-agrège un rollup long (niveau plus fin) vers ``level`` sans relire la donnée 15 min."""
+    if df.empty:
+        return df.copy()
+    out = df.assign(bucket=bucket_of(df["bucket"], level))
+    return _combine_long(out)
+
+
+# ---------------------------------------------------------------------------
+# Construction / mise à jour
+# ---------------------------------------------------------------------------
+def split_paths(cluster_id: int, split_dirs=SPLIT_DIRS) -> list[Path]:
+    return [Path(p) / f"cluster{cluster_id}.parquet" for p in split_dirs]
+
+
+def _hourly_from_files(paths, channels, since: pd.Timestamp | None) -> tuple[pd.DataFrame, pd.Timestamp | None]:
+    """Rollup horaire long des lignes postérieures à ``since`` ; lecture par lots (mémoire bornée)."""
+    parts, last_ts = [], None
+    for path in paths:
+        if not path.exists():
+            continue
+        pf = pq.ParquetFile(path)
+        col_map = value_columns(pf.schema_arrow.names, channels)
+        if not col_map:
+            continue
+        cols = [c for c, _e, _ch in col_map]
+        for batch in pf.iter_batches(batch_size=BATCH_ROWS, columns=["Dates"] + cols):
+            df = batch.to_pandas()
+            dates = pd.to_datetime(df["Dates"], utc=True)
+            if since is not None:
+                keep = (dates > since).to_numpy()
+                if not keep.any():
+                    continue
+                df, dates = df.loc[keep], dates[keep]
+            if df.empty:
+                continue
+            vals = df[cols].astype(np.float64)
+            parts.append(to_long(aggregate_wide(dates, vals, "hour"), col_map))
+            ts = dates.max()
+            last_ts = ts if last_ts is None or ts > last_ts else last_ts
+    if not parts:
+        return pd.DataFrame(columns=KEY_COLS + list(STATS)), last_ts
+    return _combine_long(pd.concat(parts, ignore_index=True)), last_ts
+
+
+def _write_level(df: pd.DataFrame, path: Path) -> None:
+    df = df.sort_values(KEY_COLS, ignore_index=True)
+    table = pa.Table.from_pandas(
+        df.astype({"count": np.int32, "valid": np.int32}), preserve_index=False
+    )
+    table = table.cast(
+        pa.schema(
+            [
+                ("channel", pa.dictionary(pa.int32(), pa.string())),
+                ("egid", pa.dictionary(pa.int32(), pa.string())),
+                ("bucket", pa.timestamp("ns", tz="UTC")),
+                ("sum", pa.float64()),
+                ("count", pa.int32()),
+                ("valid", pa.int32()),
+                ("min", pa.float64()),
+                ("max", pa.float64()),
+            ]
+        )
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    pq.write_table(table, tmp, row_group_size=ROW_GROUP_ROWS)
+    tmp.replace(path)
+
+
+def _meta_path(cluster_id: int, root: Path) -> Path:
+    return Path(root) / f"cluster{cluster_id}" / "_meta.json"
+
+
+def build_rollups(
+    cluster_id: int,
+    paths: list[Path],
+    channels=CHANNELS,
+    root: Path = PATH_ROLLUPS,
+    incremental: bool = False,
+) -> dict[str, int]:
+    """
+    Construit (ou met à jour si ``incremental``) ``hour`` / ``day`` / ``week`` pour un cluster depuis ``paths``
+    (parquets larges train / val / test du cluster).
+    Mode incrémental : seules les lignes ``Dates > last_ts`` sont agrégées ; les buckets existants chevauchant
+    la nouvelle période (heure / jour / semaine en cours) sont fusionnés, les autres ne sont pas recalculés.
+    Retourne le nombre de lignes par niveau.
+    """
+    paths = [Path(p) for p in paths]
+    cdir = Path(root) / f"cluster{cluster_id}"
+    meta_p = _meta_path(cluster_id, root)
+    since = None
+    if incremental and meta_p.exists() and all((cdir / f"{lv}.parquet").exists() for lv in LEVELS):
+        meta = json.loads(meta_p.read_text(encoding="utf-8"))
+        if list(meta.get("channels", [])) == list(channels):
+            since = pd.Timestamp(meta["last_ts"])
+
+    new_hour, last_ts = _hourly_from_files(paths, channels, since)
+    if new_hour.empty:
+        logger.info("Cluster %s : aucune ligne à agréger (depuis %s)", cluster_id, since)
+        return {lv: 0 for lv in LEVELS}
+
+    if since is None:
+        levels = {"hour": new_hour}
+    else:
+        # Heure : le bucket en cours à ``since`` est complété (somme des agrégats ancien + nouveau)
+        old = load_rollup(cluster_id, "hour", root=root)
+        first = new_hour["bucket"].min()
+        merged = _combine_long(pd.concat([old[old["bucket"] >= first], new_hour], ignore_index=True))
+        levels = {"hour": pd.concat([old[old["bucket"] < first], merged], ignore_index=True)}
+    finer = levels["hour"]
+    for lv in LEVELS[1:]:
+        if since is None:
+            levels[lv] = coarsen(finer, lv)
+        else:
+            # Jour / semaine : seuls les buckets touchés sont recalculés, depuis le niveau plus fin complet
+            label = bucket_of(pd.DatetimeIndex([first]), lv)[0]
+            start = label - pd.Timedelta(days=6) if lv == "week" else label
+            old = load_rollup(cluster_id, lv, root=root)
+            levels[lv] = pd.concat(
+                [old[old["bucket"] < label], coarsen(finer[finer["bucket"] >= start], lv)], ignore_index=True
+            )
+        finer = levels[lv]
+
+    counts = {}
+    for lv in LEVELS:
+        _write_level(levels[lv], cdir / f"{lv}.parquet")
+        counts[lv] = len(levels[lv])
+
+    meta_p.write_text(
+        json.dumps({"last_ts": str(last_ts), "channels": list(channels), "sources": [str(p) for p in paths]}, indent=2),
+        encoding="utf-8",
+    )
+    logger.info("Cluster %s : rollups %s", cluster_id, counts)
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+# ---------------------------------------------------------------------------
+def _utc(ts) -> pd.Timestamp:
+    ts = pd.Timestamp(ts)
+    return ts.tz_convert("UTC") if ts.tz is not None else ts.tz_localize("UTC")
+
+
+def load_rollup(
+    cluster_id: int,
+    level: str,
+    channels=None,
+    egids=None,
+    start=None,
+    end=None,
+    root: Path = PATH_ROLLUPS,
+) -> pd.DataFrame:
+    """Rollup long filtré (prédicats poussés dans le scan Parquet) ; ``end`` exclu."""
+    path = Path(root) / f"cluster{cluster_id}" / f"{level}.parquet"
+    if not path.exists():
+        raise FileNotFoundError(f"{path} introuvable — exécuter rollup_pyramid.py build")
+    flt = None
+    conds = []
+    if channels is not None:
+        conds.append(ds.field("channel").isin([str(c) for c in channels]))
+    if egids is not None:
+        conds.append(ds.field("egid").isin([str(e) for e in egids]))
+    if start is not None:
+        conds.append(ds.field("bucket") >= _utc(start))
+    if end is not None:
+        conds.append(ds.field("bucket") < _utc(end))
+    for c in conds:
+        flt = c if flt is None else flt & c
+    df = ds.dataset(path, format="parquet").to_table(filter=flt).to_pandas()
+    for c in ("channel", "egid"):
+        df[c] = df[c].astype(str)
+    return df
+
+
+def day_rollup_window(
+    cluster_id: int,
+    frame: pd.DataFrame,
+    columns,
+    root: Path = PATH_ROLLUPS,
+    step: pd.Timedelta = pd.Timedelta(minutes=15),
+) -> pd.DataFrame:
+    """
+    Rollup ``day`` long couvrant exactement la fenêtre de ``frame`` (pas ``step`` large : ``Dates`` + ``columns``),
+    ``columns`` = ``{egid}.{canal}`` : jours entiers lus dans la pyramide, jours partiels en bordure (fenêtre
+    commençant ou finissant en cours de journée) agrégés depuis les lignes de ``frame``.
+    """
+    dates = pd.to_datetime(frame["Dates"], utc=True)
+    if dates.empty:
+        return pd.DataFrame(columns=KEY_COLS + list(STATS))
+    col_map = value_columns(columns, channels=[str(c).partition(".")[2] for c in columns])
+    start, end = dates.min(), dates.max()
+    full_start, full_end = start.ceil("D"), (end + step).floor("D")
+    parts = []
+    if full_start < full_end:
+        parts.append(
+            load_rollup(
+                cluster_id,
+                "day",
+                channels=sorted({ch for _c, _e, ch in col_map}),
+                egids=sorted({e for _c, e, _ch in col_map}),
+                start=full_start,
+                end=full_end,
+                root=root,
+            )
+        )
+        edge = ((dates < full_start) | (dates >= full_end)).to_numpy()
+    else:
+        edge = np.ones(len(dates), dtype=bool)
+    if edge.any() and col_map:
+        vals = frame.loc[edge, [c for c, _e, _ch in col_map]].astype(np.float64)
+        parts.append(to_long(aggregate_wide(dates[edge], vals, "day"), col_map))
+    return _combine_long(pd.concat(parts, ignore_index=True)) if parts else pd.DataFrame(columns=KEY_COLS + list(STATS))
+
+
+def wide_mean(df: pd.DataFrame, sep: str = ".") -> pd.DataFrame:
+    """Rollup long → DataFrame bucket × ``{egid}.{canal}`` des moyennes (``sum / valid``, NaN si ``valid = 0``)."""
+    if df.empty:
+        return pd.DataFrame()
+    mean = np.where(df["valid"].to_numpy() > 0, df["sum"].to_numpy() / np.maximum(df["valid"].to_numpy(), 1), np.nan)
+    col = df["egid"].astype(str) + sep + df["channel"].astype(str)
+    out = pd.DataFrame({"bucket": df["bucket"].to_numpy(), "col": col.to_numpy(), "mean": mean})
+    return out.pivot(index="bucket", columns="col", values="mean").sort_index()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_b = sub.add_parser("build")
+    p_b.add_argument("--clusters", type=int, nargs="+", default=[3, 4, 5, 6])
+    p_b.add_argument(
+        "--split-dirs", nargs=3, default=list(SPLIT_DIRS), metavar=("TRAIN", "VAL", "TEST"), help="Parquets larges du split"
+    )
+    p_b.add_argument("--channels", nargs="+", default=list(CHANNELS))
+    p_b.add_argument("--incremental", action="store_true", help="N'agrège que les lignes postérieures au dernier build")
+    p_s = sub.add_parser("show")
+    p_s.add_argument("--cluster", type=int, required=True)
+    p_s.add_argument("--level", choices=LEVELS, default="week")
+    p_s.add_argument("--egids", nargs="*")
+    p_s.add_argument("--channels", nargs="*")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if args.cmd == "build":
+        for cid in args.clusters:
+            paths = split_paths(cid, args.split_dirs)
+            if not any(p.exists() for p in paths):
+                logger.warning("Cluster %s : aucun parquet de split", cid)
+                continue
+            build_rollups(cid, paths, channels=tuple(args.channels), incremental=args.incremental)
+    else:
+        df = load_rollup(args.cluster, args.level, channels=args.channels or None, egids=args.egids or None)
+        print(df.head(40).to_string())
+        print(f"{len(df)} lignes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Échantillonnage en un seul passage d'un parquet long (cluster, EGID, …) à mémoire bornée, graine fixe.
+
+Au lieu des ``max_rows`` premières lignes rencontrées (biais vers les premières dates et peu d'EGID) :
+
+- ``uniform`` : réservoir de ``n`` lignes tirées uniformément parmi les lignes du cluster (priorités aléatoires,
+  on garde les ``n`` plus petites ; mémoire O(n)) ;
+- ``stratified`` : un réservoir par strate (EGID, DATA_TYPE, mois) d'au plus ``per_stratum`` lignes, puis
+  répartition équilibrée du budget ``n`` entre strates (mémoire O(strates × per_stratum)).
+
+Le passage ne décode que les colonnes clés (cluster, EGID, DATA_TYPE, date) des row groups retenus
+(``sst_dataset.row_group_units`` : partitions, statistiques, index annexe EGID d'egid_lookup.py). Le résultat est
+un plan « row group → indices locaux » ; l'export (cluster_export.py, ``--sample``) ne relit ensuite que les row
+groups qui contiennent au moins une ligne tirée, avec projection de colonnes. Priorités tirées par row group
+(``default_rng([seed, *clé du row group])``) : plan reproductible, indépendant de l'ordre de lecture.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from egid_lookup import typed_egids
+from sst_dataset import RowGroupUnit, open_stage, row_group_units
+
+MODES = ("uniform", "stratified")
+PER_STRATUM = 50
+STRATA_KEYS = ("EGID", "DATA_TYPE", "date")
+
+
+@dataclass
+class SamplePlan:
+    """Lignes tirées : n° d'unité (``units``) → indices locaux triés (ordre du fichier)."""
+
+    units: list[RowGroupUnit] = field(default_factory=list)
+    row_groups: dict[int, np.ndarray] = field(default_factory=dict)
+    n_candidates: int = 0
+    n_strata: int = 0
+    row_groups_scanned: int = 0
+
+    @property
+    def n_rows(self) -> int:
+        return int(sum(len(v) for v in self.row_groups.values()))
+
+
+def _decoded(col):
+    return col.cast(col.type.value_type) if pa.types.is_dictionary(col.type) else col
+
+
+def _candidates(t: pa.Table, cluster_id: int | None, egid_values: pa.Array | None) -> np.ndarray:
+    """Indices locaux des lignes du cluster / des EGID demandés."""
+    mask = None
+    if cluster_id is not None:
+        col = _decoded(t["cluster"])
+        mask = pc.equal(col, pa.scalar(cluster_id).cast(col.type))
+    if egid_values is not None:
+        col = _decoded(t["EGID"])
+        m = pc.is_in(col, value_set=egid_values.cast(col.type))
+        mask = m if mask is None else pc.and_(mask, m)
+    if mask is None:
+        return np.arange(t.num_rows, dtype=np.int64)
+    return np.flatnonzero(pc.fill_null(mask, False).to_numpy(zero_copy_only=False))
+
+
+def _month_codes(col) -> np.ndarray:
+    """Mois (année × 12 + mois, UTC) d'une colonne date (horodatage ou chaîne)."""
+    col = _decoded(col)
+    if pa.types.is_timestamp(col.type):
+        if col.type.tz is not None:
+            col = col.cast(pa.timestamp(col.type.unit))
+        months = col.to_numpy(zero_copy_only=False).astype("datetime64[M]")
+    else:
+        months = pd.to_datetime(col.to_pandas(), utc=True).dt.tz_localize(None).to_numpy().astype("datetime64[M]")
+    return months.astype(np.int64)
+
+
+class _StratumIds:
+    """Identifiants entiers stables des strates rencontrées (EGID, DATA_TYPE, mois)."""
+
+    def __init__(self):
+        self.ids: dict[tuple, int] = {}
+
+    def __call__(self, t: pa.Table) -> np.ndarray:
+        arrays = [
+            _decoded(t["EGID"]).cast(pa.string()).to_numpy(zero_copy_only=False),
+            _decoded(t["DATA_TYPE"]).to_numpy(zero_copy_only=False),
+            _month_codes(t["date"]),
+        ]
+        codes, uniques = pd.MultiIndex.from_arrays(arrays).factorize()
+        lut = np.array([self.ids.setdefault(u, len(self.ids)) for u in uniques], dtype=np.int64)
+        return lut[codes]
+
+
+def _rank_in_group(groups: np.ndarray) -> np.ndarray:
+    """Rang (0, 1, …) de chaque élément dans son groupe ; ``groups`` déjà trié."""
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    sizes = np.diff(np.r_[starts, len(groups)])
+    return np.arange(len(groups)) - np.repeat(starts, sizes)
+
+
+def _keep_per_stratum(strata: np.ndarray, prio: np.ndarray, k: int) -> np.ndarray:
+    """Indices (dans l'ordre (strate, priorité)) des ``k`` plus petites priorités de chaque strate."""
+    order = np.lexsort((prio, strata))
+    return order[_rank_in_group(strata[order]) < k]
+
+
+def _balanced_budget(strata: np.ndarray, prio: np.ndarray, n: int) -> np.ndarray:
+    """Sélection de ``n`` lignes réparties au plus égal entre strates (remplissage par niveau)."""
+    order = np.lexsort((prio, strata))
+    rank = _rank_in_group(strata[order])
+    counts = np.bincount(rank)  # counts[q] = nb de strates ayant au moins q + 1 lignes
+    cum = np.cumsum(counts)
+    q = int(np.searchsorted(cum, n, side="right"))  # niveaux complets 0..q-1
+    keep = order[rank < q]
+    extra = n - len(keep)
+    if extra > 0:
+        nxt = order[rank == q]
+        keep = np.r_[keep, nxt[np.argsort(prio[nxt], kind="stable")[:extra]]]
+    return keep
+
+
+def plan_sample(
+    path: Path,
+    n_rows: int,
+    cluster_id: int | None = None,
+    mode: str = "uniform",
+    per_stratum: int = PER_STRATUM,
+    seed: int = 0,
+    egids=None,
+) -> SamplePlan:
+    """Plan d'échantillonnage (un passage sur les colonnes clés, mémoire bornée)."""
+    if mode not in MODES:
+        raise ValueError(f"Mode inconnu : {mode} (attendu : {MODES})")
+    schema = open_stage(path).schema
+    egid_values = None if egids is None else typed_egids(egids, schema.field("EGID").type)
+    key_cols = [] if cluster_id is None else ["cluster"]
+    if egids is not None:
+        key_cols.append("EGID")
+    if mode == "stratified":
+        key_cols += [c for c in STRATA_KEYS if c not in key_cols]
+    missing = [c for c in key_cols if c not in schema.names]
+    if missing:
+        raise ValueError(f"Colonnes manquantes dans {path} : {missing}")
+
+    plan = SamplePlan(units=row_group_units(path, cluster_id, egids))
+    offsets = np.r_[0, np.cumsum([u.num_rows for u in plan.units])].astype(np.int64)
+    stratum_of = _StratumIds()
+    kept_gidx = np.zeros(0, dtype=np.int64)
+    kept_prio = np.zeros(0, dtype=np.float64)
+    kept_strata = np.zeros(0, dtype=np.int64)
+
+    for i, u in enumerate(plan.units):
+        plan.row_groups_scanned += 1
+        if key_cols:
+            t = pq.ParquetFile(u.path).read_row_group(u.row_group, columns=key_cols)
+            local = _candidates(t, cluster_id, egid_values)
+        else:
+            t, local = None, np.arange(u.num_rows, dtype=np.int64)
+        if len(local) == 0:
+            continue
+        plan.n_candidates += len(local)
+        prio = np.random.default_rng([seed, *u.key]).random(len(local))
+        gidx = offsets[i] + local
+        if mode == "uniform":
+            kept_gidx = np.r_[kept_gidx, gidx]
+            kept_prio = np.r_[kept_prio, prio]
+            if len(kept_prio) > n_rows:
+                sel = np.argpartition(kept_prio, n_rows - 1)[:n_rows] if n_rows else []
+                kept_gidx, kept_prio = kept_gidx[sel], kept_prio[sel]
+        else:
+            strata = stratum_of(t.take(local))
+            kept_gidx = np.r_[kept_gidx, gidx]
+            kept_prio = np.r_[kept_prio, prio]
+            kept_strata = np.r_[kept_strata, strata]
+            sel = _keep_per_stratum(kept_strata, kept_prio, per_stratum)
+            kept_gidx, kept_prio, kept_strata = kept_gidx[sel], kept_prio[sel], kept_strata[sel]
+
+    if mode == "stratified":
+        plan.n_strata = len(stratum_of.ids)
+        if len(kept_gidx) > n_rows:
+            kept_gidx = kept_gidx[_balanced_budget(kept_strata, kept_prio, n_rows)]
+    kept_gidx = np.sort(kept_gidx)
+    rg_of = np.searchsorted(offsets, kept_gidx, side="right") - 1
+    for i in np.unique(rg_of):
+        plan.row_groups[int(i)] = kept_gidx[rg_of == i] - offsets[i]
+    return plan
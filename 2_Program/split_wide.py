@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Format large d'un split (section 7 de dataset_preparation_V2) : une ligne par pas ``freq`` (``Dates`` UTC),
+colonnes ``{EGID}.{DATA_TYPE}`` (valeur), ``.inv``, ``_fc`` / ``_norm`` et exogènes de la section 6.
+
+Sorti du notebook pour être appelé hors notebook (bench_pipeline.py) ; le notebook l'importe.
+Mode par lots (resource_planner.py) : ``build_split_df`` par lot d'EGID, puis ``merge_split_parts`` — mêmes
+colonnes, même ordre et mêmes valeurs qu'un appel unique sur tout le cluster.
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+from sst_schema import egid_labels
+from stage_profiler import profiled
+
+FEAT_COLS = [
+    "dayofyear_cos",
+    "dayofyear_sin",
+    "dayofweek_cos",
+    "dayofweek_sin",
+    "hour_cos",
+    "hour_sin",
+    "TempExt_norm",
+]
+
+
+def _tempext(dates_range: pd.DatetimeIndex, df_dates_full: pd.DataFrame) -> list[float]:
+    """TempExt de la grille enrichie à chaque pas de ``dates_range`` (0.0 si absent)."""
+    dmin, dmax = dates_range.min(), dates_range.max()
+    dtf = pd.to_datetime(df_dates_full["date_15min"], utc=True)
+    mask = (dtf >= dmin) & (dtf <= dmax)
+    temp_map = (
+        df_dates_full.loc[mask]
+        .assign(date_15min=lambda x: pd.to_datetime(x["date_15min"], utc=True))
+        .set_index("date_15min")["TempExt"]
+    )
+    return [float(temp_map.get(t, 0.0)) for t in dates_range]
+
+
+@profiled("wide_build")
+def build_split_df(df_part: pd.DataFrame, df_dates_full: pd.DataFrame, freq: str = "15min") -> pd.DataFrame | None:
+    """Format large : mesures brutes (valeur, inv) + features déjà calculées en section 6."""
+    if df_part.empty:
+        return None
+    df_part = df_part.copy()
+    # Aligner avec dates_range tz=UTC (sst_filtered_transfo a souvent date_15min naïf = instant UTC)
+    df_part["date_15min"] = pd.to_datetime(df_part["date_15min"], utc=True)
+    dates_range = pd.date_range(
+        df_part["date_15min"].min(),
+        df_part["date_15min"].max(),
+        freq=freq,
+        tz="UTC",
+    )
+    out = pd.DataFrame({"Dates": dates_range})
+    out["TempExt"] = _tempext(dates_range, df_dates_full)
+
+    df_part["col"] = egid_labels(df_part["EGID"]).astype(str) + "." + df_part["DATA_TYPE"].astype(str)
+    pv = df_part.pivot_table(index="date_15min", columns="col", values="valeur", aggfunc="mean")
+    pv_inv = df_part.pivot_table(index="date_15min", columns="col", values="inv", aggfunc="max")
+
+    tfeat = df_part.drop_duplicates(subset=["date_15min"]).set_index("date_15min")
+    tfeat = tfeat[[c for c in FEAT_COLS if c in tfeat.columns]]
+
+    pv_fc = df_part.pivot_table(index="date_15min", columns="col", values="valeur_fc", aggfunc="mean")
+    pv_fc.columns = [f"{c}_fc" for c in pv_fc.columns]
+    pv_nt = df_part.pivot_table(index="date_15min", columns="col", values="valeur_norm", aggfunc="mean")
+    pv_nt.columns = [f"{c}_norm" for c in pv_nt.columns]
+
+    out = out.set_index("Dates")
+    out = out.join(pv.reindex(dates_range), how="left")
+    out = out.join(pv_inv.add_suffix(".inv").reindex(dates_range), how="left")
+    out = out.join(tfeat.reindex(dates_range), how="left")
+    out = out.join(pv_fc.reindex(dates_range), how="left")
+    out = out.join(pv_nt.reindex(dates_range), how="left")
+    return out.reset_index()
+
+
+def merge_split_parts(
+    parts: list[pd.DataFrame | None], df_dates_full: pd.DataFrame, freq: str = "15min"
+) -> pd.DataFrame | None:
+    """Réunit les ``build_split_df`` de lots d'EGID disjoints d'un même split.
+
+    Grille ``Dates`` = plage réunie des lots (TempExt recalculé dessus), colonnes par EGID juxtaposées,
+    encodages / ``TempExt_norm`` du premier lot qui a une ligne à ce pas ; ordre des colonnes d'un appel
+    unique (chaque groupe trié comme par ``pivot_table``).
+    """
+    parts = [p.set_index("Dates") for p in parts if p is not None and not p.empty]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0].reset_index()
+    dates_range = pd.date_range(
+        min(p.index.min() for p in parts), max(p.index.max() for p in parts), freq=freq, tz="UTC", name="Dates"
+    )
+    parts = [p.reindex(dates_range) for p in parts]
+    feat = parts[0][[c for c in FEAT_COLS if c in parts[0].columns]]
+    for p in parts[1:]:
+        feat = feat.combine_first(p[[c for c in FEAT_COLS if c in p.columns]])
+    own = pd.concat([p.drop(columns=[c for c in ["TempExt", *FEAT_COLS] if c in p.columns]) for p in parts], axis=1)
+    groups = {"valeur": [], "inv": [], "fc": [], "norm": []}
+    for c in own.columns:
+        key = "inv" if c.endswith(".inv") else "fc" if c.endswith("_fc") else "norm" if c.endswith("_norm") else "valeur"
+        groups[key].append(c)
+    out = pd.concat([own, feat], axis=1)
+    out.insert(0, "TempExt", _tempext(dates_range, df_dates_full))
+    cols = (
+        ["TempExt"]
+        + sorted(groups["valeur"])
+        + sorted(groups["inv"])
+        + list(feat.columns)
+        + sorted(groups["fc"])
+        + sorted(groups["norm"])
+    )
+    return out[cols].reset_index()
@@ -11,6 +11,8 @@ import gc
 import numpy as np
 import pandas as pd
 
+from stage_profiler import profiled
+
 _Q15_VALID_MIN = 10
 _Q15_REF = 15
 
@@ -106,6 +108,7 @@ def norm_utc_naive_series(s: pd.Series) -> pd.Series:
     return t.dt.tz_localize(None)
 
 
+@profiled("bucket_aggregation_puiscpt")
 def aggregate_puiscpt_to_15min_raw(df_pc: pd.DataFrame) -> pd.DataFrame:
     """
     Réduit les lignes PuisCpt au pas 15 min (même logique que l’agrégation section 4).
@@ -116,16 +119,14 @@ def aggregate_puiscpt_to_15min_raw(df_pc: pd.DataFrame) -> pd.DataFrame:
     if df_pc.empty:
         return df_pc
     df = df_pc.copy()
-    df["_egid"] = df["EGID"].astype(str)
     df["_bucket"] = local_bucket_end_utc(df["date"])
-    gcols = ["_egid", "EGID", "DATA_TYPE", "_bucket"]
+    gcols = ["EGID", "DATA_TYPE", "_bucket"]
     grouped = df.groupby(gcols, sort=False, observed=True)
     try:
         df_out = grouped.apply(_aggregate_bucket_group, include_groups=False)
     except TypeError:
         df_out = grouped.apply(_aggregate_bucket_group)
     df_out = df_out.reset_index()
-    df_out = df_out.drop(columns=["_egid"], errors="ignore")
     df_out["date"] = (
         pd.to_datetime(df_out["_bucket"], utc=True)
         .dt.tz_convert("Europe/Zurich")
@@ -138,18 +139,17 @@ def aggregate_puiscpt_to_15min_raw(df_pc: pd.DataFrame) -> pd.DataFrame:
 def _aggregate_long_all_types(df: pd.DataFrame, *, aggregation_15min: bool, freq: str) -> pd.DataFrame:
     """Groupby complet (comportement historique section 4)."""
     df = df.copy()
-    df["_egid"] = df["EGID"].astype(str)
     if aggregation_15min:
         df["_bucket"] = local_bucket_end_utc(df["date"])
         del df["date"]
         gc.collect()
-        gcols = ["_egid", "EGID", "DATA_TYPE", "_bucket"]
+        gcols = ["EGID", "DATA_TYPE", "_bucket"]
     else:
         loc_ts = localize_zurich_infer_order(df["date"])
         df["_utc_floor"] = loc_ts.dt.tz_convert("UTC").dt.floor(freq)
         del df["date"]
         gc.collect()
-        gcols = ["_egid", "EGID", "DATA_TYPE", "_utc_floor"]
+        gcols = ["EGID", "DATA_TYPE", "_utc_floor"]
 
     grouped = df.groupby(gcols, sort=False, observed=True)
     try:
@@ -158,12 +158,10 @@ def _aggregate_long_all_types(df: pd.DataFrame, *, aggregation_15min: bool, freq
         df_out = grouped.apply(_aggregate_bucket_group)
     df_out = df_out.reset_index()
     rename_bucket = "_bucket" if aggregation_15min else "_utc_floor"
-    df_out = df_out.rename(columns={rename_bucket: "date_15min"}).drop(
-        columns=["_egid"], errors="ignore"
-    )
-    return df_out
+    return df_out.rename(columns={rename_bucket: "date_15min"})
 
 
+@profiled("bucket_aggregation")
 def aggregate_long(
     df: pd.DataFrame,
     *,
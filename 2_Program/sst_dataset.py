@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Jeux de données partitionnés (Hive) des étapes structurées SST (``sst_raw``, ``sst_enriched``, ``sst_filtered``,
+``sst_filtered_clean``, ``sst_filtered_transfo``) au lieu d'un parquet monolithique par étape.
+
+Disposition : ``1_Structured/<étape>/cluster=N/DATA_TYPE=T/year=AAAA/part-00000.parquet`` (``cluster`` absent pour
+``sst_raw`` / ``sst_enriched``, ``year`` = année de ``date``), schéma compact de sst_schema.py, lignes triées par
+(EGID, date) dans chaque fichier, row groups de ``ROW_GROUP_ROWS`` lignes avec statistiques, schéma commun dans
+``_common_metadata``. Écriture par lots (``StageWriter``, mode « lots » de resource_planner.py) : un fichier
+``part-<kkkkk>.parquet`` par lot et par partition, chacun trié (EGID, date). Les colonnes de partition restent aussi dans les fichiers : chaque fichier se lit seul
+(``pq.ParquetFile``) avec toutes ses colonnes.
+
+Lecture (``pyarrow.dataset``) : un filtre cluster / DATA_TYPE / plage de dates écarte les répertoires hors
+partition sans les ouvrir ; un filtre EGID s'appuie sur les min / max par row group (fichiers triés par EGID :
+seuls les row groups du ou des EGID sont décodés). ``row_group_units`` expose les row groups retenus aux outils
+qui travaillent row group par row group (egid_summary.py, row_sampler.py, cluster_export.py).
+
+Les anciens fichiers ``<étape>.parquet`` restent lisibles : ``stage_path`` retient le répertoire partitionné s'il
+existe, sinon le fichier.
+"""
+from __future__ import annotations
+
+import shutil
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from egid_lookup import INDEX_SUFFIX, EgidRowGroupIndex, typed_egids
+from egid_lookup import read_egids as read_egids_file
+from sst_schema import arrow_schema, coerce_long
+
+PARTITION_KEYS = ("cluster", "DATA_TYPE", "year")
+SORT_KEYS = ("EGID", "date")
+ROW_GROUP_ROWS = 262_144
+PART_NAME = "part-{:05d}.parquet"  # numéro du lot : ordre des fichiers = ordre d'écriture
+SCHEMA_FILE = "_common_metadata"
+
+
+@dataclass(frozen=True)
+class RowGroupUnit:
+    """Un row group d'un fichier de l'étape ; ``key`` : identifiant stable (graines d'échantillonnage)."""
+
+    path: Path
+    row_group: int
+    num_rows: int
+    key: tuple[int, ...]
+
+
+def dataset_path(path: Path) -> Path:
+    """Répertoire partitionné d'une étape (``sst_filtered.parquet`` → ``sst_filtered``)."""
+    path = Path(path)
+    return path.with_suffix("") if path.suffix == ".parquet" else path
+
+
+def stage_path(path: Path) -> Path:
+    """Répertoire partitionné s'il existe, sinon ancien fichier ``<étape>.parquet`` s'il existe, sinon le répertoire."""
+    root = dataset_path(path)
+    if root.is_dir():
+        return root
+    legacy = root.with_name(root.name + ".parquet")
+    return legacy if legacy.is_file() else root
+
+
+def stage_exists(path: Path) -> bool:
+    return stage_path(path).exists()
+
+
+def _value_type(t: pa.DataType) -> pa.DataType:
+    return t.value_type if pa.types.is_dictionary(t) else t
+
+
+class StageWriter:
+    """Écriture d'une étape lot par lot : ``append`` ajoute ``part-<kkkkk>.parquet`` dans chaque partition touchée,
+    ``commit`` écrit le schéma commun et bascule le répertoire (atomique, comme ``write_stage``).
+
+    Schéma (compact) et clés de partition fixés par le premier lot ; la mémoire reste celle d'un lot.
+    """
+
+    def __init__(self, path: Path, row_group_size: int = ROW_GROUP_ROWS):
+        self.root = dataset_path(path)
+        self.row_group_size = row_group_size
+        self.tmp = self.root.with_name(self.root.name + ".tmp")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.schema: pa.Schema | None = None
+        self.keys: list[str] = []
+        self.rows = 0
+        self._parts: dict[Path, int] = {}
+
+    def append(self, df: pd.DataFrame) -> "StageWriter":
+        coerce_long(df)
+        if self.schema is None:
+            self.keys = [k for k in PARTITION_KEYS[:2] if k in df.columns]
+            self.schema = arrow_schema(df)
+        if df.empty:
+            return self
+        missing = [k for k in self.keys if df[k].isna().any()]
+        if missing:
+            raise ValueError(f"{self.root.name} : clé de partition manquante ({', '.join(missing)}) sur certaines lignes")
+        year = df["date"].dt.year.astype(np.int16).rename("year")
+        groups = df.groupby([df[k] for k in self.keys] + [year], observed=True, sort=True).indices
+        for values, idx in groups.items():
+            values = values if isinstance(values, tuple) else (values,)
+            part = df.iloc[idx].sort_values(list(SORT_KEYS), kind="stable")
+            out = self.tmp.joinpath(*(f"{k}={v}" for k, v in zip(self.keys + ["year"], values)))
+            out.mkdir(parents=True, exist_ok=True)
+            n = self._parts.get(out, 0)
+            self._parts[out] = n + 1
+            table = pa.Table.from_pandas(part, schema=self.schema, preserve_index=False)
+            pq.write_table(table, out / PART_NAME.format(n), compression="zstd", row_group_size=self.row_group_size)
+        self.rows += len(df)
+        return self
+
+    def commit(self) -> Path:
+        if self.schema is None:
+            raise ValueError(f"Aucun lot écrit pour {self.root}")
+        pq.write_metadata(self.schema.append(pa.field("year", pa.int16())), self.tmp / SCHEMA_FILE)
+        if self.root.exists():
+            shutil.rmtree(self.root)
+        self.tmp.rename(self.root)
+        return self.root
+
+    def abort(self) -> None:
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def write_stage(df: pd.DataFrame, path: Path, row_group_size: int = ROW_GROUP_ROWS) -> Path:
+    """Écrit une étape en jeu partitionné (remplacement complet, bascule atomique du répertoire) ; retourne sa racine."""
+    return StageWriter(path, row_group_size).append(df).commit()
+
+
+def stage_schema(root: Path) -> pa.Schema:
+    """Schéma commun d'un jeu partitionné (colonnes des fichiers + ``year``)."""
+    meta = Path(root) / SCHEMA_FILE
+    if meta.is_file():
+        return pq.read_schema(meta).remove_metadata()
+    first = next(iter(sorted(Path(root).rglob("*.parquet"))), None)
+    if first is None:
+        raise FileNotFoundError(f"Aucun fichier parquet dans {root}")
+    return pq.read_schema(first).remove_metadata().append(pa.field("year", pa.int16()))
+
+
+def open_stage(path: Path) -> ds.Dataset:
+    """Dataset Arrow d'une étape (partitionnée ou ancien fichier)."""
+    p = stage_path(path)
+    if not p.is_dir():
+        return ds.dataset(p, format="parquet")
+    schema = stage_schema(p)
+    part_schema = pa.schema(
+        [pa.field(k, _value_type(schema.field(k).type)) for k in PARTITION_KEYS if k in schema.names]
+    )
+    return ds.dataset(p, format="parquet", partitioning=ds.partitioning(part_schema, flavor="hive"), schema=schema)
+
+
+def _timestamp(value, arrow_type: pa.DataType) -> pa.Scalar:
+    ts = pd.Timestamp(value)
+    if arrow_type.tz is None and ts.tz is not None:
+        ts = ts.tz_convert(None)
+    elif arrow_type.tz is not None and ts.tz is None:
+        ts = ts.tz_localize(arrow_type.tz)
+    return pa.scalar(ts, type=arrow_type)
+
+
+def stage_filter(
+    schema: pa.Schema,
+    clusters=None,
+    data_types=None,
+    egids=None,
+    start=None,
+    end=None,
+) -> ds.Expression | None:
+    """Filtre Arrow : clusters, types, EGID, ``start <= date < end`` (avec élagage par ``year``)."""
+    parts = []
+    if clusters is not None:
+        t = _value_type(schema.field("cluster").type)
+        parts.append(ds.field("cluster").isin(pa.array([int(c) for c in clusters], type=t)))
+    if data_types is not None:
+        parts.append(ds.field("DATA_TYPE").isin(pa.array([str(d) for d in data_types], type=pa.string())))
+    if egids is not None:
+        parts.append(ds.field("EGID").isin(typed_egids(egids, schema.field("EGID").type)))
+    has_year = "year" in schema.names
+    if start is not None:
+        parts.append(ds.field("date") >= _timestamp(start, schema.field("date").type))
+        if has_year:
+            parts.append(ds.field("year") >= pa.scalar(pd.Timestamp(start).year, type=pa.int16()))
+    if end is not None:
+        parts.append(ds.field("date") < _timestamp(end, schema.field("date").type))
+        if has_year:
+            parts.append(ds.field("year") <= pa.scalar(pd.Timestamp(end).year, type=pa.int16()))
+    flt = None
+    for p in parts:
+        flt = p if flt is None else flt & p
+    return flt
+
+
+def read_stage(
+    path: Path,
+    columns: list[str] | None = None,
+    clusters=None,
+    data_types=None,
+    egids=None,
+    start=None,
+    end=None,
+) -> pd.DataFrame:
+    """Lit une étape (colonnes demandées, partitions et row groups élagués) au schéma compact."""
+    dataset = open_stage(path)
+    cols = columns or [n for n in dataset.schema.names if n != "year"]
+    flt = stage_filter(dataset.schema, clusters, data_types, egids, start, end)
+    return coerce_long(dataset.to_table(columns=cols, filter=flt).to_pandas())
+
+
+def stage_partitions(path: Path, key: str = "cluster") -> list:
+    """Valeurs d'une clé de partition présentes (noms de répertoires, sans lecture) ; colonne lue si ancien fichier.
+
+    Pour ``cluster``, les valeurs négatives (ancien remplissage -1 des EGID sans cluster GIS) et nulles sont ignorées.
+    """
+    p = stage_path(path)
+    if p.is_dir():
+        vals = {d.name.split("=", 1)[1] for d in p.rglob(f"{key}=*") if d.is_dir()}
+        vals.discard("__HIVE_DEFAULT_PARTITION__")
+        cast = str if key == "DATA_TYPE" else int
+        out = sorted(cast(v) for v in vals)
+    else:
+        col = pq.read_table(p, columns=[key]).column(0).combine_chunks()
+        out = sorted(v for v in pc.unique(col.cast(_value_type(col.type))).to_pylist() if v is not None)
+    return [v for v in out if v >= 0] if key == "cluster" else out
+
+
+def stage_files(path: Path, clusters=None, data_types=None) -> list[Path]:
+    """Fichiers d'une étape, restreints aux partitions demandées (l'ancien fichier seul sinon)."""
+    p = stage_path(path)
+    if not p.is_dir():
+        return [p]
+    dataset = open_stage(p)
+    flt = stage_filter(dataset.schema, clusters, data_types)
+    return sorted(Path(f.path) for f in dataset.get_fragments(filter=flt))
+
+
+def _stats_overlap(st, values: list) -> bool:
+    if st is None or not st.has_min_max:
+        return True
+    lo, hi = st.min, st.max
+    if isinstance(lo, bytes):
+        lo, hi = lo.decode("utf-8", "replace"), hi.decode("utf-8", "replace")
+    return any(lo <= v <= hi for v in values)
+
+
+def row_group_units(path: Path, cluster_id: int | None = None, egids=None) -> list[RowGroupUnit]:
+    """Row groups pouvant contenir le cluster / les EGID demandés : partitions, statistiques, index annexe EGID."""
+    p = stage_path(path)
+    files = stage_files(p, None if cluster_id is None else [cluster_id])
+    single = not p.is_dir()
+    units = []
+    for f in files:
+        pf = pq.ParquetFile(f)
+        schema = pf.schema_arrow
+        keep = range(pf.num_row_groups)
+        if egids is not None and single and f.with_name(f.name + INDEX_SUFFIX).is_file():
+            keep = EgidRowGroupIndex.for_file(f).row_groups(egids)
+        ci = schema.get_field_index("cluster") if cluster_id is not None else -1
+        ei = schema.get_field_index("EGID") if egids is not None else -1
+        wanted = None if egids is None else typed_egids(egids, schema.field("EGID").type).to_pylist()
+        fkey = () if single else (zlib.crc32(f.relative_to(p).as_posix().encode("utf-8")),)
+        for rg in keep:
+            md = pf.metadata.row_group(rg)
+            if ci >= 0 and not _stats_overlap(md.column(ci).statistics, [cluster_id]):
+                continue
+            if ei >= 0 and not _stats_overlap(md.column(ei).statistics, wanted):
+                continue
+            units.append(RowGroupUnit(f, rg, md.num_rows, fkey + (rg,)))
+    return units
+
+
+def read_egids(path: Path, egids, columns: list[str] | None = None) -> pd.DataFrame:
+    """Lignes des EGID demandés (colonne EGID en ``str``, comme egid_lookup.read_egids)."""
+    p = stage_path(path)
+    if not p.is_dir():
+        return read_egids_file(p, egids, columns)
+    dataset = open_stage(p)
+    cols = None if columns is None else list(dict.fromkeys(["EGID"] + list(columns)))
+    cols = cols or [n for n in dataset.schema.names if n != "year"]
+    df = dataset.to_table(columns=cols, filter=stage_filter(dataset.schema, egids=egids)).to_pandas()
+    df["EGID"] = df["EGID"].astype(str)
+    return df
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Schéma compact commun des tables longues SST (``sst_raw``, ``sst_enriched``, ``sst_filtered``,
+``sst_filtered_clean``, ``sst_filtered_transfo``) et lecteurs / écrivains qui l'imposent.
+
+| Colonne(s)                              | pandas                     | Parquet (Arrow)                    |
+|-----------------------------------------|----------------------------|------------------------------------|
+| ``EGID``                                | ``int32``                  | ``int32`` (dictionnaire si non numérique) |
+| ``DATA_TYPE``                           | ``category`` (DATA_TYPES)  | ``dictionary<int8, string>``       |
+| ``inv``                                 | ``int8``                   | ``int8``                           |
+| ``cluster``                             | ``int8`` (``Int8`` si manquant) | ``int8`` (nullable)           |
+| mesures et variables (``valeur``, …)    | ``float32``                | ``float32``                        |
+| ``date``, ``date_15min``                | ``datetime64[ns(, UTC)]``  | ``timestamp[ns]`` (entier int64)   |
+
+Les horodatages restent dans leur convention d'étape (``date`` : heure murale Zurich naïve, nécessaire à
+l'inférence DST de sst_bucket_aggregate ; ``date_15min`` : instant UTC) ; seule l'unité est fixée (ns).
+
+Pour éviter ``df["EGID"].astype(str)`` sur des dizaines de millions de lignes : ``egid_labels``,
+``egid_isin`` et ``egid_map`` ne convertissent que les EGID distincts.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATA_TYPES = ("TempRet", "PuisCpt", "PosVan")
+INT8_COLUMNS = ("inv", "cluster")
+FLOAT32_COLUMNS = (
+    "valeur",
+    "valeur_fc",
+    "valeur_norm",
+    "TempExt",
+    "TempExt_norm",
+    "dayofyear_cos",
+    "dayofyear_sin",
+    "hour_cos",
+    "hour_sin",
+)
+TIMESTAMP_COLUMNS = ("date", "date_15min")
+ROW_GROUP_ROWS = 1_000_000
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def egid_column(s: pd.Series) -> pd.Series:
+    """EGID en ``int32`` si toutes les valeurs sont entières, sinon ``category`` de chaînes (dictionnaire)."""
+    if isinstance(s.dtype, pd.CategoricalDtype) and not pd.api.types.is_integer_dtype(s.cat.categories.dtype):
+        s = s.astype(str)
+    if pd.api.types.is_integer_dtype(s.dtype):
+        if s.empty or (s.min() >= 0 and s.max() <= _INT32_MAX):
+            return s.astype(np.int32)
+    codes, uniq = pd.factorize(s)
+    num = pd.to_numeric(pd.Index(uniq).astype(str), errors="coerce")
+    ok = (
+        num.notna().all()
+        and (num == np.floor(num)).all()
+        and (len(num) == 0 or (num.min() >= 0 and num.max() <= _INT32_MAX))
+    )
+    if ok and (codes >= 0).all():
+        return pd.Series(num.to_numpy(dtype=np.int64).astype(np.int32)[codes], index=s.index, name=s.name)
+    return pd.Series(pd.Categorical.from_codes(codes, pd.Index(uniq).astype(str)), index=s.index, name=s.name)
+
+
+def data_type_column(s: pd.Series) -> pd.Series:
+    """DATA_TYPE en ``category`` aux catégories fixes (DATA_TYPES d'abord, types inconnus ensuite)."""
+    if isinstance(s.dtype, pd.CategoricalDtype) and tuple(s.cat.categories[: len(DATA_TYPES)]) == DATA_TYPES:
+        return s
+    values = s.astype(str)
+    extra = sorted(set(values.unique()) - set(DATA_TYPES) - {"nan", "None"})
+    return values.astype(pd.CategoricalDtype(list(DATA_TYPES) + extra))
+
+
+def coerce_long(df: pd.DataFrame) -> pd.DataFrame:
+    """Applique le schéma compact aux colonnes connues (en place) ; retourne ``df``."""
+    if "EGID" in df.columns:
+        df["EGID"] = egid_column(df["EGID"])
+    if "DATA_TYPE" in df.columns:
+        df["DATA_TYPE"] = data_type_column(df["DATA_TYPE"])
+    if "inv" in df.columns and df["inv"].dtype != np.int8:  # inv manquant = invalide
+        df["inv"] = pd.to_numeric(df["inv"], errors="coerce").fillna(1).astype(np.int8)
+    if "cluster" in df.columns and df["cluster"].dtype != np.int8:
+        # cluster manquant reste manquant (Int8 nullable) : pas de valeur sentinelle prise pour un vrai cluster
+        s = pd.to_numeric(df["cluster"], errors="coerce")
+        df["cluster"] = s.astype(np.int8 if s.notna().all() else "Int8")
+    for c in df.columns:
+        if c in TIMESTAMP_COLUMNS:
+            if not pd.api.types.is_datetime64_any_dtype(df[c].dtype):
+                df[c] = pd.to_datetime(df[c])
+            tz = getattr(df[c].dt, "tz", None)
+            want = pd.DatetimeTZDtype("ns", tz) if tz is not None else np.dtype("datetime64[ns]")
+            if df[c].dtype != want:
+                df[c] = df[c].astype(want)
+        elif c in FLOAT32_COLUMNS or (pd.api.types.is_float_dtype(df[c].dtype) and c not in INT8_COLUMNS):
+            if df[c].dtype != np.float32:
+                df[c] = pd.to_numeric(df[c], errors="coerce").astype(np.float32)
+    return df
+
+
+def arrow_schema(df: pd.DataFrame) -> pa.Schema:
+    """Schéma Arrow d'un DataFrame déjà passé par ``coerce_long``."""
+    fields = []
+    for c in df.columns:
+        dt = df[c].dtype
+        if c == "EGID":
+            t = pa.int32() if dt == np.int32 else pa.dictionary(pa.int32(), pa.string())
+        elif c == "DATA_TYPE":
+            t = pa.dictionary(pa.int8(), pa.string())
+        elif c in INT8_COLUMNS:
+            t = pa.int8()
+        elif dt == np.float32:
+            t = pa.float32()
+        elif c in TIMESTAMP_COLUMNS:
+            t = pa.timestamp("ns", tz=str(df[c].dt.tz) if getattr(df[c].dt, "tz", None) is not None else None)
+        else:
+            t = pa.Schema.from_pandas(df[[c]], preserve_index=False).field(c).type
+        fields.append(pa.field(c, t))
+    return pa.schema(fields)
+
+
+def write_long(df: pd.DataFrame, path: Path, row_group_size: int = ROW_GROUP_ROWS) -> None:
+    """Écrit une table longue au schéma compact (zstd, statistiques de colonnes)."""
+    coerce_long(df)
+    table = pa.Table.from_pandas(df, schema=arrow_schema(df), preserve_index=False)
+    pq.write_table(table, path, compression="zstd", row_group_size=row_group_size)
+
+
+def read_long(path: Path, columns: list[str] | None = None, **kwargs) -> pd.DataFrame:
+    """Lit une table longue et impose le schéma compact (fichiers antérieurs compris)."""
+    return coerce_long(pd.read_parquet(path, columns=columns, engine="pyarrow", **kwargs))
+
+
+def _codes(s: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    codes, uniq = pd.factorize(s)
+    return codes, pd.Index(uniq).astype(str)
+
+
+def egid_labels(s: pd.Series) -> pd.Series:
+    """EGID en libellés texte (``category``) : conversion des seules valeurs distinctes."""
+    codes, labels = _codes(s)
+    if labels.has_duplicates:  # ex. 1511115 et "1511115" mélangés
+        uniq = labels.unique()
+        codes = np.where(codes >= 0, uniq.get_indexer(labels)[codes], -1)
+        labels = uniq
+    return pd.Series(pd.Categorical.from_codes(codes, labels), index=s.index, name=s.name)
+
+
+def egid_isin(s: pd.Series, egids) -> pd.Series:
+    """Masque ``str(EGID) in egids`` calculé sur les EGID distincts."""
+    codes, labels = _codes(s)
+    hit = np.r_[labels.isin({str(e) for e in egids}), False]
+    return pd.Series(hit[codes], index=s.index)
+
+
+def egid_map(s: pd.Series, mapping: dict) -> pd.Series:
+    """``str(EGID)`` → ``mapping`` (clés texte), calculé sur les EGID distincts ; NaN si absent."""
+    codes, labels = _codes(s)
+    vals = pd.Series(labels).map({str(k): v for k, v in mapping.items()})
+    out = pd.Series(vals.to_numpy()[codes], index=s.index, name=s.name)
+    return out.where(codes >= 0) if (codes < 0).any() else out
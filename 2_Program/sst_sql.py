@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+Moteur SQL hors mémoire (DuckDB) des sections 3 à 5 de dataset_preparation_V2, choisi par section
+(``STAGE_BACKENDS`` en section 1) à la place du chemin pandas :
+
+| Section | Fonction        | Entrée → sortie                       | Opérations                                        |
+|---------|-----------------|---------------------------------------|---------------------------------------------------|
+| 3       | ``enrich_stage`` | ``sst_raw`` → ``sst_enriched``         | heure murale Zurich → UTC, jointure météo         |
+| 4       | ``filter_stage`` | ``sst_enriched`` → ``sst_filtered``    | GIS, qualité brute, 15 min règle 10/15, météo (asof), chevauchement, étendue alignée |
+| 5       | ``clean_stage``  | ``sst_filtered`` → ``sst_filtered_clean`` | PuisCpt inv≠0 → 0, TempRet inv≠0 → médiane par EGID |
+
+Requêtes directement sur les fichiers Parquet des étapes (sst_dataset.py) : DuckDB utilise tous les cœurs et
+déborde sur disque (``PATH_SQL_WORK``) au-delà de ``memory_limit`` ; tables intermédiaires de la section 4 dans
+une base fichier du même répertoire. Résultat lu par lots Arrow (``BATCH_ROWS``) et écrit par
+``sst_dataset.StageWriter`` fourni par l'appelant (``commit`` / ``abort`` comme pour les lots pandas).
+
+Sorties identiques au chemin pandas (lignes, schéma compact, ordre de lecture) :
+
+- ``_pos`` : position de la ligne dans l'ordre de lecture de ``read_stage`` / ``load_sorted`` (fichiers triés),
+  départage des égalités comme les tris stables pandas ;
+- heure murale → UTC par une table des heures locales de la plage (pandas) : heure répétée d'automne à l'heure
+  d'été (section 3, ``ambiguous=True``), heure absente décalée à la fin du saut (``shift_forward``) ; en section 4,
+  les jours de changement d'heure d'automne passent par ``sst_bucket_aggregate`` (rang d'apparition des heures
+  répétées, comme ``localize_zurich_infer_order``) ;
+- moyennes 10/15 en float64 : fenêtres d'une ou deux valeurs (pas 15 min, PuisCpt pré-agrégé) identiques ;
+  au-delà, l'ordre de sommation peut différer au dernier bit float32.
+
+Dépendance optionnelle (``duckdb``, requirements-optional.txt) : ``available()`` ; sans elle, les sections 3 à 5
+restent sur le chemin pandas. Contrôle d'équivalence sur export synthétique : check_sql_backend.py.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sst_bucket_aggregate import local_bucket_end_utc, localize_zurich_infer_order, norm_utc_naive_series
+from sst_dataset import StageWriter, stage_files
+from validity_index import GRID_ORIGIN
+
+try:
+    import duckdb
+except ImportError:  # backend pandas seul
+    duckdb = None
+
+ROOT = Path(__file__).resolve().parent
+PATH_SQL_WORK = ROOT / "0_Data" / "1_Structured" / "_duckdb"
+
+BACKENDS = ("pandas", "duckdb")
+SQL_STAGES = ("enrich", "filter", "clean")
+ZONE = "Europe/Zurich"
+BATCH_ROWS = 1_048_576
+_NS_PER_YEAR = 365.25 * 86400.0 * 1e9  # comme dataset_preparation_V2, section 4
+_NS_HOUR = 3_600_000_000_000
+_NS_DAY = 86_400_000_000_000
+_NS_MIN = 60_000_000_000
+
+
+@dataclass
+class FilterCounts:
+    """Effectifs de la section 4, aux mêmes étapes que ``filter_batch`` (notebook)."""
+
+    rows_in: int  # après filtre GIS
+    egids_pre: int  # EGID retenus par le filtre qualité brute
+    rows_pre: int
+    rows_agg: int
+    rows_overlap: int
+    egids_overlap: int
+    egids_out: int
+    rows_out: int
+
+
+def available() -> bool:
+    return duckdb is not None
+
+
+def check_backends(backends: dict) -> None:
+    """Valide ``STAGE_BACKENDS`` (section 1) : sections et moteurs connus, duckdb installé si demandé."""
+    for stage, backend in backends.items():
+        if stage not in SQL_STAGES or backend not in BACKENDS:
+            raise ValueError(f"Backend inconnu {stage!r} → {backend!r} (sections {SQL_STAGES}, moteurs {BACKENDS})")
+    if "duckdb" in backends.values() and duckdb is None:
+        raise ImportError("Backend duckdb demandé mais module absent (pip install duckdb)")
+
+
+def connect(
+    memory_limit_gb: float | None = None,
+    threads: int | None = None,
+    work_dir: Path = PATH_SQL_WORK,
+) -> "duckdb.DuckDBPyConnection":
+    """Connexion de travail : base fichier et débordement dans ``work_dir`` ; tous les cœurs sauf ``threads``."""
+    if duckdb is None:
+        raise ImportError("Backend duckdb : module absent (pip install duckdb)")
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    con = duckdb.connect(str(work_dir / "stages.duckdb"))
+    con.execute(f"SET temp_directory = '{_sql_str(work_dir.resolve().as_posix())}'")
+    con.execute("SET preserve_insertion_order = true")
+    if memory_limit_gb:
+        con.execute(f"SET memory_limit = '{float(memory_limit_gb):g}GB'")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    return con
+
+
+# --- lecture des étapes, fuseau -------------------------------------------------------------------------------
+
+
+def _sql_str(s: str) -> str:
+    return s.replace("'", "''")
+
+
+def _scan(con, path: Path, name: str) -> int:
+    """Vue ``name`` sur les fichiers de l'étape, plus ``_pos`` (ordre de lecture) ; retourne le nombre de fichiers."""
+    files = [f.resolve().as_posix() for f in stage_files(path)]
+    if not files:
+        raise FileNotFoundError(f"Aucun fichier parquet pour {path}")
+    con.register(f"{name}_files", pd.DataFrame({"filename": files, "_file": np.arange(len(files), dtype=np.int64)}))
+    paths = ", ".join(f"'{_sql_str(f)}'" for f in files)
+    con.execute(
+        f"""
+        CREATE OR REPLACE TEMP VIEW {name} AS
+        SELECT s.* EXCLUDE (filename, file_row_number), (f._file << 40) + s.file_row_number AS _pos
+        FROM read_parquet([{paths}], filename = true, file_row_number = true, hive_partitioning = false,
+                          union_by_name = true) s
+        JOIN {name}_files f USING (filename)
+        """
+    )
+    return len(files)
+
+
+def _date_bounds(con, view: str, column: str = "date") -> tuple[int, int] | None:
+    lo, hi = con.execute(f"SELECT epoch_ns(min({column})), epoch_ns(max({column})) FROM {view}").fetchone()
+    return None if lo is None else (int(lo), int(hi))
+
+
+def date_bounds(con, path: Path, column: str = "date") -> tuple[pd.Timestamp, pd.Timestamp]:
+    """Première et dernière valeur de ``column`` d'une étape (NaT si vide), sans la charger."""
+    _scan(con, path, "_bounds")
+    b = _date_bounds(con, "_bounds", column)
+    return (pd.NaT, pd.NaT) if b is None else (pd.Timestamp(b[0], unit="ns"), pd.Timestamp(b[1], unit="ns"))
+
+
+def head(con, path: Path, n: int = 5) -> pd.DataFrame:
+    """Premières lignes d'une étape dans l'ordre de lecture (aperçu de fin de section)."""
+    _scan(con, path, "_head")
+    return con.execute(f"SELECT * EXCLUDE (_pos) FROM _head ORDER BY _pos LIMIT {int(n)}").df()
+
+
+def _register_zone(con, bounds: tuple[int, int]) -> None:
+    """Tables horaires Zurich ↔ UTC sur la plage (± 1 jour) :
+
+    - ``_wall_hours`` : heure murale → début en UTC (heure d'été si répétée, fin du saut si absente), ``gap`` ;
+    - ``_fold_days`` : jours (muraux) contenant l'heure répétée d'automne ;
+    - ``_utc_hours`` : heure UTC → décalage de l'heure murale.
+    """
+    lo = pd.Timestamp(bounds[0], unit="ns").floor("D") - pd.Timedelta(days=1)
+    hi = pd.Timestamp(bounds[1], unit="ns").ceil("D") + pd.Timedelta(days=1)
+    wall = pd.date_range(lo, hi, freq="h", unit="ns")
+    dst = np.ones(len(wall), dtype=bool)
+    start = wall.tz_localize(ZONE, ambiguous=dst, nonexistent="shift_forward")
+    gap = wall.tz_localize(ZONE, ambiguous=dst, nonexistent="NaT").isna()
+    fold = wall.tz_localize(ZONE, ambiguous="NaT", nonexistent="shift_forward").isna()
+    con.register("_wall_hours", pd.DataFrame({"hour_ns": wall.asi8, "utc_ns": start.asi8, "gap": gap}))
+    con.register("_fold_days", pd.DataFrame({"day_ns": np.unique(wall[fold].normalize().asi8)}))
+    utc = pd.date_range(lo - pd.Timedelta(days=1), hi, freq="h", tz="UTC", unit="ns")
+    offset = utc.tz_convert(ZONE).tz_localize(None).asi8 - utc.asi8
+    con.register("_utc_hours", pd.DataFrame({"hour_ns": utc.asi8, "offset_ns": offset}))
+
+
+def _stream(con, sql: str, writer: StageWriter, params: dict | None = None, utc_columns=()) -> int:
+    """Exécute ``sql`` et écrit le résultat lot par lot ; schéma fixé même si le résultat est vide."""
+    reader = con.execute(sql, params or {}).fetch_record_batch(BATCH_ROWS)
+    n = 0
+    for batch in reader:
+        df = batch.to_pandas()
+        for c in utc_columns:
+            df[c] = df[c].dt.tz_localize("UTC")
+        writer.append(df)
+        n += len(df)
+    if n == 0:
+        df = reader.schema.empty_table().to_pandas()
+        for c in utc_columns:
+            df[c] = df[c].dt.tz_localize("UTC")
+        writer.append(df)
+    return n
+
+
+# --- section 3 -------------------------------------------------------------------------------------------------
+
+
+def enrich_stage(con, path_raw: Path, writer: StageWriter, dates: pd.DataFrame, freq: str) -> int:
+    """Section 3 : ``date_15min`` = UTC de l'heure murale arrondi à ``freq`` (inférieur), ``TempExt`` de ``dates``
+    (``Dates`` UTC, ``TempExt``) par jointure exacte, 0 si absente ; retourne le nombre de lignes écrites."""
+    _scan(con, path_raw, "_raw")
+    bounds = _date_bounds(con, "_raw")
+    _register_zone(con, bounds or (0, 0))
+    utc = pd.to_datetime(dates["Dates"], utc=True)
+    con.register(
+        "_dates",
+        pd.DataFrame({"_t": utc.dt.tz_localize(None).dt.as_unit("ns").astype(np.int64), "TempExt": dates["TempExt"]}),
+    )
+    sql = f"""
+        WITH r AS (
+            SELECT s.*,
+                   CASE WHEN w.gap THEN w.utc_ns ELSE w.utc_ns + epoch_ns(s.date) - w.hour_ns END AS _u
+            FROM _raw s
+            LEFT JOIN _wall_hours w ON w.hour_ns = epoch_ns(s.date) - epoch_ns(s.date) % {_NS_HOUR}
+        )
+        SELECT r.* EXCLUDE (_pos, _u),
+               make_timestamp_ns(r._u - r._u % $step) AS date_15min,
+               coalesce(d.TempExt, 0.0) AS TempExt
+        FROM r
+        LEFT JOIN _dates d ON d._t = r._u - r._u % $step
+        ORDER BY r.EGID, r.date, r._pos
+    """
+    return _stream(con, sql, writer, {"step": int(pd.Timedelta(freq).value)}, utc_columns=("date_15min",))
+
+
+# --- section 4 -------------------------------------------------------------------------------------------------
+
+
+def _fold_times(con, aggregation_15min: bool, freq: str) -> pd.DataFrame:
+    """Jours de l'heure répétée : ``date_15min`` calculé par sst_bucket_aggregate, appel par appel (``_call``)
+    dans l'ordre de lecture, comme ``aggregate_long``."""
+    rows = con.execute("SELECT _pos, _call, date FROM _l WHERE _fold ORDER BY _call, _pos").df()
+    parts = [pd.DataFrame({"_pos": np.zeros(0, np.int64), "_t": np.zeros(0, np.int64)})]
+    for _, g in rows.groupby("_call", sort=True):
+        dates = g["date"].reset_index(drop=True)
+        if aggregation_15min:
+            t = local_bucket_end_utc(dates)
+        else:
+            t = localize_zurich_infer_order(dates).dt.tz_convert("UTC").dt.floor(freq)
+        ns = norm_utc_naive_series(t).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        parts.append(pd.DataFrame({"_pos": g["_pos"].to_numpy(dtype=np.int64), "_t": ns}))
+    return pd.concat(parts, ignore_index=True)
+
+
+def _count(con, sql: str) -> int:
+    return int(con.execute(sql).fetchone()[0])
+
+
+def filter_stage(
+    con,
+    path_enriched: Path,
+    writer: StageWriter,
+    egid_to_cluster: dict,
+    *,
+    min_years: float,
+    min_valid_ratio: float,
+    aggregation_15min: bool,
+    freq: str,
+    puiscpt_preaggregated: bool,
+) -> FilterCounts:
+    """Section 4 (4.1, 4.5 à 4.10) en requêtes ; ``writer`` reçoit les lignes (rien si aucun EGID ne passe)."""
+    _scan(con, path_enriched, "_enr")
+    bounds = _date_bounds(con, "_enr")
+    _register_zone(con, bounds or (0, 0))
+    con.register(
+        "_gis",
+        pd.DataFrame(
+            {"egid": [str(k) for k in egid_to_cluster], "cluster": np.asarray(list(egid_to_cluster.values()), np.int64)}
+        ),
+    )
+    step = int(pd.Timedelta(freq).value)
+    params = {"ns_year": _NS_PER_YEAR, "min_years": float(min_years), "ratio": float(min_valid_ratio)}
+
+    # 4.1  Filtre GIS
+    con.execute(
+        """
+        CREATE OR REPLACE TABLE _f AS
+        SELECT e._pos, e.date, e.EGID, e.DATA_TYPE, e.valeur, coalesce(e.inv, 1)::TINYINT AS inv
+        FROM _enr e
+        WHERE CAST(e.EGID AS VARCHAR) IN (SELECT egid FROM _gis)
+        """
+    )
+    rows_in = _count(con, "SELECT count(*) FROM _f")
+
+    # 4.5  Qualité brute : étendue et part inv=0 par type
+    con.execute(
+        """
+        CREATE OR REPLACE TABLE _keep AS
+        WITH s AS (
+            SELECT EGID, DATA_TYPE,
+                   (epoch_ns(max(date)) - epoch_ns(min(date)))::DOUBLE / $ns_year AS span,
+                   count_if(inv = 0)::DOUBLE / count(*) AS ratio
+            FROM _f WHERE DATA_TYPE IN ('TempRet', 'PuisCpt')
+            GROUP BY EGID, DATA_TYPE
+        )
+        SELECT EGID FROM s
+        GROUP BY EGID
+        HAVING count(*) = 2 AND bool_and(NOT coalesce(span < $min_years OR ratio < $ratio, false))
+        """,
+        params,
+    )
+    egids_pre = _count(con, "SELECT count(*) FROM _keep")
+    if egids_pre == 0:
+        return FilterCounts(rows_in, 0, 0, 0, 0, 0, 0, 0)
+
+    # 4.6  Pas de temps : heure murale → UTC (table horaire ; jours de l'heure répétée via pandas)
+    split_pc = aggregation_15min and puiscpt_preaggregated
+    con.execute(
+        f"""
+        CREATE OR REPLACE TABLE _l AS
+        SELECT f._pos, f.EGID, f.DATA_TYPE, f.valeur, f.inv, f.date,
+               CASE WHEN {str(split_pc).lower()} AND f.DATA_TYPE = 'PuisCpt' THEN 1 ELSE 0 END AS _call,
+               epoch_ns(f.date) - epoch_ns(f.date) % {_NS_DAY} IN (SELECT day_ns FROM _fold_days) AS _fold,
+               w.gap, w.utc_ns, epoch_ns(f.date) - w.hour_ns AS _into
+        FROM _f f
+        JOIN _keep USING (EGID)
+        LEFT JOIN _wall_hours w ON w.hour_ns = epoch_ns(f.date) - epoch_ns(f.date) % {_NS_HOUR}
+        """
+    )
+    rows_pre = _count(con, "SELECT count(*) FROM _l")
+    con.register("_fold_t", _fold_times(con, aggregation_15min, freq))
+    if aggregation_15min:
+        # fin de cadre locale :15 / :30 / :45 / :00 suivante, en UTC (sst_bucket_aggregate.local_bucket_end_utc)
+        t_sql = f"""CASE WHEN gap THEN utc_ns + {15 * _NS_MIN}
+                    ELSE utc_ns + _into % 1000 + CASE WHEN _into // {_NS_MIN} <= 14 THEN 15
+                                                      WHEN _into // {_NS_MIN} <= 29 THEN 30
+                                                      WHEN _into // {_NS_MIN} <= 44 THEN 45
+                                                      ELSE 60 END * {_NS_MIN} END"""
+    else:
+        u = f"(CASE WHEN gap THEN utc_ns ELSE utc_ns + _into END)"
+        t_sql = f"{u} - {u} % {step}"
+    ok = "inv = 0 AND coalesce(isfinite(valeur), false)"
+    con.execute(
+        f"""
+        CREATE OR REPLACE TABLE _a AS
+        WITH l AS (
+            SELECT _l.*, coalesce(p._t, {t_sql}) AS _t
+            FROM _l LEFT JOIN _fold_t p USING (_pos)
+        ),
+        g AS (
+            SELECT EGID, DATA_TYPE, _t, min(_pos) AS _pos, count(*) AS n, count_if({ok}) AS v,
+                   avg(valeur::DOUBLE) FILTER ({ok}) AS mean_ok,
+                   avg(valeur::DOUBLE) FILTER (NOT isnan(valeur)) AS mean_all
+            FROM l WHERE _call = 0
+            GROUP BY EGID, DATA_TYPE, _t
+        )
+        SELECT EGID, DATA_TYPE, _t, _pos,
+               CASE WHEN v * 15 >= 10 * n THEN mean_ok ELSE mean_all END AS valeur,
+               CASE WHEN v * 15 >= 10 * n THEN 0 ELSE 1 END::TINYINT AS inv
+        FROM g
+        UNION ALL
+        SELECT EGID, DATA_TYPE, _t, _pos, valeur::DOUBLE, inv FROM l WHERE _call = 1
+        """
+    )
+    rows_agg = _count(con, "SELECT count(*) FROM _a")
+
+    # 4.8  Chevauchement : pas où TempRet et PuisCpt ont tous deux une valeur
+    origin = int(GRID_ORIGIN.as_unit("ns").value)
+    con.execute(
+        f"""
+        CREATE OR REPLACE TABLE _o AS
+        WITH s AS (SELECT *, (_t - {origin}) // {step} AS _slot FROM _a),
+        both_ok AS (
+            SELECT EGID, _slot FROM s WHERE DATA_TYPE = 'TempRet' AND valeur IS NOT NULL AND NOT isnan(valeur)
+            INTERSECT
+            SELECT EGID, _slot FROM s WHERE DATA_TYPE = 'PuisCpt' AND valeur IS NOT NULL AND NOT isnan(valeur)
+        )
+        SELECT s.* EXCLUDE (_slot) FROM s SEMI JOIN both_ok USING (EGID, _slot)
+        """
+    )
+    rows_overlap = _count(con, "SELECT count(*) FROM _o")
+    egids_overlap = _count(con, "SELECT count(DISTINCT EGID) FROM _o")
+
+    # 4.9  Étendue alignée, deux types présents
+    con.execute(
+        """
+        CREATE OR REPLACE TABLE _keep2 AS
+        SELECT EGID FROM _o
+        GROUP BY EGID
+        HAVING count_if(DATA_TYPE = 'TempRet') > 0 AND count_if(DATA_TYPE = 'PuisCpt') > 0
+           AND (max(_t) - min(_t))::DOUBLE / $ns_year >= $min_years
+        """,
+        {k: params[k] for k in ("ns_year", "min_years")},
+    )
+    egids_out = _count(con, "SELECT count(*) FROM _keep2")
+
+    # 4.7 + 4.10  Météo (dernière TempExt connue, table dédoublonnée au premier rang de lecture), date murale,
+    # cluster ; ordre d'écriture des lots pandas (EGID, date, date_15min)
+    rows_out = 0
+    if egids_out:
+        sql = f"""
+            WITH ext AS (
+                SELECT epoch_ns(date_15min) AS _t, arg_min(TempExt, _pos) AS TempExt
+                FROM _enr GROUP BY 1
+            ),
+            o AS (SELECT * FROM _o WHERE EGID IN (SELECT EGID FROM _keep2))
+            SELECT o.EGID, o.DATA_TYPE, make_timestamp_ns(o._t) AS date_15min, o.valeur, o.inv,
+                   coalesce(x.TempExt, 0.0)::FLOAT AS TempExt,
+                   make_timestamp_ns(o._t + z.offset_ns) AS date, g.cluster
+            FROM o
+            ASOF LEFT JOIN ext x ON o._t >= x._t
+            JOIN _utc_hours z ON z.hour_ns = o._t - o._t % {_NS_HOUR}
+            JOIN _gis g ON g.egid = CAST(o.EGID AS VARCHAR)
+            ORDER BY o.EGID, date, o._t, o._pos
+        """
+        rows_out = _stream(con, sql, writer)
+    for t in ("_f", "_keep", "_l", "_a", "_o", "_keep2"):
+        con.execute(f"DROP TABLE IF EXISTS {t}")
+    return FilterCounts(rows_in, egids_pre, rows_pre, rows_agg, rows_overlap, egids_overlap, egids_out, rows_out)
+
+
+# --- section 5 -------------------------------------------------------------------------------------------------
+
+
+def clean_stage(con, path_filtered: Path, writer: StageWriter) -> int:
+    """Section 5 : PuisCpt inv≠0 → 0 ; TempRet inv≠0 → médiane des valeurs inv=0 de l'EGID (0 si aucune), série
+    inchangée si rien à remplacer ou tout invalide ; retourne le nombre de lignes écrites."""
+    _scan(con, path_filtered, "_flt")
+    sql = """
+        WITH m AS (
+            SELECT EGID,
+                   bool_or(inv <> 0) AND NOT bool_and(inv <> 0) AS fill,
+                   list_sort(list(valeur::DOUBLE) FILTER (inv = 0 AND NOT isnan(valeur))) AS v
+            FROM _flt WHERE DATA_TYPE = 'TempRet'
+            GROUP BY EGID
+        ),
+        med AS (
+            SELECT EGID, fill,
+                   CASE WHEN len(v) = 0 THEN 0.0 ELSE (v[(len(v) + 1) // 2] + v[len(v) // 2 + 1]) / 2 END AS med
+            FROM m
+        )
+        SELECT f.* EXCLUDE (_pos) REPLACE (
+                   CASE WHEN f.DATA_TYPE = 'PuisCpt' AND f.inv <> 0 THEN 0.0
+                        WHEN f.DATA_TYPE = 'TempRet' AND f.inv <> 0 AND m.fill THEN m.med
+                        ELSE f.valeur END::FLOAT AS valeur
+               )
+        FROM _flt f
+        LEFT JOIN med m ON f.DATA_TYPE = 'TempRet' AND m.EGID = f.EGID
+        ORDER BY f.EGID, f.date, f._pos
+    """
+    return _stream(con, sql, writer)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Profilage par étape du pipeline : durée murale / CPU, mémoire (RSS début / fin / pic, pic Python tracemalloc),
+lignes entrée / sortie, octets lus / écrits, rapport JSON + Parquet par exécution et dump cProfile optionnel.
+
+- ``RunProfiler.section(nom)`` : étape de premier niveau (section de notebook) — ``handle.end(rows_out=…)`` la
+  ferme ; une section encore ouverte (cellule interrompue) est close comme ``interrompu`` à la suivante ;
+- ``RunProfiler.stage(nom)`` : bloc ``with`` imbriqué (étape parente enregistrée) ;
+- ``@profiled("nom")`` : fonctions coûteuses (agrégation, features, entraînement) ; sans profileur actif
+  (``activate``), appel direct sans surcoût mesurable. Lignes = ``len`` du premier DataFrame / tableau en
+  argument et du résultat.
+
+Pic RSS : échantillonné par un fil (``sample_interval``) via psutil, ou ``/proc/self/statm`` (Linux) ; sans
+l'un ni l'autre, colonnes RSS vides. Compteurs d'E/S du processus (``io_read_bytes`` / ``io_write_bytes``) si
+psutil est installé. ``trace_python=True`` active tracemalloc (pic des allocations Python, surcoût notable) ;
+``cprofile=True`` écrit ``<run_id>/<n>_<étape>.prof`` par section (``snakeviz`` / ``pstats``).
+
+Rapports : ``9_Results/_profiles/<run_id>.json`` et ``.parquet`` (réécrits à chaque fin de section) ;
+``load_reports`` les relit tous pour comparer les exécutions.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe stage_profiler.py
+  .venv\\Scripts\\python.exe stage_profiler.py --last 5 --metric rss_peak_mb
+"""
+from __future__ import annotations
+
+import argparse
+import cProfile
+import functools
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:  # RSS via /proc (Linux) ou absent
+    psutil = None
+
+ROOT = Path(__file__).resolve().parent
+PATH_PROFILES = ROOT / "0_Data" / "9_Results" / "_profiles"
+_MB = 1024 * 1024
+_ACTIVE: "RunProfiler | None" = None
+
+
+def _rss() -> int | None:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _io() -> tuple[int, int] | None:
+    if psutil is None:
+        return None
+    try:
+        c = psutil.Process().io_counters()
+        return c.read_bytes, c.write_bytes
+    except (AttributeError, psutil.Error):
+        return None
+
+
+def _path_bytes(path) -> int:
+    p = Path(path)
+    if p.is_file():
+        return p.stat().st_size
+    if p.is_dir():
+        return sum(f.stat().st_size for f in p.rglob("*") if f.is_file())
+    return 0
+
+
+def _n_rows(obj) -> int | None:
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    return len(obj) if hasattr(obj, "__len__") and hasattr(obj, "shape") else None
+
+
+def _mb(n: int | None) -> float | None:
+    return None if n is None else round(n / _MB, 1)
+
+
+@dataclass
+class StageRecord:
+    run_id: str
+    stage: str
+    parent: str | None
+    labels: dict
+    started_at: str
+    wall_s: float
+    cpu_s: float
+    rss_start_mb: float | None
+    rss_end_mb: float | None
+    rss_peak_mb: float | None
+    py_peak_mb: float | None
+    rows_in: int | None
+    rows_out: int | None
+    bytes_read: int | None
+    bytes_written: int | None
+    io_read_bytes: int | None
+    io_write_bytes: int | None
+    profile: str | None
+    status: str
+
+
+@dataclass
+class StageHandle:
+    """Étape ouverte ; ``read`` / ``wrote`` cumulent la taille des fichiers ou répertoires lus / écrits."""
+
+    profiler: "RunProfiler"
+    stage: str
+    parent: str | None
+    labels: dict
+    rows_in: int | None = None
+    rows_out: int | None = None
+    bytes_read: int = 0
+    bytes_written: int = 0
+    _t0: float = 0.0
+    _c0: float = 0.0
+    _started: str = ""
+    _rss0: int | None = None
+    _rss_peak: int | None = None
+    _py_peak: int = 0
+    _io0: tuple[int, int] | None = None
+    _prof: cProfile.Profile | None = field(default=None, repr=False)
+    _open: bool = True
+
+    def read(self, *paths) -> "StageHandle":
+        self.bytes_read += sum(_path_bytes(p) for p in paths)
+        return self
+
+    def wrote(self, *paths) -> "StageHandle":
+        self.bytes_written += sum(_path_bytes(p) for p in paths)
+        return self
+
+    def end(self, rows_out: int | None = None, status: str = "ok") -> StageRecord | None:
+        if rows_out is not None:
+            self.rows_out = rows_out
+        return self.profiler._close(self, status)
+
+
+class RunProfiler:
+    """Une exécution (notebook ou script) : pile d'étapes ouvertes et enregistrements terminés."""
+
+    def __init__(
+        self,
+        name: str,
+        out_dir: Path = PATH_PROFILES,
+        cprofile: bool = False,
+        trace_python: bool = False,
+        sample_interval: float = 0.05,
+    ):
+        self.name = name
+        self.out_dir = Path(out_dir)
+        self.cprofile = cprofile
+        self.trace_python = trace_python
+        self.sample_interval = sample_interval
+        self.run_id = f"{name}_{time.strftime('%Y%m%d_%H%M%S')}"
+        self.records: list[StageRecord] = []
+        self._stack: list[StageHandle] = []
+        self._lock = threading.Lock()
+        self._sampler: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._n_profiles = 0
+
+    # --- cycle de vie -------------------------------------------------------------------------------------
+
+    def activate(self) -> "RunProfiler":
+        """Profileur actif du processus (utilisé par ``@profiled``)."""
+        global _ACTIVE
+        _ACTIVE = self
+        if self.trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self
+
+    def deactivate(self) -> None:
+        global _ACTIVE
+        for h in reversed(list(self._stack)):
+            self._close(h, "interrompu")
+        if _ACTIVE is self:
+            _ACTIVE = None
+        if self.trace_python and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.sample_interval):
+            rss = _rss()
+            with self._lock:
+                for h in self._stack:
+                    if rss is not None and (h._rss_peak is None or rss > h._rss_peak):
+                        h._rss_peak = rss
+
+    def _sync_trace(self) -> None:
+        """Pic tracemalloc depuis le dernier événement attribué à toutes les étapes ouvertes, puis remis à zéro."""
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for h in self._stack:
+            h._py_peak = max(h._py_peak, peak)
+        tracemalloc.reset_peak()
+
+    # --- étapes -------------------------------------------------------------------------------------------
+
+    def begin(self, stage: str, rows_in: int | None = None, **labels) -> StageHandle:
+        """Ouvre une étape imbriquée dans l'étape courante."""
+        with self._lock:
+            self._sync_trace()
+            parent = self._stack[-1].stage if self._stack else None
+            h = StageHandle(self, stage, parent, labels, rows_in=rows_in)
+            h._rss0 = h._rss_peak = _rss()
+            h._io0 = _io()
+            h._started = pd.Timestamp.now().isoformat(timespec="seconds")
+            self._stack.append(h)
+        if self.cprofile and not any(s._prof for s in self._stack[:-1]):
+            h._prof = cProfile.Profile()
+            h._prof.enable()
+        if self._sampler is None or self._stop.is_set():
+            if self._sampler is not None:
+                self._sampler.join()
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._sampler.start()
+        h._c0, h._t0 = time.process_time(), time.perf_counter()
+        return h
+
+    def section(self, stage: str, rows_in: int | None = None, **labels) -> StageHandle:
+        """Étape de premier niveau : ferme d'abord les étapes restées ouvertes (cellule interrompue)."""
+        for h in reversed(list(self._stack)):
+            self._close(h, "interrompu")
+        return self.begin(stage, rows_in, **labels)
+
+    @contextmanager
+    def stage(self, stage: str, rows_in: int | None = None, **labels):
+        h = self.begin(stage, rows_in, **labels)
+        try:
+            yield h
+        except BaseException as e:
+            self._close(h, f"erreur: {type(e).__name__}")
+            raise
+        self._close(h, "ok")
+
+    def _close(self, h: StageHandle, status: str) -> StageRecord | None:
+        if not h._open:
+            return None
+        if h in self._stack:  # étapes filles encore ouvertes : closes d'abord
+            for child in reversed(self._stack[self._stack.index(h) + 1 :]):
+                self._close(child, "interrompu")
+        wall, cpu = time.perf_counter() - h._t0, time.process_time() - h._c0
+        prof_path = None
+        if h._prof is not None:
+            h._prof.disable()
+            self._n_profiles += 1
+            prof_path = self.out_dir / self.run_id / f"{self._n_profiles:02d}_{h.stage}.prof"
+            prof_path.parent.mkdir(parents=True, exist_ok=True)
+            h._prof.dump_stats(prof_path)
+        rss = _rss()
+        io = _io()
+        with self._lock:
+            self._sync_trace()
+            h._open = False
+            if h in self._stack:
+                self._stack.remove(h)
+            peak = max(x for x in (h._rss_peak, rss) if x is not None) if rss is not None else h._rss_peak
+        rec = StageRecord(
+            run_id=self.run_id,
+            stage=h.stage,
+            parent=h.parent,
+            labels=h.labels,
+            started_at=h._started,
+            wall_s=round(wall, 4),
+            cpu_s=round(cpu, 4),
+            rss_start_mb=_mb(h._rss0),
+            rss_end_mb=_mb(rss),
+            rss_peak_mb=_mb(peak),
+            py_peak_mb=_mb(h._py_peak) if self.trace_python else None,
+            rows_in=h.rows_in,
+            rows_out=h.rows_out,
+            bytes_read=h.bytes_read or None,
+            bytes_written=h.bytes_written or None,
+            io_read_bytes=None if io is None or h._io0 is None else io[0] - h._io0[0],
+            io_write_bytes=None if io is None or h._io0 is None else io[1] - h._io0[1],
+            profile=None if prof_path is None else prof_path.as_posix(),
+            status=status,
+        )
+        self.records.append(rec)
+        if not self._stack:
+            self._stop.set()
+            if h.parent is None:
+                self.save()
+        return rec
+
+    # --- rapports -----------------------------------------------------------------------------------------
+
+    def summary(self) -> pd.DataFrame:
+        df = pd.DataFrame([asdict(r) for r in self.records])
+        if not df.empty:
+            df["labels"] = df["labels"].map(lambda d: json.dumps(d, ensure_ascii=False, default=str))
+        return df
+
+    def save(self) -> Path:
+        """Écrit ``<run_id>.json`` (méta + étapes) et ``<run_id>.parquet`` ; retourne le chemin JSON."""
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "run_id": self.run_id,
+            "name": self.name,
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "rss_source": "psutil" if psutil is not None else ("procfs" if _rss() is not None else None),
+            "trace_python": self.trace_python,
+        }
+        path = self.out_dir / f"{self.run_id}.json"
+        payload = {"meta": meta, "stages": [asdict(r) for r in self.records]}
+        path.write_text(json.dumps(payload, indent=2, ensure_ascii=False, default=str), encoding="utf-8")
+        df = self.summary()
+        if not df.empty:
+            df.to_parquet(path.with_suffix(".parquet"), index=False)
+        return path
+
+
+def active() -> RunProfiler | None:
+    return _ACTIVE
+
+
+def profiled(stage: str | None = None):
+    """Décorateur : étape ``stage`` (nom de la fonction par défaut) si un profileur est actif."""
+
+    def deco(fn):
+        name = stage or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            prof = _ACTIVE
+            if prof is None:
+                return fn(*args, **kwargs)
+            rows_in = next((n for n in map(_n_rows, args) if n is not None), None)
+            with prof.stage(name, rows_in) as h:
+                out = fn(*args, **kwargs)
+                h.rows_out = _n_rows(out)
+            return out
+
+        return wrapper
+
+    return deco
+
+
+def load_reports(out_dir: Path = PATH_PROFILES) -> pd.DataFrame:
+    """Toutes les étapes de toutes les exécutions enregistrées (une ligne par étape)."""
+    files = sorted(Path(out_dir).glob("*.parquet"))
+    return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True) if files else pd.DataFrame()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", type=Path, default=PATH_PROFILES)
+    ap.add_argument("--name", default=None, help="Filtre sur le nom d'exécution (préfixe de run_id)")
+    ap.add_argument("--last", type=int, default=3, help="Nombre d'exécutions comparées")
+    ap.add_argument("--metric", default="wall_s", help="wall_s, cpu_s, rss_peak_mb, py_peak_mb, rows_out…")
+    args = ap.parse_args()
+    df = load_reports(args.dir)
+    if args.name:
+        df = df[df["run_id"].str.startswith(args.name)]
+    if df.empty:
+        print(f"Aucun rapport dans {args.dir}")
+        return
+    runs = sorted(df["run_id"].unique())[-args.last :]
+    df = df[df["run_id"].isin(runs)]
+    df["stage"] = df["parent"].fillna("").map(lambda p: f"{p} / " if p else "") + df["stage"]
+    table = df.pivot_table(index="stage", columns="run_id", values=args.metric, aggfunc="sum", sort=False)
+    print(table.to_string(float_format=lambda x: f"{x:.2f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Exports SST synthétiques déterministes (mêmes graine / paramètres → mêmes fichiers), pour les mesures de
+performance (bench_pipeline.py) et les essais du pipeline sans les exports réels.
+
+Contenu, pour N EGID sur Y années à partir de ``start`` :
+
+- PuisCpt au pas 1 min (kW), TempRet au pas 15 min (°C), dépendant d'une température extérieure synthétique
+  (``tempext``, cycle annuel + journalier) ;
+- ``date`` = heure murale Zurich naïve, comme les CSV ExpArchi : heure répétée fin octobre (deux lignes à la
+  même date), heure absente fin mars ;
+- ``inv`` : invalidations isolées (``inv_rate``) et par rafales (quelques heures) ;
+- trous : pannes de quelques heures à quelques jours par type, début PuisCpt décalé pour une partie des EGID,
+  valeurs manquantes isolées.
+
+Sorties (``write_export``) : un CSV par table au format d'export SST (``date;<EGID>_<TYPE>;inv``, date
+``DD/MM/YYYY HH:MM``) dans ``export_SSTCAD_<YYYYMMDD>/``, lu par ``load_raw_csvs`` (dataset_preparation_V2,
+section 2) ; ``--gis`` ajoute un ``DATA_GIS_Filtered.parquet`` (``U_NO_EGID``, ``cluster``, ``U_PUISSANCE_kW``).
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe synthetic_sst.py 0_Data/0_Raw/Synthetic --egids 10 --years 2
+  .venv\\Scripts\\python.exe synthetic_sst.py 0_Data/0_Raw/Synthetic --egids 50 --years 1 --seed 7 --gis
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+START = "2023-01-01"
+EGID_BASE = 1_500_000
+TABLE_BASE = 10_000
+CLUSTERS = (3, 4, 5, 6)
+ZONE = "Europe/Zurich"
+
+
+def egid_ids(n_egids: int) -> list[str]:
+    return [str(EGID_BASE + i) for i in range(n_egids)]
+
+
+def tempext(utc: pd.DatetimeIndex) -> np.ndarray:
+    """Température extérieure synthétique (°C) : cycle annuel (min mi-janvier) + cycle journalier (max 15 h)."""
+    doy = np.asarray(utc.dayofyear, dtype=np.float64)
+    hour = np.asarray(utc.hour, dtype=np.float64) + np.asarray(utc.minute, dtype=np.float64) / 60.0
+    return 9.0 - 10.0 * np.cos(2 * np.pi * (doy - 15) / 365.25) + 4.0 * np.cos(2 * np.pi * (hour - 14) / 24)
+
+
+def _wall_clock(utc: pd.DatetimeIndex) -> np.ndarray:
+    return utc.tz_convert(ZONE).tz_localize(None).to_numpy(dtype="datetime64[ns]")
+
+
+def _outages(rng: np.random.Generator, n: int, step_min: int, years: float) -> np.ndarray:
+    """Masque des pas en panne : ~6 pannes / an, durée log-normale (médiane 6 h, plafonnée à 10 jours)."""
+    down = np.zeros(n, dtype=bool)
+    per_day = 1440 // step_min
+    for _ in range(rng.poisson(6 * years)):
+        a = int(rng.integers(0, n))
+        hours = min(float(rng.lognormal(np.log(6.0), 1.2)), 240.0)
+        down[a : a + max(1, int(hours * 60 / step_min))] = True
+    if rng.random() < 0.1:  # coupure longue (semaines)
+        a = int(rng.integers(0, n))
+        down[a : a + int(rng.integers(14, 42)) * per_day] = True
+    return down
+
+
+def _inv_flags(rng: np.random.Generator, n: int, step_min: int, inv_rate: float) -> np.ndarray:
+    inv = rng.random(n) < inv_rate
+    for _ in range(rng.poisson(max(1.0, n * step_min / 1440 / 30))):  # ~1 rafale / mois
+        a = int(rng.integers(0, n))
+        inv[a : a + int(rng.integers(1, 8)) * 60 // step_min] = True
+    return inv.astype(np.int8)
+
+
+def _series(
+    rng: np.random.Generator,
+    utc: pd.DatetimeIndex,
+    data_type: str,
+    power_kw: float,
+    years: float,
+    inv_rate: float,
+    nan_rate: float,
+) -> pd.DataFrame:
+    step_min = 1 if data_type == "PuisCpt" else 15
+    t_ext = tempext(utc)
+    n = len(utc)
+    if data_type == "PuisCpt":
+        load = np.clip((18.0 - t_ext) / 28.0, 0.0, 1.0)
+        val = np.clip(power_kw * (load + rng.normal(0, 0.05, n)), 0.0, None)
+    else:
+        val = 40.0 - 0.5 * t_ext + rng.normal(0, 1.0, n)
+    val[rng.random(n) < nan_rate] = np.nan
+    keep = ~_outages(rng, n, step_min, years)
+    return pd.DataFrame(
+        {
+            "date": _wall_clock(utc[keep]),
+            "valeur": val[keep].round(2),
+            "inv": _inv_flags(rng, n, step_min, inv_rate)[keep],
+        }
+    )
+
+
+def generate_long(
+    n_egids: int = 5,
+    years: float = 1.0,
+    seed: int = 0,
+    start: str = START,
+    inv_rate: float = 0.01,
+    nan_rate: float = 0.002,
+    late_start_share: float = 0.2,
+) -> pd.DataFrame:
+    """Table longue ``date, EGID, DATA_TYPE, valeur, inv, table`` (format de ``load_raw_csvs``)."""
+    t0 = pd.Timestamp(start, tz=ZONE).tz_convert("UTC")
+    t1 = t0 + pd.Timedelta(days=round(365.25 * years))
+    frames = []
+    for i, egid in enumerate(egid_ids(n_egids)):
+        rng = np.random.default_rng([seed, i])
+        power = float(rng.uniform(20, 200))
+        late = pd.Timedelta(days=int(rng.integers(10, 90))) if rng.random() < late_start_share else pd.Timedelta(0)
+        for k, (dt, freq) in enumerate((("TempRet", "15min"), ("PuisCpt", "1min"))):
+            utc = pd.date_range(t0 + (late if dt == "PuisCpt" else pd.Timedelta(0)), t1, freq=freq, inclusive="left")
+            df = _series(rng, utc, dt, power, years, inv_rate, nan_rate)
+            df["EGID"] = egid
+            df["DATA_TYPE"] = dt
+            df["table"] = f"techant{TABLE_BASE + 2 * i + k}"
+            frames.append(df)
+    cols = ["date", "EGID", "DATA_TYPE", "valeur", "inv", "table"]
+    return pd.concat(frames, ignore_index=True)[cols] if frames else pd.DataFrame(columns=cols)
+
+
+def gis_frame(n_egids: int, seed: int = 0) -> pd.DataFrame:
+    """Équivalent minimal de ``DATA_GIS_Filtered`` : cluster et puissance nominale par EGID."""
+    rows = []
+    for i, egid in enumerate(egid_ids(n_egids)):
+        rng = np.random.default_rng([seed, i])
+        power = float(rng.uniform(20, 200))  # même tirage que generate_long
+        rows.append({"U_NO_EGID": egid, "cluster": CLUSTERS[i % len(CLUSTERS)], "U_PUISSANCE_kW": round(power * 1.2, 1)})
+    return pd.DataFrame(rows)
+
+
+def write_export(df: pd.DataFrame, out_dir: Path, stamp: str | None = None) -> Path:
+    """Un CSV par table (``<table>_<YYYYMMDD>.csv``) dans ``out_dir/export_SSTCAD_<YYYYMMDD>/`` ; retourne le dossier."""
+    stamp = stamp or pd.Timestamp(df["date"].max()).strftime("%Y%m%d")
+    dest = Path(out_dir) / f"export_SSTCAD_{stamp}"
+    dest.mkdir(parents=True, exist_ok=True)
+    for (table, egid, dt), g in df.groupby(["table", "EGID", "DATA_TYPE"], sort=True):
+        out = pd.DataFrame(
+            {
+                "date": pd.DatetimeIndex(g["date"]).strftime("%d/%m/%Y %H:%M"),
+                f"{egid}_{dt}": g["valeur"].to_numpy(),
+                "inv": g["inv"].to_numpy(),
+            }
+        )
+        out.to_csv(dest / f"{table}_{stamp}.csv", sep=";", index=False, na_rep="")
+    return dest
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("out_dir", type=Path)
+    ap.add_argument("--egids", type=int, default=10)
+    ap.add_argument("--years", type=float, default=1.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--start", default=START)
+    ap.add_argument("--gis", action="store_true", help="Écrit aussi DATA_GIS_Filtered.parquet dans out_dir")
+    args = ap.parse_args()
+    df = generate_long(args.egids, args.years, args.seed, args.start)
+    dest = write_export(df, args.out_dir)
+    print(f"{len(df):,} lignes, {df['table'].nunique()} tables → {dest}")
+    if args.gis:
+        gis = gis_frame(args.egids, args.seed)
+        gis.to_parquet(args.out_dir / "DATA_GIS_Filtered.parquet", index=False)
+        print(f"GIS : {len(gis)} EGID → {args.out_dir / 'DATA_GIS_Filtered.parquet'}")
+
+
+if __name__ == "__main__":
+    main()
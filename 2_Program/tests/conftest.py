@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""Les modules testés sont des scripts à plat de 2_Program (lancer ``python -m pytest tests`` depuis 2_Program)."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
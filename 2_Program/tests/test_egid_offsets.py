@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Index EGID (egid_offsets.py) : le fichier d'offsets d'une étape à EGID non numériques est relu, pas recalculé."""
+import numpy as np
+import pandas as pd
+
+import egid_offsets
+from egid_offsets import EgidOffsets, load_sorted, offsets_path
+from sst_dataset import write_stage
+
+
+def _stage(tmp_path):
+    n = 96
+    df = pd.DataFrame(
+        {
+            "date": np.tile(pd.date_range("2024-01-01", periods=n, freq="15min"), 3),
+            "EGID": np.repeat(["CH-B", "CH-A", "CH-C"], n),
+            "DATA_TYPE": "TempRet",
+            "valeur": np.arange(3 * n, dtype=np.float32),
+            "inv": 0,
+            "cluster": 3,
+        }
+    )
+    return write_stage(df.sample(frac=1.0, random_state=0), tmp_path / "sst_filtered_transfo")
+
+
+def test_string_egid_offsets_reload_without_rebuild(tmp_path, monkeypatch):
+    stage = _stage(tmp_path)
+    df1, idx1 = load_sorted(stage, cluster=3)
+    assert offsets_path(stage, 3).is_file()
+    assert idx1.egids.dtype.kind == "U"
+
+    def no_rebuild(*args, **kwargs):
+        raise AssertionError("offsets recalculés alors que le fichier est à jour")
+
+    monkeypatch.setattr(egid_offsets.EgidOffsets, "build", classmethod(no_rebuild))
+    df2, idx2 = load_sorted(stage, cluster=3)
+    np.testing.assert_array_equal(idx2.egids, idx1.egids)
+    assert sorted(idx2.egids) == ["CH-A", "CH-B", "CH-C"]
+    pd.testing.assert_frame_equal(df1, df2)
+
+
+def test_object_egids_saved_without_pickle(tmp_path):
+    idx = EgidOffsets.build(pd.DataFrame({"EGID": pd.Series(["b", "a"], dtype=object), "DATA_TYPE": ["TempRet"] * 2}))
+    idx.egids = idx.egids.astype(object)  # index construit par une version antérieure
+    idx.save(tmp_path / "o.npz")
+    loaded, _sig = EgidOffsets.load(tmp_path / "o.npz")
+    assert list(loaded.egids) == ["a", "b"]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+ExpArchiV8 (0_Data/0_Raw/liste_techant) sur une base SQLite de substitution : les sorties zip et Parquet,
+relues par les fonctions de la section 2 de dataset_preparation_V2 (``load_raw_increments``), donnent les
+mêmes lignes, identiques au contenu de la base.
+"""
+import ast
+import importlib.util
+import json
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+PROGRAM = Path(__file__).resolve().parents[1]
+EXPORTER = PROGRAM / "0_Data" / "0_Raw" / "liste_techant" / "ExpArchiV8.py"
+NOTEBOOK = PROGRAM / "dataset_preparation_V2.ipynb"
+CONFIG = """Nom;Table;nbr
+1511188_TempRet;techant101;40
+1511188_PuisCpt;techant102;40
+190198380_TempRet;techant203;40
+bad-name;techant999;40
+"""
+N_ROWS = 300
+COLUMNS = ["table", "date", "EGID", "DATA_TYPE", "valeur", "inv"]
+
+
+@pytest.fixture(scope="module")
+def exparchi():
+    spec = importlib.util.spec_from_file_location("ExpArchiV8", EXPORTER)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod  # dataclasses : module résolu via sys.modules
+    spec.loader.exec_module(mod)
+    yield mod
+    sys.modules.pop(spec.name, None)
+
+
+@pytest.fixture(scope="module")
+def section2():
+    """Fonctions de la cellule d'import (section 2) du notebook, sans exécuter l'import lui-même."""
+    nb = json.loads(NOTEBOOK.read_text(encoding="utf-8"))
+    code = ["".join(c["source"]) for c in nb["cells"] if c["cell_type"] == "code"]
+    (src,) = [s for s in code if "def load_raw_csvs(" in s]
+    tree = ast.parse(src)
+    keep = [
+        n
+        for n in tree.body
+        if isinstance(n, ast.FunctionDef)
+        or (isinstance(n, ast.Assign) and all(isinstance(t, ast.Name) and t.id.isupper() for t in n.targets))
+    ]
+    ns = {"pd": pd, "np": np, "re": re, "Path": Path}
+    exec(compile(ast.Module(body=keep, type_ignores=[]), "<section 2>", "exec"), ns)
+    return ns
+
+
+def _export(exparchi, jobs, db: Path, out: Path, fmt: str, mode: int):
+    out.mkdir()
+    sink = exparchi.ZipSink(out, "20260201") if fmt == "zip" else exparchi.ParquetShardSink(out, "20260201")
+    report = exparchi.run_export(jobs, exparchi.SqliteSource(db), sink, mode=mode, workers=2, rate=0)
+    assert not report.failed
+    return report
+
+
+def _normalized(df: pd.DataFrame) -> pd.DataFrame:
+    df = df[COLUMNS].copy()
+    df["date"] = pd.to_datetime(df["date"]).astype("datetime64[ns]")
+    df["EGID"] = df["EGID"].astype(str)
+    df["DATA_TYPE"] = df["DATA_TYPE"].astype(str)
+    df["valeur"] = df["valeur"].astype(np.float64)
+    df["inv"] = df["inv"].astype(np.int64)
+    return df.sort_values(["table", "date"]).reset_index(drop=True)
+
+
+def _expected(db: Path, jobs, limit: int | None) -> pd.DataFrame:
+    frames = []
+    with sqlite3.connect(db) as conn:
+        for job in jobs:
+            sql = f"SELECT tod, value, invalid FROM {job.table} ORDER BY tod DESC"
+            sql += f" LIMIT {limit}" if limit else ""
+            d = pd.read_sql_query(sql, conn)
+            egid, _, data_type = job.nom.partition("_")
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "table": job.table,
+                        "date": pd.to_datetime(d["tod"], unit="s").dt.floor("min"),
+                        "EGID": egid,
+                        "DATA_TYPE": data_type,
+                        "valeur": d["value"],
+                        "inv": d["invalid"],
+                    }
+                )
+            )
+    return _normalized(pd.concat(frames, ignore_index=True))
+
+
+@pytest.mark.parametrize("mode", [0, 1])
+def test_zip_and_parquet_match_section2(tmp_path, exparchi, section2, mode):
+    cfg = tmp_path / "config.csv"
+    cfg.write_text(CONFIG, encoding="utf-8")
+    jobs, skipped = exparchi.read_config(cfg)
+    assert skipped == 1 and len(jobs) == 3
+    db = tmp_path / "fake.db"
+    exparchi.seed_fake_archive(db, jobs, N_ROWS, seed=3)
+
+    rep_zip = _export(exparchi, jobs, db, tmp_path / "zip", "zip", mode)
+    rep_pq = _export(exparchi, jobs, db, tmp_path / "parquet", "parquet", mode)
+    from_zip = _normalized(section2["load_raw_increments"](tmp_path / "zip"))
+    from_pq = _normalized(section2["load_raw_increments"](tmp_path / "parquet"))
+
+    expected = _expected(db, jobs, 40 if mode == 0 else None)
+    assert len(expected) == 3 * (40 if mode == 0 else N_ROWS)
+    assert rep_zip.rows == rep_pq.rows == len(expected)
+    pd.testing.assert_frame_equal(from_zip, from_pq)
+    pd.testing.assert_frame_equal(from_zip, expected)
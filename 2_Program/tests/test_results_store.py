@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Jeu de résultats consolidé (results_store.py) : parts sans résumé d'entraînement puis parts avec résumé."""
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from results_store import ResultsStore
+
+
+def _predictions() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "Dates": pd.date_range("2024-01-01", periods=4, freq="15min", tz="UTC"),
+            "TempRet": [40.0, 41.0, 42.0, 43.0],
+            "TempRetPred": [40.0, 41.5, 41.0, 43.0],
+            "PuisCpt": [0.1, 0.2, 0.3, 0.4],
+            "PuisCptPred": [0.1, 0.25, 0.3, 0.35],
+        }
+    )
+
+
+def test_null_summaries_then_real_summaries(tmp_path):
+    store = ResultsStore(tmp_path)
+    store.add_predictions(3, "RF", "1511188", _predictions())  # pas de *_training_summary.json
+    store.flush()
+    time.sleep(0.01)
+    store.add_predictions(3, "RF", "190198380", _predictions())
+    store.add_training_summary(3, "RF", "190198380", {"best_params": {"max_depth": 8}})
+    store.flush()
+
+    met = store.metrics()
+    assert met["egid"].tolist() == ["1511188", "190198380"]
+    assert met["summary_json"].isna().tolist() == [True, False]
+    assert store.training_summaries() == {(3, "190198380", "RF"): {"best_params": {"max_depth": 8}}}
+
+    store.compact()
+    assert store.metrics()["summary_json"].isna().tolist() == [True, False]
+
+
+def test_legacy_null_typed_part_is_readable(tmp_path):
+    store = ResultsStore(tmp_path)
+    store.add_predictions(4, "XBG", "1511188", _predictions())
+    store.flush()
+    # part écrit avant le typage explicite : summary_json stocké en type null
+    part = store._parts("metrics", 4, "XBG")[0]
+    table = pq.read_table(part)
+    i = table.schema.get_field_index("summary_json")
+    pq.write_table(table.set_column(i, pa.field("summary_json", pa.null()), pa.nulls(table.num_rows)), part)
+    time.sleep(0.01)
+    store.add_predictions(4, "XBG", "190198380", _predictions())
+    store.add_training_summary(4, "XBG", "190198380", {"epochs_ran": 12})
+    store.flush()
+
+    met = store.metrics(cluster_ids=[4])
+    assert len(met) == 2
+    assert met.set_index("egid").loc["190198380", "summary_json"] == '{"epochs_ran": 12}'
@@ -1,20 +1,34 @@
 # -*- coding: utf-8 -*-
-"""Trace un EGID : sst_enrichi → transfo long → parquet train large (défaut cluster 3).
+"""Trace un ou plusieurs EGID : sst_enrichi → transfo long → parquet train large (défaut cluster 3).
+
+Lecture ciblée : seuls les row groups des EGID demandés sont lus dans les étapes longues (jeux partitionnés
+triés par EGID de sst_dataset.py : statistiques min / max ; anciens fichiers : index annexe ``*.egid_rg.json``
+d'egid_lookup.py construit au premier appel) et seules les colonnes ``Dates`` +
+``{egid}.TempRet_norm`` / ``{egid}.PuisCpt_fc`` du parquet large. Un lot d'EGID est tracé en une passe.
+Couverture au pas 15 min (premier pas valide par type, chevauchement, 90 premiers jours, trous) : index de
+validité de ``sst_enriched`` (validity_index.py), sans relire l'étape.
 
 Usage (depuis 2_Program) :
-  .venv\\Scripts\\python.exe trace_egid_sst_pipeline.py [EGID]
+  .venv\\Scripts\\python.exe trace_egid_sst_pipeline.py [EGID ...]
   .venv\\Scripts\\python.exe trace_egid_sst_pipeline.py 1511188 0_Data/3_training/cluster5.parquet
+  .venv\\Scripts\\python.exe trace_egid_sst_pipeline.py 1511188 1511200 1600345 --wide 0_Data/3_training/cluster5.parquet
 """
-import sys
+import argparse
+import time
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+from egid_lookup import read_wide_egids
+from sst_dataset import read_egids
+from validity_index import TYPES, ValidityIndex, open_index
+
 ROOT = Path(__file__).resolve().parent
 STRUCT = ROOT / "0_Data/1_Structured"
-PATH_ENRICHED = STRUCT / "sst_enriched.parquet"
-PATH_TRANSFO = STRUCT / "sst_filtered_transfo.parquet"
+PATH_ENRICHED = STRUCT / "sst_enriched"
+PATH_TRANSFO = STRUCT / "sst_filtered_transfo"
+DEFAULT_WIDE = ROOT / "0_Data/3_training/cluster3.parquet"
 
 
 def fmt_pct(x: float) -> str:
@@ -34,18 +48,7 @@ def summarize_series(dates: pd.Series, mask_ok: pd.Series, label: str) -> None:
     )
 
 
-def main(egid: str, path_wide: Path) -> None:
-    egid = str(egid)
-
-    print("=" * 72)
-    print(f"EGID = {egid}  |  wide = {path_wide}")
-    print("=" * 72)
-
-    df_e = pd.read_parquet(PATH_ENRICHED, columns=["date", "EGID", "DATA_TYPE", "valeur", "inv"])
-    df_e["EGID"] = df_e["EGID"].astype(str)
-    sub_e = df_e[df_e["EGID"] == egid]
-    del df_e
-
+def report_enriched(sub_e: pd.DataFrame) -> None:
     for dt in ["TempRet", "PuisCpt"]:
         s = sub_e[sub_e["DATA_TYPE"] == dt]
         summarize_series(
@@ -57,14 +60,34 @@ def main(egid: str, path_wide: Path) -> None:
             nz = s["date"].sort_values()
             print(f"    première date toute ligne: {nz.iloc[0]}, dernière: {nz.iloc[-1]}")
 
-    df_t = pd.read_parquet(
-        PATH_TRANSFO,
-        columns=["date", "date_15min", "EGID", "DATA_TYPE", "valeur", "valeur_fc", "valeur_norm", "inv"],
+
+def report_validity(vidx: ValidityIndex, egid: str, min_gap_steps: int = 96) -> None:
+    """Couverture 15 min (inv=0 & valeur non NaN) lue dans l'index de validité de l'étape enrichie."""
+    print("\nIndex de validité (enrichi, pas 15 min, instants UTC) :")
+    for dt in TYPES:
+        first = vidx.first_valid(egid, dt)
+        if first is None:
+            print(f"  {dt}: aucun pas valide")
+            continue
+        end90 = first + pd.Timedelta(days=90)
+        gaps = vidx.gaps(egid, dt, min_steps=min_gap_steps)
+        longest = f", plus long {pd.Timedelta(vidx.step) * int(gaps['steps'].max())}" if len(gaps) else ""
+        print(
+            f"  {dt}: 1er pas {first}, dernier {vidx.last_valid(egid, dt)}, {vidx.count(egid, dt)} pas ; "
+            f"90 j dès le 1er pas : {fmt_pct(vidx.coverage(egid, dt, first, end90))} ; "
+            f"trous >= {min_gap_steps} pas : {len(gaps)}{longest}"
+        )
+    starts, ends = vidx.overlap(egid)
+    if not len(starts):
+        print("  Chevauchement TempRet ∧ PuisCpt : aucun")
+        return
+    print(
+        f"  Chevauchement TempRet ∧ PuisCpt : {int((ends - starts).sum())} pas, "
+        f"de {vidx.step_time(starts[0])} à {vidx.step_time(ends[-1] - 1)}, {len(starts)} plages"
     )
-    df_t["EGID"] = df_t["EGID"].astype(str)
-    sub_t = df_t[df_t["EGID"] == egid]
-    del df_t
 
+
+def report_transfo(sub_t: pd.DataFrame) -> None:
     for dt, col_fc in [("PuisCpt", "valeur_fc"), ("TempRet", "valeur_norm")]:
         s = sub_t[sub_t["DATA_TYPE"] == dt]
         if s.empty:
@@ -85,17 +108,8 @@ def main(egid: str, path_wide: Path) -> None:
             if bad.any():
                 print(f"    exemple dates: {s.loc[bad, 'date'].head(3).tolist()}")
 
-    if not path_wide.exists():
-        print(f"\nFichier large absent : {path_wide}")
-        return
-
-    df_w = pd.read_parquet(path_wide)
-    df_w["Dates"] = pd.to_datetime(df_w["Dates"], utc=True)
-    print(
-        f"\nGrille globale du parquet large: min={df_w['Dates'].min()}, max={df_w['Dates'].max()}, "
-        f"n={len(df_w)} pas"
-    )
 
+def report_wide(df_w: pd.DataFrame, egid: str) -> None:
     c_tr = f"{egid}.TempRet_norm"
     c_pc = f"{egid}.PuisCpt_fc"
     for name, col in [("TempRet_norm", c_tr), ("PuisCpt_fc", c_pc)]:
@@ -125,7 +139,54 @@ def main(egid: str, path_wide: Path) -> None:
             )
 
 
+def trace_egids(egids: list[str], path_wide: Path) -> None:
+    """Une passe par fichier pour tout le lot d'EGID, puis rapport par EGID."""
+    egids = [str(e) for e in egids]
+    t_start = time.perf_counter()
+
+    df_e = read_egids(PATH_ENRICHED, egids, columns=["date", "DATA_TYPE", "valeur", "inv"])
+    df_t = read_egids(
+        PATH_TRANSFO,
+        egids,
+        columns=["date", "date_15min", "DATA_TYPE", "valeur", "valeur_fc", "valeur_norm", "inv"],
+    )
+    df_w = read_wide_egids(path_wide, egids) if path_wide.exists() else None
+    vidx = open_index(PATH_ENRICHED)
+    by_e = dict(tuple(df_e.groupby("EGID", sort=False)))
+    by_t = dict(tuple(df_t.groupby("EGID", sort=False)))
+    del df_e, df_t
+
+    for egid in egids:
+        print("=" * 72)
+        print(f"EGID = {egid}  |  wide = {path_wide}")
+        print("=" * 72)
+        report_enriched(by_e.get(egid, pd.DataFrame(columns=["date", "DATA_TYPE", "valeur", "inv"])))
+        if vidx is not None:
+            report_validity(vidx, egid)
+        report_transfo(by_t.get(egid, pd.DataFrame(columns=["date", "DATA_TYPE", "valeur", "valeur_fc", "valeur_norm"])))
+        if df_w is None:
+            print(f"\nFichier large absent : {path_wide}")
+            continue
+        print(
+            f"\nGrille globale du parquet large: min={df_w['Dates'].min()}, max={df_w['Dates'].max()}, "
+            f"n={len(df_w)} pas"
+        )
+        report_wide(df_w, egid)
+
+    print(f"\n{len(egids)} EGID tracés en {time.perf_counter() - t_start:.2f} s")
+
+
+def main(egid: str, path_wide: Path) -> None:
+    trace_egids([egid], path_wide)
+
+
 if __name__ == "__main__":
-    eg = sys.argv[1] if len(sys.argv) > 1 else "1511188"
-    wide = Path(sys.argv[2]) if len(sys.argv) > 2 else ROOT / "0_Data/3_training/cluster3.parquet"
-    main(eg, wide)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("args", nargs="*", help="EGID (défaut 1511188) ; un chemin *.parquet final = parquet large")
+    ap.add_argument("--wide", type=Path, default=None, help=f"Parquet large (défaut {DEFAULT_WIDE.relative_to(ROOT)})")
+    ns = ap.parse_args()
+    pos = list(ns.args)
+    wide = ns.wide
+    if wide is None and pos and pos[-1].endswith(".parquet"):
+        wide = Path(pos.pop())
+    trace_egids(pos or ["1511188"], wide or DEFAULT_WIDE)
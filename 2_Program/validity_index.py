@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+Index de validité par (EGID, DATA_TYPE) sur la grille globale 15 min : un bit par pas (valeur présente et
+inv == 0), stocké compressé en plages (run-length) ``[début, fin)`` de numéros de pas.
+
+Pas n = instant UTC ``GRID_ORIGIN + n × step`` (colonne ``date_15min`` : UTC, naïve ou avec fuseau). Un
+EGID / type = deux tableaux triés ``starts`` / ``ends`` ; les questions de couverture se résolvent par
+``searchsorted`` sur ces plages au lieu de relire l'étape :
+
+- ``first_valid`` / ``last_valid`` : premier / dernier pas valide ;
+- ``count`` / ``coverage`` : pas valides (part) dans une fenêtre ``[start, end)`` ;
+- ``overlap`` : plages où plusieurs types sont valides à la fois (intersection) ;
+- ``gaps`` : trous entre le premier et le dernier pas valide ;
+- ``update`` : mise à jour incrémentale — les pas touchés par de nouvelles lignes prennent leur validité
+  (ajout comme correction tardive), le reste de l'index est inchangé.
+
+Fichier ``.npz`` à côté de l'étape (``<étape>/_validity.npz`` ou ``<fichier>.validity.npz``), disposition CSR
+(plages de la clé k : ``[ptr[k], ptr[k + 1])``), signature des fichiers comme egid_offsets.py. Construit en
+section 3 (dataset_preparation_V2) pour ``sst_enriched`` ; un fragment ExpArchiV8 (``--format parquet``) peut
+être appliqué directement après l'ingestion, sans relancer le notebook.
+
+Usage (depuis 2_Program) :
+  .venv\\Scripts\\python.exe validity_index.py
+  .venv\\Scripts\\python.exe validity_index.py --rebuild
+  .venv\\Scripts\\python.exe validity_index.py --update 0_Data/0_Raw/ExportSST/increments/export_SSTCAD_20260301_060000
+  .venv\\Scripts\\python.exe validity_index.py --egids 1511188,190198380
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from sst_dataset import read_stage, stage_files, stage_path
+
+logger = logging.getLogger("validity_index")
+
+ROOT = Path(__file__).resolve().parent
+PATH_ENRICHED = ROOT / "0_Data/1_Structured/sst_enriched"
+INDEX_NAME = "_validity.npz"
+INDEX_SUFFIX = ".validity.npz"
+GRID_ORIGIN = pd.Timestamp("2000-01-01")
+STEP = "15min"
+TYPES = ("TempRet", "PuisCpt")
+_EMPTY = (np.zeros(0, np.int64), np.zeros(0, np.int64))
+
+
+# --- plages (run-length) ----------------------------------------------------------------------------------
+
+
+def _encode(slots: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Pas triés sans doublon → plages ``[starts, ends)``."""
+    if not len(slots):
+        return _EMPTY
+    brk = np.flatnonzero(np.diff(slots) != 1) + 1
+    return slots[np.r_[0, brk]].astype(np.int64), slots[np.r_[brk - 1, len(slots) - 1]].astype(np.int64) + 1
+
+
+def _normalize(starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Fusionne les plages contiguës (fin d'une plage = début de la suivante) ; plages triées, disjointes."""
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) <= 1:
+        return starts, ends
+    brk = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    return starts[np.r_[0, brk]], ends[np.r_[brk - 1, len(ends) - 1]]
+
+
+def _count(starts: np.ndarray, ends: np.ndarray, lo: int, hi: int) -> int:
+    """Pas valides dans ``[lo, hi)``."""
+    i0 = np.searchsorted(ends, lo, "right")
+    i1 = np.searchsorted(starts, hi, "left")
+    if i1 <= i0:
+        return 0
+    return int((np.minimum(ends[i0:i1], hi) - np.maximum(starts[i0:i1], lo)).sum())
+
+
+def _intersect(a: tuple, b: tuple) -> tuple[np.ndarray, np.ndarray]:
+    """Intersection de deux listes de plages (balayage des bornes)."""
+    if not len(a[0]) or not len(b[0]):
+        return _EMPTY
+    pos = np.r_[a[0], b[0], a[1], b[1]]
+    delta = np.r_[np.ones(len(a[0]) + len(b[0]), np.int8), -np.ones(len(a[1]) + len(b[1]), np.int8)]
+    order = np.lexsort((delta, pos))  # fin avant début au même pas : plages demi-ouvertes
+    pos, depth = pos[order], np.cumsum(delta[order])
+    enter = np.flatnonzero(depth == 2)
+    return _normalize(pos[enter], pos[enter + 1])
+
+
+def _clip(starts: np.ndarray, ends: np.ndarray, lo: int, hi: int) -> tuple[np.ndarray, np.ndarray]:
+    """Plages restreintes à ``[lo, hi)``."""
+    i0 = np.searchsorted(ends, lo, "right")
+    i1 = np.searchsorted(starts, hi, "left")
+    return np.maximum(starts[i0:i1], lo), np.minimum(ends[i0:i1], hi)
+
+
+def _assign(runs: tuple, touched: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(``runs`` − ``touched``) ∪ ``valid`` ; ``touched`` / ``valid`` : pas triés sans doublon."""
+    starts, ends = runs
+    if not len(touched):
+        return runs
+    lo, hi = int(touched[0]), int(touched[-1]) + 1
+    dense = np.zeros(hi - lo, dtype=bool)
+    for s, e in zip(*_clip(starts, ends, lo, hi)):
+        dense[s - lo : e - lo] = True
+    dense[touched - lo] = False
+    dense[valid - lo] = True
+    mid = _encode(np.flatnonzero(dense) + lo)
+    left = _clip(starts, ends, np.iinfo(np.int64).min, lo)
+    right = _clip(starts, ends, hi, np.iinfo(np.int64).max)
+    return _normalize(np.r_[left[0], mid[0], right[0]], np.r_[left[1], mid[1], right[1]])
+
+
+# --- grille -----------------------------------------------------------------------------------------------
+
+
+def _utc_ns(s: pd.Series) -> np.ndarray:
+    if getattr(s.dt, "tz", None) is not None:
+        s = s.dt.tz_convert("UTC").dt.tz_localize(None)
+    return s.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+
+
+def _step_ns(step: str) -> int:
+    return int(pd.Timedelta(step).value)
+
+
+def _ts_ns(ts) -> int:
+    ts = pd.Timestamp(ts)
+    return int((ts.tz_convert("UTC").tz_localize(None) if ts.tz is not None else ts).value)
+
+
+@dataclass
+class ValidityIndex:
+    """Plages de pas valides par (EGID, DATA_TYPE) ; EGID en texte."""
+
+    runs: dict = field(default_factory=dict)
+    step: str = STEP
+
+    # --- construction -------------------------------------------------------------------------------------
+
+    def _slots(self, times: pd.Series) -> np.ndarray:
+        ns = _utc_ns(times)
+        out = np.full(len(ns), -1, dtype=np.int64)
+        ok = ns != np.iinfo(np.int64).min
+        out[ok] = (ns[ok] - GRID_ORIGIN.value) // _step_ns(self.step)
+        return out
+
+    def _key_slots(self, df: pd.DataFrame, time: str, valid) -> tuple[list, np.ndarray, np.ndarray, np.ndarray]:
+        """Clés distinctes, code de clé, pas et validité par ligne (lignes sans date écartées)."""
+        if valid is None:
+            valid = df["valeur"].notna().to_numpy() & (df["inv"].to_numpy() == 0)
+        e_codes, e_uniq = pd.factorize(df["EGID"])
+        t_codes, t_uniq = pd.factorize(df["DATA_TYPE"])
+        pair = e_codes.astype(np.int64) * max(len(t_uniq), 1) + t_codes
+        slots = self._slots(df[time])
+        ok = (slots >= 0) & (e_codes >= 0) & (t_codes >= 0)
+        used, codes = np.unique(pair[ok], return_inverse=True)
+        e_lab, t_lab = pd.Index(e_uniq).astype(str), pd.Index(t_uniq).astype(str)
+        keys = [(e_lab[p // max(len(t_uniq), 1)], t_lab[p % max(len(t_uniq), 1)]) for p in used]
+        return keys, codes.astype(np.int64), slots[ok], np.asarray(valid, dtype=bool)[ok]
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, time: str = "date_15min", valid=None, step: str = STEP) -> "ValidityIndex":
+        """Index d'une table longue (``valid`` par défaut : ``valeur`` non NaN et ``inv == 0``)."""
+        idx = cls(step=step)
+        keys, codes, slots, ok = idx._key_slots(df, time, valid)
+        packed = np.unique((codes[ok] << 32) | slots[ok])  # tri (clé, pas) en une passe
+        k, s = packed >> 32, packed & 0xFFFFFFFF
+        brk = np.flatnonzero((np.diff(k) != 0) | (np.diff(s) != 1)) + 1
+        first = np.r_[0, brk] if len(packed) else brk
+        last = np.r_[brk - 1, len(packed) - 1] if len(packed) else brk
+        starts, ends = s[first], s[last] + 1
+        ptr = np.searchsorted(k[first], np.arange(len(keys) + 1))
+        for i, key in enumerate(keys):
+            idx.runs[key] = (starts[ptr[i] : ptr[i + 1]].copy(), ends[ptr[i] : ptr[i + 1]].copy())
+        return idx
+
+    def update(self, df: pd.DataFrame, time: str = "date_15min", valid=None) -> int:
+        """Applique de nouvelles lignes : chaque pas touché prend leur validité ; retourne le nombre de clés modifiées."""
+        keys, codes, slots, ok = self._key_slots(df, time, valid)
+        order = np.lexsort((slots, codes))
+        codes, slots, ok = codes[order], slots[order], ok[order]
+        ptr = np.searchsorted(codes, np.arange(len(keys) + 1))
+        changed = 0
+        for i, key in enumerate(keys):
+            sl = slice(ptr[i], ptr[i + 1])
+            if sl.start == sl.stop:
+                continue
+            old = self.runs.get(key, _EMPTY)
+            new = _assign(old, np.unique(slots[sl]), np.unique(slots[sl][ok[sl]]))
+            if not (np.array_equal(old[0], new[0]) and np.array_equal(old[1], new[1])) or key not in self.runs:
+                changed += 1
+            self.runs[key] = new
+        return changed
+
+    # --- requêtes -----------------------------------------------------------------------------------------
+
+    def step_time(self, slot: int) -> pd.Timestamp:
+        """Instant UTC naïf du pas ``slot``."""
+        return GRID_ORIGIN + int(slot) * pd.Timedelta(self.step)
+
+    def _slot_ceil(self, ts) -> int:
+        step = _step_ns(self.step)
+        return -((GRID_ORIGIN.value - _ts_ns(ts)) // step)
+
+    def _window(self, start, end) -> tuple[int, int]:
+        lo = np.iinfo(np.int64).min if start is None else self._slot_ceil(start)
+        hi = np.iinfo(np.int64).max if end is None else self._slot_ceil(end)
+        return lo, hi
+
+    @property
+    def egids(self) -> list[str]:
+        return sorted({e for e, _ in self.runs})
+
+    def get(self, egid, data_type: str) -> tuple[np.ndarray, np.ndarray]:
+        """Plages ``(starts, ends)`` d'un couple ; vides si absent."""
+        return self.runs.get((str(egid), str(data_type)), _EMPTY)
+
+    def first_valid(self, egid, data_type: str) -> pd.Timestamp | None:
+        """Premier pas valide (instant UTC naïf) ; None si aucun."""
+        starts, _ = self.get(egid, data_type)
+        return self.step_time(starts[0]) if len(starts) else None
+
+    def last_valid(self, egid, data_type: str) -> pd.Timestamp | None:
+        """Dernier pas valide (début du pas, instant UTC naïf) ; None si aucun."""
+        _, ends = self.get(egid, data_type)
+        return self.step_time(ends[-1] - 1) if len(ends) else None
+
+    def count(self, egid, data_type: str, start=None, end=None) -> int:
+        """Pas valides dont l'instant est dans ``[start, end)`` (toute la série si bornes absentes)."""
+        return _count(*self.get(egid, data_type), *self._window(start, end))
+
+    def coverage(self, egid, data_type: str, start, end) -> float:
+        """Part des pas de ``[start, end)`` valides (NaN si fenêtre vide)."""
+        lo, hi = self._window(start, end)
+        return self.count(egid, data_type, start, end) / (hi - lo) if hi > lo else float("nan")
+
+    def overlap(self, egid, data_types=TYPES) -> tuple[np.ndarray, np.ndarray]:
+        """Plages où tous les ``data_types`` sont valides."""
+        runs = self.get(egid, data_types[0])
+        for dt in data_types[1:]:
+            runs = _intersect(runs, self.get(egid, dt))
+        return runs
+
+    def overlaps(self, data_types=TYPES) -> dict:
+        """``overlap`` de chaque EGID (EGID sans intersection omis)."""
+        out = {}
+        for egid in self.egids:
+            runs = self.overlap(egid, data_types)
+            if len(runs[0]):
+                out[egid] = runs
+        return out
+
+    def gaps(self, egid, data_type: str, min_steps: int = 1, start=None, end=None) -> pd.DataFrame:
+        """Trous entre pas valides (``start`` inclus, ``end`` exclu, ``steps``), bornés à ``[start, end)``."""
+        starts, ends = _clip(*self.get(egid, data_type), *self._window(start, end))
+        g0, g1 = ends[:-1], starts[1:]
+        keep = g1 - g0 >= min_steps
+        step = pd.Timedelta(self.step)
+        return pd.DataFrame(
+            {
+                "start": GRID_ORIGIN + g0[keep] * step,
+                "end": GRID_ORIGIN + g1[keep] * step,
+                "steps": (g1 - g0)[keep],
+            }
+        )
+
+    def summary(self) -> pd.DataFrame:
+        """Par couple : premier / dernier pas valide, pas valides, nombre de plages."""
+        rows = []
+        for (egid, dt), (starts, ends) in sorted(self.runs.items()):
+            rows.append(
+                {
+                    "EGID": egid,
+                    "DATA_TYPE": dt,
+                    "first_valid": self.step_time(starts[0]) if len(starts) else pd.NaT,
+                    "last_valid": self.step_time(ends[-1] - 1) if len(ends) else pd.NaT,
+                    "n_valid": int((ends - starts).sum()),
+                    "n_runs": len(starts),
+                }
+            )
+        return pd.DataFrame(rows, columns=["EGID", "DATA_TYPE", "first_valid", "last_valid", "n_valid", "n_runs"])
+
+    def rows_in(self, df: pd.DataFrame, runs_by_egid: dict, time: str = "date_15min") -> np.ndarray:
+        """Masque des lignes de ``df`` dont le pas tombe dans les plages de leur EGID (``overlaps`` par ex.)."""
+        codes, uniq = pd.factorize(df["EGID"])
+        labels = pd.Index(uniq).astype(str)
+        lo, hi = [], []
+        for c, egid in enumerate(labels):
+            starts, ends = runs_by_egid.get(egid, _EMPTY)
+            lo.append((np.int64(c) << 32) | starts)
+            hi.append((np.int64(c) << 32) | ends)
+        lo = np.concatenate(lo) if lo else np.zeros(0, np.int64)
+        hi = np.concatenate(hi) if hi else np.zeros(0, np.int64)
+        slots = self._slots(df[time])
+        row = (codes.astype(np.int64) << 32) | np.maximum(slots, 0)
+        pos = np.searchsorted(lo, row, "right") - 1
+        hit = (pos >= 0) & (slots >= 0) & (codes >= 0)
+        hit[hit] = row[hit] < hi[pos[hit]]
+        return hit
+
+    # --- sérialisation ------------------------------------------------------------------------------------
+
+    def save(self, path: Path, signature: dict | None = None) -> None:
+        keys = sorted(self.runs)
+        lens = np.array([len(self.runs[k][0]) for k in keys], dtype=np.int64)
+        cat = lambda i: np.concatenate([self.runs[k][i] for k in keys]) if keys else np.zeros(0)  # noqa: E731
+        meta = {"step": self.step, "origin": str(GRID_ORIGIN), "signature": signature or {}}
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(
+            tmp,
+            meta=np.array(json.dumps(meta)),
+            egid=np.array([k[0] for k in keys], dtype=str),
+            data_type=np.array([k[1] for k in keys], dtype=str),
+            ptr=np.r_[0, np.cumsum(lens)].astype(np.int64),
+            starts=cat(0).astype(np.int32),
+            ends=cat(1).astype(np.int32),
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> tuple["ValidityIndex", dict]:
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(str(z["meta"]))
+            if pd.Timestamp(meta["origin"]) != GRID_ORIGIN:
+                raise ValueError(f"Origine de grille inattendue : {meta['origin']}")
+            ptr = z["ptr"]
+            starts, ends = z["starts"].astype(np.int64), z["ends"].astype(np.int64)
+            runs = {
+                (str(e), str(t)): (starts[ptr[i] : ptr[i + 1]], ends[ptr[i] : ptr[i + 1]])
+                for i, (e, t) in enumerate(zip(z["egid"], z["data_type"]))
+            }
+        return cls(runs=runs, step=meta["step"]), meta["signature"]
+
+
+# --- étapes -----------------------------------------------------------------------------------------------
+
+
+def index_path(path: Path) -> Path:
+    """Emplacement de l'index d'une étape (jeu partitionné ou ancien fichier)."""
+    p = stage_path(path)
+    return p / INDEX_NAME if p.is_dir() else p.with_name(p.name + INDEX_SUFFIX)
+
+
+def _signature(path: Path) -> dict:
+    files = stage_files(path)
+    return {"files": [[f.as_posix(), f.stat().st_size, f.stat().st_mtime_ns] for f in files]}
+
+
+def write_index(path: Path, df: pd.DataFrame | None = None, time: str = "date_15min") -> ValidityIndex:
+    """Construit l'index d'une étape (depuis ``df`` déjà en mémoire, sinon en relisant les colonnes utiles)."""
+    if df is None:
+        df = read_stage(path, columns=["EGID", "DATA_TYPE", time, "valeur", "inv"])
+    idx = ValidityIndex.build(df, time=time)
+    idx.save(index_path(path), _signature(path))
+    logger.info("Index de validité %s : %s couples", index_path(path), len(idx.runs))
+    return idx
+
+
+def open_index(path: Path) -> ValidityIndex | None:
+    """Index d'une étape s'il existe (avertissement si l'étape a été réécrite depuis) ; None sinon."""
+    side = index_path(path)
+    if not side.is_file():
+        return None
+    idx, sig = ValidityIndex.load(side)
+    if sig.get("files") != _signature(path)["files"]:
+        logger.warning("Index de validité %s antérieur à la dernière écriture de l'étape", side)
+    return idx
+
+
+def load_index(path: Path, rebuild: bool = False) -> ValidityIndex:
+    """Index d'une étape, reconstruit s'il manque, est illisible ou a été construit sur d'autres fichiers."""
+    side = index_path(path)
+    if side.is_file() and not rebuild:
+        try:
+            idx, sig = ValidityIndex.load(side)
+            if sig.get("files") == _signature(path)["files"]:
+                return idx
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Index de validité illisible %s : %s", side, e)
+    return write_index(path)
+
+
+def fragment_rows(fragment: Path) -> pd.DataFrame:
+    """Fragment ExpArchiV8 ``--format parquet`` → lignes au pas de ``sst_enriched`` (sections 2–3)."""
+    from sst_bucket_aggregate import aggregate_puiscpt_to_15min_raw
+
+    shards = sorted(Path(fragment).glob("part-*.parquet")) if Path(fragment).is_dir() else [Path(fragment)]
+    df = pq.read_table(shards, columns=["date", "EGID", "DATA_TYPE", "valeur", "inv"]).to_pandas()
+    df["date"] = df["date"].astype("datetime64[ns]")
+    df["inv"] = pd.to_numeric(df["inv"], errors="coerce").fillna(1)
+    m_pc = df["DATA_TYPE"].eq("PuisCpt")
+    if m_pc.any():
+        df = pd.concat([df.loc[~m_pc], aggregate_puiscpt_to_15min_raw(df.loc[m_pc].copy())], ignore_index=True)
+    df["date_15min"] = (
+        df["date"]
+        .dt.tz_localize("Europe/Zurich", ambiguous=True, nonexistent="shift_forward")
+        .dt.tz_convert("UTC")
+        .dt.floor(STEP)
+    )
+    return df
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--stage", type=Path, default=PATH_ENRICHED, help="Étape indexée (défaut sst_enriched)")
+    ap.add_argument("--rebuild", action="store_true", help="Reconstruit l'index depuis l'étape")
+    ap.add_argument("--update", type=Path, nargs="*", default=[], help="Fragments ExpArchiV8 Parquet à appliquer")
+    ap.add_argument("--egids", type=str, default="", help="EGID à résumer (ex: 1511188,190198380)")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.update:
+        side = index_path(args.stage)
+        idx, sig = ValidityIndex.load(side) if side.is_file() else (load_index(args.stage), _signature(args.stage))
+        for frag in args.update:
+            n = idx.update(fragment_rows(frag))
+            print(f"{frag} : {n} couples (EGID, DATA_TYPE) mis à jour")
+        idx.save(side, sig)
+    else:
+        idx = load_index(args.stage, rebuild=args.rebuild)
+    s = idx.summary()
+    if args.egids.strip():
+        s = s[s["EGID"].isin([e.strip() for e in args.egids.split(",")])]
+    print(f"{len(idx.runs)} couples (EGID, DATA_TYPE), {len(idx.egids)} EGID")
+    print(s.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
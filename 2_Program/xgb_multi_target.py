@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+XGBoost bi-cible (TempRet_norm, PuisCpt_fc) sur matrices quantifiées partagées.
+
+Utilisé par ML_training (section 3) : les ``QuantileDMatrix`` train / val / test sont construites
+**une seule fois** par EGID (histogrammes calculés sur train, val et test alignés via ``ref``),
+puis réutilisées pour les deux cibles — soit deux boosters (early stopping par cible, comme
+``XGBRegressor``), soit un booster natif multi-sortie (``multi_strategy``, XGBoost >= 2.0).
+
+Les boosters sont sauvegardés au format natif UBJSON (``.ubj``), rechargeables sans pickle.
+"""
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import xgboost as xgb
+
+from stage_profiler import profiled
+
+TARGET_NAMES = ("TempRet", "PuisCpt")
+MULTI_OUTPUT_KEY = "TempRet+PuisCpt"
+
+
+@dataclass
+class XgbStageTimings:
+    """Durées (s) par étape : construction des matrices, entraînement (par booster), prédiction."""
+
+    build_s: float = 0.0
+    train_s: dict[str, float] = field(default_factory=dict)
+    predict_s: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "build_s": round(self.build_s, 4),
+            "train_s": {k: round(v, 4) for k, v in self.train_s.items()},
+            "train_total_s": round(sum(self.train_s.values()), 4),
+            "predict_s": round(self.predict_s, 4),
+        }
+
+
+@dataclass
+class XgbMultiTargetResult:
+    boosters: dict[str, xgb.Booster]
+    pred_tr: np.ndarray
+    pred_va: np.ndarray
+    pred_te: np.ndarray
+    multi_output: bool
+    timings: XgbStageTimings
+
+
+def supports_multi_output_tree() -> bool:
+    """``multi_strategy`` (arbres multi-sorties) disponible à partir de XGBoost 2.0."""
+    try:
+        major = int(str(xgb.__version__).split(".", 1)[0])
+    except ValueError:
+        return False
+    return major >= 2
+
+
+def _resolve_nthread(n_jobs: int | None) -> int:
+    """Convention joblib (cf. N_JOBS_PARALLEL) : négatif → max(1, n_cpu + 1 + n_jobs)."""
+    if n_jobs is None or n_jobs == 0:
+        return 0
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + int(n_jobs))
+    return int(n_jobs)
+
+
+def sklearn_to_native_params(params: dict) -> tuple[dict, int]:
+    """Convertit ``XGB_PARAMS`` (API sklearn) en (paramètres ``xgb.train``, num_boost_round)."""
+    p = dict(params)
+    num_round = int(p.pop("n_estimators", 100))
+    native: dict = {"objective": "reg:squarederror", "tree_method": "hist"}
+    if "learning_rate" in p:
+        native["eta"] = p.pop("learning_rate")
+    if "random_state" in p:
+        native["seed"] = p.pop("random_state")
+    if "n_jobs" in p:
+        native["nthread"] = _resolve_nthread(p.pop("n_jobs"))
+    p.pop("callbacks", None)
+    p.pop("early_stopping_rounds", None)
+    native.update(p)
+    return native, num_round
+
+
+def build_quantile_dmatrices(
+    X_tr: np.ndarray,
+    X_va: np.ndarray,
+    X_te: np.ndarray,
+    *,
+    max_bin: int = 256,
+    nthread: int = 0,
+) -> tuple[xgb.QuantileDMatrix, xgb.QuantileDMatrix, xgb.QuantileDMatrix]:
+    """Quantification unique : coupures calculées sur train, réutilisées (``ref``) par val et test."""
+    d_tr = xgb.QuantileDMatrix(
+        np.ascontiguousarray(X_tr, dtype=np.float32), max_bin=max_bin, nthread=nthread
+    )
+    d_va = xgb.QuantileDMatrix(
+        np.ascontiguousarray(X_va, dtype=np.float32), ref=d_tr, max_bin=max_bin, nthread=nthread
+    )
+    d_te = xgb.QuantileDMatrix(
+        np.ascontiguousarray(X_te, dtype=np.float32), ref=d_tr, max_bin=max_bin, nthread=nthread
+    )
+    return d_tr, d_va, d_te
+
+
+def _predict_best(booster: xgb.Booster, dm: xgb.DMatrix) -> np.ndarray:
+    """Prédiction limitée à best_iteration (équivalent XGBRegressor.predict après early stopping)."""
+    if dm.num_row() == 0:
+        n_out = 2 if booster.attr("multi_output") == "1" else 1
+        return np.zeros((0, n_out) if n_out > 1 else (0,), dtype=np.float64)
+    best = getattr(booster, "best_iteration", None)
+    if best is None:
+        return booster.predict(dm)
+    return booster.predict(dm, iteration_range=(0, int(best) + 1))
+
+
+@profiled("fit_predict_xgb")
+def train_xgb_multi_target(
+    X_tr: np.ndarray,
+    y_tr: np.ndarray,
+    X_va: np.ndarray,
+    y_va: np.ndarray,
+    X_te: np.ndarray,
+    params: dict,
+    *,
+    early_stopping_rounds: int,
+    multi_output: bool = False,
+    max_bin: int = 256,
+) -> XgbMultiTargetResult:
+    """
+    Entraîne TempRet + PuisCpt sur les mêmes ``QuantileDMatrix``.
+
+    ``multi_output=False`` : un booster par cible (labels échangés via ``set_label``), early stopping
+    par cible. ``multi_output=True`` : un seul booster ``multi_output_tree`` (label 2-D, early
+    stopping sur la RMSE moyenne) si la version d'XGBoost le permet, sinon repli sur deux boosters.
+    """
+    native, num_round = sklearn_to_native_params(params)
+    timings = XgbStageTimings()
+
+    t0 = time.perf_counter()
+    d_tr, d_va, d_te = build_quantile_dmatrices(
+        X_tr, X_va, X_te, max_bin=max_bin, nthread=int(native.get("nthread", 0))
+    )
+    timings.build_s = time.perf_counter() - t0
+
+    y_tr = np.asarray(y_tr, dtype=np.float32)
+    y_va = np.asarray(y_va, dtype=np.float32)
+    use_multi = bool(multi_output) and supports_multi_output_tree()
+    boosters: dict[str, xgb.Booster] = {}
+
+    if use_multi:
+        d_tr.set_label(y_tr)
+        d_va.set_label(y_va)
+        t0 = time.perf_counter()
+        b = xgb.train(
+            {**native, "multi_strategy": "multi_output_tree"},
+            d_tr,
+            num_boost_round=num_round,
+            evals=[(d_va, "validation_0")],
+            early_stopping_rounds=early_stopping_rounds,
+            verbose_eval=False,
+        )
+        b.set_attr(multi_output="1")
+        timings.train_s[MULTI_OUTPUT_KEY] = time.perf_counter() - t0
+        boosters[MULTI_OUTPUT_KEY] = b
+    else:
+        for j, name in enumerate(TARGET_NAMES):
+            d_tr.set_label(y_tr[:, j])
+            d_va.set_label(y_va[:, j])
+            t0 = time.perf_counter()
+            b = xgb.train(
+                native,
+                d_tr,
+                num_boost_round=num_round,
+                evals=[(d_va, "validation_0")],
+                early_stopping_rounds=early_stopping_rounds,
+                verbose_eval=False,
+            )
+            timings.train_s[name] = time.perf_counter() - t0
+            boosters[name] = b
+
+    t0 = time.perf_counter()
+    preds = []
+    for dm, n in ((d_tr, len(y_tr)), (d_va, len(y_va)), (d_te, d_te.num_row())):
+        out = np.zeros((n, len(TARGET_NAMES)), dtype=np.float64)
+        if use_multi:
+            out[:] = np.asarray(_predict_best(boosters[MULTI_OUTPUT_KEY], dm)).reshape(n, -1)
+        else:
+            for j, name in enumerate(TARGET_NAMES):
+                out[:, j] = _predict_best(boosters[name], dm)
+        preds.append(out)
+    timings.predict_s = time.perf_counter() - t0
+
+    return XgbMultiTargetResult(
+        boosters=boosters,
+        pred_tr=preds[0],
+        pred_va=preds[1],
+        pred_te=preds[2],
+        multi_output=use_multi,
+        timings=timings,
+    )
+
+
+def booster_feature_importances(booster: xgb.Booster, n_features: int) -> np.ndarray:
+    """Importance « gain » normalisée (somme 1), comme ``XGBRegressor.feature_importances_``."""
+    score = booster.get_score(importance_type="gain")
+    imp = np.zeros(n_features, dtype=np.float64)
+    for k, v in score.items():
+        idx = int(k[1:]) if k.startswith("f") and k[1:].isdigit() else None
+        if idx is not None and idx < n_features:
+            imp[idx] = float(v)
+    tot = imp.sum()
+    return imp / tot if tot > 0 else imp
+
+
+def ubj_paths(model_dir: Path, prefix: str, egid: str, names) -> dict[str, Path]:
+    return {name: Path(model_dir) / f"{prefix}_{egid}_{name}.ubj" for name in names}
+
+
+def save_boosters_ubj(
+    boosters: dict[str, xgb.Booster], model_dir: Path, prefix: str, egid: str
+) -> dict[str, str]:
+    """Écrit ``{prefix}_{egid}_{cible}.ubj`` ; retourne {cible: nom de fichier} pour le bundle joblib."""
+    paths = ubj_paths(model_dir, prefix, egid, boosters.keys())
+    for name, b in boosters.items():
+        b.save_model(str(paths[name]))
+    return {name: p.name for name, p in paths.items()}
+
+
+def load_boosters_ubj(model_dir: Path, files: dict[str, str]) -> dict[str, xgb.Booster]:
+    out: dict[str, xgb.Booster] = {}
+    for name, fname in files.items():
+        b = xgb.Booster()
+        b.load_model(str(Path(model_dir) / fname))
+        out[name] = b
+    return out
+
+
+def predict_boosters(boosters: dict[str, xgb.Booster], X: np.ndarray) -> np.ndarray:
+    """Prédictions (n, 2) [TempRet_norm, PuisCpt_fc] à partir de boosters chargés (UBJSON)."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    n = X.shape[0]
+    out = np.zeros((n, len(TARGET_NAMES)), dtype=np.float64)
+    if n == 0:
+        return out
+    dm = xgb.DMatrix(X)
+    if MULTI_OUTPUT_KEY in boosters:
+        out[:] = np.asarray(_predict_best(boosters[MULTI_OUTPUT_KEY], dm)).reshape(n, -1)
+        return out
+    for j, name in enumerate(TARGET_NAMES):
+        out[:, j] = _predict_best(boosters[name], dm)
+    return out